@@ -2,8 +2,21 @@ import chainlit as cl
 import httpx
 import uuid
 
-# URL của FastAPI backend
-BASE_URL = "http://127.0.0.1:8001"  # Thay đổi nếu FastAPI của bạn chạy trên một địa chỉ khác
+from chat_client import BackendClient, SessionBusy
+
+# Client dùng chung tới FastAPI backend (địa chỉ đặt qua BACKEND_URL, mặc định http://127.0.0.1:8001)
+backend = BackendClient()
+
+
+@cl.on_app_startup
+async def on_app_startup():
+    # Mở connection pool một lần cho cả tiến trình thay vì mỗi tin nhắn một client
+    backend.open()
+
+
+@cl.on_app_shutdown
+async def on_app_shutdown():
+    await backend.aclose()
 
 @cl.on_chat_start
 async def on_chat_start():
@@ -35,34 +48,44 @@ async def on_message(message: cl.Message):
         ).send()
         return
 
-    # Dữ liệu để gửi đến API
-    chat_request = {
-        "message": message.content,
-        "thread_id": thread_id
-    }
+    # Tin nhắn trả lời được stream dần từng token lên giao diện
+    reply = cl.Message(content="")
+    streamed = False
 
-    async with httpx.AsyncClient() as client:
-        try:
-            # Gửi yêu cầu POST đến endpoint /chat
-            response = await client.post(f"{BASE_URL}/chat", json=chat_request, timeout=30.0)
-            response.raise_for_status()  # Ném ra một ngoại lệ nếu có lỗi HTTP
+    try:
+        # Gửi tin nhắn đến endpoint /chat/stream và đọc từng sự kiện SSE
+        async for event, data in backend.stream_chat(thread_id, message.content):
+            if event == "token":
+                await reply.stream_token(data["text"])
+                streamed = True
+            elif event == "done":
+                if not streamed:
+                    reply.content = data.get("response") or "Không nhận được phản hồi hợp lệ từ bot."
+            elif event == "error":
+                # Giữ lại phần trả lời đã stream, chỉ nối thêm thông báo lỗi
+                error = f"Đã xảy ra lỗi khi giao tiếp với bot: {data.get('detail')}"
+                reply.content = f"{reply.content}\n\n{error}" if reply.content else error
 
-            chat_response = response.json()
+        # Gửi (hoặc chốt lại) phản hồi của bot trên giao diện người dùng
+        await reply.send()
 
-            # Gửi phản hồi của bot trở lại giao diện người dùng
-            await cl.Message(
-                content=chat_response.get("response", "Không nhận được phản hồi hợp lệ từ bot."),
-            ).send()
-
-        except httpx.HTTPStatusError as e:
-            await cl.Message(
-                content=f"Đã xảy ra lỗi khi giao tiếp với bot: {e.response.status_code} - {e.response.text}",
-            ).send()
-        except httpx.RequestError as e:
-            await cl.Message(
-                content=f"Đã xảy ra lỗi mạng: {e}",
-            ).send()
-        except Exception as e:
-            await cl.Message(
-                content=f"Đã xảy ra một lỗi không mong muốn: {e}",
-            ).send()
\ No newline at end of file
+    except SessionBusy:
+        # Các tin nhắn trước của phiên này vẫn đang chờ xử lý
+        await cl.Message(content="Mình đang xử lý các tin nhắn trước, anh/chị đợi một chút rồi gửi tiếp nhé.").send()
+    except httpx.HTTPStatusError as e:
+        if e.response.status_code == 429:
+            # Server đang quá tải hoặc tin nhắn trước của phiên này vẫn đang được xử lý
+            content = "Hệ thống đang bận, anh/chị vui lòng gửi lại sau giây lát ạ."
+        else:
+            content = f"Đã xảy ra lỗi khi giao tiếp với bot: {e.response.status_code}"
+        await cl.Message(content=content).send()
+    except httpx.TimeoutException:
+        await cl.Message(content="Bot phản hồi quá lâu, anh/chị vui lòng thử lại sau ạ.").send()
+    except httpx.RequestError as e:
+        await cl.Message(
+            content=f"Đã xảy ra lỗi mạng: {e}",
+        ).send()
+    except Exception as e:
+        await cl.Message(
+            content=f"Đã xảy ra một lỗi không mong muốn: {e}",
+        ).send()
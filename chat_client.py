@@ -0,0 +1,142 @@
+"""
+Client HTTP dùng chung của frontend Chainlit (app.py) tới FastAPI backend.
+Tách riêng khỏi app.py (không phụ thuộc chainlit) để test và benchmark được.
+"""
+import asyncio
+import json
+import os
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional, Tuple
+
+import httpx
+
+from src.flight_booking_agent.deadlines import TURN_DEADLINE
+
+# Cấu hình kết nối tới backend:
+# - BACKEND_URL: địa chỉ FastAPI backend
+# - BACKEND_MAX_CONNECTIONS / BACKEND_MAX_KEEPALIVE: giới hạn connection pool dùng chung cho mọi phiên
+# - BACKEND_CONNECT_TIMEOUT: thời gian chờ mở kết nối (giây)
+# - BACKEND_CONNECT_RETRIES: số lần thử lại khi không kết nối được (request chưa được gửi nên an toàn)
+# - CHAT_TURN_TIMEOUT: thời gian chờ tối đa giữa hai sự kiện của một lượt; mặc định TURN_DEADLINE
+#   của backend (đọc từ deadlines.py, nơi duy nhất định nghĩa giá trị này) cộng
+#   CHAT_TURN_TIMEOUT_MARGIN (mạng, đọc/ghi checkpoint), 60s nếu backend không giới hạn lượt
+# - CHAT_SESSION_MAX_PENDING: số tin nhắn (đang xử lý + đang chờ) tối đa của một phiên chat
+BACKEND_URL = os.getenv("BACKEND_URL", "http://127.0.0.1:8001")
+BACKEND_MAX_CONNECTIONS = int(os.getenv("BACKEND_MAX_CONNECTIONS", "100"))
+BACKEND_MAX_KEEPALIVE = int(os.getenv("BACKEND_MAX_KEEPALIVE", "100"))
+BACKEND_CONNECT_TIMEOUT = float(os.getenv("BACKEND_CONNECT_TIMEOUT", "5"))
+BACKEND_CONNECT_RETRIES = int(os.getenv("BACKEND_CONNECT_RETRIES", "2"))
+CHAT_TURN_TIMEOUT_MARGIN = float(os.getenv("CHAT_TURN_TIMEOUT_MARGIN", "10"))
+CHAT_TURN_TIMEOUT = float(os.getenv("CHAT_TURN_TIMEOUT") or (TURN_DEADLINE + CHAT_TURN_TIMEOUT_MARGIN if TURN_DEADLINE > 0 else 60))
+CHAT_SESSION_MAX_PENDING = int(os.getenv("CHAT_SESSION_MAX_PENDING", "2"))
+
+
+class SessionBusy(Exception):
+    """Phiên chat đã có quá nhiều tin nhắn chờ xử lý; tin nhắn mới bị từ chối ngay ở frontend."""
+
+
+class SessionGate:
+    """
+    Mỗi phiên chat chỉ có một lượt gửi tới backend tại một thời điểm: tin nhắn gửi tiếp chờ
+    lượt trước xong (theo thứ tự gửi). Quá `max_pending` tin nhắn thì ném `SessionBusy` thay
+    vì dồn thêm request mà backend cũng sẽ trả 429.
+    """
+
+    def __init__(self, max_pending: int = CHAT_SESSION_MAX_PENDING):
+        self.max_pending = max(max_pending, 1)
+        self._entries = {}  # thread_id -> [asyncio.Lock, số tin nhắn đang xử lý + đang chờ]
+
+    def depth(self, thread_id: str) -> int:
+        entry = self._entries.get(thread_id)
+        return entry[1] if entry else 0
+
+    @asynccontextmanager
+    async def turn(self, thread_id: str):
+        entry = self._entries.get(thread_id)
+        if entry is None:
+            entry = self._entries[thread_id] = [asyncio.Lock(), 0]
+        if entry[1] >= self.max_pending:
+            raise SessionBusy(thread_id)
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0 and self._entries.get(thread_id) is entry:
+                del self._entries[thread_id]
+
+
+async def iter_sse(response: httpx.Response) -> AsyncIterator[Tuple[str, dict]]:
+    """Đọc luồng Server-Sent Events từ backend, trả về từng cặp (event, data)."""
+    event, data_lines = None, []
+    async for line in response.aiter_lines():
+        if line.startswith("event:"):
+            event = line[len("event:"):].strip()
+        elif line.startswith("data:"):
+            data_lines.append(line[len("data:"):].strip())
+        elif not line and event:
+            yield event, json.loads("\n".join(data_lines) or "{}")
+            event, data_lines = None, []
+
+
+class BackendClient:
+    """
+    Một `httpx.AsyncClient` dùng chung cho cả tiến trình Chainlit: các phiên dùng lại kết nối
+    keep-alive thay vì mở kết nối TCP mới cho mỗi tin nhắn. Client được tạo trong hook khởi
+    động của Chainlit (`open`) hoặc ở lần dùng đầu tiên, và đóng khi tắt ứng dụng.
+    """
+
+    def __init__(self, base_url: str = BACKEND_URL, *, max_connections: int = BACKEND_MAX_CONNECTIONS,
+                 max_keepalive: int = BACKEND_MAX_KEEPALIVE, connect_timeout: float = BACKEND_CONNECT_TIMEOUT,
+                 turn_timeout: float = CHAT_TURN_TIMEOUT, connect_retries: int = BACKEND_CONNECT_RETRIES,
+                 sessions: Optional[SessionGate] = None):
+        self.base_url = base_url
+        self.limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive)
+        self.timeout = httpx.Timeout(turn_timeout, connect=connect_timeout)
+        self.connect_retries = max(connect_retries, 0)
+        self.sessions = sessions or SessionGate()
+        self._client: Optional[httpx.AsyncClient] = None
+
+    def open(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(base_url=self.base_url, limits=self.limits, timeout=self.timeout)
+        return self._client
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    @asynccontextmanager
+    async def _stream(self, method: str, path: str, **kwargs):
+        client = self.open()
+        request = client.build_request(method, path, **kwargs)
+        # Chưa kết nối được thì request chưa được gửi đi: thử lại an toàn kể cả với POST. Hết giờ
+        # đọc thì backend có thể đã xử lý lượt chat, nên không gửi lại.
+        for attempt in range(self.connect_retries + 1):
+            try:
+                response = await client.send(request, stream=True)
+                break
+            except httpx.ConnectError:
+                if attempt >= self.connect_retries:
+                    raise
+                await asyncio.sleep(0.1 * 2 ** attempt)
+        try:
+            yield response
+        finally:
+            await response.aclose()
+
+    async def stream_chat(self, thread_id: str, message: str) -> AsyncIterator[Tuple[str, dict]]:
+        """
+        Gửi một tin nhắn tới `/chat/stream` và trả về từng sự kiện SSE. Tin nhắn của cùng phiên
+        chạy lần lượt (`SessionBusy` nếu phiên đã có quá nhiều tin nhắn chờ); lỗi HTTP được ném
+        ra dưới dạng `httpx.HTTPStatusError`.
+        """
+        async with self.sessions.turn(thread_id):
+            async with self._stream("POST", "/chat/stream", json={"message": message, "thread_id": thread_id}) as response:
+                if response.is_error:
+                    await response.aread()
+                response.raise_for_status()
+                async for item in iter_sse(response):
+                    yield item
@@ -1,12 +1,36 @@
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
-from typing import List, Optional
-from langchain_core.messages import HumanMessage
+from typing import AsyncIterator, List, Optional
+from langchain_core.messages import HumanMessage, AIMessage, AIMessageChunk
+import asyncio
+import json
 import traceback
+from contextlib import asynccontextmanager
 
 from src.flight_booking_agent.graph.workflow import app as graph_app
+from src.flight_booking_agent.graph.checkpointing import use_configured_checkpointer
+from src.flight_booking_agent import config
+from src.flight_booking_agent.agents.airports import airport_resolver
+from src.flight_booking_agent.agents.faq_index import faq_index
+from src.flight_booking_agent.services.amadeus_client import amadeus_client
+from src.flight_booking_agent.metrics import metrics
+from src.flight_booking_agent.admission import Overloaded, admit_turn, check_admission
+from src.flight_booking_agent.deadlines import turn_config
 
-fastapi_app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Mở sẵn chỉ mục FAQ (dựng lại nếu tài liệu đã đổi) để lượt hỏi đầu tiên không phải chờ
+    try:
+        await asyncio.to_thread(faq_index)
+    except Exception as e:
+        print(f"Không mở được chỉ mục FAQ khi khởi động, sẽ thử lại ở lần hỏi đầu tiên: {e}")
+    # Gắn checkpointer theo cấu hình (CHECKPOINT_BACKEND) trong suốt vòng đời server
+    async with use_configured_checkpointer(graph_app):
+        yield
+    await amadeus_client.aclose()
+
+fastapi_app = FastAPI(lifespan=lifespan)
 
 class ChatRequest(BaseModel):
     message: str
@@ -16,6 +40,9 @@ class ChatResponse(BaseModel):
     response: str
     thread_id: str
 
+def _too_many_requests(e: Overloaded) -> HTTPException:
+    return HTTPException(status_code=429, detail=e.reason, headers={"Retry-After": str(e.retry_after)})
+
 @fastapi_app.post("/chat", response_model=ChatResponse)
 async def chat_endpoint(request: ChatRequest):
     """
@@ -23,18 +50,17 @@ async def chat_endpoint(request: ChatRequest):
     Mỗi thread_id đại diện cho 1 cuộc hội thoại riêng biệt.
     """
     try:
-        # Config với thread_id để LangGraph biết load state nào
-        config = {
-            "configurable": {
-                "thread_id": request.thread_id
-            }
-        }
+        # Config với thread_id để LangGraph biết load state nào, kèm thời hạn của lượt
+        # (tính cả thời gian chờ trong hàng) cho mọi lời gọi LLM/tool bên trong
+        config = turn_config(request.thread_id)
         
-        # Invoke graph với checkpoint
-        result = graph_app.invoke(
-            {"messages": [HumanMessage(content=request.message)]},
-            config=config
-        )
+        # Invoke graph với checkpoint (bất đồng bộ để không chặn event loop).
+        # Các lượt của cùng thread chạy lần lượt; quá tải thì trả 429 ngay.
+        async with admit_turn(request.thread_id):
+            result = await graph_app.ainvoke(
+                {"messages": [HumanMessage(content=request.message)]},
+                config=config
+            )
         
         # Lấy response cuối cùng
         last_message = result["messages"][-1]
@@ -44,6 +70,8 @@ async def chat_endpoint(request: ChatRequest):
             thread_id=request.thread_id
         )
         
+    except Overloaded as e:
+        raise _too_many_requests(e)
     except Exception as e:
         # 2. Đảm bảo bạn có những dòng này để in lỗi chi tiết
         print("\n--- TRACEBACK LỖI CHI TIẾT ---")
@@ -53,6 +81,64 @@ async def chat_endpoint(request: ChatRequest):
         # 3. Dòng raise HTTPException phải nằm cuối cùng
         raise HTTPException(status_code=500, detail=str(e))
 
+def _sse(event: str, data: dict) -> str:
+    """Đóng gói một sự kiện theo định dạng Server-Sent Events."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+async def stream_chat_events(request: ChatRequest) -> AsyncIterator[str]:
+    """
+    Chạy graph ở chế độ stream và phát ra các sự kiện SSE:
+    - `node`:  một node bắt đầu chạy (dùng để hiển thị trạng thái "đang xử lý").
+    - `token`: một đoạn nội dung trả lời của AI (token từ LLM hoặc tin nhắn soạn sẵn của node).
+    - `done`:  lượt hội thoại kết thúc, kèm câu trả lời đầy đủ.
+    - `error`: có lỗi xảy ra trong lúc chạy graph.
+    """
+    config = turn_config(request.thread_id)
+    try:
+        async with admit_turn(request.thread_id):
+            async for mode, chunk in graph_app.astream(
+                {"messages": [HumanMessage(content=request.message)]},
+                config=config,
+                stream_mode=["tasks", "messages"],
+            ):
+                if mode == "tasks":
+                    # Sự kiện bắt đầu task có "input", sự kiện kết thúc có "result"
+                    if "input" in chunk:
+                        yield _sse("node", {"node": chunk["name"]})
+                else:
+                    message, metadata = chunk
+                    # Chỉ stream nội dung hội thoại của AI; bỏ qua tool call rỗng và ToolMessage
+                    if isinstance(message, (AIMessage, AIMessageChunk)) and isinstance(message.content, str) and message.content:
+                        yield _sse("token", {"node": metadata.get("langgraph_node"), "text": message.content})
+
+            state = await graph_app.aget_state(config)
+            last_message = state.values["messages"][-1]
+            yield _sse("done", {"response": last_message.content, "thread_id": request.thread_id})
+
+    except Overloaded as e:
+        yield _sse("error", {"detail": e.reason, "status": 429})
+    except Exception as e:
+        print("\n--- TRACEBACK LỖI CHI TIẾT (stream) ---")
+        traceback.print_exc()
+        print("------------------------------\n")
+        yield _sse("error", {"detail": str(e)})
+
+@fastapi_app.post("/chat/stream")
+async def chat_stream_endpoint(request: ChatRequest):
+    """
+    Endpoint chat dạng stream (Server-Sent Events).
+    Người dùng thấy token đầu tiên ngay khi LLM bắt đầu sinh, thay vì chờ cả lượt hội thoại.
+    """
+    try:
+        check_admission(request.thread_id)
+    except Overloaded as e:
+        raise _too_many_requests(e)
+    return StreamingResponse(
+        stream_chat_events(request),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 @fastapi_app.get("/history/{thread_id}")
 async def get_conversation_history(thread_id: str):
     """
@@ -62,7 +148,7 @@ async def get_conversation_history(thread_id: str):
         config = {"configurable": {"thread_id": thread_id}}
         
         # Lấy state hiện tại từ checkpoint
-        state = graph_app.get_state(config)
+        state = await graph_app.aget_state(config)
         
         if state and state.values.get("messages"):
             messages = state.values["messages"]
@@ -88,8 +174,69 @@ async def clear_conversation(thread_id: str):
     Xóa lịch sử hội thoại của một thread_id
     """
     try:
-        # Trong SQLite checkpoint, không có API trực tiếp để xóa
-        # Bạn có thể tạo thread_id mới thay vì xóa
-        return {"message": f"Để bắt đầu cuộc hội thoại mới, hãy dùng thread_id khác"}
+        await graph_app.checkpointer.adelete_thread(thread_id)
+        return {"message": f"Đã xóa lịch sử hội thoại của thread {thread_id}"}
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+@fastapi_app.get("/llm/usage")
+async def llm_usage():
+    """
+    Báo cáo độ trễ và chi phí LLM theo vai trò (route/extract/respond) kể từ khi khởi động
+    """
+    return config.model_registry.usage.report()
+
+@fastapi_app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """
+    Histogram độ trễ theo node, lời gọi LLM (kèm token), tool và checkpoint (định dạng Prometheus)
+    """
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@fastapi_app.get("/airports/autocomplete")
+async def airports_autocomplete(q: str = "", limit: int = 8):
+    """
+    Gợi ý sân bay cho ô nhập điểm đi/điểm đến (không phân biệt dấu, chịu lỗi gõ)
+    """
+    return [match._asdict() for match in airport_resolver().autocomplete(q, limit=min(max(limit, 0), 20))]
+
+@fastapi_app.get("/healthz")
+async def healthz():
+    """
+    Liveness: tiến trình còn sống và event loop còn phản hồi (không kiểm tra phụ thuộc ngoài)
+    """
+    return {"status": "ok"}
+
+def _prewarm() -> dict:
+    """Dựng trước model LLM, client Amadeus, chỉ mục sân bay và chỉ mục FAQ; trả về lỗi của từng phần (nếu có)."""
+    errors = {}
+    steps = {
+        "llm": config.model_registry.warm,
+        "amadeus": lambda: amadeus_client.backend,
+        "airports": airport_resolver,
+        "faq": faq_index,
+    }
+    for name, step in steps.items():
+        try:
+            step()
+        except Exception as e:
+            errors[name] = str(e)
+    return errors
+
+@fastapi_app.get("/readyz")
+async def readyz(warm: bool = False):
+    """
+    Readiness: graph đã có checkpointer. Với `warm=true`, dựng trước model LLM và các client
+    (chạy trong thread) và chỉ báo sẵn sàng khi tất cả dựng được.
+    """
+    errors = await asyncio.to_thread(_prewarm) if warm else {}
+    if graph_app.checkpointer is None:
+        errors["checkpointer"] = "not attached"
+    if warm and amadeus_client.backend is None:
+        errors.setdefault("amadeus", "client unavailable")
+    body = {
+        "ready": not errors,
+        "llm_models": config.model_registry.built_roles(),
+        "amadeus_client": amadeus_client.initialized,
+        "errors": errors,
+    }
+    return JSONResponse(body, status_code=200 if not errors else 503)
@@ -0,0 +1,224 @@
+# src/flight_booking_agent/admission.py
+import asyncio
+import heapq
+import itertools
+import os
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+from .metrics import ADMISSION_REJECTED, LLM_QUEUE_WAIT
+
+# Kiểm soát tải quanh các lượt chạy graph:
+# - LLM_MAX_CONCURRENCY: số lời gọi LLM chạy đồng thời tối đa trong toàn tiến trình (quota Vertex)
+# - LLM_MAX_QUEUE: số lời gọi được xếp hàng chờ; vượt quá thì từ chối ngay (429)
+# - LLM_QUEUE_TIMEOUT: số giây tối đa một lời gọi chờ trong hàng trước khi bị từ chối
+# - CHAT_MAX_PENDING_PER_THREAD: số lượt (đang chạy + đang chờ) tối đa của một cuộc hội thoại
+# - ADMISSION_RETRY_AFTER: giá trị header Retry-After (giây) của phản hồi 429
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "64"))
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "30"))
+CHAT_MAX_PENDING_PER_THREAD = int(os.getenv("CHAT_MAX_PENDING_PER_THREAD", "3"))
+ADMISSION_RETRY_AFTER = int(os.getenv("ADMISSION_RETRY_AFTER", "1"))
+
+# Số nhỏ hơn được phục vụ trước: lượt gần bước thanh toán không phải chờ sau lượt tìm kiếm
+PRIORITY_PAYMENT = 0
+PRIORITY_NORMAL = 1
+_PRIORITY_LABELS = {PRIORITY_PAYMENT: "payment", PRIORITY_NORMAL: "normal"}
+
+
+class Overloaded(Exception):
+    """Hệ thống đang quá tải; endpoint trả về 429 kèm `retry_after` giây."""
+
+    def __init__(self, reason: str, retry_after: int = ADMISSION_RETRY_AFTER):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+def turn_priority(state) -> int:
+    """Lượt đã chọn chuyến (`confirmed_flight`) hoặc đã gửi bản tổng kết được ưu tiên."""
+    if state.get("final_confirmation_sent") or state.get("confirmed_flight"):
+        return PRIORITY_PAYMENT
+    return PRIORITY_NORMAL
+
+
+class _Waiter:
+    __slots__ = ("wake", "granted", "cancelled")
+
+    def __init__(self, wake):
+        self.wake = wake
+        self.granted = False
+        self.cancelled = False
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class PriorityLimiter:
+    """
+    Giới hạn số lời gọi đồng thời, hàng chờ theo độ ưu tiên (cùng mức thì theo thứ tự
+    đến). Dùng được từ cả code đồng bộ (`slot`) lẫn bất đồng bộ (`aslot`); khi một chỗ
+    được nhả ra, nó được chuyển thẳng cho lời gọi đứng đầu hàng. Hàng chờ đầy hoặc chờ
+    quá `queue_timeout` giây thì ném `Overloaded` thay vì chờ tiếp.
+    """
+
+    def __init__(self, max_concurrency: int = LLM_MAX_CONCURRENCY, max_queue: int = LLM_MAX_QUEUE,
+                 queue_timeout: float = LLM_QUEUE_TIMEOUT):
+        self.max_concurrency = max(max_concurrency, 1)
+        self.max_queue = max(max_queue, 0)
+        self.queue_timeout = queue_timeout
+        self._lock = threading.Lock()
+        self._active = 0
+        self._waiting = 0
+        self._heap = []
+        self._order = itertools.count()
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+    @property
+    def waiting(self) -> int:
+        return self._waiting
+
+    def queue_full(self) -> bool:
+        return self._waiting >= self.max_queue
+
+    def _acquire_or_enqueue(self, priority: int, waiter: _Waiter) -> bool:
+        """True nếu có chỗ ngay; False nếu đã xếp hàng (chờ `waiter.wake`)."""
+        with self._lock:
+            if self._active < self.max_concurrency and not self._waiting:
+                self._active += 1
+                return True
+            if self._waiting >= self.max_queue:
+                ADMISSION_REJECTED.inc("llm_queue_full")
+                raise Overloaded(f"Hàng chờ LLM đã đầy ({self._waiting} lời gọi)")
+            heapq.heappush(self._heap, (priority, next(self._order), waiter))
+            self._waiting += 1
+            return False
+
+    def _abandon(self, waiter: _Waiter) -> bool:
+        """Rời hàng chờ; False nếu chỗ vừa được cấp (người gọi phải dùng hoặc nhả nó)."""
+        with self._lock:
+            if waiter.granted:
+                return False
+            waiter.cancelled = True
+            self._waiting -= 1
+            return True
+
+    def release(self):
+        with self._lock:
+            while self._heap:
+                _, _, waiter = heapq.heappop(self._heap)
+                if waiter.cancelled:
+                    continue
+                self._waiting -= 1
+                waiter.granted = True
+                waiter.wake()
+                return
+            self._active -= 1
+
+    def _timed_out(self, timeout: float) -> Overloaded:
+        ADMISSION_REJECTED.inc("llm_queue_timeout")
+        return Overloaded(f"Chờ LLM quá {timeout:g}s")
+
+    def _wait_limit(self, timeout):
+        return self.queue_timeout if timeout is None else min(self.queue_timeout, timeout)
+
+    @contextmanager
+    def slot(self, priority: int = PRIORITY_NORMAL, timeout=None):
+        """Giữ một chỗ; `timeout` (vd. phần còn lại của thời hạn lượt) rút ngắn thời gian chờ trong hàng."""
+        started = time.perf_counter()
+        event = threading.Event()
+        waiter = _Waiter(event.set)
+        timeout = self._wait_limit(timeout)
+        if not self._acquire_or_enqueue(priority, waiter):
+            if not event.wait(timeout) and self._abandon(waiter):
+                raise self._timed_out(timeout)
+        LLM_QUEUE_WAIT.observe(time.perf_counter() - started, _PRIORITY_LABELS.get(priority, str(priority)))
+        try:
+            yield
+        finally:
+            self.release()
+
+    @asynccontextmanager
+    async def aslot(self, priority: int = PRIORITY_NORMAL, timeout=None):
+        started = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        waiter = _Waiter(lambda: loop.call_soon_threadsafe(_resolve, future))
+        timeout = self._wait_limit(timeout)
+        if not self._acquire_or_enqueue(priority, waiter):
+            try:
+                await asyncio.wait_for(future, timeout)
+            except asyncio.TimeoutError:
+                if self._abandon(waiter):
+                    raise self._timed_out(timeout) from None
+            except asyncio.CancelledError:
+                if not self._abandon(waiter):
+                    self.release()
+                raise
+        LLM_QUEUE_WAIT.observe(time.perf_counter() - started, _PRIORITY_LABELS.get(priority, str(priority)))
+        try:
+            yield
+        finally:
+            self.release()
+
+
+class ThreadTurnQueue:
+    """
+    Tuần tự hóa các lượt của cùng một cuộc hội thoại (thread_id): lượt gửi sau chờ lượt
+    trước ghi xong checkpoint rồi mới chạy, theo đúng thứ tự gửi. Quá
+    `max_pending` lượt đang chờ trên một thread (gửi trùng liên tục) thì ném `Overloaded`.
+    Chỉ dùng trong một event loop (tiến trình FastAPI).
+    """
+
+    def __init__(self, max_pending: int = CHAT_MAX_PENDING_PER_THREAD):
+        self.max_pending = max(max_pending, 1)
+        self._entries = {}  # thread_id -> [asyncio.Lock, số lượt đang chạy + đang chờ]
+
+    def depth(self, thread_id: str) -> int:
+        entry = self._entries.get(thread_id)
+        return entry[1] if entry else 0
+
+    @asynccontextmanager
+    async def turn(self, thread_id: str):
+        entry = self._entries.get(thread_id)
+        if entry is None:
+            entry = self._entries[thread_id] = [asyncio.Lock(), 0]
+        if entry[1] >= self.max_pending:
+            ADMISSION_REJECTED.inc("thread_queue_full")
+            raise Overloaded(f"Cuộc hội thoại {thread_id} đang có {entry[1]} lượt chờ xử lý")
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0 and self._entries.get(thread_id) is entry:
+                del self._entries[thread_id]
+
+
+llm_limiter = PriorityLimiter()
+thread_turns = ThreadTurnQueue()
+
+
+def check_admission(thread_id: str):
+    """Từ chối sớm (trước khi chạy graph) khi hàng chờ LLM hoặc hàng chờ của thread đã đầy."""
+    if llm_limiter.queue_full():
+        ADMISSION_REJECTED.inc("llm_queue_full")
+        raise Overloaded(f"Hàng chờ LLM đã đầy ({llm_limiter.waiting} lời gọi)")
+    if thread_turns.depth(thread_id) >= thread_turns.max_pending:
+        ADMISSION_REJECTED.inc("thread_queue_full")
+        raise Overloaded(f"Cuộc hội thoại {thread_id} đang có {thread_turns.depth(thread_id)} lượt chờ xử lý")
+
+
+@asynccontextmanager
+async def admit_turn(thread_id: str):
+    """Nhận một lượt chat: kiểm tra quá tải rồi giữ lượt của thread cho tới khi chạy xong."""
+    check_admission(thread_id)
+    async with thread_turns.turn(thread_id):
+        yield
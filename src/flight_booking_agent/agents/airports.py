@@ -0,0 +1,251 @@
+# src/flight_booking_agent/agents/airports.py
+import bisect
+import csv
+import functools
+import os
+import re
+from collections import Counter
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+from .utils import AIRPORT_MAP, fold_vietnamese
+
+# Bộ dữ liệu sân bay đi kèm (offline): iata, tên, thành phố, quốc gia, lượng khách
+# (triệu/năm, dùng để xếp hạng) và các tên gọi khác phân tách bằng "|"
+AIRPORTS_DATA_PATH = os.getenv(
+    "AIRPORTS_DATA_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "airports.csv"),
+)
+AIRPORT_RESOLVER_CACHE_SIZE = int(os.getenv("AIRPORT_RESOLVER_CACHE_SIZE", "4096"))
+
+# Các cụm từ không mang thông tin địa danh ("sân bay Nội Bài", "TP Huế", "Hanoi airport")
+_STOPWORDS = re.compile(r"\b(?:san bay(?: quoc te)?|quoc te|thanh pho|tp|airport|international|city)\b")
+_NON_ALNUM = re.compile(r"[^a-z0-9]+")
+
+
+def normalize_place(text: str) -> str:
+    """Chuẩn hóa tên địa danh: bỏ dấu, chữ thường, bỏ ký tự lạ và các cụm "sân bay", "TP"..."""
+    folded = _NON_ALNUM.sub(" ", fold_vietnamese(text))
+    return " ".join(_STOPWORDS.sub(" ", folded).split())
+
+
+class Airport(NamedTuple):
+    iata: str
+    name: str
+    city: str
+    country: str
+    passengers_m: float
+
+
+class AirportMatch(NamedTuple):
+    """Kết quả tra cứu: sân bay, tên gọi đã khớp và điểm (1.0 = khớp chính xác)."""
+    iata: str
+    name: str
+    city: str
+    country: str
+    score: float
+    alias: str
+
+
+def load_airports(path: str = AIRPORTS_DATA_PATH):
+    """Đọc bộ dữ liệu CSV, trả về (danh sách Airport, {iata: [tên gọi khác]})."""
+    airports, aliases = [], {}
+    with open(path, encoding="utf-8", newline="") as f:
+        for row in csv.DictReader(f):
+            iata = row["iata"].strip().upper()
+            airports.append(Airport(iata, row["name"], row["city"], row["country"], float(row["passengers_m"] or 0)))
+            aliases[iata] = [a for a in (row.get("aliases") or "").split("|") if a.strip()]
+    return airports, aliases
+
+
+def _bounded_edit_distance(a: str, b: str, limit: int) -> int:
+    """Khoảng cách Damerau-Levenshtein (hoán vị kề nhau tính 1), dừng sớm khi vượt `limit`."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous2, previous = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1]
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if previous2 is not None and i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+        previous2, previous = previous, current
+    return previous[-1]
+
+
+def _trigrams(text: str) -> List[str]:
+    padded = f"^{text}$"
+    return [padded[i:i + 3] for i in range(len(padded) - 2)]
+
+
+class AirportResolver:
+    """
+    Tra cứu mã IATA từ tên thành phố/sân bay do người dùng nhập, không phân biệt dấu
+    và hoa/thường, chịu được lỗi gõ. Thứ tự: mã IATA đã biết → tên gọi khớp chính xác
+    (dict) → tiền tố duy nhất (danh sách khóa đã sắp xếp + bisect) → gần đúng (chỉ mục
+    trigram để lấy ứng viên, rồi kiểm tra khoảng cách sửa). Khi nhiều sân bay cùng khớp,
+    ưu tiên ánh xạ trong AIRPORT_MAP rồi tới sân bay lớn hơn (lượng khách).
+    Kết quả `resolve` được cache LRU (`cache_size=0` để tắt).
+    """
+
+    def __init__(self, airports: Iterable[Airport], aliases: Optional[Dict[str, List[str]]] = None,
+                 curated: Optional[Dict[str, str]] = None, cache_size: int = AIRPORT_RESOLVER_CACHE_SIZE):
+        self.airports = {a.iata: a for a in airports}
+        # Hạng của sân bay trong một khóa: ánh xạ thủ công trước, rồi theo lượng khách
+        self._ranks: Dict[str, Dict[str, tuple]] = {}
+        self._alias_labels: Dict[str, str] = {}
+        for airport in self.airports.values():
+            for label in [airport.city, airport.name, *(aliases or {}).get(airport.iata, [])]:
+                self._add_key(label, airport.iata, curated=False)
+        for label, iata in (curated or {}).items():
+            if iata in self.airports:
+                self._add_key(label, iata, curated=True)
+
+        # Khóa khớp chính xác → danh sách IATA đã xếp hạng
+        self._exact = {key: self._ranked(ranks) for key, ranks in self._ranks.items()}
+        # Chỉ mục tiền tố: (khóa, thứ hạng loại khóa, iata), sắp xếp theo khóa.
+        # Loại 0 = cả tên gọi, 1 = phần đuôi bắt đầu từ một từ ("minh" của "ho chi minh")
+        prefix_entries = []
+        for key, ranks in self._ranks.items():
+            words = key.split()
+            for iata in ranks:
+                prefix_entries.append((key, 0, iata))
+                for i in range(1, len(words)):
+                    suffix = " ".join(words[i:])
+                    if len(suffix) >= 3:
+                        prefix_entries.append((suffix, 1, iata))
+        prefix_entries.sort()
+        self._prefix_keys = [entry[0] for entry in prefix_entries]
+        self._prefix_entries = prefix_entries
+        # Chỉ mục trigram trên dạng viết liền của các khóa (bỏ khoảng trắng)
+        self._compact_keys: Dict[str, str] = {}
+        for key in self._ranks:
+            self._compact_keys.setdefault(key.replace(" ", ""), key)
+        self._trigram_index: Dict[str, List[str]] = {}
+        for compact in self._compact_keys:
+            for gram in set(_trigrams(compact)):
+                self._trigram_index.setdefault(gram, []).append(compact)
+
+        self.resolve = functools.lru_cache(maxsize=cache_size)(self._resolve)
+
+    def _add_key(self, label: str, iata: str, curated: bool):
+        key = normalize_place(label)
+        if not key:
+            return
+        self._alias_labels.setdefault(key, label)
+        rank = (0 if curated else 1, -self.airports[iata].passengers_m)
+        key_ranks = self._ranks.setdefault(key, {})
+        key_ranks[iata] = min(key_ranks.get(iata, rank), rank)
+        compact = key.replace(" ", "")
+        if compact != key:
+            # "ha noi" và "hanoi" là cùng một tên gọi
+            self._alias_labels.setdefault(compact, label)
+            compact_ranks = self._ranks.setdefault(compact, {})
+            compact_ranks[iata] = min(compact_ranks.get(iata, rank), rank)
+
+    def known_names(self) -> List[str]:
+        """Mọi tên gọi đã chuẩn hóa (không dấu, chữ thường) có trong chỉ mục khớp chính xác."""
+        return list(self._exact)
+
+    @staticmethod
+    def _ranked(ranks: Dict[str, tuple]) -> List[str]:
+        return [iata for iata, _ in sorted(ranks.items(), key=lambda item: item[1])]
+
+    def _match(self, iata: str, key: str, score: float) -> AirportMatch:
+        airport = self.airports[iata]
+        return AirportMatch(iata, airport.name, airport.city, airport.country, round(score, 3),
+                            self._alias_labels.get(key, key))
+
+    def _prefix_candidates(self, query: str) -> Dict[str, tuple]:
+        """{iata: (loại khóa, hạng, khóa)} tốt nhất cho các khóa bắt đầu bằng `query`."""
+        found = {}
+        for index in range(bisect.bisect_left(self._prefix_keys, query), len(self._prefix_entries)):
+            key, kind, iata = self._prefix_entries[index]
+            if not key.startswith(query):
+                break
+            full_key = key if kind == 0 else None
+            candidate = (kind, self._ranks[full_key][iata] if full_key else (2, -self.airports[iata].passengers_m), key)
+            if iata not in found or candidate < found[iata]:
+                found[iata] = candidate
+        return found
+
+    def _fuzzy_candidates(self, query: str, max_candidates: int = 24) -> List[tuple]:
+        """[(khoảng cách, hạng, iata, khóa)] của các khóa gần đúng với `query` (viết liền)."""
+        compact = query.replace(" ", "")
+        if len(compact) < 4:
+            return []
+        overlap = Counter()
+        for gram in set(_trigrams(compact)):
+            for key in self._trigram_index.get(gram, ()):
+                overlap[key] += 1
+        limit = 1 if len(compact) <= 6 else 2
+        results = []
+        for key, _ in overlap.most_common(max_candidates):
+            distance = _bounded_edit_distance(compact, key, limit)
+            if distance <= limit:
+                full_key = self._compact_keys[key]
+                for iata, rank in self._ranks[full_key].items():
+                    results.append((distance, rank, iata, full_key))
+        results.sort()
+        return results
+
+    def _resolve(self, text: str) -> Optional[AirportMatch]:
+        if not text:
+            return None
+        raw = text.strip()
+        if len(raw) == 3 and raw.isascii() and raw.isalpha() and raw.upper() in self.airports:
+            return self._match(raw.upper(), raw.lower(), 1.0)
+        query = normalize_place(raw)
+        if not query:
+            return None
+
+        exact = self._exact.get(query) or self._exact.get(query.replace(" ", ""))
+        if exact:
+            return self._match(exact[0], query, 1.0)
+
+        if len(query) >= 3:
+            prefix = self._prefix_candidates(query)
+            # Chỉ chấp nhận tiền tố khi mọi ứng viên cùng một thành phố ("tok" → Tokyo)
+            if prefix and len({self.airports[iata].city for iata in prefix}) == 1:
+                iata, (_, _, key) = min(prefix.items(), key=lambda item: item[1])
+                return self._match(iata, key, 0.9)
+
+        fuzzy = self._fuzzy_candidates(query)
+        if fuzzy:
+            distance, _, iata, key = fuzzy[0]
+            return self._match(iata, key, 1 - distance / max(len(key), 1))
+        return None
+
+    def autocomplete(self, prefix: str, limit: int = 8) -> List[AirportMatch]:
+        """
+        Gợi ý sân bay cho ô nhập liệu: mã IATA bắt đầu bằng chuỗi đã gõ, rồi các tên gọi
+        bắt đầu bằng chuỗi đó (xếp theo ánh xạ thủ công và lượng khách), bổ sung bằng
+        kết quả gần đúng nếu chưa đủ `limit`.
+        """
+        query = normalize_place(prefix or "")
+        if not query or limit <= 0:
+            return []
+        matches: Dict[str, AirportMatch] = {}
+        code = query.replace(" ", "").upper()
+        if len(code) <= 3:
+            for iata in sorted(i for i in self.airports if i.startswith(code)):
+                if len(code) == 3 or len(matches) < limit:
+                    matches[iata] = self._match(iata, iata.lower(), 1.0 if iata == code else 0.8)
+        ranked = sorted(self._prefix_candidates(query).items(), key=lambda item: (item[1][0], item[1][1]))
+        for iata, (kind, _, key) in ranked:
+            if iata not in matches:
+                matches[iata] = self._match(iata, key, (1.0 if key == query else 0.9) - 0.1 * kind)
+        if len(matches) < limit:
+            for distance, _, iata, key in self._fuzzy_candidates(query):
+                if iata not in matches:
+                    matches[iata] = self._match(iata, key, 0.7 - 0.1 * distance)
+        return list(matches.values())[:limit]
+
+
+@functools.lru_cache(maxsize=None)
+def airport_resolver() -> AirportResolver:
+    """Resolver dùng chung, dựng lười ở lần tra cứu đầu tiên từ bộ dữ liệu đi kèm."""
+    airports, aliases = load_airports()
+    return AirportResolver(airports, aliases, curated=AIRPORT_MAP)
@@ -1,12 +1,20 @@
 import json
+import uuid
+from datetime import datetime, timedelta
 from langchain_core.messages import SystemMessage, HumanMessage, ToolMessage, AIMessage
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, ValidationError
 from typing import Optional, List
 
+from ..admission import turn_priority
 from ..graph.state import AgentState
-from ..config import llm
-from ..tools.booking_tools import search_flights_tool
-from .utils import get_iata_code, convert_relative_date, filter_for_human_ai
+from ..deadlines import DeadlineExceeded
+from ..config import get_llm, BOOKING_SUMMARY_MODE, BOOKING_EXTRACTION_MODE, FLIGHT_RESULTS_TOP_N
+from ..tools.booking_tools import search_flights_tool, fare_calendar_tool, format_flights_compact, format_vnd, render_flight_summary, render_fare_calendar
+from ..tools.flight_query import DEFAULT_SORT, FlightTable
+from .refine_rules import Refinement, SORT_LABELS, describe_filters, parse_refinement
+from .slot_rules import FLIGHT_SLOTS, extract_flight_slots, extract_passengers
+from .context_window import context_prompt
+from .utils import get_iata_code, convert_relative_date, nearby_airports, NodeSteps, run_steps, arun_steps, bound_tools, structured_output
 
 class FlightInfoExtractor(BaseModel):
     """Trích xuất thông tin chuyến bay từ tin nhắn của người dùng."""
@@ -14,8 +22,11 @@ class FlightInfoExtractor(BaseModel):
     destination_city: Optional[str] = Field(None, description="Thành phố hoặc sân bay điểm đến")
     departure_date: Optional[str] = Field(None, description="Ngày đi, ví dụ: 'hôm nay', 'ngày mai', '25/12'")
     passenger_count: Optional[int] = Field(None, description="Số lượng hành khách người lớn")
+    flexible_date: bool = Field(False, description="True nếu người dùng linh hoạt ngày bay và muốn biết ngày nào rẻ nhất trong một khoảng, ví dụ: 'tuần sau ngày nào rẻ nhất'")
+    date_window_days: Optional[int] = Field(None, description="Số ngày của khoảng cần tìm khi linh hoạt ngày bay, ví dụ: 'tuần sau' là 7")
+    include_nearby_airports: bool = Field(False, description="True nếu người dùng chấp nhận bay từ/đến các sân bay lân cận")
 
-# --- Pydantic model để hiểu lựa chọn chuyến bay ---
+# --- Pydantic model để hiểu lựa chọn chuyến bay (tool tùy chọn của lời gọi trả lời ở State 2) ---
 class FlightChoice(BaseModel):
     """Xác định lựa chọn chuyến bay của người dùng từ một danh sách."""
     choice_index: Optional[int] = Field(None, description="Chỉ số (bắt đầu từ 1) của chuyến bay người dùng chọn.")
@@ -32,19 +43,140 @@ class PassengerInfoExtractor(BaseModel):
     """Trích xuất danh sách thông tin của một hoặc nhiều hành khách."""
     passengers: List[PassengerInfo] = Field(description="Danh sách thông tin các hành khách được cung cấp.")
 
-# --- LLM và System Prompt ---
-booking_llm = llm.bind_tools([search_flights_tool])
+# --- System Prompt ---
+# Model được lấy theo vai trò: "extract" cho các lời gọi có cấu trúc (trích xuất slot, hành
+# khách), "respond" cho câu trả lời gửi khách. Câu trả lời luôn là văn bản thường để
+# /chat/stream phát được từng token; ở State 2 lựa chọn chuyến là tool tùy chọn của chính
+# lời gọi trả lời, nên mỗi lượt chỉ một lời gọi dù khách đã chọn hay chưa.
 SYSTEM_PROMPT = """Bạn là **Vivi**, một trợ lý ảo chuyên hỗ trợ những vấn đề liên quan đến đặt vé máy bay.
         Luôn giao tiếp thân thiện, gọi khách là anh/chị và xưng em.
         Luôn tuân thủ chặt chẽ quy trình nghiệp vụ từng bước.
         Khi nhận được kết quả từ tool, hãy tóm tắt nó cho người dùng và đề xuất bước tiếp theo.
         Nếu yêu cầu của khách hàng không liên quan đến đặt vé, hãy nói chính xác câu: "Về vấn đề này, em xin phép chuyển cho một chuyên viên khác." và không làm gì thêm.
 """
+SYSTEM_MESSAGE = SystemMessage(content=SYSTEM_PROMPT)
+
+def _booking_summary(flight_info: dict, passengers: List[dict], passenger_count: int, total_price) -> str:
+    """Bản tổng kết trước thanh toán render bằng template (BOOKING_SUMMARY_MODE="template")."""
+    lines = [f"Dạ em xin tổng kết thông tin đặt vé chuyến bay {flight_info.get('flight_number', '')}:"]
+    lines += [f"- {p['full_name']}, {p['date_of_birth']}, {p['phone_number']}" for p in passengers]
+    lines.append(f"Số lượng vé: {passenger_count}. Tổng chi phí: {total_price} VND.")
+    lines.append("Anh/chị vui lòng kiểm tra lại và phản hồi `xác nhận` để tiếp tục ạ.")
+    return "\n".join(lines)
+
+def _tool_call_message(tool, args: dict) -> AIMessage:
+    """Tin nhắn AI chứa tool call được dựng trực tiếp (tham số đã biết, không cần hỏi LLM)."""
+    return AIMessage(content="", tool_calls=[{"name": tool.name, "args": args, "id": f"call_{uuid.uuid4().hex}"}])
+
+def _passenger_request(passenger_count) -> str:
+    return (f"Anh/chị vui lòng cung cấp thông tin cho {passenger_count} hành khách gồm "
+            "Họ và tên, Ngày sinh (DD/MM/YYYY) và Số điện thoại ạ.")
+
+def _choice_confirmation(flight: dict, passenger_count) -> str:
+    departure = datetime.fromisoformat(flight["departure_time"]).strftime("%H:%M %d/%m")
+    return (f"Dạ em xác nhận anh/chị đã chọn chuyến bay **{flight['flight_number']}** cất cánh {departure}, "
+            f"giá **{format_vnd(flight['price'])}**/khách. " + _passenger_request(passenger_count))
+
+def _flight_choice(message: AIMessage) -> Optional[FlightChoice]:
+    """Lựa chọn chuyến trong tool call FlightChoice của model (None nếu model trả lời bằng văn bản)."""
+    for call in getattr(message, "tool_calls", None) or []:
+        if call["name"] == FlightChoice.__name__:
+            try:
+                return FlightChoice(**call["args"])
+            except ValidationError:
+                return None
+    return None
+
+def _resolve_pick(table: FlightTable, shown: List[dict], refinement: Refinement, filters: dict) -> Optional[dict]:
+    """
+    Chuyến khách chỉ tới: số hiệu (trong mọi chuyến đã lấy về), số thứ tự (trên trang đang
+    hiển thị) hoặc "rẻ nhất/sớm nhất..." (trong các chuyến khớp bộ lọc). Nhiều cách chỉ ra
+    các chuyến khác nhau ("chuyến 1 hay chuyến 2") thì coi là chưa chọn.
+    """
+    chosen = []
+    for kind, value in refinement.picks:
+        if kind == "flight":
+            flight = table.find(value)
+        elif kind == "ordinal":
+            flight = shown[-1] if value == -1 else shown[value - 1] if 1 <= value <= len(shown) else None
+        else:
+            flight = table.best(filters, value)
+        if flight is not None and flight not in chosen:
+            chosen.append(flight)
+    return chosen[0] if len(chosen) == 1 else None
+
+def _canonical_filters(filters: dict) -> dict:
+    """
+    Bộ lọc ở dạng lưu trong checkpoint: tuple thành list, vì serde của checkpointer trả lại
+    list. Nhờ vậy so sánh với `search_view` đã nạp lại không bị lệch kiểu.
+    """
+    return {key: list(value) if isinstance(value, (tuple, list)) else value for key, value in filters.items()}
+
+def _refine_results(state: AgentState, refinement: Refinement) -> Optional[dict]:
+    """
+    Lọc, sắp xếp, phân trang hoặc chọn chuyến trên danh sách đã lấy về (`search_pool`), không
+    gọi lại Amadeus hay LLM. Trả về None khi không xử lý chắc chắn được để hỏi LLM như trước.
+    """
+    shown = state["search_results"]
+    view = {"filters": {}, "sort": DEFAULT_SORT, "page": 0, **(state.get("search_view") or {})}
+    filters = {} if refinement.reset else _canonical_filters(view["filters"])
+    filters.update(_canonical_filters(refinement.filters))
+    try:
+        table = FlightTable(state.get("search_pool") or shown)
+    except (KeyError, TypeError, ValueError) as e:
+        print(f"Không dựng được bảng chuyến bay, chuyển sang LLM: {e}")
+        return None
+
+    if refinement.picks:
+        flight = _resolve_pick(table, shown, refinement, filters)
+        if flight is None:
+            return None
+        return {
+            "messages": [AIMessage(content=_choice_confirmation(flight, state.get("passenger_count", 1)))],
+            "confirmed_flight": flight,
+            "search_results": None, "search_pool": None, "search_view": None,
+            "previous_agent": "booking_agent",
+        }
+
+    sort = refinement.sort or view["sort"]
+    if filters != _canonical_filters(view["filters"]) or sort != view["sort"]:
+        page_index = 0
+    else:
+        page_index = view["page"] + {"next": 1, "prev": -1}.get(refinement.page, 0)
+    page = table.page(filters, sort, page_index)
+    if not page.total:
+        reply = (f"Dạ trong kết quả hiện tại không có chuyến nào {describe_filters(filters)} ạ. "
+                 "Anh/chị có thể thử điều kiện khác, hoặc nhắn `bỏ lọc` để xem lại tất cả các chuyến ạ.")
+        return {"messages": [AIMessage(content=reply)], "previous_agent": "booking_agent"}
+    if page.page < page_index and refinement.page == "next":
+        reply = (f"Dạ em đã hiển thị hết {page.total} chuyến phù hợp rồi ạ. "
+                 "Anh/chị muốn chọn chuyến bay số mấy trong danh sách trên ạ?")
+        return {"messages": [AIMessage(content=reply)], "previous_agent": "booking_agent"}
+
+    description = describe_filters(filters)
+    header = (f"Dạ, có {page.total} chuyến" + (f" {description}" if description else "")
+              + f", xếp theo {SORT_LABELS.get(sort, sort)}" + (f" (trang {page.page + 1}/{page.pages})" if page.pages > 1 else "") + ":")
+    shown_until = page.page * FLIGHT_RESULTS_TOP_N + len(page.flights)
+    return {
+        "messages": [AIMessage(content=render_flight_summary(page.flights, header=header, more=page.total - shown_until))],
+        "search_results": page.flights,
+        "search_view": {"filters": filters, "sort": sort, "page": page.page},
+        "previous_agent": "booking_agent",
+    }
 
 def booking_node(state: AgentState) -> dict:
+    """Phiên bản đồng bộ của node đặt vé."""
+    return run_steps(_booking_steps(state), priority=turn_priority(state))
+
+async def abooking_node(state: AgentState) -> dict:
+    """Phiên bản bất đồng bộ của node đặt vé, dùng trong `app.ainvoke`."""
+    return await arun_steps(_booking_steps(state), priority=turn_priority(state))
+
+def _booking_steps(state: AgentState) -> NodeSteps:
     """
     Node xử lý toàn bộ nghiệp vụ đặt vé máy bay một cách tuần tự.
     (Phiên bản tái cấu trúc với logic if/elif/else để sửa lỗi vòng lặp)
+    Mỗi lời gọi LLM được `yield` ra để chạy được cả đồng bộ lẫn bất đồng bộ.
     """
     print("---NODE: BOOKING---")
     messages = list(state['messages'])
@@ -60,22 +192,42 @@ def booking_node(state: AgentState) -> dict:
         except (json.JSONDecodeError, TypeError):
             search_results_data = {"error": "Dữ liệu trả về từ tool không hợp lệ."}
 
-        prompt = HumanMessage(
-            content=f"""Dựa vào kết quả từ tool call sau đây:
-            ---
-            {json.dumps(search_results_data, ensure_ascii=False, indent=2)}
-            ---
-            Hãy tóm tắt kết quả cho người dùng dưới dạng danh sách gạch đầu dòng, mỗi chuyến bay gồm: Mã hiệu, giờ cất cánh, giờ hạ cánh, và giá vé.
-            Đánh số thứ tự cho các chuyến bay bắt đầu từ 1. Sau đó hỏi họ muốn chọn chuyến bay nào.
-            """
-        )
-        response = booking_llm.invoke([SystemMessage(content=SYSTEM_PROMPT), prompt])
+        # Lịch giá theo ngày: hiển thị để khách chọn ngày, lượt sau mới tìm chi tiết
+        if messages[-1].name == fare_calendar_tool.name:
+            return {"messages": [AIMessage(content=render_fare_calendar(search_results_data))], "previous_agent": current_agent}
+
+        # Lỗi từ tool ({"error": ...}) không được lưu làm kết quả, để lượt sau tìm lại được
+        flights = search_results_data if isinstance(search_results_data, list) else []
+        # Chỉ hiển thị top-N; cả danh sách được giữ trong state để lọc/xem thêm tại chỗ
+        shown = flights[:FLIGHT_RESULTS_TOP_N]
+
+        response = None
+        if BOOKING_SUMMARY_MODE == "template":
+            # Tóm tắt là việc định dạng thuần túy: render bằng template, không cần gọi LLM
+            try:
+                response = AIMessage(content=render_flight_summary(shown, more=len(flights) - len(shown)))
+            except (KeyError, TypeError, ValueError) as e:
+                print(f"Không render được kết quả tìm kiếm, chuyển sang LLM: {e}")
+
+        if response is None:
+            prompt = HumanMessage(
+                content=f"""Dựa vào kết quả từ tool call sau đây:
+                ---
+                {format_flights_compact(shown if flights else search_results_data)}
+                ---
+                Hãy tóm tắt kết quả cho người dùng dưới dạng danh sách gạch đầu dòng, mỗi chuyến bay gồm: Mã hiệu, giờ cất cánh, giờ hạ cánh, và giá vé.
+                Giữ nguyên số thứ tự ở cột "#" cho các chuyến bay. Sau đó hỏi họ muốn chọn chuyến bay nào.
+                """
+            )
+            response = yield get_llm("respond"), [SYSTEM_MESSAGE, prompt]
         
         # **SỬA LỖI TẠI ĐÂY:** Trả về một dictionary chỉ chứa các trường cần cập nhật
         # LangGraph sẽ tự động merge dict này vào state chung.
         return {
             "messages": [response],
-            "search_results": search_results_data, # Quan trọng nhất là bước này
+            "search_results": shown or None, # Quan trọng nhất là bước này
+            "search_pool": flights or None,
+            "search_view": None,
             "previous_agent": current_agent
         }
 
@@ -84,90 +236,95 @@ def booking_node(state: AgentState) -> dict:
     # ==============================================================================
     elif state.get("search_results"):
         print(">>> Booking Node [State 2]: Đã có kết quả, xử lý lựa chọn của người dùng...")
-        
-        # Dùng LLM có cấu trúc để hiểu lựa chọn của người dùng
-        structured_llm_choice = llm.with_structured_output(FlightChoice)
-        choice_prompt = f"""Dưới đây là danh sách các chuyến bay đã được cung cấp (đánh số từ 1):
-        {json.dumps(state["search_results"], ensure_ascii=False, indent=2)}
 
-        Và đây là phản hồi của người dùng: "{messages[-1].content}"
+        # Lọc/sắp xếp/xem thêm/chọn chuyến rõ ràng được xử lý tại chỗ trên kết quả đã có
+        refinement = parse_refinement(messages[-1].content) if BOOKING_EXTRACTION_MODE == "rules" else None
+        if refinement is not None and refinement.actionable:
+            refined = _refine_results(state, refinement)
+            if refined is not None:
+                print(">>> Booking Node [State 2]: Xử lý bằng bộ lọc kết quả, bỏ qua LLM")
+                return refined
+
+        # Một lời gọi duy nhất: khách đã chọn thì model gọi tool FlightChoice, chưa chọn thì model
+        # trả lời bằng văn bản thường (stream được từng token)
+        passenger_count = state.get("passenger_count", 1)
+        flight_list = format_flights_compact(state["search_results"])
+        choice_prompt = HumanMessage(
+            content=f"""[Instruction] Dưới đây là danh sách các chuyến bay đã được cung cấp (đánh số từ 1):
+            {flight_list}
 
-        Dựa vào phản hồi, hãy xác định xem người dùng đã chọn chuyến bay nào (dựa trên số thứ tự) và đã xác nhận lựa chọn đó chưa.
-        """
-        user_choice = structured_llm_choice.invoke(choice_prompt)
+            Nếu tin nhắn cuối cùng của người dùng đã chọn và xác nhận một chuyến bay, hãy gọi tool FlightChoice với số thứ tự của chuyến đó.
+            Nếu chưa, không gọi tool: hãy trả lời câu hỏi của họ dựa trên danh sách trên, hoặc hỏi lại họ muốn chọn chuyến bay số mấy.
+            """
+        )
+        response = yield bound_tools(get_llm("respond"), FlightChoice), context_prompt(state, SYSTEM_MESSAGE) + [choice_prompt]
+        user_choice = _flight_choice(response)
 
-        # Nếu người dùng đã chọn và xác nhận
-        if user_choice.is_confirmed and user_choice.choice_index is not None and 1 <= user_choice.choice_index <= len(state["search_results"]):
+        # Nếu người dùng đã chọn và xác nhận: câu xác nhận là template, không cần gọi thêm LLM
+        if user_choice and user_choice.is_confirmed and user_choice.choice_index is not None and 1 <= user_choice.choice_index <= len(state["search_results"]):
             # Trừ 1 vì index của list bắt đầu từ 0
             chosen_flight = state["search_results"][user_choice.choice_index - 1]
-            
-            passenger_count = state.get("passenger_count", 1)
-            instructional_prompt = HumanMessage(
-                content=f"""
-                [Instruction] Người dùng vừa chọn chuyến bay sau đây:
-                {json.dumps(chosen_flight, ensure_ascii=False, indent=2)}
-
-                Nhiệm vụ của bạn bây giờ là:
-                1. Dùng văn phong thân thiện, xác nhận lại với người dùng rằng bạn đã ghi nhận lựa chọn của họ (ví dụ: "Dạ em xác nhận anh/chị đã chọn chuyến bay...").
-                2. Yêu cầu người dùng cung cấp thông tin cho {passenger_count} hành khách lần lượt bao gồm: Họ và tên, Ngày sinh (theo định dạng DD/MM/YYYY), và Số điện thoại.
-                """
-            )
-            
-            # Lọc tin nhắn để giữ ngữ cảnh sạch và thêm chỉ thị vào cuối
-            filtered_messages = filter_for_human_ai(messages)[-6:]
-            final_prompt =  [SystemMessage(content=SYSTEM_PROMPT)] + filtered_messages + [instructional_prompt]
-            
-            # Gọi LLM để tạo ra câu trả lời tự nhiên
-            response = booking_llm.invoke(final_prompt)
-            
             return {
-                "messages": [response],
+                "messages": [AIMessage(content=_choice_confirmation(chosen_flight, passenger_count))],
                 "confirmed_flight": chosen_flight,
                 "search_results": None, # Xóa kết quả tìm kiếm cũ để tránh vào lại state này
+                "search_pool": None,
+                "search_view": None,
                 "previous_agent": current_agent
             }
-        
-        # Nếu người dùng chưa chọn rõ ràng, hỏi lại hoặc xử lý câu hỏi phụ
+
+        # Nếu người dùng chưa chọn rõ ràng: câu trả lời văn bản của model đã là câu hỏi lại/trả lời
+        # câu hỏi phụ. Tool call không được lưu vào lịch sử (không có ToolMessage đi kèm); không có
+        # văn bản nào thì hỏi lại bằng template.
         else:
-            response = booking_llm.invoke(filter_for_human_ai(messages)[-6:])
+            text = response.content if isinstance(response.content, str) else ""
+            if response.tool_calls or not text.strip():
+                response = AIMessage(content=text.strip() or "Dạ anh/chị muốn chọn chuyến bay số mấy trong danh sách trên ạ?")
             return {"messages": [response], "previous_agent": current_agent}
-        
+
          # ==============================================================================
     # STATE 4 (ĐÃ SỬA LỖI TRIỆT ĐỂ): Thu thập thông tin hành khách
     # ==============================================================================
     elif state.get("confirmed_flight") and len(state.get("passengers", [])) < state.get("passenger_count", 1):
         print(f">>> Booking Node [State 4]: Thu thập thông tin hành khách...")
         
-        structured_llm_pax = llm.with_structured_output(PassengerInfoExtractor)
-        extractor_prompt = f"Trích xuất toàn bộ thông tin hành khách từ nội dung sau. Input: \"{messages[-1].content}\""
-        
-        try:
-            extracted_data = structured_llm_pax.invoke(extractor_prompt)
-            newly_extracted_passengers = [p.dict() for p in extracted_data.passengers]
-        except Exception:
-            newly_extracted_passengers = []
+        current_passengers = state.get("passengers", [])
+        passenger_count = state.get("passenger_count", 1)
+        flight_info = state.get("confirmed_flight", {})
+        total_price = flight_info.get("price", 0) * passenger_count
+
+        # Tin nhắn đúng khuôn (họ tên, ngày sinh, SĐT) được đọc bằng luật, không cần LLM
+        rule_guess = extract_passengers(messages[-1].content) if BOOKING_EXTRACTION_MODE == "rules" else None
+        if rule_guess and not rule_guess.conflict:
+            print(">>> Booking Node [State 4]: Đọc được thông tin hành khách bằng luật, bỏ qua LLM")
+            newly_extracted_passengers = rule_guess.slots["passengers"]
+        else:
+            extractor_prompt = f"Trích xuất toàn bộ thông tin hành khách từ nội dung sau. Input: \"{messages[-1].content}\""
+            try:
+                extracted_data = yield structured_output(get_llm("extract"), PassengerInfoExtractor), extractor_prompt
+                newly_extracted_passengers = [p.model_dump() for p in extracted_data.passengers]
+            except DeadlineExceeded:
+                raise  # hết thời hạn lượt: để run_steps trả câu trả lời soạn sẵn
+            except Exception:
+                newly_extracted_passengers = []
 
         if not newly_extracted_passengers:
             response = AIMessage(content="Dạ em chưa nhận được thông tin hành khách. Anh/chị vui lòng cung cấp lần lượt Họ tên, Ngày sinh (DD/MM/YYYY), và Số điện thoại ạ.")
-            updates = {"messages": state["messages"] + [response], "previous_agent": current_agent}
-            return {**state, **updates}
+            return {"messages": [response], "previous_agent": current_agent}
 
-        current_passengers = state.get("passengers", [])
         all_passengers = current_passengers + newly_extracted_passengers
-        
-        remaining = state.get("passenger_count", 1) - len(all_passengers)
+        remaining = passenger_count - len(all_passengers)
 
         # KỊCH BẢN 1: Vẫn còn thiếu thông tin -> Tạo tin nhắn và DỪNG LẠI
         if remaining > 0:
             print(f">>> Booking Node [State 4]: Vẫn còn thiếu {remaining} hành khách. Yêu cầu nhập thêm...")
             response_content = f"Dạ em đã ghi nhận thông tin. Anh/chị vui lòng cung cấp thông tin cho {remaining} hành khách còn lại ạ."
             response = AIMessage(content=response_content)
-            updates = {
-                "messages": state["messages"] + [response],
+            return {
+                "messages": [response],
                 "passengers": all_passengers,
                 "previous_agent": current_agent
             }
-            return {**state, **updates}
 
         # KỊCH BẢN 2: Đã thu thập đủ thông tin -> KHÔNG tạo tin nhắn và CHẠY TIẾP
         else:
@@ -176,33 +333,68 @@ def booking_node(state: AgentState) -> dict:
             ### =================================================================
             print(">>> Booking Node [State 5]: Đã đủ thông tin, bắt đầu tổng kết...")
             
-            flight_info = state.get("confirmed_flight", {})
-            passenger_info = state.get("passengers", [])
-            passenger_count = state.get("passenger_count", 1)
-            price_per_ticket = flight_info.get("price", 0)
-            total_price = price_per_ticket * passenger_count
-
-            instructional_prompt = HumanMessage(content=f"[INSTRUCTION] Bạn đã thu thập đủ thông tin. Bây giờ là bước cuối cùng trước khi thanh toán.\nDữ liệu đã thu thập:\n- Thông tin chuyến bay (giá này là giá cho 1 người): {json.dumps(flight_info, ensure_ascii=False, indent=2)}\n- Thông tin hành khách: {json.dumps(passenger_info, ensure_ascii=False, indent=2)}\n- Số lượng vé: {passenger_count}\n- **TỔNG CHI PHÍ CUỐI CÙNG (ĐÃ TÍNH TOÁN): {total_price} VND**\n\nNhiệm vụ của bạn:\n1. Hiển thị lại **TOÀN BỘ** thông tin đặt vé trên cho người dùng một cách rõ ràng, mạch lạc, chuyên nghiệp.\n2. **QUAN TRỌNG:** Khi hiển thị phần 'Tổng chi phí', hãy sử dụng con số **TỔNG CHI PHÍ CUỐI CÙNG** đã được tính toán ở trên, không dùng giá vé trong 'Thông tin chuyến bay'.\n3. Yêu cầu người dùng kiểm tra lại thật kỹ các thông tin.\n4. **BẮT BUỘC** phải yêu cầu người dùng phản hồi chính xác bằng từ `xác nhận` để tiếp tục.")
-            final_prompt = [SystemMessage(content=SYSTEM_PROMPT)] + filter_for_human_ai(messages)[-6:] + [instructional_prompt]
-            response = booking_llm.invoke(final_prompt)
-            updates = {"messages": state["messages"] + [response], "final_confirmation_sent": True, "previous_agent": current_agent}
-            return {**state, **updates}
+            if BOOKING_SUMMARY_MODE == "template":
+                response = AIMessage(content=_booking_summary(flight_info, all_passengers, passenger_count, total_price))
+            else:
+                summary_prompt = HumanMessage(content=f"""[INSTRUCTION] Bạn đã thu thập đủ thông tin. Bây giờ là bước cuối cùng trước khi thanh toán.
+Dữ liệu đã thu thập:
+- Thông tin chuyến bay (giá này là giá cho 1 người): {json.dumps(flight_info, ensure_ascii=False, separators=(",", ":"))}
+- Thông tin hành khách: {json.dumps(all_passengers, ensure_ascii=False)}
+- Số lượng vé: {passenger_count}
+- **TỔNG CHI PHÍ CUỐI CÙNG (ĐÃ TÍNH TOÁN): {total_price} VND**
+
+Nhiệm vụ của bạn:
+1. Hiển thị lại **TOÀN BỘ** thông tin đặt vé trên cho người dùng một cách rõ ràng, mạch lạc, chuyên nghiệp.
+2. **QUAN TRỌNG:** Khi hiển thị phần 'Tổng chi phí', hãy sử dụng con số **TỔNG CHI PHÍ CUỐI CÙNG** đã được tính toán ở trên, không dùng giá vé trong 'Thông tin chuyến bay'.
+3. Yêu cầu người dùng kiểm tra lại thật kỹ các thông tin.
+4. **BẮT BUỘC** phải yêu cầu người dùng phản hồi chính xác bằng từ `xác nhận` để tiếp tục.""")
+                response = yield get_llm("respond"), [SYSTEM_MESSAGE, summary_prompt]
+            return {"messages": [response], "passengers": all_passengers, "final_confirmation_sent": True, "previous_agent": current_agent}
   
     # ==============================================================================
     # ƯU TIÊN 3 (CUỐI CÙNG): Thu thập thông tin và kích hoạt tìm kiếm mới
     # ==============================================================================
     else:
         print(">>> Booking Node [State 3]: Thu thập thông tin...")
-        structured_llm = llm.with_structured_output(FlightInfoExtractor)
-        extractor_prompt = f"Trích xuất thông tin chuyến bay từ câu sau. Input: \"{messages[-1].content}\""
-        extracted_info = structured_llm.invoke(extractor_prompt)
+        # Bộ trích xuất luật chạy trước; slot nó đọc được luôn được giữ, LLM chỉ được gọi
+        # khi vẫn còn thiếu slot hoặc tín hiệu trong câu mâu thuẫn
+        rule_guess = extract_flight_slots(messages[-1].content) if BOOKING_EXTRACTION_MODE == "rules" else None
+        rule_slots = rule_guess.slots if rule_guess and not rule_guess.conflict else {}
+
+        if rule_guess and not rule_guess.conflict and all(rule_slots.get(k) or state.get(k) for k in FLIGHT_SLOTS):
+            print(">>> Booking Node [State 3]: Đủ thông tin từ bộ trích xuất luật, bỏ qua LLM")
+            extracted_info = FlightInfoExtractor()
+        else:
+            extractor_prompt = f"Trích xuất thông tin chuyến bay từ câu sau. Input: \"{messages[-1].content}\""
+            extracted_info = yield structured_output(get_llm("extract"), FlightInfoExtractor), extractor_prompt
 
         # Tạo một dictionary để cập nhật thông tin
         updates = {}
         if extracted_info.departure_city: updates["departure_from"] = get_iata_code(extracted_info.departure_city)
         if extracted_info.destination_city: updates["arrival_to"] = get_iata_code(extracted_info.destination_city)
-        if extracted_info.departure_date: updates["departure_date"] = convert_relative_date(extracted_info.departure_date)
+        if extracted_info.departure_date:
+            try:
+                updates["departure_date"] = convert_relative_date(extracted_info.departure_date)
+            except ValueError:
+                pass  # Ngày không nhận dạng được: coi như chưa có, hỏi lại người dùng
         if extracted_info.passenger_count: updates["passenger_count"] = extracted_info.passenger_count
+        updates.update(rule_slots)
+
+        departure_from = updates.get("departure_from") or state.get("departure_from")
+        arrival_to = updates.get("arrival_to") or state.get("arrival_to")
+        if extracted_info.flexible_date and departure_from and arrival_to:
+            print(">>> Booking Node: Linh hoạt ngày bay, tìm lịch giá rẻ nhất theo ngày...")
+            # Ngày cụ thể sẽ do người dùng chọn sau khi xem lịch giá
+            window_start = updates.pop("departure_date", None) or (datetime.now() + timedelta(days=1)).strftime("%Y-%m-%d")
+            nearby = extracted_info.include_nearby_airports
+            tool_call = _tool_call_message(fare_calendar_tool, {
+                "origins": nearby_airports(departure_from) if nearby else [departure_from],
+                "destinations": nearby_airports(arrival_to) if nearby else [arrival_to],
+                "start_date": window_start,
+                "days": extracted_info.date_window_days or 7,
+                "adults": updates.get("passenger_count") or state.get("passenger_count") or 1,
+            })
+            return {**updates, "messages": [tool_call], "previous_agent": current_agent}
 
         # Lấy thông tin hiện tại từ state và cập nhật nó
         current_info = {
@@ -215,8 +407,13 @@ def booking_node(state: AgentState) -> dict:
 
         if all(current_info.values()):
             print(">>> Booking Node: Đủ thông tin, chuẩn bị gọi Tool tìm kiếm...")
-            tool_input_message = HumanMessage(content=f"Tìm chuyến bay từ {current_info['departure_from']} đến {current_info['arrival_to']} vào ngày {current_info['departure_date']} cho {current_info['passenger_count']} hành khách.")
-            response_with_tool_call = booking_llm.invoke([SystemMessage(content=SYSTEM_PROMPT), tool_input_message])
+            # Tham số đã biết đủ nên tạo tool call trực tiếp, không cần hỏi lại LLM
+            response_with_tool_call = _tool_call_message(search_flights_tool, {
+                "origin": current_info["departure_from"],
+                "destination": current_info["arrival_to"],
+                "departure_date": current_info["departure_date"],
+                "adults": current_info["passenger_count"],
+            })
             
             # Cập nhật state với thông tin đã thu thập và tool call
             return {**updates, "messages": [response_with_tool_call], "previous_agent": current_agent}
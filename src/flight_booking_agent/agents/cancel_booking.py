@@ -21,4 +21,9 @@ def cancel_booking_node(state: AgentState) -> dict:
     return {
         "messages": [response_message],
         "previous_agent": "cancel_booking_agent"
-    }
\ No newline at end of file
+    }
+
+
+async def acancel_booking_node(state: AgentState) -> dict:
+    """Phiên bản bất đồng bộ của `cancel_booking_node` (không có lời gọi I/O nào cần chờ)."""
+    return cancel_booking_node(state)
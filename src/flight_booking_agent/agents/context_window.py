@@ -0,0 +1,225 @@
+# src/flight_booking_agent/agents/context_window.py
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import List, Optional
+
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
+
+from .. import admission
+from ..admission import PRIORITY_NORMAL
+from ..config import (
+    get_llm, CONTEXT_WINDOW_TOKENS, CONTEXT_WINDOW_MAX_MESSAGES, CONTEXT_SUMMARY_TOKENS, CONTEXT_SUMMARY_MODE,
+)
+from .utils import is_dialogue_message
+
+_WORD = re.compile(r"\w+|[^\w\s]")
+
+
+def estimate_tokens(text) -> int:
+    """Ước lượng số token (từ + dấu câu), đủ cho ngân sách prompt mà không cần tokenizer."""
+    return len(_WORD.findall(text if isinstance(text, str) else str(text)))
+
+
+def _clip_words(text: str, limit: int) -> str:
+    words = text.split()
+    return " ".join(words) if len(words) <= limit else " ".join(words[:limit]) + " …"
+
+
+def _line(m: BaseMessage) -> list:
+    """Dòng [vai, nội dung rút gọn] của một tin nhắn trôi khỏi cửa sổ, chờ được tóm tắt."""
+    if isinstance(m, HumanMessage):
+        return ["Khách", _clip_words(str(m.content), 40)]
+    return ["Vivi", _clip_words(str(m.content), 20)]
+
+
+def _compact(summary: str, lines: List[list]) -> str:
+    """
+    Tóm tắt bằng luật: nối lời khách vào bản tóm tắt cũ và chỉ giữ phần cuối trong ngân sách
+    CONTEXT_SUMMARY_TOKENS (tính theo từ). Câu trả lời của Vivi bỏ qua: phần lớn là template,
+    và các thông tin đã chốt nằm sẵn trong state (xem `known_facts`).
+    """
+    parts = ([summary] if summary else []) + [f"{role}: {text}" for role, text in lines if role == "Khách"]
+    words = " ".join(parts).split()
+    if len(words) > CONTEXT_SUMMARY_TOKENS:
+        words = ["…"] + words[-CONTEXT_SUMMARY_TOKENS:]
+    return " ".join(words)
+
+
+_RUNNING, _FAILED = object(), object()
+
+
+class BackgroundSummarizer:
+    """
+    Tóm tắt cuộn bằng LLM chạy ở luồng nền, ngoài đường găng của lượt chat: lượt làm cửa sổ
+    tràn chỉ gửi việc, các lượt sau lấy kết quả khi đã xong. Kết quả được lưu theo nội dung
+    (hash của bản tóm tắt cũ + các dòng mới) nên không cần biết thread_id.
+    """
+
+    def __init__(self, workers: int = 2, capacity: int = 1024):
+        self.workers = workers
+        self.capacity = capacity
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._results = OrderedDict()  # key -> _RUNNING | _FAILED | str
+        self._futures = set()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(summary: str, lines: List[list]) -> str:
+        payload = "\n".join([summary] + [f"{role}: {text}" for role, text in lines])
+        return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+    def submit(self, key: str, summary: str, lines: List[list]):
+        with self._lock:
+            if key in self._results:
+                return
+            self._results[key] = _RUNNING
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="context-summary")
+            future = self._executor.submit(self._run, key, summary, lines)
+            self._futures.add(future)
+            future.add_done_callback(self._futures.discard)
+
+    def _run(self, key: str, summary: str, lines: List[list]):
+        prompt = (
+            f"Tóm tắt ngắn gọn (tối đa {CONTEXT_SUMMARY_TOKENS} từ) đoạn hội thoại đặt vé máy bay dưới đây để làm ngữ "
+            "cảnh cho các lượt sau. Giữ lại mọi thông tin khách đã cung cấp (chặng bay, ngày, số khách, chuyến đã "
+            "chọn, yêu cầu riêng); bỏ lời chào và nội dung lặp lại. Chỉ trả về bản tóm tắt.\n"
+            f"Tóm tắt trước đó: {summary or '(chưa có)'}\n"
+            "Tin nhắn mới:\n" + "\n".join(f"{role}: {text}" for role, text in lines)
+        )
+        try:
+            with admission.llm_limiter.slot(PRIORITY_NORMAL):
+                reply = get_llm("extract").invoke(prompt)
+            result = _clip_words(str(reply.content), CONTEXT_SUMMARY_TOKENS) or _FAILED
+        except Exception as e:
+            print(f"Không tóm tắt được hội thoại ở nền, dùng bản tóm tắt luật: {e}")
+            result = _FAILED
+        with self._lock:
+            self._results[key] = result
+            while len(self._results) > self.capacity:
+                self._results.popitem(last=False)
+
+    def result(self, key: str):
+        """Bản tóm tắt nếu đã xong, `_RUNNING` nếu đang chạy, `_FAILED` nếu lỗi hoặc không còn."""
+        with self._lock:
+            return self._results.get(key, _FAILED)
+
+    def wait(self, timeout: Optional[float] = None):
+        """Chờ các việc đang chạy xong (dùng trong test và khi tắt ứng dụng)."""
+        wait(list(self._futures), timeout=timeout)
+
+
+summarizer = BackgroundSummarizer()
+
+
+def _new_context(seen: int) -> dict:
+    return {"seen": seen, "window": [], "tokens": 0, "overflow": [], "summary": "", "pending": None}
+
+
+def _consistent(context: Optional[dict], messages: List[BaseMessage]) -> bool:
+    # Chỉ kiểm tra hai đầu cửa sổ (O(1)); lịch sử bị viết lại thì dựng lại cửa sổ
+    if not isinstance(context, dict) or context.get("seen", 0) > len(messages):
+        return False
+    return all(messages[index].id == message_id for index, message_id, _ in context["window"][:1] + context["window"][-1:])
+
+
+def _rebuild(messages: List[BaseMessage]) -> dict:
+    """Cửa sổ dựng từ cuối lịch sử (thread cũ chưa có `context`); phần cũ hơn không được tóm tắt."""
+    context = _new_context(len(messages))
+    for index in range(len(messages) - 1, -1, -1):
+        m = messages[index]
+        if not is_dialogue_message(m):
+            continue
+        tokens = estimate_tokens(m.content)
+        if context["window"] and (len(context["window"]) >= CONTEXT_WINDOW_MAX_MESSAGES
+                                  or context["tokens"] + tokens > CONTEXT_WINDOW_TOKENS):
+            break
+        context["window"].insert(0, [index, m.id, tokens])
+        context["tokens"] += tokens
+    return context
+
+
+def _fold(context: dict):
+    """Gộp các dòng đã trôi khỏi cửa sổ vào bản tóm tắt (bằng luật, hoặc lấy kết quả LLM ở nền)."""
+    if CONTEXT_SUMMARY_MODE != "llm":
+        if context["overflow"]:
+            context["summary"], context["overflow"] = _compact(context["summary"], context["overflow"]), []
+        return
+    if context["pending"]:
+        key, count = context["pending"]
+        result = summarizer.result(key)
+        if result is _RUNNING:
+            # LLM chậm hơn nhịp hội thoại: không để phần chờ tóm tắt phình quá ngân sách
+            if sum(len(text.split()) for _, text in context["overflow"]) > 2 * CONTEXT_SUMMARY_TOKENS:
+                context["summary"], context["overflow"], context["pending"] = _compact(context["summary"], context["overflow"]), [], None
+            return
+        done = context["overflow"][:count]
+        context["summary"] = _compact(context["summary"], done) if result is _FAILED else result
+        context["overflow"], context["pending"] = context["overflow"][count:], None
+    if context["overflow"]:
+        key = summarizer.key(context["summary"], context["overflow"])
+        summarizer.submit(key, context["summary"], context["overflow"])
+        context["pending"] = [key, len(context["overflow"])]
+
+
+def advance(context: Optional[dict], messages: List[BaseMessage]) -> dict:
+    """
+    Cập nhật cửa sổ ngữ cảnh với các tin nhắn mới từ lượt trước (`messages[seen:]`): giữ chỉ số
+    các tin nhắn hội thoại gần nhất trong ngân sách token/số tin nhắn, tin nhắn trôi ra được gộp
+    vào bản tóm tắt cuộn. Chi phí mỗi lượt tỉ lệ với số tin nhắn mới, không với độ dài lịch sử.
+    Trả về dict mới (lưu vào `AgentState.context`), không sửa `context` cũ.
+    """
+    if not _consistent(context, messages):
+        return _rebuild(messages)
+    context = {**context, "window": list(context["window"]), "overflow": list(context["overflow"])}
+    for index in range(context["seen"], len(messages)):
+        m = messages[index]
+        if is_dialogue_message(m):
+            tokens = estimate_tokens(m.content)
+            context["window"].append([index, m.id, tokens])
+            context["tokens"] += tokens
+    context["seen"] = len(messages)
+    # Luôn giữ ít nhất tin nhắn mới nhất, kể cả khi một mình nó vượt ngân sách
+    while len(context["window"]) > 1 and (len(context["window"]) > CONTEXT_WINDOW_MAX_MESSAGES
+                                          or context["tokens"] > CONTEXT_WINDOW_TOKENS):
+        index, _, tokens = context["window"].pop(0)
+        context["overflow"].append(_line(messages[index]))
+        context["tokens"] -= tokens
+    _fold(context)
+    return context
+
+
+def known_facts(state) -> str:
+    """Các slot đã chốt trong state, để prompt không phụ thuộc vào việc tin nhắn cũ còn trong cửa sổ."""
+    facts = []
+    if state.get("departure_from") and state.get("arrival_to"):
+        facts.append(f"chặng {state['departure_from']} → {state['arrival_to']}")
+    if state.get("departure_date"):
+        facts.append(f"ngày đi {state['departure_date']}")
+    if state.get("passenger_count"):
+        facts.append(f"{state['passenger_count']} hành khách")
+    if state.get("confirmed_flight"):
+        facts.append(f"đã chọn chuyến {state['confirmed_flight'].get('flight_number', '')}")
+    return ", ".join(facts)
+
+
+def context_prompt(state, system: SystemMessage) -> List[BaseMessage]:
+    """
+    Prompt giới hạn theo ngân sách cho một node: `system` kèm các thông tin đã biết và bản tóm
+    tắt phần hội thoại cũ, rồi các tin nhắn trong cửa sổ. Router cập nhật `context` mỗi lượt;
+    ở đây chỉ bắt kịp các tin nhắn phát sinh sau đó (thường không có).
+    """
+    messages = state["messages"]
+    context = advance(state.get("context"), messages)
+    notes = []
+    facts = known_facts(state)
+    if facts:
+        notes.append(f"Thông tin đã biết: {facts}.")
+    summary = _compact(context["summary"], context["overflow"]) if context["overflow"] else context["summary"]
+    if summary:
+        notes.append(f"Tóm tắt phần hội thoại trước: {summary}")
+    head = SystemMessage(content=system.content + "\n\n" + "\n".join(notes)) if notes else system
+    return [head] + [messages[index] for index, _, _ in context["window"]]
@@ -0,0 +1,367 @@
+# src/flight_booking_agent/agents/faq_index.py
+import functools
+import glob
+import hashlib
+import json
+import os
+import re
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Iterable, List, NamedTuple, Optional
+
+import numpy as np
+
+from .utils import fold_vietnamese
+
+# Tra cứu câu hỏi chung (hành lý, check-in, hoàn/đổi vé...) trên bộ tài liệu quy định, offline:
+# - FAQ_DOCS_DIR: thư mục tài liệu (*.md, *.txt); mỗi mục "## ..." là một đoạn
+# - FAQ_INDEX_DIR: nơi lưu chỉ mục (ma trận vector .npy, mở lại bằng memory-map); rỗng = không lưu
+# - FAQ_EMBEDDER: "hashing" (mặc định: TF-IDF trên n-gram băm, không cần mạng hay model) hoặc
+#   "sentence-transformers:<tên hoặc đường dẫn model cục bộ>" (thiếu thư viện thì quay về hashing)
+# - FAQ_HASH_DIM: số chiều vector của embedder hashing
+# - FAQ_TOP_K / FAQ_MIN_SCORE: số đoạn lấy về mỗi câu hỏi và điểm cosine tối thiểu để trả lời; ngoài
+#   điểm, câu hỏi còn phải có chung một từ hai âm tiết với tiêu đề đoạn, hoặc hai từ với nội dung
+# - FAQ_ANSWER_CACHE_SIZE: số câu trả lời (theo câu hỏi đã chuẩn hóa) giữ trong LRU
+FAQ_DOCS_DIR = os.getenv(
+    "FAQ_DOCS_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "faq"),
+)
+FAQ_INDEX_DIR = os.getenv("FAQ_INDEX_DIR", ".faq_index")
+FAQ_EMBEDDER = os.getenv("FAQ_EMBEDDER", "hashing")
+FAQ_HASH_DIM = int(os.getenv("FAQ_HASH_DIM", "512"))
+FAQ_TOP_K = int(os.getenv("FAQ_TOP_K", "3"))
+FAQ_MIN_SCORE = float(os.getenv("FAQ_MIN_SCORE", "0.18"))
+FAQ_ANSWER_CACHE_SIZE = int(os.getenv("FAQ_ANSWER_CACHE_SIZE", "2048"))
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+_WORD = re.compile(r"\w+")
+# Từ đệm/xưng hô không mang nội dung câu hỏi ("cho em hỏi", "ạ", "với")
+_STOPWORDS = frozenset(
+    "a ah anh chi em minh toi ban oi cho hoi voi nhe nha vay the thi la co khong duoc nao gi sao nhu "
+    "va cua cac nhung mot de khi neu vui long xin cam on ok oke okay vang da roi".split()
+)
+_BATCH_ROWS = 4096
+
+
+class Chunk(NamedTuple):
+    """Một đoạn tài liệu: tệp nguồn, tiêu đề tài liệu, tiêu đề mục và nội dung."""
+    source: str
+    title: str
+    heading: str
+    text: str
+
+
+class FaqHit(NamedTuple):
+    chunk: Chunk
+    score: float
+
+
+class FaqAnswer(NamedTuple):
+    """Câu trả lời cho người dùng, kèm đoạn tài liệu dùng để trả lời."""
+    reply: str
+    hits: List[FaqHit]
+
+
+def normalize_question(text: str) -> str:
+    """Khóa cache của câu hỏi: bỏ dấu, chữ thường, bỏ dấu câu và từ đệm."""
+    return " ".join(t for t in _TOKEN.findall(fold_vietnamese(text)) if t not in _STOPWORDS)
+
+
+def _word_pairs(text: str) -> frozenset:
+    """Các cặp âm tiết liền nhau (đã bỏ dấu và từ đệm): xấp xỉ các từ ghép như "hành lý", "hoàn vé"."""
+    tokens = [t for t in _TOKEN.findall(fold_vietnamese(text)) if t not in _STOPWORDS]
+    return frozenset(f"{a} {b}" for a, b in zip(tokens, tokens[1:]))
+
+
+@functools.lru_cache(maxsize=4096)
+def _chunk_pairs(chunk: "Chunk") -> tuple:
+    return _word_pairs(f"{chunk.title} {chunk.heading}"), _word_pairs(chunk.text)
+
+
+def on_topic(question: str, chunk: "Chunk") -> bool:
+    """
+    Câu hỏi có thật sự nói về đoạn tài liệu không: có chung một từ với tiêu đề đoạn hoặc hai từ
+    với nội dung. Điểm cosine một mình không đủ: "ok", "bạn tên gì", "thời tiết Hà Nội thế nào"
+    vẫn đạt ~0.2 nhờ một âm tiết chung hoặc va chạm băm.
+    """
+    pairs = _word_pairs(question)
+    heading, body = _chunk_pairs(chunk)
+    return bool(pairs & heading) or len(pairs & body) >= 2
+
+
+def chunk_document(path: str, max_words: int = 120) -> List[Chunk]:
+    """
+    Tách tài liệu thành các đoạn theo mục "## ..." (dòng "# ..." đầu tiên là tiêu đề tài liệu);
+    mục dài hơn `max_words` từ được tách tiếp theo đoạn văn.
+    """
+    with open(path, encoding="utf-8") as f:
+        lines = f.read().splitlines()
+    source = os.path.basename(path)
+    title = next((l[2:].strip() for l in lines if l.startswith("# ")), os.path.splitext(source)[0])
+    sections, heading, body = [], "", []
+    for line in lines + ["## "]:
+        if line.startswith("## "):
+            if body:
+                sections.append((heading, body))
+            heading, body = line[3:].strip(), []
+        elif not line.startswith("# "):
+            body.append(line)
+    chunks = []
+    for heading, body in sections:
+        paragraphs = [p.strip() for p in "\n".join(body).split("\n\n") if p.strip()]
+        current = []
+        for paragraph in paragraphs:
+            if current and len(" ".join(current + [paragraph]).split()) > max_words:
+                chunks.append(Chunk(source, title, heading, " ".join(current)))
+                current = []
+            current.append(" ".join(paragraph.split()))
+        if current:
+            chunks.append(Chunk(source, title, heading, " ".join(current)))
+    return chunks
+
+
+def load_chunks(docs_dir: str = FAQ_DOCS_DIR) -> List[Chunk]:
+    paths = sorted(glob.glob(os.path.join(docs_dir, "*.md")) + glob.glob(os.path.join(docs_dir, "*.txt")))
+    return [chunk for path in paths for chunk in chunk_document(path)]
+
+
+class HashingEmbedder:
+    """
+    Embedder offline: TF-IDF trên âm tiết và cặp âm tiết liền nhau (đã bỏ dấu), băm vào `dim`
+    chiều với dấu ±1 để giảm lệch do va chạm (feature hashing). Không cần từ điển hay model;
+    IDF học từ bộ tài liệu khi dựng chỉ mục và được lưu cùng chỉ mục.
+    """
+
+    def __init__(self, dim: int = FAQ_HASH_DIM):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+        self.idf = np.ones(dim, dtype=np.float32)
+        self._features = {}  # n-gram -> ±cột; băm bằng crc32 để ổn định giữa các tiến trình
+        self._folded = {}  # từ gốc -> các âm tiết đã bỏ dấu (bỏ dấu từng ký tự là phần chậm nhất khi dựng)
+
+    def _tokens(self, text: str) -> List[str]:
+        folded, words = self._folded, []
+        for word in _WORD.findall(text.lower()):
+            syllables = folded.get(word)
+            if syllables is None:
+                syllables = folded[word] = tuple(t for t in _TOKEN.findall(fold_vietnamese(word)) if t not in _STOPWORDS)
+            words.extend(syllables)
+        return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+    def _feature(self, token: str) -> int:
+        h = zlib.crc32(token.encode("utf-8"))
+        self._features[token] = feature = ((h % self.dim) or self.dim) * (1 if h & 0x80000000 else -1)
+        return feature
+
+    def _counts(self, texts: List[str]) -> np.ndarray:
+        # Mỗi n-gram là một số nguyên: |giá trị| là cột (cột 0 ghi là `dim`), dấu là dấu của feature
+        features, lengths, ids = self._features, [], []
+        for text in texts:
+            tokens = self._tokens(text)
+            lengths.append(len(tokens))
+            ids.extend([features.get(t) or self._feature(t) for t in tokens])
+        ids = np.asarray(ids, dtype=np.int64)
+        rows = np.repeat(np.arange(len(texts), dtype=np.int64), lengths)
+        flat = rows * self.dim + np.abs(ids) % self.dim
+        counts = np.bincount(flat, weights=np.sign(ids).astype(np.float64), minlength=len(texts) * self.dim)
+        return counts.reshape(len(texts), self.dim).astype(np.float32)
+
+    def _weigh(self, counts: np.ndarray) -> np.ndarray:
+        vectors = np.sign(counts) * np.log1p(np.abs(counts)) * self.idf
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms == 0, 1, norms)
+
+    def fit(self, texts: List[str]) -> np.ndarray:
+        """Học IDF trên cả bộ tài liệu và trả về ma trận vector của các đoạn (theo lô)."""
+        batches = [self._counts(texts[i:i + _BATCH_ROWS]) for i in range(0, len(texts), _BATCH_ROWS)]
+        df = sum((batch != 0).sum(axis=0) for batch in batches) if batches else np.zeros(self.dim)
+        self.idf = (np.log((1 + len(texts)) / (1 + df)) + 1).astype(np.float32)
+        return np.vstack([self._weigh(batch) for batch in batches]) if batches else np.zeros((0, self.dim), np.float32)
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        return self._weigh(self._counts(texts))
+
+    def state(self) -> dict:
+        return {"idf": self.idf}
+
+    def load_state(self, arrays: dict):
+        self.idf = np.asarray(arrays["idf"], dtype=np.float32)
+
+
+class SentenceTransformerEmbedder:
+    """Embedder dùng model sentence-transformers có sẵn trên máy (thư viện tùy chọn)."""
+
+    def __init__(self, model: str):
+        from sentence_transformers import SentenceTransformer
+        self._model = SentenceTransformer(model)
+        self.dim = self._model.get_sentence_embedding_dimension()
+        self.name = f"sentence-transformers-{model}"
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        return np.asarray(self._model.encode(list(texts), normalize_embeddings=True), dtype=np.float32)
+
+    fit = embed
+
+    def state(self) -> dict:
+        return {}
+
+    def load_state(self, arrays: dict):
+        pass
+
+
+def get_embedder(spec: str = FAQ_EMBEDDER):
+    """Dựng embedder theo FAQ_EMBEDDER; model cục bộ không dùng được thì quay về hashing."""
+    if spec.startswith("sentence-transformers:"):
+        try:
+            return SentenceTransformerEmbedder(spec.split(":", 1)[1])
+        except Exception as e:
+            print(f"Không dùng được embedder {spec}, chuyển sang hashing: {e}")
+    return HashingEmbedder()
+
+
+def corpus_fingerprint(chunks: List[Chunk], embedder) -> str:
+    digest = hashlib.sha1(embedder.name.encode("utf-8"))
+    for chunk in chunks:
+        digest.update("\x1f".join(chunk).encode("utf-8"))
+        digest.update(b"\x1e")
+    return digest.hexdigest()
+
+
+class FaqIndex:
+    """
+    Chỉ mục vector của các đoạn tài liệu: ma trận (số đoạn × số chiều) đã chuẩn hóa L2 nên
+    cosine là một phép nhân ma trận. Nhiều câu hỏi được tìm cùng lúc trong một lần nhân
+    (`search`). Chỉ mục lưu ra đĩa (`save`) được mở lại bằng memory-map (`load`) nên không
+    phải dựng lại hay đọc hết vào RAM khi khởi động. Câu trả lời được cache theo câu hỏi đã
+    chuẩn hóa (LRU).
+    """
+
+    def __init__(self, chunks: List[Chunk], vectors: np.ndarray, embedder, fingerprint: str = "",
+                 cache_size: int = FAQ_ANSWER_CACHE_SIZE):
+        self.chunks = chunks
+        self.vectors = vectors
+        self.embedder = embedder
+        self.fingerprint = fingerprint
+        self.cache_size = cache_size
+        self._answers = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0}
+
+    @classmethod
+    def build(cls, chunks: List[Chunk], embedder=None, **kwargs) -> "FaqIndex":
+        embedder = embedder or get_embedder()
+        vectors = embedder.fit([f"{c.title}. {c.heading}. {c.text}" for c in chunks])
+        return cls(chunks, vectors, embedder, corpus_fingerprint(chunks, embedder), **kwargs)
+
+    def save(self, index_dir: str):
+        """Ghi chỉ mục vào thư mục tạm rồi đổi tên, để tiến trình khác không đọc phải bản ghi dở."""
+        os.makedirs(os.path.dirname(os.path.abspath(index_dir)), exist_ok=True)
+        staging = f"{index_dir}.tmp-{os.getpid()}-{threading.get_ident()}"
+        os.makedirs(staging, exist_ok=True)
+        np.save(os.path.join(staging, "vectors.npy"), np.ascontiguousarray(self.vectors, dtype=np.float32))
+        np.savez(os.path.join(staging, "embedder.npz"), **self.embedder.state())
+        with open(os.path.join(staging, "chunks.json"), "w", encoding="utf-8") as f:
+            json.dump({"fingerprint": self.fingerprint, "embedder": self.embedder.name,
+                       "chunks": [list(c) for c in self.chunks]}, f, ensure_ascii=False)
+        if os.path.isdir(index_dir):
+            retired = f"{staging}.old"
+            os.replace(index_dir, retired)
+            os.replace(staging, index_dir)
+            for name in os.listdir(retired):
+                os.remove(os.path.join(retired, name))
+            os.rmdir(retired)
+        else:
+            os.replace(staging, index_dir)
+
+    @classmethod
+    def load(cls, index_dir: str, embedder=None, fingerprint: Optional[str] = None, **kwargs) -> Optional["FaqIndex"]:
+        """Mở chỉ mục đã lưu (vector qua memory-map); None nếu chưa có, hỏng hoặc đã cũ."""
+        embedder = embedder or get_embedder()
+        if not os.path.exists(os.path.join(index_dir, "chunks.json")):
+            return None
+        try:
+            with open(os.path.join(index_dir, "chunks.json"), encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta["embedder"] != embedder.name or (fingerprint and meta["fingerprint"] != fingerprint):
+                return None
+            with np.load(os.path.join(index_dir, "embedder.npz")) as arrays:
+                embedder.load_state(dict(arrays))
+            vectors = np.load(os.path.join(index_dir, "vectors.npy"), mmap_mode="r")
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Không mở được chỉ mục FAQ tại {index_dir}, dựng lại: {e}")
+            return None
+        return cls([Chunk(*c) for c in meta["chunks"]], vectors, embedder, meta["fingerprint"], **kwargs)
+
+    def search(self, queries: List[str], k: int = FAQ_TOP_K) -> List[List[FaqHit]]:
+        """Top-k đoạn theo cosine cho từng câu hỏi, tìm theo lô bằng một phép nhân ma trận."""
+        if not queries or not len(self.chunks):
+            return [[] for _ in queries]
+        scores = self.embedder.embed(list(queries)) @ self.vectors.T
+        k = min(k, scores.shape[1])
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        results = []
+        for row, candidates in zip(scores, top):
+            ranked = candidates[np.argsort(-row[candidates], kind="stable")]
+            results.append([FaqHit(self.chunks[i], float(row[i])) for i in ranked])
+        return results
+
+    def answer_many(self, questions: Iterable[str], min_score: float = FAQ_MIN_SCORE) -> List[Optional[FaqAnswer]]:
+        """Trả lời nhiều câu hỏi; câu chưa có trong cache được tìm chung một lô."""
+        questions = list(questions)
+        # Cùng câu hỏi với ngưỡng khác có thể có câu trả lời khác: ngưỡng là một phần của khóa cache
+        keys = [(normalize_question(q), min_score) for q in questions]
+        answers, missing = [None] * len(questions), {}
+        with self._lock:
+            for i, key in enumerate(keys):
+                if key in self._answers:
+                    self._answers.move_to_end(key)
+                    answers[i] = self._answers[key]
+                    self.counters["hits"] += 1
+                elif key[0]:
+                    missing.setdefault(key, []).append(i)
+                    self.counters["misses"] += 1
+        if missing:
+            # Tìm theo câu đã chuẩn hóa: cùng khóa cache thì cùng kết quả
+            found = dict(zip(missing, self.search([question for question, _ in missing])))
+            with self._lock:
+                for key, positions in missing.items():
+                    hits = [hit for hit in found[key] if hit.score >= min_score]
+                    answer = FaqAnswer(render_faq_answer(hits[0].chunk), hits) if hits and on_topic(key[0], hits[0].chunk) else None
+                    self._answers[key] = answer
+                    while len(self._answers) > self.cache_size:
+                        self._answers.popitem(last=False)
+                    for i in positions:
+                        answers[i] = answer
+        return answers
+
+    def answer(self, question: str, min_score: float = FAQ_MIN_SCORE) -> Optional[FaqAnswer]:
+        return self.answer_many([question], min_score)[0]
+
+
+def render_faq_answer(chunk: Chunk) -> str:
+    return (f"Dạ, về {chunk.heading[0].lower() + chunk.heading[1:].rstrip('?') if chunk.heading else chunk.title.lower()}: "
+            f"{chunk.text}\nAnh/chị cần em hỗ trợ thêm thông tin gì không ạ?")
+
+
+def load_or_build(docs_dir: Optional[str] = None, index_dir: Optional[str] = None, embedder=None) -> FaqIndex:
+    """Mở chỉ mục đã lưu nếu còn khớp với tài liệu hiện tại, nếu không thì dựng lại và lưu."""
+    embedder = embedder or get_embedder()
+    index_dir = FAQ_INDEX_DIR if index_dir is None else index_dir
+    chunks = load_chunks(docs_dir or FAQ_DOCS_DIR)
+    fingerprint = corpus_fingerprint(chunks, embedder)
+    index = FaqIndex.load(index_dir, embedder, fingerprint) if index_dir else None
+    if index is None:
+        index = FaqIndex.build(chunks, embedder)
+        if index_dir:
+            try:
+                index.save(index_dir)
+            except OSError as e:
+                print(f"Không lưu được chỉ mục FAQ vào {index_dir}: {e}")
+    return index
+
+
+@functools.lru_cache(maxsize=None)
+def faq_index() -> FaqIndex:
+    """Chỉ mục dùng chung, mở/dựng lười ở lần hỏi đầu tiên (hoặc khi /readyz?warm=true)."""
+    return load_or_build()
@@ -1,29 +1,36 @@
-# src/flight_booking_agent/agents/information_gatherer.py
-import json
-from datetime import datetime, timedelta
-from typing import Optional
-# SỬA LỖI PYDANTIC: Import trực tiếp từ pydantic
-from pydantic import BaseModel, Field
-from langchain_core.messages import SystemMessage, AIMessage, HumanMessage
+# src/flight_booking_agent/agents/general.py
+from langchain_core.messages import AIMessage
 
-from ..config import llm
 from ..graph.state import AgentState
 
-from .utils import get_iata_code, convert_relative_date
+from .faq_index import faq_index
 
 
 # === THÊM HÀM MỚI TẠI ĐÂY ===
 def general_node(state: AgentState) -> dict:
     """
-    NODE GIẢ LẬP: Xử lý các câu hỏi chung.
-    Trong tương lai, node này sẽ chứa logic để gọi RAG hoặc các tool kiến thức chung.
+    Xử lý các câu hỏi chung (hành lý, check-in, hoàn/đổi vé, thanh toán...) bằng cách tra
+    cứu bộ tài liệu quy định offline (agents/faq_index.py), không gọi LLM. Không tìm được
+    đoạn nào đủ gần thì trả lời chung như trước.
     """
-    print("---NODE: GENERAL (Placeholder)---")
-    
-    # Hiện tại, chỉ trả về một tin nhắn thông báo chung
-    response_message = AIMessage(content="Dạ, em có thể giúp gì khác cho anh/chị ạ?")
+    print("---NODE: GENERAL---")
+
+    answer = None
+    try:
+        answer = faq_index().answer(state["messages"][-1].content)
+    except Exception as e:
+        print(f"Không tra cứu được FAQ: {e}")
+    response_message = AIMessage(content=answer.reply if answer else "Dạ, em có thể giúp gì khác cho anh/chị ạ?")
     
     return {
         "messages": [response_message],
         "previous_agent": "general_agent"
-    }
\ No newline at end of file
+    }
+
+
+async def ageneral_node(state: AgentState) -> dict:
+    """
+    Phiên bản bất đồng bộ của `general_node`. Tra cứu chỉ là một phép nhân ma trận nhỏ (dưới
+    1ms với bộ tài liệu đi kèm) nên chạy thẳng trên event loop; chỉ mục được mở sẵn khi khởi động.
+    """
+    return general_node(state)
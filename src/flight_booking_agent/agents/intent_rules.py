@@ -0,0 +1,97 @@
+# src/flight_booking_agent/agents/intent_rules.py
+import re
+from typing import NamedTuple, Optional
+
+from .utils import AIRPORT_MAP, fold_vietnamese
+
+
+class IntentGuess(NamedTuple):
+    """Kết quả phân loại bằng luật: agent đích, độ tin cậy (0..1) và lý do."""
+    target_agent_name: Optional[str]
+    confidence: float
+    reason: str
+
+
+def _phrase_pattern(phrases) -> re.Pattern:
+    # Khớp nguyên cụm từ, không khớp một phần của từ khác ("hi" không khớp "chi")
+    alternatives = "|".join(sorted((re.escape(p) for p in phrases), key=len, reverse=True))
+    return re.compile(rf"(?<!\w)(?:{alternatives})(?!\w)")
+
+
+# "hủy" được so khớp trên văn bản CÓ dấu để không nhầm với tên riêng như "Huy";
+# văn bản không dấu chỉ được chấp nhận khi đi kèm danh từ ("huy ve", "huy dat cho").
+_CANCEL_ACCENTED = _phrase_pattern(["hủy", "huỷ", "hoàn vé"])
+_CANCEL_FOLDED = _phrase_pattern([
+    "huy ve", "huy chuyen", "huy dat cho", "huy booking", "huy dat ve", "hoan ve",
+    "cancel", "cancellation", "refund my ticket",
+])
+# Dấu hiệu câu hỏi về chính sách/thủ tục ("hủy vé có mất phí không?", "hoàn vé mất bao lâu"):
+# có từ khóa hủy nhưng không phải yêu cầu hủy một đặt chỗ cụ thể
+_POLICY_QUESTION = _phrase_pattern([
+    "bao lau", "the nao", "nhu the nao", "chinh sach", "quy dinh", "phi", "mat phi", "le phi",
+    "how long", "policy", "fee", "fees",
+])
+_CO_KHONG = re.compile(r"(?<!\w)co(?!\w).*(?<!\w)khong(?!\w)")
+_BOOKING_CODE = re.compile(r"(?<![A-Za-z0-9])(?=[A-Z0-9]*[A-Z])(?=[A-Z0-9]*\d)[A-Z0-9]{6}(?![A-Za-z0-9])")
+
+# Động từ thể hiện ý định đặt/tìm vé, và danh từ chỉ chuyến bay (tín hiệu yếu hơn,
+# vì cũng xuất hiện trong câu hủy vé hoặc hỏi chính sách)
+_BOOKING_VERBS = _phrase_pattern([
+    "dat ve", "mua ve", "dat cho", "dat chuyen", "tim ve", "tim chuyen", "san ve", "con ve",
+    "bay tu", "bay di", "bay ra", "bay vao", "book", "buy a ticket", "fly",
+])
+_FLIGHT_NOUNS = _phrase_pattern(["chuyen bay", "ve may bay", "flight", "flights", "ticket", "tickets"])
+# Tên thành phố/sân bay trong AIRPORT_MAP (bỏ các alias quá ngắn dễ trùng từ thường như "la")
+_CITY_FOLDED = _phrase_pattern({fold_vietnamese(name) for name in AIRPORT_MAP if len(name) >= 3})
+_IATA_CODES = set(AIRPORT_MAP.values())
+_IATA_TOKEN = re.compile(r"(?<![A-Za-z])[A-Z]{3}(?![A-Za-z])")
+
+_GREETING_FOLDED = _phrase_pattern([
+    "xin chao", "chao", "chao ban", "chao em", "alo", "hello", "hi", "hey",
+    "cam on", "thank you", "thanks", "tam biet", "bye",
+])
+
+
+def classify_intent(text: str) -> IntentGuess:
+    """
+    Bộ phân loại ý định bằng luật (tiếng Việt và tiếng Anh) đứng trước Manager LLM.
+    Chỉ trả về độ tin cậy cao cho các trường hợp rõ ràng; khi có tín hiệu mâu thuẫn
+    hoặc không có tín hiệu nào, độ tin cậy thấp để Manager chuyển sang hỏi LLM.
+    """
+    if not text or not text.strip():
+        return IntentGuess(None, 0.0, "empty")
+
+    lowered = text.lower()
+    folded = fold_vietnamese(text)
+
+    cancel = bool(_CANCEL_ACCENTED.search(lowered) or _CANCEL_FOLDED.search(folded))
+    has_code = bool(_BOOKING_CODE.search(text))
+    # Bỏ các cụm hủy ("huy dat cho") trước khi tìm động từ đặt vé ("dat cho")
+    without_cancel = _CANCEL_FOLDED.sub(" ", folded)
+    booking = bool(_BOOKING_VERBS.search(without_cancel))
+    flight_noun = bool(_FLIGHT_NOUNS.search(without_cancel))
+    cities = len(set(_CITY_FOLDED.findall(folded))) + sum(1 for t in _IATA_TOKEN.findall(text) if t in _IATA_CODES)
+    greeting = bool(_GREETING_FOLDED.search(folded))
+    word_count = len(folded.split())
+
+    policy_question = bool(_POLICY_QUESTION.search(folded) or _CO_KHONG.search(folded))
+
+    if cancel and policy_question and not has_code:
+        return IntentGuess("general_agent", 0.5, "cancel keyword in policy question")
+    if cancel and booking and not has_code:
+        return IntentGuess(None, 0.4, "cancel+booking conflict")
+    if cancel:
+        return IntentGuess("cancel_booking_agent", 0.95 if has_code else 0.85, "cancel keyword" + (" + booking code" if has_code else ""))
+    if booking and cities:
+        return IntentGuess("booking_agent", 0.95, "booking verb + city")
+    if flight_noun and cities:
+        return IntentGuess("booking_agent", 0.9, "flight noun + city")
+    if booking:
+        return IntentGuess("booking_agent", 0.8, "booking verb")
+    if cities >= 2:
+        return IntentGuess("booking_agent", 0.8, "two cities")
+    if flight_noun:
+        return IntentGuess("booking_agent", 0.5, "flight noun only")
+    if greeting and not cities and word_count <= 6:
+        return IntentGuess("general_agent", 0.9, "short greeting")
+    return IntentGuess(None, 0.0, "no rule matched")
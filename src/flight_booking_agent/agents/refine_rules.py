@@ -0,0 +1,261 @@
+# src/flight_booking_agent/agents/refine_rules.py
+import re
+import unicodedata
+from typing import NamedTuple, Optional
+
+from ..tools.booking_tools import format_vnd
+from .utils import fold_vietnamese
+
+
+class Refinement(NamedTuple):
+    """
+    Yêu cầu với danh sách chuyến bay đã có, đọc bằng luật:
+    - filters: bộ lọc cần đặt (xem `FlightTable.mask`), ghi đè bộ lọc cùng loại đang dùng;
+    - sort: khóa sắp xếp mới; page: "next"/"prev"; reset: bỏ mọi bộ lọc;
+    - picks: các cách khách chỉ tới một chuyến, theo thứ tự ưu tiên:
+      ("flight", "VN213"), ("ordinal", 2) (-1 là chuyến cuối), ("best", "price");
+    - question: câu hỏi về thông tin chuyến bay (để LLM trả lời, kể cả khi có lọc/sắp xếp/chọn);
+    - defer: lý do phải để LLM hiểu (đổi ngày, sửa lại...), None nếu không có.
+    """
+    filters: dict
+    sort: Optional[str]
+    page: Optional[str]
+    reset: bool
+    picks: tuple
+    question: bool
+    defer: Optional[str]
+
+    @property
+    def changes_view(self) -> bool:
+        return bool(self.filters or self.sort or self.page or self.reset)
+
+    @property
+    def actionable(self) -> bool:
+        return self.defer is None and (self.changes_view or bool(self.picks))
+
+
+# Khách muốn đổi chặng/ngày hoặc sửa lại ý trước: không phải thao tác trên danh sách hiện có
+_DEFER = re.compile(
+    r"(?<![a-z])(?:doi|ngay khac|hom khac|khong phai|nham|huy|thay vi|ngay mai|hom nay|ngay kia|(?:sang|chieu|toi) mai"
+    r"|thu\s+(?:2|3|4|5|6|7|hai|ba|tu|nam|sau|bay)\s+tuan)(?![a-z])"
+    r"|(?<![\d.,])\d{1,2}\s*[/.-]\s*\d{1,2}(?:[/.-]\d{2,4})?(?![\d])(?!\s*(?:h|g|gio|tr|trieu|k)\b)"
+)
+_QUESTION = re.compile(
+    r"\?|(?<![a-z])(?:bao nhieu|may gio|the nao|sao|gi|cho (?:minh|em|toi|anh|chi) hoi)(?![a-z])"
+    r"|(?<![a-z])(?:khong|chua)\W*$"
+)
+_INFO_QUESTION = re.compile(r"(?<![a-z])(?:bao nhieu|may gio|the nao|sao|gi|hoi)(?![a-z])")
+# "chuyến nào rẻ nhất?": hỏi chuyến nào thì trả lời bằng chính danh sách đã lọc/sắp xếp
+_WHICH_QUESTION = re.compile(r"(?<![a-z])(?:chuyen|cai|hang) nao(?![a-z])")
+_PICK_VERB = re.compile(r"(?<![a-z])(?:chon|lay|dat|book|chot|quyet dinh|mua)(?![a-z])")
+# Khách từ chối/chưa chọn: "không chọn chuyến 2", "đừng lấy VN213", "chuyến 1 không được"
+_NEGATED_PICK = re.compile(
+    r"(?<![a-z])(?:khong|dung|chua|tru|bo)\s+(?:[a-z0-9]+\s+){0,2}?(?:chon|lay|dat|book|chot|mua|chuyen|cai|so)(?![a-z])"
+    r"|(?<![a-z])khong\s+(?:duoc|on|ok|chiu)(?![a-z])"
+)
+_PARTICLES = re.compile(r"(?<![a-z])(?:nhe|nha|a|em|anh|chi|minh|oi|nhe em|di|vay|thi)(?![a-z])")
+
+_ORDINAL_WORDS = {"nhat": 1, "hai": 2, "ba": 3, "tu": 4, "nam": 5, "sau": 6, "bay": 7, "tam": 8, "chin": 9, "muoi": 10}
+_ORDINAL = re.compile(
+    r"(?<![a-z0-9])(?:chuyen|so|cai|#)\s*(?:so\s*|thu\s*)?(\d{1,2})(?![\d/:.,]|\s*(?:h|g|gio|tr|trieu|k|nguoi|khach|ve)(?![a-z]))"
+    r"|(?<![a-z])(?:chuyen|cai)\s+thu\s+(nhat|hai|ba|tu|nam|sau|bay|tam|chin|muoi)(?![a-z])"
+    r"|(?<![a-z])(?:chuyen|cai)\s+(dau tien|dau|cuoi cung|cuoi)(?![a-z])"
+)
+_FLIGHT_NUMBER = re.compile(r"(?<![A-Za-z0-9])([A-Za-z][A-Za-z0-9])\s?(\d{1,4})(?![\d])")
+
+_SUPERLATIVES = [
+    (re.compile(r"(?<![a-z])re nhat(?![a-z])"), "price"),
+    (re.compile(r"(?<![a-z])(?:dat nhat|mac nhat)(?![a-z])"), "-price"),
+    (re.compile(r"(?<![a-z])som nhat(?![a-z])"), "departure"),
+    (re.compile(r"(?<![a-z])(?:muon nhat|tre nhat|khuya nhat)(?![a-z])"), "-departure"),
+    (re.compile(r"(?<![a-z])(?:nhanh nhat|ngan nhat|it thoi gian nhat)(?![a-z])"), "duration"),
+]
+_SORT_PHRASES = [
+    (re.compile(r"(?:sap xep|xep) theo gia(?: giam dan| cao)|gia giam dan"), "-price"),
+    (re.compile(r"(?:sap xep|xep) theo gia|gia tang dan"), "price"),
+    (re.compile(r"(?:sap xep|xep) theo (?:thoi gian bay|thoi luong)"), "duration"),
+    (re.compile(r"(?:sap xep|xep) theo (?:gio|thoi gian|gio bay|gio di|gio cat canh)"), "departure"),
+]
+_NEXT_PAGE = re.compile(r"(?<![a-z])(?:xem them|them chuyen|chuyen khac|con chuyen nao|trang sau|trang tiep|xem tiep|tiep theo|more)(?![a-z])")
+_PREV_PAGE = re.compile(r"(?<![a-z])(?:trang truoc|quay lai trang|xem lai (?:cac )?chuyen (?:dau|truoc))(?![a-z])")
+_RESET = re.compile(r"(?<![a-z])(?:bo loc|xoa loc|bo dieu kien|tat ca (?:cac )?chuyen|xem tat ca|hien tat ca|gio nao cung duoc)(?![a-z])")
+
+# Khung giờ cất cánh, phút trong ngày [bắt đầu, kết thúc). "sáng"/"tối" so trên chữ có dấu vì
+# bỏ dấu thì trùng với "sang" (đi sang) và "tôi".
+_DAYPARTS = [
+    (re.compile(r"(?<!\w)(?:buổi sáng|sáng sớm|sáng)(?!\w)|(?<![a-z])buoi sang(?![a-z])"), (5 * 60, 12 * 60), "buổi sáng"),
+    (re.compile(r"(?<!\w)(?:buổi trưa|trưa)(?!\w)|(?<![a-z])buoi trua(?![a-z])"), (11 * 60, 14 * 60), "buổi trưa"),
+    (re.compile(r"(?<!\w)(?:buổi chiều|chiều)(?!\w)|(?<![a-z])buoi chieu(?![a-z])"), (12 * 60, 18 * 60), "buổi chiều"),
+    (re.compile(r"(?<!\w)(?:buổi tối|tối)(?!\w)(?! đa| thiểu)|(?<![a-z])buoi toi(?![a-z])"), (18 * 60, 24 * 60), "buổi tối"),
+    (re.compile(r"(?<!\w)(?:đêm|khuya|bay đêm)(?!\w)|(?<![a-z])(?:bay dem|ban dem)(?![a-z])"), (21 * 60, 5 * 60), "ban đêm"),
+]
+_CLOCK = r"(\d{1,2})\s*(?:(?:h|g|gio)\s*(\d{2})?|:(\d{2}))(?:\s*(sang|trua|chieu|toi))?"
+# Khoảng giờ: mốc đầu có thể bỏ đơn vị ("từ 8 đến 11 giờ"), mốc sau thì bắt buộc
+_CLOCK_LOOSE = r"(\d{1,2})\s*(?:(?:h|g|gio)\s*(\d{2})?|:(\d{2}))?(?:\s*(sang|trua|chieu|toi))?"
+_TIME_RANGE = re.compile(rf"(?<![a-z0-9.,])(?:tu\s*)?{_CLOCK_LOOSE}\s*(?:-|den|toi)\s*{_CLOCK}")
+_TIME_BOUND = re.compile(rf"(?<![a-z])(truoc|sau|tu)\s*{_CLOCK}")
+
+_PRICE = re.compile(
+    r"(?<![a-z])(duoi|khong qua|toi da|re hon|it hon|max|tren|hon|tu)\s*"
+    r"(\d+(?:[.,]\d+)*)\s*(trieu|tr|k|nghin|ngan|dong|d|vnd)?\s*(\d)?(?![a-z0-9])"
+)
+_DURATION = re.compile(r"(?<![a-z])(?:duoi|khong qua|toi da|it hon)\s*(\d+(?:[.,]\d+)?)\s*(?:tieng|gio|h)(?![a-z])")
+
+_NON_STOP_ACCENTED = re.compile(r"(?<!\w)(?:bay thẳng|thẳng|không dừng|không quá cảnh|không nối chuyến)(?!\w)")
+_NON_STOP_FOLDED = re.compile(r"(?<![a-z])(?:bay thang(?!\s*\d)|direct|non\s*-?\s*stop|khong transit)(?![a-z])")
+_MAX_ONE_STOP = re.compile(r"(?<![a-z])(?:toi da|khong qua|chi)\s*(?:1|mot)\s*(?:diem dung|lan dung|chang dung|diem noi)(?![a-z])")
+
+_CARRIER_NAMES = [
+    (re.compile(r"(?<![a-z])(?:vietnam airlines?|vna|hang quoc gia)(?![a-z])"), "VN"),
+    (re.compile(r"(?<![a-z])(?:vietjet(?: air)?|viet jet)(?![a-z])"), "VJ"),
+    (re.compile(r"(?<![a-z])bamboo(?: airways)?(?![a-z])"), "QH"),
+    (re.compile(r"(?<![a-z])(?:pacific airlines|pacific|jetstar)(?![a-z])"), "BL"),
+    (re.compile(r"(?<![a-z])vietravel(?: airlines)?(?![a-z])"), "VU"),
+]
+_CARRIER_CODE = re.compile(r"(?<![A-Za-z])(VN|VJ|QH|BL|VU)(?![A-Za-z0-9])")
+_CARRIER_NEGATION = re.compile(r"(?:khong|tru|ngoai|bo|tranh)\s+(?:bay\s+|di\s+|hang\s+)*$")
+
+CARRIER_LABELS = {"VN": "Vietnam Airlines", "VJ": "Vietjet", "QH": "Bamboo Airways", "BL": "Pacific Airlines", "VU": "Vietravel Airlines"}
+SORT_LABELS = {"price": "giá rẻ nhất", "-price": "giá cao nhất", "departure": "giờ bay sớm nhất",
+               "-departure": "giờ bay muộn nhất", "duration": "thời gian bay ngắn nhất"}
+
+
+def _clock_minutes(hour: str, minute: Optional[str], minute_colon: Optional[str], part: Optional[str]) -> Optional[int]:
+    value, minutes = int(hour), int(minute or minute_colon or 0)
+    if part in ("chieu", "toi") and value < 12:
+        value += 12
+    if value > 24 or minutes > 59:
+        return None
+    return value * 60 + minutes
+
+
+def _amount(number: str, unit: Optional[str], decimal: Optional[str]) -> Optional[float]:
+    if unit in ("trieu", "tr"):
+        value = float(number.replace(",", "."))
+        return (value + (int(decimal) / 10 if decimal else 0)) * 1_000_000  # "1tr8" = 1.800.000
+    if unit in ("k", "nghin", "ngan"):
+        return float(number.replace(",", ".")) * 1000
+    value = float(number.replace(".", "").replace(",", ""))
+    return value if value >= 1000 else None  # "dưới 2" không rõ đơn vị
+
+
+def _time_window(lowered: str, folded: str) -> Optional[tuple]:
+    match = _TIME_RANGE.search(folded)
+    if match:
+        start, end = _clock_minutes(*match.groups()[:4]), _clock_minutes(*match.groups()[4:])
+        if start is not None and end is not None and start < end:
+            return start, end
+    match = _TIME_BOUND.search(folded)
+    if match:
+        minute = _clock_minutes(*match.groups()[1:])
+        if minute is not None:
+            return (0, minute) if match.group(1) == "truoc" else (minute, 24 * 60)
+    for pattern, window, _ in _DAYPARTS:
+        if pattern.search(lowered) or pattern.search(folded):
+            return window
+    return None
+
+
+def _carriers(text: str, folded: str) -> tuple:
+    include, exclude = set(), set()
+    found = [(m.start(), code) for pattern, code in _CARRIER_NAMES for m in pattern.finditer(folded)]
+    # Vị trí trên `text` và `folded` lệch nhau không đáng kể cho mã IATA (chữ không dấu)
+    found += [(m.start(), m.group(1)) for m in _CARRIER_CODE.finditer(text) if not _FLIGHT_NUMBER.match(text, m.start())]
+    for start, code in found:
+        (exclude if _CARRIER_NEGATION.search(folded[max(0, start - 20):start]) else include).add(code)
+    return tuple(sorted(include)), tuple(sorted(exclude))
+
+
+def parse_refinement(text: str) -> Refinement:
+    """
+    Đọc các yêu cầu thường gặp sau khi đã có danh sách chuyến bay: lọc ("chỉ bay buổi sáng",
+    "bay thẳng thôi", "dưới 2 triệu", "Vietjet"), sắp xếp ("chuyến nào rẻ nhất"), phân trang
+    ("xem thêm") và chọn chuyến ("lấy chuyến VN213", "chọn chuyến 2", "lấy chuyến sớm nhất").
+    Không chắc thì để `actionable` là False để booking node hỏi LLM như trước.
+    """
+    text = unicodedata.normalize("NFC", text or "").strip()
+    lowered = text.lower()
+    folded = fold_vietnamese(text)
+    if not folded:
+        return Refinement({}, None, None, False, (), False, "empty")
+
+    filters = {}
+    window = _time_window(lowered, folded)
+    if window:
+        filters["time_window"] = window
+    for match in _PRICE.finditer(folded):
+        amount = _amount(*match.groups()[1:])
+        if amount is not None:
+            filters["min_price" if match.group(1) in ("tren", "hon", "tu") else "max_price"] = amount
+    match = _DURATION.search(folded)
+    if match:
+        filters["max_duration"] = round(float(match.group(1).replace(",", ".")) * 60)
+    if _NON_STOP_ACCENTED.search(lowered) or _NON_STOP_FOLDED.search(folded):
+        filters["max_stops"] = 0
+    elif _MAX_ONE_STOP.search(folded):
+        filters["max_stops"] = 1
+    include, exclude = _carriers(text, folded)
+    if include:
+        filters["carriers"] = include
+    if exclude:
+        filters["exclude_carriers"] = exclude
+
+    sort = next((key for pattern, key in _SORT_PHRASES if pattern.search(folded)), None)
+    superlative = next((key for pattern, key in _SUPERLATIVES if pattern.search(folded)), None)
+    page = "prev" if _PREV_PAGE.search(folded) else "next" if _NEXT_PAGE.search(folded) else None
+    reset = bool(_RESET.search(folded))
+    question = bool(_QUESTION.search(folded))
+    if question and _WHICH_QUESTION.search(folded) and not _INFO_QUESTION.search(folded):
+        question = False
+
+    picks = []
+    verb = bool(_PICK_VERB.search(folded))
+    short = len(_PARTICLES.sub(" ", folded).split()) <= 4
+    flight_refs = [f"{m.group(1)}{m.group(2)}".upper() for m in _FLIGHT_NUMBER.finditer(text)
+                   if re.search(r"[A-Za-z]", m.group(1)) and not re.fullmatch(r"(?i)so|tu|di|ve|de", m.group(1))]
+    if verb or short:
+        picks += [("flight", code) for code in flight_refs]
+        for match in _ORDINAL.finditer(folded):
+            number, word, position = match.groups()
+            ordinal = int(number) if number else _ORDINAL_WORDS[word] if word else 1 if position.startswith("dau") else -1
+            picks.append(("ordinal", ordinal))
+    if verb and superlative:
+        picks.append(("best", superlative))
+    elif superlative and not sort:
+        sort = superlative
+
+    defer = "needs context" if _DEFER.search(folded) else None
+    if (picks or verb) and _NEGATED_PICK.search(folded):
+        picks, defer = [], defer or "negated pick"
+    if question and (picks or filters or sort):
+        # "chuyến 2 mấy giờ bay?", "chuyến rẻ nhất là bao nhiêu tiền?": cần trả lời, không phải thao tác
+        picks, defer = [], defer or "question"
+    return Refinement(filters, sort, page, reset, tuple(picks), question, defer)
+
+
+def describe_filters(filters: dict) -> str:
+    """Mô tả bộ lọc cho người dùng: "buổi sáng, bay thẳng, dưới 2.000.000 VND"."""
+    parts = []
+    window = filters.get("time_window")
+    if window:
+        label = next((name for _, dp_window, name in _DAYPARTS if tuple(dp_window) == tuple(window)), None)
+        start, end = window
+        parts.append(label or ("trước %02d:%02d" % divmod(end, 60) if start == 0 else
+                               "sau %02d:%02d" % divmod(start, 60) if end == 24 * 60 else
+                               "%02d:%02d-%02d:%02d" % (*divmod(start, 60), *divmod(end, 60))))
+    if filters.get("max_stops") == 0:
+        parts.append("bay thẳng")
+    elif filters.get("max_stops") is not None:
+        parts.append(f"tối đa {filters['max_stops']} điểm dừng")
+    if filters.get("carriers"):
+        parts.append(", ".join(CARRIER_LABELS.get(c, c) for c in filters["carriers"]))
+    if filters.get("exclude_carriers"):
+        parts.append("không bay " + ", ".join(CARRIER_LABELS.get(c, c) for c in filters["exclude_carriers"]))
+    if filters.get("min_price") is not None:
+        parts.append(f"từ {format_vnd(filters['min_price'])}")
+    if filters.get("max_price") is not None:
+        parts.append(f"dưới {format_vnd(filters['max_price'])}")
+    if filters.get("max_duration") is not None:
+        hours, minutes = divmod(filters["max_duration"], 60)
+        parts.append(f"bay dưới {hours} giờ" + (f" {minutes} phút" if minutes else ""))
+    return ", ".join(parts)
@@ -1,17 +1,23 @@
 from ..graph.state import AgentState
+from .context_window import advance
 
 SPECIALIST_AGENTS = ["booking_agent", "cancel_booking_agent", "general_agent"]
 
 def proxy_router_node(state: AgentState) -> dict:
+    # Router là node đầu tiên của mỗi lượt: cập nhật cửa sổ ngữ cảnh với tin nhắn mới
+    context = advance(state.get("context"), state["messages"])
+    return {"next_agent": _next_agent(state), "context": context}
+
+def _next_agent(state: AgentState) -> str:
     previous_agent = state.get("previous_agent")
 
     # Nếu chưa từng gọi agent nào → đi qua manager
     if previous_agent is None:
-        return {"next_agent": "manager"}
+        return "manager"
 
     # Nếu đã có agent và agent đó thuộc nhóm chuyên trách → quay lại đúng agent đó
     if previous_agent in SPECIALIST_AGENTS:
-        return {"next_agent": previous_agent}
+        return previous_agent
 
     # Mặc định → vẫn về manager
-    return {"next_agent": "manager"}
\ No newline at end of file
+    return "manager"
\ No newline at end of file
@@ -0,0 +1,235 @@
+# src/flight_booking_agent/agents/slot_rules.py
+import functools
+import re
+import unicodedata
+from datetime import datetime
+from typing import NamedTuple, Optional
+
+from .airports import airport_resolver
+from .utils import convert_relative_date, fold_vietnamese
+
+
+class SlotGuess(NamedTuple):
+    """Kết quả trích xuất bằng luật: các slot chắc chắn và lý do nếu tín hiệu mâu thuẫn."""
+    slots: dict
+    conflict: Optional[str]
+
+
+def _aligned_fold(text: str) -> str:
+    """Bỏ dấu từng ký tự, giữ nguyên độ dài để vị trí khớp trên bản bỏ dấu dùng được cho bản gốc."""
+    return "".join(fold_vietnamese(c)[:1] or " " for c in unicodedata.normalize("NFC", text))
+
+
+# Tên gọi trùng với từ thông dụng ("nhân viên", "a ten"...) không được dò trong câu tự do
+_AMBIGUOUS_PLACE_NAMES = {"vien", "a ten", "do ha", "la"}
+
+
+@functools.lru_cache(maxsize=None)
+def _place_pattern() -> re.Pattern:
+    names = [n for n in airport_resolver().known_names() if len(n) >= 3 and n not in _AMBIGUOUS_PLACE_NAMES]
+    alternatives = "|".join(r"[\s-]+".join(map(re.escape, n.split())) for n in sorted(names, key=len, reverse=True))
+    return re.compile(rf"(?<![a-z0-9])(?:{alternatives})(?![a-z0-9])")
+
+
+_IATA_TOKEN = re.compile(r"(?<![A-Za-z])[A-Z]{3}(?![A-Za-z])")
+# Từ nối đứng ngay trước địa danh cho biết vai trò của nó
+_ORIGIN_MARKER = re.compile(r"(?:^|[^a-z0-9])(?:tu|from|xuat phat(?: tu)?|khoi hanh(?: tu)?)\s*$")
+_DESTINATION_MARKER = re.compile(r"(?:(?:^|[^a-z0-9])(?:di|den|toi|ra|vao|sang|qua|to)|-+>?|→|–)\s*$")
+_NAME_MARKER = re.compile(r"(?:^|[^a-z0-9])(?:ten|ten la|toi la|em la|minh la)\s*$")
+
+_DATE_EXPR = re.compile(
+    r"(?<![a-z0-9/.-])(?:hom nay|ngay mai|ngay mot|ngay kia"
+    r"|thu\s*(?:2|3|4|5|6|7|hai|ba|tu|nam|sau|bay)(?:\s+(?:tuan\s+(?:sau|toi|nay)|nay|toi))?"
+    r"|chu nhat(?:\s+(?:tuan\s+(?:sau|toi|nay)|nay|toi))?"
+    r"|cuoi\s+tuan(?:\s+(?:sau|toi|nay))?|(?:cuoi|dau)\s+thang(?:\s+(?:sau|toi|nay))?"
+    r"|(?:ngay\s+)?\d{1,2}[/.-]\d{1,2}(?:[/.-]\d{4})?|\d{4}-\d{2}-\d{2})(?![a-z0-9/.-])"
+)
+_NUMBER_WORDS = {"mot": 1, "hai": 2, "ba": 3, "bon": 4, "nam": 5, "sau": 6, "bay": 7, "tam": 8, "chin": 9, "muoi": 10}
+_PASSENGER_COUNT = re.compile(
+    r"(?<![a-z0-9/.-])(\d{1,2}|mot|hai|ba|bon|nam|sau|bay|tam|chin|muoi)\s*"
+    r"(?:nguoi lon|nguoi|hanh khach|khach|ve|adults?|passengers?|pax|minh)(?![a-z0-9])"
+)
+# Có trẻ em/em bé đi cùng: số khách theo từng nhóm tuổi để LLM tách, luật không cộng dồn
+_CHILD_PASSENGERS = re.compile(
+    r"(?<![a-z])(?:tre em|tre nho|tre so sinh|em be|so sinh|chau be|children|child|kids?|infants?|bab(?:y|ies))(?![a-z])"
+)
+# Khách linh hoạt ngày/sân bay hoặc đang sửa lại thông tin: để LLM hiểu ngữ cảnh
+_DEFER_TO_LLM = re.compile(
+    r"(?<![a-z])(?:ngay nao|re nhat|linh hoat|bat ky ngay|khoang ngay|lan can|san bay gan"
+    r"|khong phai|nham|doi lai|thay vi|cheapest|flexible|instead)(?![a-z])"
+)
+
+FLIGHT_SLOTS = ("departure_from", "arrival_to", "departure_date", "passenger_count")
+
+
+def _place_mentions(text: str, folded: str) -> list:
+    """[(vị trí, iata)] theo thứ tự xuất hiện: tên thành phố/sân bay và mã IATA viết hoa."""
+    resolver = airport_resolver()
+    mentions = []
+    for match in _place_pattern().finditer(folded):
+        if _NAME_MARKER.search(folded[max(0, match.start() - 12):match.start()]):
+            continue  # "tên Vinh" là tên người, không phải địa danh
+        airport = resolver.resolve(match.group())
+        if airport:
+            mentions.append((match.start(), match.end(), airport.iata))
+    for match in _IATA_TOKEN.finditer(text):
+        if match.group() in resolver.airports:
+            mentions.append((match.start(), match.end(), match.group()))
+    mentions.sort()
+    # Bỏ các lần khớp chồng lên nhau (giữ lần bắt đầu sớm nhất)
+    result, last_end = [], -1
+    for start, end, iata in mentions:
+        if start >= last_end:
+            result.append((start, iata))
+            last_end = end
+    return result
+
+
+def extract_flight_slots(text: str, today: Optional[datetime] = None) -> SlotGuess:
+    """
+    Trích xuất điểm đi/điểm đến (IATA), ngày đi (YYYY-MM-DD) và số hành khách bằng luật
+    cho các câu đặt vé thông thường ("SGN đi HAN 25/12 2 người"). Chỉ trả về slot khi
+    chắc chắn; khi tín hiệu mâu thuẫn (nhiều ngày, ba địa danh, khách đang sửa thông tin,
+    linh hoạt ngày, có trẻ em/em bé đi cùng...) trả về `conflict` để booking node hỏi LLM.
+    """
+    if not text or not text.strip():
+        return SlotGuess({}, None)
+    text = unicodedata.normalize("NFC", text)
+    folded = _aligned_fold(text)
+    if _DEFER_TO_LLM.search(folded):
+        return SlotGuess({}, "needs context")
+
+    slots = {}
+    mentions = _place_mentions(text, folded)
+    if len({iata for _, iata in mentions}) > 2:
+        return SlotGuess({}, "more than two places")
+    roles = {}
+    unassigned = []
+    for start, iata in mentions:
+        before = folded[max(0, start - 20):start]
+        role = "departure_from" if _ORIGIN_MARKER.search(before) else "arrival_to" if _DESTINATION_MARKER.search(before) else None
+        if role is None:
+            unassigned.append(iata)
+        elif roles.get(role, iata) != iata:
+            return SlotGuess({}, f"two values for {role}")
+        else:
+            roles[role] = iata
+    # Địa danh không có từ nối: theo thứ tự xuất hiện, chỉ khi câu có đúng hai địa danh
+    if unassigned and len(mentions) == 2:
+        for iata in unassigned:
+            role = "departure_from" if "departure_from" not in roles else "arrival_to"
+            roles.setdefault(role, iata)
+    if roles.get("departure_from") and roles.get("departure_from") == roles.get("arrival_to"):
+        return SlotGuess({}, "same origin and destination")
+    slots.update(roles)
+
+    dates = set()
+    for match in _DATE_EXPR.finditer(folded):
+        try:
+            dates.add(convert_relative_date(match.group(), today=today))
+        except ValueError:
+            return SlotGuess({}, f"invalid date {match.group()!r}")
+    if len(dates) > 1:
+        return SlotGuess({}, "more than one date")
+    if dates:
+        slots["departure_date"] = dates.pop()
+
+    if _CHILD_PASSENGERS.search(folded):
+        return SlotGuess({}, "children or infants in party")
+    counts = set()
+    for match in _PASSENGER_COUNT.finditer(folded):
+        value = match.group(1)
+        if match.group().endswith("minh") and value not in ("1", "mot"):
+            continue  # chỉ "một mình" mới là số khách
+        count = int(value) if value.isdigit() else _NUMBER_WORDS[value]
+        if count > 0:
+            counts.add(count)
+    if len(counts) > 1:
+        return SlotGuess({}, "more than one passenger count")
+    if counts:
+        slots["passenger_count"] = counts.pop()
+    return SlotGuess(slots, None)
+
+
+_PHONE = re.compile(r"(?<![\d+])(\+?84|0)((?:[\s.-]?\d){9})(?!\d)")
+_DOB = re.compile(r"(?<!\d)(?:(\d{1,2})[/.-](\d{1,2})[/.-](\d{4})|(\d{4})-(\d{1,2})-(\d{1,2}))(?!\d)")
+_PASSENGER_LABELS = re.compile(
+    r"(?<![a-z])(?:ho va ten|ho ten|ten|ngay sinh|sinh ngay|ns|dob|date of birth|so dien thoai|dien thoai|sdt|dt"
+    r"|phone|full name|name|hanh khach|khach|nguoi|toi la|em la|minh la)(?![a-z])"
+)
+_NAME_WORDS = re.compile(r"[a-z]+")
+_LIST_NUMBER = re.compile(r"(?m)^\s*\d{1,2}[.)]\s+")  # "1. Nguyen Van A ..." khi liệt kê nhiều khách
+
+
+def _normalize_phone(match: re.Match) -> Optional[str]:
+    digits = re.sub(r"\D", "", match.group(2))
+    return "0" + digits if digits[0] in "35789" else None
+
+
+def _normalize_dob(match: re.Match, today: datetime) -> Optional[str]:
+    if match.group(1):
+        day, month, year = int(match.group(1)), int(match.group(2)), int(match.group(3))
+    else:
+        year, month, day = int(match.group(4)), int(match.group(5)), int(match.group(6))
+    try:
+        dob = datetime(year, month, day)
+    except ValueError:
+        return None
+    return dob.strftime("%d/%m/%Y") if 1900 <= year and dob <= today else None
+
+
+def _parse_passenger(chunk: str, today: datetime) -> Optional[dict]:
+    phones = list(_PHONE.finditer(chunk))
+    dobs = list(_DOB.finditer(chunk))
+    if len(phones) != 1 or len(dobs) != 1:
+        return None
+    phone, dob = _normalize_phone(phones[0]), _normalize_dob(dobs[0], today)
+    if not phone or not dob:
+        return None
+    rest = _PHONE.sub(" ", _DOB.sub(" ", chunk))
+    rest = _PASSENGER_LABELS.sub(" ", rest)
+    if re.search(r"\d", rest):
+        return None
+    words = _NAME_WORDS.findall(rest)
+    if not 2 <= len(words) <= 6:
+        return None
+    return {"full_name": " ".join(w.capitalize() for w in words), "date_of_birth": dob, "phone_number": phone}
+
+
+def _passenger_chunks(text: str) -> list:
+    """Tách tin nhắn thành từng khách: cắt ngay sau trường còn lại (SĐT hoặc ngày sinh) của mỗi khách."""
+    fields = sorted([(m.end(), "phone") for m in _PHONE.finditer(text)] + [(m.end(), "dob") for m in _DOB.finditer(text)])
+    chunks, start, seen = [], 0, set()
+    for end, kind in fields:
+        if kind in seen:
+            seen = set()  # trường lặp lại trước khi đủ bộ: để _parse_passenger từ chối
+            continue
+        seen.add(kind)
+        if len(seen) == 2:
+            chunks.append(text[start:end])
+            start, seen = end, set()
+    chunks.append(text[start:])
+    return chunks
+
+
+def extract_passengers(text: str, today: Optional[datetime] = None) -> SlotGuess:
+    """
+    Trích xuất hành khách dạng "Nguyen Van A, 25/12/1990, 0987654321" (một hoặc nhiều khách,
+    mỗi khách gồm họ tên, ngày sinh và số điện thoại theo thứ tự bất kỳ, có thể kèm nhãn
+    "Họ tên:", "SĐT:"). Tên được viết không dấu, ngày sinh theo DD/MM/YYYY, số di động
+    Việt Nam chuẩn hóa về dạng 0xxxxxxxxx. Chỉ trả về danh sách khi mọi phần của tin nhắn
+    đều đọc được; nếu không trả về `conflict` để hỏi LLM.
+    """
+    today = today or datetime.now()
+    folded = _LIST_NUMBER.sub("", fold_vietnamese(unicodedata.normalize("NFC", text or "")))
+    passengers = []
+    for chunk in _passenger_chunks(folded):
+        if not _NAME_WORDS.search(chunk) and not re.search(r"\d", chunk):
+            continue  # chỉ còn dấu câu/khoảng trắng
+        passenger = _parse_passenger(chunk, today)
+        if passenger is None:
+            return SlotGuess({"passengers": []}, f"unparsed passenger details {' '.join(chunk.split())!r}")
+        passengers.append(passenger)
+    if not passengers:
+        return SlotGuess({"passengers": []}, "no passenger details")
+    return SlotGuess({"passengers": passengers}, None)
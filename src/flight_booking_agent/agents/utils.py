@@ -1,7 +1,20 @@
+from langchain_core.callbacks import BaseCallbackHandler
 from langchain_core.messages import BaseMessage, HumanMessage, AIMessage
-from typing import List
+from langchain_core.runnables import Runnable
+from langchain_core.runnables.config import ensure_config, merge_configs
+from langgraph.graph import END
+from typing import Any, Generator, List, Optional, Tuple
 from datetime import datetime, timedelta
+import asyncio
 import re
+import threading
+import time
+import unicodedata
+
+from .. import admission, config
+from ..admission import PRIORITY_NORMAL
+from ..deadlines import TURN_DEADLINE_REPLY, CallPlan, Deadline, DeadlineExceeded, attempt_scope, current_deadline, is_transient
+from ..metrics import LLM_RECOVERIES
 
 AIRPORT_MAP = {
     # Việt Nam
@@ -68,47 +81,112 @@ AIRPORT_MAP = {
     'brisbane': 'BNE'
 }
 
+# Các sân bay gần nhau có thể thay thế cho nhau khi khách linh hoạt điểm đi/điểm đến
+NEARBY_AIRPORTS = {
+    'HAN': ['HAN', 'HPH'], 'HPH': ['HPH', 'HAN'],
+    'DAD': ['DAD', 'HUI'], 'HUI': ['HUI', 'DAD'],
+    'NRT': ['NRT', 'HND'], 'HND': ['HND', 'NRT'],
+    'BKK': ['BKK', 'DMK'], 'DMK': ['DMK', 'BKK'],
+}
+
+
+def nearby_airports(iata_code: str) -> List[str]:
+    """Sân bay đã cho và các sân bay lân cận (sân bay đã cho luôn đứng đầu)."""
+    return NEARBY_AIRPORTS.get(iata_code, [iata_code])
+
+
+def fold_vietnamese(text: str) -> str:
+    """Bỏ dấu tiếng Việt và chuyển về chữ thường: "Hủy vé Đà Nẵng" -> "huy ve da nang"."""
+    decomposed = unicodedata.normalize("NFD", text.lower().replace("đ", "d"))
+    return "".join(c for c in decomposed if unicodedata.category(c) != "Mn")
 
 def get_iata_code(location_name: str) -> str | None:
     if not location_name: return None
+    # Tra cứu không phân biệt dấu, chịu lỗi gõ và tiền tố (xem agents/airports.py)
+    from .airports import airport_resolver
+    match = airport_resolver().resolve(location_name.strip())
+    if match:
+        return match.iata
+
+    # Nếu người dùng nhập thẳng mã IATA (3 chữ cái) không có trong bộ dữ liệu
     normalized = location_name.lower().strip()
-    
-    # Nếu người dùng nhập thẳng mã IATA (3 chữ cái)
     if len(normalized) == 3 and normalized.isalpha():
         return normalized.upper()
-        
-    return AIRPORT_MAP.get(normalized)
 
-def convert_relative_date(date_str: str) -> str:
+    return None
+
+# Thứ trong tuần (đã bỏ dấu) -> datetime.weekday(): "thứ 2"/"thứ hai" = 0, ..., "chủ nhật" = 6
+_WEEKDAY_NAMES = {"2": 0, "hai": 0, "3": 1, "ba": 1, "4": 2, "tu": 2, "5": 3, "nam": 3, "6": 4, "sau": 4, "7": 5, "bay": 5}
+_WEEKDAY_EXPR = re.compile(r"(?:thu\s*(2|3|4|5|6|7|hai|ba|tu|nam|sau|bay)|(chu nhat|cn))(?:\s+(tuan\s+(?:sau|toi)|tuan\s+nay|nay|toi))?")
+_WEEK_EXPR = re.compile(r"(cuoi\s+)?tuan\s+(sau|toi|nay)|cuoi\s+tuan")
+_MONTH_EXPR = re.compile(r"(cuoi|dau)\s+thang(?:\s+(sau|toi|nay))?")
+_DAY_MONTH_EXPR = re.compile(r"(?:ngay\s+)?(\d{1,2})[/.-](\d{1,2})(?:[/.-](\d{4}))?")
+
+
+def _month_start(day: datetime, months_ahead: int) -> datetime:
+    month_index = day.month - 1 + months_ahead
+    return datetime(day.year + month_index // 12, month_index % 12 + 1, 1)
+
+
+def convert_relative_date(date_str: str, today: datetime | None = None) -> str:
     """
     Chuyển đổi các ngày tương đối hoặc định dạng dd/mm sang định dạng 'YYYY-MM-DD'.
+    Chấp nhận cả văn bản không dấu; `today` mặc định là thời điểm hiện tại.
 
     Supported:
         - "hôm nay"
         - "ngày mai"
-        - "ngày mốt"
-        - "dd/mm" hoặc "dd-mm"
+        - "ngày mốt" / "ngày kia"
+        - "thứ 6", "thứ sáu này", "chủ nhật tuần sau", "thứ 2 tuần tới"
+        - "tuần sau" (thứ 2 tuần sau), "cuối tuần", "cuối tuần sau"
+        - "cuối tháng", "cuối tháng sau", "đầu tháng sau"
+        - "dd/mm", "dd-mm", "dd/mm/yyyy" (có thể kèm chữ "ngày" phía trước)
         - "YYYY-mm-dd" (trả về nguyên bản nếu đúng định dạng)
     """
     date_str = date_str.strip().lower()
-    today = datetime.now()
+    today = today or datetime.now()
+    folded = " ".join(fold_vietnamese(date_str).split())
 
-    if date_str in ["hôm nay", "hom nay"]:
+    if folded == "hom nay":
         return today.strftime("%Y-%m-%d")
-    elif date_str in ["ngày mai", "ngay mai"]:
+    elif folded == "ngay mai":
         return (today + timedelta(days=1)).strftime("%Y-%m-%d")
-    elif date_str in ["ngày mốt", "ngay mot"]:
+    elif folded in ("ngay mot", "ngay kia"):
         return (today + timedelta(days=2)).strftime("%Y-%m-%d")
-    
-    # Kiểm tra định dạng dd/mm hoặc dd-mm
-    match = re.match(r"(\d{1,2})[/-](\d{1,2})", date_str)
+
+    next_monday = today + timedelta(days=7 - today.weekday())
+    match = _WEEKDAY_EXPR.fullmatch(folded)
+    if match:
+        weekday = 6 if match.group(2) else _WEEKDAY_NAMES[match.group(1)]
+        if match.group(3) and match.group(3).startswith("tuan") and not match.group(3).endswith("nay"):
+            # "thứ 6 tuần sau": thứ 6 của tuần lịch kế tiếp (tuần bắt đầu từ thứ 2)
+            return (next_monday + timedelta(days=weekday)).strftime("%Y-%m-%d")
+        return (today + timedelta(days=(weekday - today.weekday()) % 7)).strftime("%Y-%m-%d")
+
+    match = _WEEK_EXPR.fullmatch(folded)
+    if match:
+        next_week = match.group(2) in ("sau", "toi")
+        if folded.startswith("cuoi"):
+            saturday = (next_monday + timedelta(days=5)) if next_week else today + timedelta(days=(5 - today.weekday()) % 7)
+            return saturday.strftime("%Y-%m-%d")
+        return (next_monday if next_week else today).strftime("%Y-%m-%d")
+
+    match = _MONTH_EXPR.fullmatch(folded)
+    if match:
+        months_ahead = 1 if match.group(2) in ("sau", "toi") else 0
+        if match.group(1) == "dau":
+            return _month_start(today, max(months_ahead, 1)).strftime("%Y-%m-%d")
+        return (_month_start(today, months_ahead + 1) - timedelta(days=1)).strftime("%Y-%m-%d")
+
+    # Kiểm tra định dạng dd/mm, dd-mm hoặc dd/mm/yyyy
+    match = _DAY_MONTH_EXPR.fullmatch(folded)
     if match:
-        day, month = map(int, match.groups())
-        year = today.year
+        day, month = int(match.group(1)), int(match.group(2))
+        year = int(match.group(3)) if match.group(3) else today.year
         try:
             dt = datetime(year, month, day)
             # Nếu ngày đã qua trong năm hiện tại, tự động lấy năm sau
-            if dt < today:
+            if not match.group(3) and dt.date() < today.date():
                 dt = datetime(year + 1, month, day)
             return dt.strftime("%Y-%m-%d")
         except ValueError:
@@ -124,6 +202,10 @@ def convert_relative_date(date_str: str) -> str:
     raise ValueError(f"Không thể nhận dạng ngày: {date_str}")
 
 # Xử lí tin nhắn hội thoại
+def is_dialogue_message(m: BaseMessage) -> bool:
+    """HumanMessage, hoặc AIMessage có nội dung văn bản (không phải tin nhắn chỉ chứa tool_calls)."""
+    return isinstance(m, HumanMessage) or (isinstance(m, AIMessage) and bool(m.content))
+
 def filter_for_human_ai(messages: List[BaseMessage]) -> List[BaseMessage]:
     """
     Lọc lịch sử hội thoại, chỉ giữ lại các tin nhắn từ người dùng (HumanMessage)
@@ -132,13 +214,215 @@ def filter_for_human_ai(messages: List[BaseMessage]) -> List[BaseMessage]:
     Loại bỏ:
     - ToolMessage (kết quả từ tool)
     - AIMessage không có nội dung (thường là các tin nhắn chứa tool_calls)
+
+    Duyệt toàn bộ lịch sử; prompt của node dùng `context_window.context_messages` (tăng dần).
+    """
+    return [m for m in messages if is_dialogue_message(m)]
+
+# Dùng lại các runnable (structured output, chain) thay vì dựng lại ở mỗi lượt
+class RunnableCache:
+    """
+    Dựng runnable một lần cho mỗi cặp (model, khóa) bằng `build(model)` rồi dùng lại. Runnable
+    của LangChain là bất biến nên có thể chia sẻ an toàn giữa các request đồng thời; khóa chỉ
+    bảo vệ lần dựng đầu tiên (RLock vì một runnable có thể được dựng từ runnable khác trong
+    cache). Cache giữ tham chiếu tới model để `id(model)` không bị tái sử dụng, và nhớ cách
+    dựng mỗi runnable để dựng bản tương đương trên model khác (`rebuild`, cho model dự phòng).
     """
-    filtered_messages = []
-    for m in messages:
-        # Giữ lại tất cả HumanMessage
-        if isinstance(m, HumanMessage):
-            filtered_messages.append(m)
-        # Chỉ giữ lại AIMessage nếu nó có nội dung văn bản để trò chuyện
-        elif isinstance(m, AIMessage) and m.content:
-            filtered_messages.append(m)
-    return filtered_messages
\ No newline at end of file
+
+    def __init__(self):
+        self._entries = {}
+        self._origins = {}  # id(runnable) -> (runnable, model, khóa, build)
+        self._lock = threading.RLock()
+
+    def get(self, model, key, build):
+        cache_key = (id(model), key)
+        entry = self._entries.get(cache_key)
+        if entry is None or entry[0] is not model:
+            with self._lock:
+                entry = self._entries.get(cache_key)
+                if entry is None or entry[0] is not model:
+                    entry = (model, build(model))
+                    self._entries[cache_key] = entry
+                    self._origins[id(entry[1])] = (entry[1], model, key, build)
+        return entry[1]
+
+    def _origin(self, runnable):
+        origin = self._origins.get(id(runnable))
+        return origin if origin is not None and origin[0] is runnable else None
+
+    def model_of(self, runnable):
+        """Model mà `runnable` được dựng từ (qua cache); None nếu không dựng qua cache."""
+        origin = self._origin(runnable)
+        return origin[1] if origin else None
+
+    def rebuild(self, runnable, model):
+        """Runnable dựng giống `runnable` nhưng trên `model`; None nếu `runnable` không dựng qua cache."""
+        origin = self._origin(runnable)
+        return self.get(model, origin[2], origin[3]) if origin else None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._origins.clear()
+
+runnable_cache = RunnableCache()
+
+def structured_output(model, schema):
+    """`model.with_structured_output(schema)` được dựng một lần và dùng lại."""
+    return runnable_cache.get(model, schema, lambda m: m.with_structured_output(schema))
+
+def bound_tools(model, *tools):
+    """`model.bind_tools(tools)` được dựng một lần và dùng lại; model tự chọn gọi tool hay trả lời văn bản."""
+    return runnable_cache.get(model, ("tools", *tools), lambda m: m.bind_tools(list(tools)))
+
+# Chạy các node theo từng bước gọi LLM
+# Một "luồng bước" là generator yield ra (runnable, input) mỗi khi cần gọi LLM,
+# nhận lại kết quả qua send() và kết thúc bằng `return <dict cập nhật state>`.
+# Nhờ vậy cùng một logic nghiệp vụ dùng được cho cả node đồng bộ lẫn bất đồng bộ.
+NodeSteps = Generator[Tuple[Runnable, Any], Any, dict]
+
+def _role_of(runnable) -> Optional[str]:
+    model = runnable_cache.model_of(runnable) or runnable
+    return (getattr(model, "metadata", None) or {}).get("llm_role")
+
+def _call_plan(runnable, deadline: Deadline) -> Tuple[CallPlan, Optional[str]]:
+    """Kế hoạch gọi của một bước theo vai trò của model (timeout, có model dự phòng không)."""
+    role = _role_of(runnable)
+    registry = config.model_registry
+    spec = registry.specs.get(role) if role else None
+    fallback = registry.fallback_specs.get(role) if role else None
+    return CallPlan(deadline, spec.timeout if spec else None, fallback.timeout if fallback else None), role
+
+def _fallback_runnable(runnable, role: str):
+    model = config.model_registry.fallback(role)
+    if runnable_cache.model_of(runnable) is None:
+        return model  # bước gọi thẳng model của vai trò
+    return runnable_cache.rebuild(runnable, model)
+
+def _exhausted(error: Exception, deadline: Deadline) -> Exception:
+    """Lỗi ném vào generator khi hết lượt thử: hết giờ/hết thời hạn thì là `DeadlineExceeded`."""
+    if error is None or isinstance(error, TimeoutError) or deadline.expired():
+        exceeded = DeadlineExceeded(f"Hết thời hạn lượt chat: {error or 'không còn thời gian gọi LLM'}")
+        exceeded.__cause__ = error
+        return exceeded
+    return error
+
+def _deadline_update() -> dict:
+    """Cập nhật state khi lượt hết thời hạn: câu trả lời soạn sẵn và kết thúc lượt."""
+    print(">>> Lượt chat hết thời hạn, trả lời soạn sẵn")
+    return {"messages": [AIMessage(content=TURN_DEADLINE_REPLY)], "next_agent": END}
+
+class _AttemptRuns(BaseCallbackHandler):
+    """
+    Các lời gọi chat model đang chạy của một lần thử. Lần thử bị hủy vì hết giờ thì LangChain
+    không gọi `on_llm_error`, nên các lời gọi còn dở được báo lỗi cho `usage` ở đây.
+    """
+
+    def __init__(self):
+        self.running = set()
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self.running.add(run_id)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        self.running.discard(run_id)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self.running.discard(run_id)
+
+def _invoke(runnable, payload, priority: int, deadline: Optional[Deadline]):
+    """Một bước gọi đồng bộ; trả về (kết quả, lỗi)."""
+    if deadline is None:
+        with admission.llm_limiter.slot(priority):
+            try:
+                return runnable.invoke(payload), None
+            except Exception as e:
+                return None, e
+    plan, role = _call_plan(runnable, deadline)
+    error = None
+    while (step := plan.next()) is not None:
+        fallback, delay = step
+        if error is not None:
+            LLM_RECOVERIES.inc(role or "unknown", "fallback" if fallback else "retry")
+        if delay:
+            time.sleep(delay)
+        target = _fallback_runnable(runnable, role) if fallback else runnable
+        # Lời gọi đồng bộ không hủy được giữa chừng: timeout chỉ được truyền xuống request của model
+        with admission.llm_limiter.slot(priority, deadline.remaining()), attempt_scope(plan.attempt_timeout(fallback)):
+            try:
+                return target.invoke(payload), None
+            except Exception as e:
+                error = e
+        if not is_transient(error):
+            return None, error
+    LLM_RECOVERIES.inc(role or "unknown", "deadline")
+    return None, _exhausted(error, deadline)
+
+async def _ainvoke(runnable, payload, priority: int, deadline: Optional[Deadline]):
+    """Một bước gọi bất đồng bộ; mỗi lần gọi bị hủy khi vượt timeout của nó."""
+    if deadline is None:
+        async with admission.llm_limiter.aslot(priority):
+            try:
+                return await runnable.ainvoke(payload), None
+            except Exception as e:
+                return None, e
+    plan, role = _call_plan(runnable, deadline)
+    error = None
+    while (step := plan.next()) is not None:
+        fallback, delay = step
+        if error is not None:
+            LLM_RECOVERIES.inc(role or "unknown", "fallback" if fallback else "retry")
+        if delay:
+            await asyncio.sleep(delay)
+        target = _fallback_runnable(runnable, role) if fallback else runnable
+        async with admission.llm_limiter.aslot(priority, deadline.remaining()):
+            timeout = plan.attempt_timeout(fallback)
+            runs = _AttemptRuns()
+            with attempt_scope(timeout):
+                try:
+                    return await asyncio.wait_for(target.ainvoke(payload, merge_configs(ensure_config(), {"callbacks": [runs]})), timeout), None
+                except Exception as e:
+                    error = e
+            for run_id in list(runs.running):
+                config.model_registry.usage.on_llm_error(error, run_id=run_id)
+        if not is_transient(error):
+            return None, error
+    LLM_RECOVERIES.inc(role or "unknown", "deadline")
+    return None, _exhausted(error, deadline)
+
+def run_steps(steps: NodeSteps, priority: int = PRIORITY_NORMAL) -> dict:
+    """
+    Chạy đồng bộ một luồng bước: mỗi lời gọi được thực hiện bằng `invoke`.
+    Lỗi của runnable được ném ngược vào generator để node tự xử lý (try/except).
+    Mỗi lời gọi giữ một chỗ của `admission.llm_limiter` theo `priority`; lỗi quá tải
+    (`Overloaded`) không ném vào generator mà thoát ra ngoài để endpoint trả 429.
+    Khi lượt có thời hạn (`deadlines.turn_config`), lỗi tạm thời được thử lại/chuyển sang model
+    dự phòng trong thời hạn đó; hết thời hạn thì generator nhận `DeadlineExceeded`, và nếu node
+    không tự xử lý thì lượt kết thúc bằng câu trả lời soạn sẵn.
+    """
+    deadline = current_deadline()
+    try:
+        runnable, payload = next(steps)
+        while True:
+            result, error = _invoke(runnable, payload, priority, deadline)
+            runnable, payload = steps.throw(error) if error else steps.send(result)
+    except StopIteration as stop:
+        return stop.value
+    except DeadlineExceeded:
+        return _deadline_update()
+
+async def arun_steps(steps: NodeSteps, priority: int = PRIORITY_NORMAL) -> dict:
+    """
+    Phiên bản bất đồng bộ của `run_steps`: mỗi lời gọi dùng `ainvoke`,
+    không chặn event loop trong lúc chờ LLM trả lời (hay chờ chỗ trong hàng).
+    """
+    deadline = current_deadline()
+    try:
+        runnable, payload = next(steps)
+        while True:
+            result, error = await _ainvoke(runnable, payload, priority, deadline)
+            runnable, payload = steps.throw(error) if error else steps.send(result)
+    except StopIteration as stop:
+        return stop.value
+    except DeadlineExceeded:
+        return _deadline_update()
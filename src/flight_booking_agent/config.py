@@ -1,17 +1,298 @@
 # src/flight_booking_agent/config.py
 import os
+import statistics
+import threading
+import time
+from typing import Callable, Dict, NamedTuple, Optional
 from dotenv import load_dotenv
-# Thay đổi import
-from langchain_google_vertexai import ChatVertexAI
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.language_models.chat_models import BaseChatModel
+
+from .deadlines import attempt_timeout
+from .metrics import LLM_CALLS, LLM_DURATION, LLM_TOKENS
 
 
 
 load_dotenv()
-llm = ChatVertexAI(
-    model_name="gemini-2.5-pro", 
-    temperature=0.7,
-    project="end-to-end-agentic-rag",  
-    location="us-central1",     
-)
 
+VERTEX_PROJECT = os.getenv("VERTEX_PROJECT", "end-to-end-agentic-rag")
+VERTEX_LOCATION = os.getenv("VERTEX_LOCATION", "us-central1")
+
+
+# ==============================================================================
+# Registry model theo vai trò (task class)
+# - route:   định tuyến của Manager (ManagerHandoff) → model nhanh, tất định
+# - extract: trích xuất slot (FlightInfoExtractor...) → model nhanh, tất định
+# - respond: câu trả lời gửi khách hàng → model Pro, văn phong tự nhiên
+# Mỗi vai trò cấu hình được qua biến môi trường LLM_<ROLE>_MODEL/_TEMPERATURE/_TIMEOUT.
+# ==============================================================================
+class ModelSpec(NamedTuple):
+    model_name: str
+    temperature: float
+    timeout: float  # giây, cho mỗi lời gọi
+
+
+def _spec_from_env(role: str, model_name: str, temperature: float, timeout: float) -> ModelSpec:
+    prefix = f"LLM_{role.upper()}"
+    return ModelSpec(
+        model_name=os.getenv(f"{prefix}_MODEL", model_name),
+        temperature=float(os.getenv(f"{prefix}_TEMPERATURE", str(temperature))),
+        timeout=float(os.getenv(f"{prefix}_TIMEOUT", str(timeout))),
+    )
+
+
+MODEL_SPECS: Dict[str, ModelSpec] = {
+    "route": _spec_from_env("route", "gemini-2.5-flash", 0.0, 10),
+    "extract": _spec_from_env("extract", "gemini-2.5-flash", 0.0, 15),
+    "respond": _spec_from_env("respond", "gemini-2.5-pro", 0.7, 60),
+}
+
+# Model dự phòng (nhanh hơn) theo vai trò, dùng khi model chính lỗi/hết giờ gần thời hạn
+# của lượt (xem deadlines.py). Cấu hình qua LLM_<ROLE>_FALLBACK_MODEL/_TEMPERATURE/_TIMEOUT;
+# đặt LLM_<ROLE>_FALLBACK_MODEL rỗng để tắt dự phòng cho vai trò đó.
+FALLBACK_SPECS: Dict[str, ModelSpec] = {
+    role: spec for role, spec in {
+        "route": _spec_from_env("route_fallback", "gemini-2.5-flash-lite", 0.0, 4),
+        "extract": _spec_from_env("extract_fallback", "gemini-2.5-flash-lite", 0.0, 4),
+        "respond": _spec_from_env("respond_fallback", "gemini-2.5-flash", 0.7, 4),
+    }.items() if spec.model_name
+}
+
+# Giá tham khảo (USD / 1 triệu token: input, output) để ước tính chi phí theo vai trò
+MODEL_PRICES = {
+    "gemini-2.5-pro": (1.25, 10.0),
+    "gemini-2.5-flash": (0.30, 2.50),
+    "gemini-2.5-flash-lite": (0.10, 0.40),
+}
+
+
+_vertex_class = None
+_vertex_class_lock = threading.Lock()
+
+
+def _vertex_chat_class():
+    """
+    Lớp ChatVertexAI có timeout mặc định, được tạo ở lần dùng đầu tiên: riêng việc import
+    langchain_google_vertexai mất vài giây nên không được làm lúc import config.
+    """
+    global _vertex_class
+    if _vertex_class is None:
+        with _vertex_class_lock:
+            if _vertex_class is None:
+                from langchain_google_vertexai import ChatVertexAI
+
+                class _ChatVertexAIWithTimeout(ChatVertexAI):
+                    """ChatVertexAI với timeout mặc định cho mỗi request (ChatVertexAI chỉ nhận timeout theo từng lời gọi)."""
+                    request_timeout: Optional[float] = None
+
+                    def _with_timeout(self, kwargs):
+                        # Không vượt phần thời gian còn lại của lượt chat (nếu có)
+                        timeout = attempt_timeout()
+                        if self.request_timeout is not None:
+                            timeout = self.request_timeout if timeout is None else min(timeout, self.request_timeout)
+                        if timeout is not None:
+                            kwargs.setdefault("timeout", timeout)
+                        return kwargs
+
+                    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+                        return super()._generate(messages, stop=stop, run_manager=run_manager, **self._with_timeout(kwargs))
+
+                    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+                        return await super()._agenerate(messages, stop=stop, run_manager=run_manager, **self._with_timeout(kwargs))
+
+                    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+                        return super()._stream(messages, stop=stop, run_manager=run_manager, **self._with_timeout(kwargs))
+
+                    def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+                        return super()._astream(messages, stop=stop, run_manager=run_manager, **self._with_timeout(kwargs))
+
+                _vertex_class = _ChatVertexAIWithTimeout
+    return _vertex_class
+
+
+def build_vertex_model(spec: ModelSpec) -> BaseChatModel:
+    return _vertex_chat_class()(
+        model_name=spec.model_name,
+        temperature=spec.temperature,
+        request_timeout=spec.timeout,
+        project=VERTEX_PROJECT,
+        location=VERTEX_LOCATION,
+    )
+
+
+class LLMUsageTracker(BaseCallbackHandler):
+    """
+    Callback ghi nhận độ trễ, số token và chi phí ước tính của mỗi lời gọi LLM,
+    gộp theo vai trò (lấy từ metadata `llm_role` mà registry gắn vào model).
+    Khi model không trả về usage_metadata, số token được ước tính ~4 ký tự/token.
+    """
+
+    def __init__(self, prices=MODEL_PRICES, timer=time.perf_counter):
+        self.prices = prices
+        self._timer = timer
+        self._lock = threading.Lock()
+        self._running = {}
+        self._stats = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, metadata=None, **kwargs):
+        metadata = metadata or {}
+        prompt_chars = sum(len(str(m.content)) for batch in messages for m in batch)
+        with self._lock:
+            self._running[run_id] = (metadata.get("llm_role", "unknown"), metadata.get("llm_model"), prompt_chars, self._timer())
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        with self._lock:
+            started = self._running.pop(run_id, None)
+        if started is None:
+            return
+        role, model_name, prompt_chars, started_at = started
+        input_tokens, output_tokens = 0, 0
+        for generations in response.generations:
+            for generation in generations:
+                message = getattr(generation, "message", None)
+                usage = getattr(message, "usage_metadata", None)
+                if usage:
+                    input_tokens += usage.get("input_tokens", 0)
+                    output_tokens += usage.get("output_tokens", 0)
+                else:
+                    text = generation.text + "".join(str(c.get("args")) for c in getattr(message, "tool_calls", None) or [])
+                    input_tokens += prompt_chars // 4
+                    output_tokens += len(text) // 4
+        input_price, output_price = self.prices.get(model_name, (0.0, 0.0))
+        cost = (input_tokens * input_price + output_tokens * output_price) / 1_000_000
+        latency = self._timer() - started_at
+        self._record(role, latency, input_tokens, output_tokens, cost)
+        LLM_CALLS.inc(role, "ok")
+        LLM_DURATION.observe(latency, role, model_name or "unknown")
+        LLM_TOKENS.observe(input_tokens, role, "input")
+        LLM_TOKENS.observe(output_tokens, role, "output")
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        with self._lock:
+            started = self._running.pop(run_id, None)
+            if started is not None:
+                self._role_stats(started[0])["errors"] += 1
+        if started is not None:
+            LLM_CALLS.inc(started[0], "error")
+            LLM_DURATION.observe(self._timer() - started[3], started[0], started[1] or "unknown")
+
+    def _role_stats(self, role):
+        return self._stats.setdefault(role, {
+            "calls": 0, "errors": 0, "latencies": [], "input_tokens": 0, "output_tokens": 0, "cost_usd": 0.0,
+        })
+
+    def _record(self, role, latency, input_tokens, output_tokens, cost):
+        with self._lock:
+            stats = self._role_stats(role)
+            stats["calls"] += 1
+            stats["latencies"].append(latency)
+            stats["input_tokens"] += input_tokens
+            stats["output_tokens"] += output_tokens
+            stats["cost_usd"] += cost
+
+    def report(self) -> Dict[str, dict]:
+        """Báo cáo theo vai trò: số lời gọi, lỗi, độ trễ (ms) trung bình/p50/p95, token và chi phí."""
+        with self._lock:
+            snapshot = {role: dict(stats, latencies=list(stats["latencies"])) for role, stats in self._stats.items()}
+        report = {}
+        for role, stats in snapshot.items():
+            latencies = sorted(stats.pop("latencies"))
+            stats["mean_ms"] = round(statistics.fmean(latencies) * 1000, 1) if latencies else 0.0
+            stats["p50_ms"] = round(latencies[len(latencies) // 2] * 1000, 1) if latencies else 0.0
+            stats["p95_ms"] = round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000, 1) if latencies else 0.0
+            stats["cost_usd"] = round(stats["cost_usd"], 6)
+            report[role] = stats
+        return report
+
+    def reset(self):
+        with self._lock:
+            self._running.clear()
+            self._stats.clear()
+
+
+class ModelRegistry:
+    """
+    Cấp model theo vai trò. Model được tạo lười (lần đầu được yêu cầu) bằng `factory`,
+    mỗi vai trò một bản riêng mang metadata vai trò và callback `usage`.
+    Truyền `factory` khác (ví dụ trả về chat model giả) để chạy offline.
+    Model dự phòng của vai trò (`fallback_specs`) được dựng cùng cách, metadata có thêm `llm_fallback`.
+    """
+
+    def __init__(self, specs: Dict[str, ModelSpec] = MODEL_SPECS,
+                 factory: Callable[[ModelSpec], BaseChatModel] = build_vertex_model,
+                 fallback_specs: Dict[str, ModelSpec] = FALLBACK_SPECS):
+        self.specs = specs
+        self.fallback_specs = fallback_specs
+        self.factory = factory
+        self.usage = LLMUsageTracker()
+        self._models = {}
+        self._fallbacks = {}
+        self._lock = threading.Lock()
+
+    def _cached(self, models: dict, role: str, spec: ModelSpec, **metadata) -> BaseChatModel:
+        model = models.get(role)
+        if model is None:
+            with self._lock:
+                model = models.get(role)
+                if model is None:
+                    base = self.factory(spec)
+                    model = base.model_copy(update={
+                        "callbacks": list(base.callbacks or []) + [self.usage],
+                        "metadata": {**(base.metadata or {}), "llm_role": role, "llm_model": spec.model_name, **metadata},
+                    })
+                    models[role] = model
+        return model
+
+    def get(self, role: str) -> BaseChatModel:
+        return self._cached(self._models, role, self.specs[role])
+
+    def fallback(self, role: str) -> Optional[BaseChatModel]:
+        """Model dự phòng của vai trò; None nếu vai trò không có."""
+        spec = self.fallback_specs.get(role)
+        if spec is None:
+            return None
+        return self._cached(self._fallbacks, role, spec, llm_fallback=True)
+
+    def warm(self) -> list:
+        """Dựng trước model (và model dự phòng) của mọi vai trò (dùng cho /readyz?warm=true); trả về các vai trò đã sẵn sàng."""
+        for role in self.specs:
+            self.get(role)
+            self.fallback(role)
+        return sorted(self._models)
+
+    def built_roles(self) -> list:
+        return sorted(self._models)
+
+
+model_registry = ModelRegistry()
+
+
+def get_llm(role: str) -> BaseChatModel:
+    """Model cho một vai trò: "route", "extract" hoặc "respond"."""
+    return model_registry.get(role)
+
+
+# Số chuyến bay (rẻ nhất) giữ lại sau mỗi lần tìm kiếm để hiển thị và đưa vào prompt
+FLIGHT_RESULTS_TOP_N = int(os.getenv("FLIGHT_RESULTS_TOP_N", "5"))
+
+# Cách soạn bản tóm tắt kết quả tìm kiếm (booking State 1) và bản tổng kết trước thanh toán
+# (State 5): "template" (mặc định, không gọi LLM) hoặc "llm" (văn bản thường, stream được).
+# Chế độ template tự chuyển sang LLM nếu kết quả tìm kiếm không render được.
+BOOKING_SUMMARY_MODE = os.getenv("BOOKING_SUMMARY_MODE", "template").lower()
+
+# Trích xuất slot (booking State 3/4): "rules" (mặc định: bộ trích xuất luật/regex trước,
+# chỉ gọi LLM khi còn thiếu slot hoặc tín hiệu mâu thuẫn) hoặc "llm" (luôn gọi LLM)
+BOOKING_EXTRACTION_MODE = os.getenv("BOOKING_EXTRACTION_MODE", "rules").lower()
+
+# Ngưỡng tin cậy để Manager dùng bộ phân loại luật thay cho LLM (> 1 để luôn hỏi LLM)
+MANAGER_RULE_THRESHOLD = float(os.getenv("MANAGER_RULE_THRESHOLD", "0.8"))
 
+# Cửa sổ ngữ cảnh đưa vào prompt (agents/context_window.py):
+# - CONTEXT_WINDOW_TOKENS / CONTEXT_WINDOW_MAX_MESSAGES: ngân sách cho các tin nhắn gần nhất giữ nguyên văn
+# - CONTEXT_SUMMARY_TOKENS: ngân sách của bản tóm tắt các tin nhắn đã trôi khỏi cửa sổ
+# - CONTEXT_SUMMARY_MODE: "rules" (mặc định: giữ lời khách, rút gọn, không gọi LLM) hoặc "llm"
+#   (model "extract" tóm tắt ở luồng nền, lượt sau mới dùng kết quả; chưa xong thì dùng bản luật)
+CONTEXT_WINDOW_TOKENS = int(os.getenv("CONTEXT_WINDOW_TOKENS", "800"))
+CONTEXT_WINDOW_MAX_MESSAGES = int(os.getenv("CONTEXT_WINDOW_MAX_MESSAGES", "6"))
+CONTEXT_SUMMARY_TOKENS = int(os.getenv("CONTEXT_SUMMARY_TOKENS", "200"))
+CONTEXT_SUMMARY_MODE = os.getenv("CONTEXT_SUMMARY_MODE", "rules").lower()
@@ -0,0 +1,147 @@
+# src/flight_booking_agent/deadlines.py
+import contextvars
+import os
+import random
+import time
+from contextlib import contextmanager
+from typing import Optional, Tuple
+
+from langgraph.config import get_config
+
+# Thời hạn của một lượt chat và cách dùng nó cho các lời gọi LLM:
+# - TURN_DEADLINE: số giây tối đa cho các lời gọi LLM/tool của một lượt (tính từ lúc endpoint
+#   nhận tin nhắn, gồm cả thời gian chờ trong hàng); CHAT_TURN_TIMEOUT của frontend (chat_client.py)
+#   được suy ra từ giá trị này để khách nhận được câu trả lời thay vì lỗi hết giờ; 0 = không giới
+#   hạn (mỗi lời gọi LLM chỉ chạy một lần như trước)
+# - LLM_MAX_ATTEMPTS: số lần gọi model chính tối đa cho một bước khi gặp lỗi tạm thời/hết giờ
+# - LLM_RETRY_BACKOFF: thời gian chờ cơ sở (giây) trước lần thử lại, tăng gấp đôi mỗi lần và
+#   lấy ngẫu nhiên trong [0, giá trị đó] (full jitter) để các lượt không thử lại cùng lúc
+# - LLM_FALLBACK_RESERVE: số giây cuối của lượt dành cho model dự phòng (nhanh hơn); model chính
+#   chỉ được gọi (lại) khi sau khi trừ phần này vẫn còn ít nhất LLM_MIN_ATTEMPT giây
+TURN_DEADLINE = float(os.getenv("TURN_DEADLINE", "25"))
+LLM_MAX_ATTEMPTS = int(os.getenv("LLM_MAX_ATTEMPTS", "2"))
+LLM_RETRY_BACKOFF = float(os.getenv("LLM_RETRY_BACKOFF", "0.25"))
+LLM_FALLBACK_RESERVE = float(os.getenv("LLM_FALLBACK_RESERVE", "4"))
+LLM_MIN_ATTEMPT = float(os.getenv("LLM_MIN_ATTEMPT", "1"))
+
+# Câu trả lời soạn sẵn khi lượt hết thời hạn mà chưa có câu trả lời từ LLM
+TURN_DEADLINE_REPLY = (
+    "Dạ, hệ thống đang phản hồi chậm nên em chưa xử lý kịp yêu cầu này. "
+    "Anh/chị vui lòng gửi lại tin nhắn sau ít phút giúp em ạ."
+)
+
+
+class DeadlineExceeded(TimeoutError):
+    """Lượt chat đã (gần) hết thời hạn, không còn đủ thời gian cho một lời gọi LLM nữa."""
+
+
+class Deadline:
+    """
+    Thời điểm kết thúc của một lượt chat (theo đồng hồ `timer`). Được truyền qua
+    `configurable["turn_deadline"]` của graph; vì không phải kiểu nguyên thủy nên không bị
+    chép vào metadata của checkpoint.
+    """
+
+    __slots__ = ("at", "_timer")
+
+    def __init__(self, budget: float, timer=time.monotonic):
+        self._timer = timer
+        self.at = timer() + budget
+
+    def remaining(self) -> float:
+        return max(self.at - self._timer(), 0.0)
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def __repr__(self) -> str:
+        return f"Deadline(remaining={self.remaining():.3f}s)"
+
+
+def turn_config(thread_id: str, budget: Optional[float] = None) -> dict:
+    """Config của graph cho một lượt: thread_id kèm thời hạn lượt (nếu TURN_DEADLINE > 0)."""
+    budget = TURN_DEADLINE if budget is None else budget
+    configurable = {"thread_id": thread_id}
+    if budget > 0:
+        configurable["turn_deadline"] = Deadline(budget)
+    return {"configurable": configurable}
+
+
+def current_deadline() -> Optional[Deadline]:
+    """Thời hạn của lượt đang chạy (đọc từ config của node/tool hiện tại); None nếu không có."""
+    try:
+        config = get_config()
+    except RuntimeError:
+        return None
+    deadline = (config.get("configurable") or {}).get("turn_deadline")
+    return deadline if isinstance(deadline, Deadline) else None
+
+
+_attempt_timeout: contextvars.ContextVar = contextvars.ContextVar("llm_attempt_timeout", default=None)
+
+
+def attempt_timeout() -> Optional[float]:
+    """Timeout (giây) của lần gọi LLM hiện tại theo thời hạn lượt; None nếu không có."""
+    return _attempt_timeout.get()
+
+
+@contextmanager
+def attempt_scope(timeout: Optional[float]):
+    token = _attempt_timeout.set(timeout)
+    try:
+        yield
+    finally:
+        _attempt_timeout.reset(token)
+
+
+def is_transient(error: BaseException) -> bool:
+    """Lỗi đáng thử lại: hết giờ, lỗi kết nối, hoặc lỗi API có mã 429/5xx (google.api_core)."""
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    code = getattr(error, "code", None)
+    return isinstance(code, int) and (code == 429 or code >= 500)
+
+
+class CallPlan:
+    """
+    Kế hoạch các lần gọi cho một bước LLM trong thời hạn lượt: gọi model chính (tối đa
+    LLM_MAX_ATTEMPTS lần, thử lại có jitter) khi còn đủ thời gian sau phần dành cho model dự
+    phòng, sau đó gọi model dự phòng một lần. Timeout mỗi lần gọi model chính chia đều phần
+    thời gian còn lại cho các lần còn được phép (không vượt `timeout` của vai trò), để một lần
+    treo không ăn hết thời hạn của cả lượt.
+    """
+
+    def __init__(self, deadline: Deadline, timeout: Optional[float] = None,
+                 fallback_timeout: Optional[float] = None, rng=random.random):
+        self.deadline = deadline
+        self.timeout = timeout
+        self.fallback_timeout = fallback_timeout  # None: vai trò không có model dự phòng
+        self.attempts = 0
+        self.fell_back = False
+        self._rng = rng
+
+    @property
+    def reserve(self) -> float:
+        return LLM_FALLBACK_RESERVE if self.fallback_timeout is not None else 0.0
+
+    def next(self) -> Optional[Tuple[bool, float]]:
+        """(dùng model dự phòng?, số giây chờ trước khi gọi) cho lần gọi kế tiếp; None nếu hết."""
+        if self.fell_back:
+            return None
+        remaining = self.deadline.remaining()
+        if self.attempts < LLM_MAX_ATTEMPTS:
+            delay = self._rng() * LLM_RETRY_BACKOFF * 2 ** (self.attempts - 1) if self.attempts else 0.0
+            if remaining - delay - self.reserve >= LLM_MIN_ATTEMPT:
+                self.attempts += 1
+                return False, delay
+        if self.fallback_timeout is not None and remaining > 0:
+            self.fell_back = True
+            return True, 0.0
+        return None
+
+    def attempt_timeout(self, fallback: bool) -> float:
+        remaining = self.deadline.remaining()
+        if fallback:
+            return min(self.fallback_timeout, remaining)
+        share = max((remaining - self.reserve) / (LLM_MAX_ATTEMPTS - self.attempts + 1), LLM_MIN_ATTEMPT)
+        return min(share, remaining) if self.timeout is None else min(share, remaining, self.timeout)
@@ -0,0 +1,242 @@
+# src/flight_booking_agent/graph/checkpoint_serde.py
+import hashlib
+import pathlib
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional, Set, Tuple
+
+import ormsgpack
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, ToolMessage
+from langgraph.checkpoint.serde.base import SerializerProtocol
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+
+# Kiểu dữ liệu ghi cạnh bytes của checkpoint/blob/write. Bản ghi có tham chiếu tới kho khối
+# mang kiểu riêng để việc dọn khối không phải giải mã các bản ghi không có tham chiếu.
+COMPACT_TYPE = "compact"
+COMPACT_BLOCKS_TYPE = "compact-blocks"
+
+# Mã ext msgpack riêng, không trùng với các mã 0-6 của JsonPlusSerializer
+_EXT_MESSAGE = 64
+_EXT_BLOCKS = 65
+_EXT_FALLBACK = 66
+_OPTION = (
+    ormsgpack.OPT_NON_STR_KEYS
+    | ormsgpack.OPT_PASSTHROUGH_DATACLASS
+    | ormsgpack.OPT_PASSTHROUGH_DATETIME
+    | ormsgpack.OPT_PASSTHROUGH_ENUM
+    | ormsgpack.OPT_PASSTHROUGH_UUID
+)
+_MESSAGE_KINDS = {HumanMessage: "human", AIMessage: "ai", ToolMessage: "tool", SystemMessage: "system"}
+_MESSAGE_CLASSES = {kind: cls for cls, kind in _MESSAGE_KINDS.items()}
+_MESSAGE_SKIP = ("content", "id", "type")
+# Độ sâu dict tối đa được duyệt để tìm list lớn: checkpoint -> channel_values -> giá trị kênh
+_MAX_DEPTH = 3
+
+
+class ContentStore:
+    """Kho khối bytes theo nội dung (khóa = blake2b 16 byte của khối), giữ trong bộ nhớ."""
+
+    def __init__(self):
+        self._blocks: Dict[bytes, bytes] = {}
+
+    def put(self, key: bytes, data: bytes):
+        self._blocks.setdefault(key, data)
+
+    def get(self, key: bytes) -> bytes:
+        try:
+            return self._blocks[key]
+        except KeyError:
+            raise KeyError(f"Thiếu khối checkpoint {key.hex()}") from None
+
+    def keys(self) -> list:
+        return list(self._blocks)
+
+    def discard(self, keys: Iterable[bytes]):
+        for key in keys:
+            self._blocks.pop(key, None)
+
+    def size(self) -> int:
+        return sum(len(data) for data in list(self._blocks.values()))
+
+    def __len__(self) -> int:
+        return len(self._blocks)
+
+
+class SqliteContentStore(ContentStore):
+    """
+    Kho khối cho backend SQLite (bảng `checkpoint_blocks`): khối mới nằm trong `pending` cho
+    tới khi saver ghi chúng cùng giao dịch với checkpoint tham chiếu tới chúng. Các khối đã
+    dùng được giữ trong LRU `cache_size` khối; khối không có trong cache (vd. sau khi khởi động
+    lại) được đọc đồng bộ qua một kết nối sqlite3 chỉ đọc riêng (WAL nên không chặn bên ghi).
+    """
+
+    def __init__(self, path: str, cache_size: Optional[int] = 4096):
+        super().__init__()
+        self.path = path
+        # DB trong bộ nhớ không mở lại được từ kết nối khác: giữ mọi khối trong cache
+        self.cache_size = None if path == ":memory:" else cache_size
+        self._blocks = OrderedDict()
+        self._pending: Dict[bytes, bytes] = {}
+        self._lock = threading.Lock()
+        self._reader: Optional[sqlite3.Connection] = None
+
+    def put(self, key: bytes, data: bytes):
+        with self._lock:
+            if key in self._blocks:
+                self._blocks.move_to_end(key)
+                return
+            self._blocks[key] = self._pending[key] = data
+            self._evict()
+
+    def get(self, key: bytes) -> bytes:
+        with self._lock:
+            data = self._blocks.get(key)
+            if data is not None:
+                self._blocks.move_to_end(key)
+                return data
+            data = self._pending.get(key)
+            if data is not None:
+                return data
+            if self._reader is None:
+                self._reader = sqlite3.connect(
+                    pathlib.Path(self.path).resolve().as_uri() + "?mode=ro", uri=True, check_same_thread=False
+                )
+            row = self._reader.execute("SELECT data FROM checkpoint_blocks WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                raise KeyError(f"Thiếu khối checkpoint {key.hex()}")
+            self._blocks[key] = row[0]
+            self._evict()
+            return row[0]
+
+    def _evict(self):
+        """Bỏ các khối dùng lâu nhất khi cache vượt `cache_size` (gọi trong `self._lock`)."""
+        if self.cache_size is not None:
+            while len(self._blocks) > self.cache_size:
+                self._blocks.popitem(last=False)
+
+    def pending(self) -> Dict[bytes, bytes]:
+        with self._lock:
+            return dict(self._pending)
+
+    def flushed(self, keys: Iterable[bytes]):
+        """Các khối đã được ghi (đã commit) vào bảng `checkpoint_blocks`."""
+        with self._lock:
+            for key in keys:
+                self._pending.pop(key, None)
+
+    def discard(self, keys: Iterable[bytes]):
+        with self._lock:
+            for key in keys:
+                self._blocks.pop(key, None)
+
+    def close(self):
+        with self._lock:
+            if self._reader is not None:
+                self._reader.close()
+                self._reader = None
+
+
+class CompactSerializer(SerializerProtocol):
+    """
+    Serializer checkpoint gọn hơn JsonPlusSerializer mặc định:
+    - BaseMessage (human/ai/tool/system) ghi thành [loại, nội dung, id, các trường khác rỗng]
+      thay vì toàn bộ `model_dump()` kèm tên module/lớp;
+    - list từ `block_items` phần tử trở lên (lịch sử tin nhắn, kết quả tìm kiếm, hành khách)
+      được cắt thành các khối `block_items` phần tử cố định theo vị trí, lưu một lần trong kho
+      theo nội dung (`store`); bản ghi chỉ giữ khóa của các khối đầy và phần đuôi chưa đủ khối.
+      List chỉ nối thêm qua các lượt nên checkpoint kế tiếp dùng lại mọi khối cũ: mỗi checkpoint
+      chỉ tốn phần thay đổi (delta) cộng 16 byte cho mỗi khối, và không phụ thuộc checkpoint cha
+      nên xóa checkpoint cũ (keep_last, TTL) không làm hỏng checkpoint mới.
+    Bản ghi cũ (kiểu "msgpack", "json"...) vẫn đọc được qua JsonPlusSerializer; đối tượng
+    không mã hóa được ở đây cũng được nhường cho nó.
+    """
+
+    def __init__(self, store: Optional[ContentStore] = None, block_items: int = 4):
+        self.store = store if store is not None else ContentStore()
+        self.block_items = max(block_items, 2)
+        self._fallback = JsonPlusSerializer()
+
+    # --- Ghi ---
+    def dumps_typed(self, obj: Any) -> Tuple[str, bytes]:
+        if obj is None or isinstance(obj, (bytes, bytearray)):
+            return self._fallback.dumps_typed(obj)
+        refs = []
+        try:
+            data = ormsgpack.packb(self._prepare(obj, 0, refs), default=self._default, option=_OPTION)
+        except (ormsgpack.MsgpackEncodeError, TypeError):
+            return self._fallback.dumps_typed(obj)
+        return (COMPACT_BLOCKS_TYPE if refs else COMPACT_TYPE), data
+
+    def _prepare(self, obj: Any, depth: int, refs: list) -> Any:
+        if isinstance(obj, list) and len(obj) >= self.block_items:
+            return self._blocks(obj, refs)
+        if isinstance(obj, dict) and depth < _MAX_DEPTH:
+            return {key: self._prepare(value, depth + 1, refs) for key, value in obj.items()}
+        return obj
+
+    def _blocks(self, items: list, refs: list) -> ormsgpack.Ext:
+        full = len(items) - len(items) % self.block_items
+        keys = []
+        for start in range(0, full, self.block_items):
+            data = ormsgpack.packb(items[start:start + self.block_items], default=self._default, option=_OPTION)
+            key = hashlib.blake2b(data, digest_size=16).digest()
+            self.store.put(key, data)
+            keys.append(key)
+        refs.extend(keys)
+        return ormsgpack.Ext(_EXT_BLOCKS, ormsgpack.packb([keys, items[full:]], default=self._default, option=_OPTION))
+
+    def _default(self, obj: Any) -> ormsgpack.Ext:
+        kind = _MESSAGE_KINDS.get(type(obj))
+        if kind is not None:
+            # Bỏ các trường rỗng/mặc định (additional_kwargs, response_metadata, tool_calls=[]...)
+            extra = {k: v for k, v in obj.__dict__.items() if v and k not in _MESSAGE_SKIP}
+            payload = [kind, obj.content, obj.id, extra or None]
+            return ormsgpack.Ext(_EXT_MESSAGE, ormsgpack.packb(payload, default=self._default, option=_OPTION))
+        return ormsgpack.Ext(_EXT_FALLBACK, ormsgpack.packb(list(self._fallback.dumps_typed(obj))))
+
+    # --- Đọc ---
+    def loads_typed(self, data: Tuple[str, bytes]) -> Any:
+        type_, payload = data
+        if type_ in (COMPACT_TYPE, COMPACT_BLOCKS_TYPE):
+            return ormsgpack.unpackb(payload, ext_hook=self._ext_hook, option=ormsgpack.OPT_NON_STR_KEYS)
+        return self._fallback.loads_typed(data)
+
+    def _ext_hook(self, code: int, data: bytes) -> Any:
+        if code == _EXT_MESSAGE:
+            kind, content, message_id, extra = ormsgpack.unpackb(data, ext_hook=self._ext_hook, option=ormsgpack.OPT_NON_STR_KEYS)
+            return _MESSAGE_CLASSES[kind](content=content, id=message_id, **(extra or {}))
+        if code == _EXT_BLOCKS:
+            keys, tail = ormsgpack.unpackb(data, ext_hook=self._ext_hook, option=ormsgpack.OPT_NON_STR_KEYS)
+            items = []
+            for key in keys:
+                items.extend(ormsgpack.unpackb(self.store.get(key), ext_hook=self._ext_hook, option=ormsgpack.OPT_NON_STR_KEYS))
+            items.extend(tail)
+            return items
+        if code == _EXT_FALLBACK:
+            return self._fallback.loads_typed(tuple(ormsgpack.unpackb(data)))
+        raise ValueError(f"Mã ext checkpoint không hợp lệ: {code}")
+
+    def refs(self, data: Tuple[str, bytes]) -> Set[bytes]:
+        """Khóa các khối mà một bản ghi tham chiếu tới (để dọn khối không còn dùng)."""
+        if data[0] != COMPACT_BLOCKS_TYPE:
+            return set()
+        found = set()
+
+        def collect(code: int, payload: bytes):
+            if code == _EXT_BLOCKS:
+                keys, _ = ormsgpack.unpackb(payload, ext_hook=collect)
+                found.update(keys)
+            return None
+
+        ormsgpack.unpackb(data[1], ext_hook=collect)
+        return found
+
+
+def referenced_blocks(serde, records: Iterable[Tuple[str, bytes]]) -> Set[bytes]:
+    """Hợp các khóa khối được `records` tham chiếu; rỗng nếu serde không dùng kho khối."""
+    live = set()
+    if isinstance(serde, CompactSerializer):
+        for record in records:
+            live |= serde.refs(record)
+    return live
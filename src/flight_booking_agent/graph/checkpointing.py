@@ -0,0 +1,198 @@
+# src/flight_booking_agent/graph/checkpointing.py
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict, defaultdict, deque
+from contextlib import asynccontextmanager
+from dotenv import load_dotenv
+from langgraph.checkpoint.memory import InMemorySaver
+
+from ..metrics import CHECKPOINT_DURATION
+from .checkpoint_serde import CompactSerializer, ContentStore, referenced_blocks
+
+load_dotenv()
+
+# Cấu hình checkpoint:
+# - CHECKPOINT_BACKEND: "memory" (mặc định) hoặc "sqlite" (bền vững, WAL, bất đồng bộ)
+# - CHECKPOINT_KEEP_LAST: số checkpoint giữ lại cho mỗi thread
+# - CHECKPOINT_THREAD_TTL: số giây một thread không hoạt động trước khi bị xóa
+CHECKPOINT_BACKEND = os.getenv("CHECKPOINT_BACKEND", "memory").lower()
+CHECKPOINT_SQLITE_PATH = os.getenv("CHECKPOINT_SQLITE_PATH", "checkpoints.sqlite")
+CHECKPOINT_KEEP_LAST = int(os.getenv("CHECKPOINT_KEEP_LAST", "10"))
+CHECKPOINT_THREAD_TTL = float(os.getenv("CHECKPOINT_THREAD_TTL", str(24 * 3600)))
+CHECKPOINT_SWEEP_INTERVAL = float(os.getenv("CHECKPOINT_SWEEP_INTERVAL", "300"))
+# - CHECKPOINT_SERDE: "compact" (mặc định, xem graph/checkpoint_serde.py) hoặc "jsonplus"
+#   (serializer mặc định của LangGraph); checkpoint ghi bằng cách nào cũng đọc được
+# - CHECKPOINT_BLOCK_ITEMS: số phần tử mỗi khối khi tách list lớn ra kho khối theo nội dung
+CHECKPOINT_SERDE = os.getenv("CHECKPOINT_SERDE", "compact").lower()
+CHECKPOINT_BLOCK_ITEMS = int(os.getenv("CHECKPOINT_BLOCK_ITEMS", "4"))
+
+
+def create_serde(store=None):
+    """Serializer theo CHECKPOINT_SERDE; None = serializer mặc định của saver."""
+    if CHECKPOINT_SERDE != "compact":
+        return None
+    return CompactSerializer(store if store is not None else ContentStore(), CHECKPOINT_BLOCK_ITEMS)
+
+
+class BoundedInMemorySaver(InMemorySaver):
+    """
+    InMemorySaver có giới hạn bộ nhớ:
+    - Mỗi thread chỉ giữ `keep_last` checkpoint mới nhất (kèm pending writes và các
+      blob giá trị kênh mà những checkpoint đó còn tham chiếu).
+    - Thread không hoạt động quá `thread_ttl` giây bị xóa hẳn; việc dọn dẹp được
+      thực hiện dần trong `put`, tối đa một lần mỗi `sweep_interval` giây, kèm theo việc
+      dọn các khối của kho khối (CompactSerializer) không còn bản ghi nào tham chiếu.
+    """
+
+    def __init__(self, *, keep_last=CHECKPOINT_KEEP_LAST, thread_ttl=CHECKPOINT_THREAD_TTL,
+                 sweep_interval=CHECKPOINT_SWEEP_INTERVAL, timer=time.monotonic, serde=None):
+        super().__init__(serde=serde or create_serde())
+        self.keep_last = max(keep_last, 1)
+        self.thread_ttl = thread_ttl
+        self.sweep_interval = sweep_interval
+        self._timer = timer
+        self._lock = threading.RLock()
+        # thread_id -> lần hoạt động cuối, sắp theo thứ tự hoạt động (cũ nhất ở đầu)
+        self._last_seen = OrderedDict()
+        # thread_id -> checkpoint_ns -> channel -> các version blob theo thứ tự tăng dần
+        self._blob_versions = defaultdict(lambda: defaultdict(lambda: defaultdict(deque)))
+        self._next_sweep = timer() + sweep_interval
+
+    # Các hàm async của InMemorySaver gọi lại bản đồng bộ, nên đo ở đây là đủ cho cả hai
+    def get_tuple(self, config):
+        with CHECKPOINT_DURATION.time("memory", "get"):
+            return super().get_tuple(config)
+
+    def put_writes(self, config, writes, task_id, task_path=""):
+        with CHECKPOINT_DURATION.time("memory", "put_writes"), self._lock:
+            super().put_writes(config, writes, task_id, task_path)
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        with CHECKPOINT_DURATION.time("memory", "put"):
+            return self._put(config, checkpoint, metadata, new_versions)
+
+    def _put(self, config, checkpoint, metadata, new_versions):
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"]["checkpoint_ns"]
+        with self._lock:
+            next_config = super().put(config, checkpoint, metadata, new_versions)
+            channels = self._blob_versions[thread_id][checkpoint_ns]
+            for channel, version in new_versions.items():
+                channels[channel].append(version)
+            self._prune(thread_id, checkpoint_ns)
+            self._last_seen[thread_id] = self._timer()
+            self._last_seen.move_to_end(thread_id)
+        self._maybe_sweep()
+        return next_config
+
+    def _prune(self, thread_id, checkpoint_ns):
+        checkpoints = self.storage[thread_id][checkpoint_ns]
+        if len(checkpoints) <= self.keep_last:
+            return
+        ids = sorted(checkpoints)
+        for checkpoint_id in ids[:-self.keep_last]:
+            del checkpoints[checkpoint_id]
+            self.writes.pop((thread_id, checkpoint_ns, checkpoint_id), None)
+
+        # Version của kênh chỉ tăng, nên blob cũ hơn version mà checkpoint cũ nhất
+        # còn giữ đang dùng sẽ không còn ai tham chiếu tới.
+        oldest = self.serde.loads_typed(checkpoints[ids[-self.keep_last]][0])
+        floors = oldest["channel_versions"]
+        for channel, versions in self._blob_versions[thread_id][checkpoint_ns].items():
+            floor = floors.get(channel)
+            while floor is not None and versions and versions[0] < floor:
+                self.blobs.pop((thread_id, checkpoint_ns, channel, versions.popleft()), None)
+
+    def _maybe_sweep(self):
+        now = self._timer()
+        if now >= self._next_sweep:
+            self._next_sweep = now + self.sweep_interval
+            self.sweep_expired(now)
+
+    def sweep_expired(self, now=None) -> int:
+        """Xóa các thread không hoạt động quá TTL; trả về số thread đã xóa."""
+        now = self._timer() if now is None else now
+        expired = []
+        with self._lock:
+            for thread_id, last_seen in self._last_seen.items():
+                if now - last_seen < self.thread_ttl:
+                    break
+                expired.append(thread_id)
+        for thread_id in expired:
+            self.delete_thread(thread_id)
+        self.collect_blocks()
+        return len(expired)
+
+    def collect_blocks(self) -> int:
+        """Xóa các khối trong kho khối không còn checkpoint, blob hay write nào tham chiếu."""
+        store = getattr(self.serde, "store", None)
+        if not store:
+            return 0
+        # Ghi (put/put_writes) cũng giữ lock nên không có bản ghi nào tham chiếu khối mới giữa chừng
+        with self._lock:
+            records = [saved[0] for namespaces in self.storage.values() for checkpoints in namespaces.values()
+                       for saved in checkpoints.values()]
+            records += list(self.blobs.values())
+            records += [write[2] for writes in self.writes.values() for write in writes.values()]
+            live = referenced_blocks(self.serde, records)
+            dead = [key for key in store.keys() if key not in live]
+            store.discard(dead)
+        return len(dead)
+
+    def delete_thread(self, thread_id):
+        # Dùng chỉ mục theo thread thay vì quét toàn bộ writes/blobs như lớp cha
+        with self._lock:
+            for checkpoint_ns, checkpoints in self.storage.pop(thread_id, {}).items():
+                for checkpoint_id in checkpoints:
+                    self.writes.pop((thread_id, checkpoint_ns, checkpoint_id), None)
+            for checkpoint_ns, channels in self._blob_versions.pop(thread_id, {}).items():
+                for channel, versions in channels.items():
+                    for version in versions:
+                        self.blobs.pop((thread_id, checkpoint_ns, channel, version), None)
+            self._last_seen.pop(thread_id, None)
+
+    def thread_count(self) -> int:
+        return len(self._last_seen)
+
+
+def create_checkpointer() -> BoundedInMemorySaver:
+    """
+    Checkpointer dùng khi compile graph. Backend SQLite cần một event loop đang chạy
+    nên được gắn vào graph lúc ứng dụng khởi động, xem `use_configured_checkpointer`.
+    """
+    return BoundedInMemorySaver()
+
+
+@asynccontextmanager
+async def use_configured_checkpointer(graph):
+    """
+    Gắn checkpointer theo cấu hình vào graph đã compile trong suốt vòng đời ứng dụng
+    (dùng trong lifespan của FastAPI). Với backend SQLite, một tác vụ nền định kỳ
+    xóa các thread đã hết hạn.
+    """
+    if CHECKPOINT_BACKEND != "sqlite":
+        yield graph.checkpointer
+        return
+
+    from .sqlite_checkpointer import open_sqlite_checkpointer
+
+    previous = graph.checkpointer
+    async with open_sqlite_checkpointer(CHECKPOINT_SQLITE_PATH) as saver:
+        graph.checkpointer = saver
+
+        async def sweep_periodically():
+            while True:
+                await asyncio.sleep(CHECKPOINT_SWEEP_INTERVAL)
+                try:
+                    await saver.asweep_expired()
+                except Exception as e:
+                    print(f"Lỗi khi dọn dẹp checkpoint hết hạn: {e}")
+
+        sweeper = asyncio.create_task(sweep_periodically())
+        try:
+            yield saver
+        finally:
+            sweeper.cancel()
+            graph.checkpointer = previous
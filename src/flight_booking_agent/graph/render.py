@@ -0,0 +1,42 @@
+# src/flight_booking_agent/graph/render.py
+"""
+Vẽ sơ đồ workflow ra file (lệnh dành cho dev, không chạy khi import ứng dụng):
+
+    python -m src.flight_booking_agent.graph.render img/workflow_graph.png
+    python -m src.flight_booking_agent.graph.render --mermaid img/workflow_graph.mmd
+
+Ảnh PNG được render qua dịch vụ Mermaid từ xa (cần mạng); `--mermaid` chỉ ghi mã
+Mermaid nên chạy được offline.
+"""
+import argparse
+import os
+
+DEFAULT_OUTPUT = os.path.join("img", "workflow_graph.png")
+
+
+def render_workflow(output_path: str = DEFAULT_OUTPUT, mermaid_only: bool = False) -> str:
+    from .workflow import app
+
+    graph = app.get_graph()
+    directory = os.path.dirname(output_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    if mermaid_only:
+        with open(output_path, "w", encoding="utf-8") as f:
+            f.write(graph.draw_mermaid())
+    else:
+        graph.draw_mermaid_png(output_file_path=output_path)
+    return output_path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Vẽ sơ đồ workflow LangGraph của agent đặt vé")
+    parser.add_argument("output", nargs="?", default=DEFAULT_OUTPUT, help=f"file đích (mặc định {DEFAULT_OUTPUT})")
+    parser.add_argument("--mermaid", action="store_true", help="chỉ ghi mã Mermaid (offline) thay vì ảnh PNG")
+    args = parser.parse_args(argv)
+    path = render_workflow(args.output, mermaid_only=args.mermaid)
+    print(f"Đã vẽ sơ đồ workflow ra file: {path}")
+
+
+if __name__ == "__main__":
+    main()
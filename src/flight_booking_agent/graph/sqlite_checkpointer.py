@@ -0,0 +1,187 @@
+# src/flight_booking_agent/graph/sqlite_checkpointer.py
+# Backend checkpoint SQLite (tùy chọn): cần `langgraph-checkpoint-sqlite` và `aiosqlite`.
+import time
+from contextlib import asynccontextmanager
+
+import aiosqlite
+from langgraph.checkpoint.base import WRITES_IDX_MAP, get_checkpoint_metadata
+from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+
+from ..metrics import CHECKPOINT_DURATION
+from .checkpoint_serde import COMPACT_BLOCKS_TYPE, SqliteContentStore, referenced_blocks
+from .checkpointing import CHECKPOINT_KEEP_LAST, CHECKPOINT_THREAD_TTL, create_serde
+
+
+class BoundedAsyncSqliteSaver(AsyncSqliteSaver):
+    """
+    AsyncSqliteSaver (WAL) có chính sách lưu giữ: mỗi thread chỉ giữ `keep_last`
+    checkpoint mới nhất, và `asweep_expired` xóa các thread không hoạt động quá
+    `thread_ttl` giây. Thời điểm hoạt động được lưu trong bảng `thread_activity`
+    nên chính sách vẫn đúng sau khi khởi động lại tiến trình.
+
+    Với CompactSerializer, các khối list lớn nằm trong bảng `checkpoint_blocks` và được ghi
+    cùng giao dịch với checkpoint/write tham chiếu tới chúng; `asweep_expired` dọn các khối
+    không còn được tham chiếu.
+    """
+
+    def __init__(self, conn, *, keep_last=CHECKPOINT_KEEP_LAST, thread_ttl=CHECKPOINT_THREAD_TTL, serde=None):
+        super().__init__(conn, serde=serde)
+        self.keep_last = max(keep_last, 1)
+        self.thread_ttl = thread_ttl
+
+    async def setup(self):
+        if self.is_setup:
+            return
+        await super().setup()  # Tạo bảng và bật journal_mode=WAL
+        async with self.lock:
+            await self.conn.executescript(
+                """
+                PRAGMA synchronous=NORMAL;
+                CREATE TABLE IF NOT EXISTS thread_activity (
+                    thread_id TEXT PRIMARY KEY,
+                    last_seen REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS thread_activity_last_seen ON thread_activity (last_seen);
+                CREATE TABLE IF NOT EXISTS checkpoint_blocks (
+                    key BLOB PRIMARY KEY,
+                    data BLOB NOT NULL
+                ) WITHOUT ROWID;
+                """
+            )
+            await self.conn.commit()
+
+    # Các hàm đồng bộ của AsyncSqliteSaver gọi lại bản async, nên đo ở đây là đủ cho cả hai
+    async def aget_tuple(self, config):
+        with CHECKPOINT_DURATION.time("sqlite", "get"):
+            return await super().aget_tuple(config)
+
+    async def aput_writes(self, config, writes, task_id, task_path=""):
+        with CHECKPOINT_DURATION.time("sqlite", "put_writes"):
+            await self._aput_writes(config, writes, task_id, task_path)
+
+    async def _write_blocks(self) -> list:
+        """Ghi các khối mới của kho khối (chưa commit); trả về khóa để báo `flushed` sau commit."""
+        store = getattr(self.serde, "store", None)
+        if not isinstance(store, SqliteContentStore):
+            return []
+        blocks = store.pending()
+        if blocks:
+            await self.conn.executemany(
+                "INSERT OR IGNORE INTO checkpoint_blocks (key, data) VALUES (?, ?)", list(blocks.items())
+            )
+        return list(blocks)
+
+    def _flushed(self, keys):
+        if keys:
+            self.serde.store.flushed(keys)
+
+    async def _aput_writes(self, config, writes, task_id, task_path=""):
+        # Như AsyncSqliteSaver.aput_writes, nhưng mã hóa trong lock và ghi khối cùng giao dịch
+        query = (
+            "INSERT OR REPLACE INTO writes (thread_id, checkpoint_ns, checkpoint_id, task_id, idx, channel, type, value) VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+            if all(w[0] in WRITES_IDX_MAP for w in writes)
+            else "INSERT OR IGNORE INTO writes (thread_id, checkpoint_ns, checkpoint_id, task_id, idx, channel, type, value) VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+        )
+        await self.setup()
+        configurable = config["configurable"]
+        async with self.lock:
+            rows = [
+                (str(configurable["thread_id"]), str(configurable["checkpoint_ns"]), str(configurable["checkpoint_id"]),
+                 task_id, WRITES_IDX_MAP.get(channel, idx), channel, *self.serde.dumps_typed(value))
+                for idx, (channel, value) in enumerate(writes)
+            ]
+            blocks = await self._write_blocks()
+            await self.conn.executemany(query, rows)
+            await self.conn.commit()
+            self._flushed(blocks)
+
+    async def aput(self, config, checkpoint, metadata, new_versions):
+        with CHECKPOINT_DURATION.time("sqlite", "put"):
+            return await self._aput(config, checkpoint, metadata, new_versions)
+
+    async def _aput(self, config, checkpoint, metadata, new_versions):
+        # Ghi khối, checkpoint, dọn checkpoint cũ và cập nhật thời điểm hoạt động trong một giao dịch
+        await self.setup()
+        thread_id = str(config["configurable"]["thread_id"])
+        checkpoint_ns = config["configurable"]["checkpoint_ns"]
+        async with self.lock:
+            type_, serialized_checkpoint = self.serde.dumps_typed(checkpoint)
+            serialized_metadata = self.jsonplus_serde.dumps(get_checkpoint_metadata(config, metadata))
+            blocks = await self._write_blocks()
+            await self.conn.execute(
+                """INSERT OR REPLACE INTO checkpoints (thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id,
+                type, checkpoint, metadata) VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                (thread_id, checkpoint_ns, checkpoint["id"], config["configurable"].get("checkpoint_id"),
+                 type_, serialized_checkpoint, serialized_metadata),
+            )
+            await self.conn.execute(
+                """DELETE FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id NOT IN (
+                    SELECT checkpoint_id FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ?
+                    ORDER BY checkpoint_id DESC LIMIT ?)""",
+                (thread_id, checkpoint_ns, thread_id, checkpoint_ns, self.keep_last),
+            )
+            await self.conn.execute(
+                """DELETE FROM writes WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id < (
+                    SELECT MIN(checkpoint_id) FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ?)""",
+                (thread_id, checkpoint_ns, thread_id, checkpoint_ns),
+            )
+            await self.conn.execute(
+                """INSERT INTO thread_activity (thread_id, last_seen) VALUES (?, ?)
+                ON CONFLICT(thread_id) DO UPDATE SET last_seen = excluded.last_seen""",
+                (thread_id, time.time()),
+            )
+            await self.conn.commit()
+            self._flushed(blocks)
+        return {"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": checkpoint["id"]}}
+
+    async def asweep_expired(self, now=None) -> int:
+        """Xóa các thread không hoạt động quá TTL; trả về số thread đã xóa."""
+        await self.setup()
+        cutoff = (time.time() if now is None else now) - self.thread_ttl
+        async with self.lock:
+            async with self.conn.execute(
+                "SELECT thread_id FROM thread_activity WHERE last_seen < ?", (cutoff,)
+            ) as cursor:
+                expired = [row[0] for row in await cursor.fetchall()]
+            for table in ("checkpoints", "writes", "thread_activity"):
+                await self.conn.executemany(
+                    f"DELETE FROM {table} WHERE thread_id = ?", [(t,) for t in expired]
+                )
+            await self._collect_blocks()
+            await self.conn.commit()
+        return len(expired)
+
+    async def _collect_blocks(self) -> int:
+        """Xóa các khối không còn checkpoint hay write nào tham chiếu (gọi trong `self.lock`)."""
+        store = getattr(self.serde, "store", None)
+        if not isinstance(store, SqliteContentStore):
+            return 0
+        records = []
+        for table, column in (("checkpoints", "checkpoint"), ("writes", "value")):
+            async with self.conn.execute(f"SELECT {column} FROM {table} WHERE type = ?", (COMPACT_BLOCKS_TYPE,)) as cursor:
+                records += [(COMPACT_BLOCKS_TYPE, row[0]) for row in await cursor.fetchall()]
+        live = referenced_blocks(self.serde, records)
+        async with self.conn.execute("SELECT key FROM checkpoint_blocks") as cursor:
+            dead = [row[0] for row in await cursor.fetchall() if row[0] not in live]
+        await self.conn.executemany("DELETE FROM checkpoint_blocks WHERE key = ?", [(key,) for key in dead])
+        store.discard(dead)
+        return len(dead)
+
+    async def adelete_thread(self, thread_id):
+        await super().adelete_thread(thread_id)
+        async with self.lock:
+            await self.conn.execute("DELETE FROM thread_activity WHERE thread_id = ?", (str(thread_id),))
+            await self.conn.commit()
+
+
+@asynccontextmanager
+async def open_sqlite_checkpointer(path, **kwargs):
+    kwargs.setdefault("serde", create_serde(SqliteContentStore(path)))
+    async with aiosqlite.connect(path) as conn:
+        saver = BoundedAsyncSqliteSaver(conn, **kwargs)
+        await saver.setup()
+        try:
+            yield saver
+        finally:
+            if isinstance(getattr(saver.serde, "store", None), SqliteContentStore):
+                saver.serde.store.close()
@@ -1,6 +1,6 @@
 from typing import List, TypedDict, Annotated, Optional, Literal
 from langchain_core.messages import BaseMessage
-import operator
+from langgraph.graph.message import add_messages
 
 class AgentState(TypedDict):
     """
@@ -10,9 +10,17 @@ class AgentState(TypedDict):
         messages: Lịch sử hội thoại.
         next_agent: Agent tiếp theo được gọi, do Manager quyết định.
         ... các trường dữ liệu khác được thu thập trong quá trình ...
+
+    Quy ước cập nhật: mỗi node CHỈ trả về các trường thay đổi (delta), với `messages`
+    là danh sách tin nhắn MỚI của lượt đó. Không trả về `{**state, ...}` hay
+    `state["messages"] + [...]`.
     """
-    # Lịch sử hội thoại
-    messages: Annotated[List[BaseMessage], operator.add]
+    # Lịch sử hội thoại. `add_messages` gộp theo id: tin nhắn đã có (cùng id) được
+    # thay thế tại chỗ thay vì bị nối thêm lần nữa, nên lịch sử không thể tự nhân đôi.
+    messages: Annotated[List[BaseMessage], add_messages]
+    # Cửa sổ ngữ cảnh cho prompt (chỉ số các tin nhắn gần nhất + bản tóm tắt cuộn), router
+    # cập nhật tăng dần mỗi lượt; xem agents/context_window.py
+    context: Optional[dict]
 
     # Trường điều hướng luồng
     next_agent: Optional[str]
@@ -32,7 +40,9 @@ class AgentState(TypedDict):
     original_ticket_price: Optional[str]
     
     # Kết quả tìm kiếm và lựa chọn
-    search_results: Optional[List[dict]]
+    search_results: Optional[List[dict]]  # trang đang hiển thị; số thứ tự khách thấy = vị trí trong list
+    search_pool: Optional[List[dict]]  # toàn bộ chuyến đã lấy về, để lọc/sắp xếp/phân trang không cần tìm lại
+    search_view: Optional[dict]  # {"filters": ..., "sort": ..., "page": ...} của trang đang hiển thị
     confirmed_flight: Optional[dict]
 
     # THÊM TRƯỜNG MỚI ĐỂ LƯU DANH SÁCH HÀNH KHÁCH
@@ -1,26 +1,37 @@
 from langgraph.graph import StateGraph, END
 from langgraph.prebuilt import ToolNode
-#from langgraph.checkpoint.sqlite import SqliteSaver  # THÊM DÒNG NÀY
-from langgraph.checkpoint.memory import InMemorySaver
+from langchain_core.runnables import RunnableLambda
 from .state import AgentState
+from .checkpointing import create_checkpointer
 from ..agents import manager, booking, cancel_booking, general, router
+from ..metrics import timed_node, tool_metrics
 from ..tools import booking_tools
 
 # 1. Tập hợp tất cả các tool
 all_tools = [
     booking_tools.search_flights_tool,
+    booking_tools.fare_calendar_tool,
 ]
+# Callback ghi độ trễ/tỉ lệ lỗi của từng tool cho endpoint /metrics
+for _tool in all_tools:
+    _tool.callbacks = [tool_metrics]
 tool_node = ToolNode(all_tools)
 
 # 2. Xây dựng đồ thị
 workflow = StateGraph(AgentState)
 
 # Thêm tất cả các node
-workflow.add_node("router", router.proxy_router_node)
-workflow.add_node("manager", manager.manager_node)
-workflow.add_node("booking_agent", booking.booking_node)
-workflow.add_node("cancel_booking_agent", cancel_booking.cancel_booking_node)
-workflow.add_node("general_agent", general.general_node)
+# Mỗi node agent có cả bản đồng bộ lẫn bất đồng bộ: `app.invoke` dùng bản đồng bộ,
+# `app.ainvoke`/`app.astream` dùng bản async để không chặn event loop của FastAPI.
+def _node(name, func, afunc):
+    """Node agent có đo thời gian chạy (agent_node_duration_seconds{node=...})."""
+    return RunnableLambda(timed_node(name, func), afunc=timed_node(name, afunc))
+
+workflow.add_node("router", timed_node("router", router.proxy_router_node))
+workflow.add_node("manager", _node("manager", manager.manager_node, manager.amanager_node))
+workflow.add_node("booking_agent", _node("booking_agent", booking.booking_node, booking.abooking_node))
+workflow.add_node("cancel_booking_agent", _node("cancel_booking_agent", cancel_booking.cancel_booking_node, cancel_booking.acancel_booking_node))
+workflow.add_node("general_agent", _node("general_agent", general.general_node, general.ageneral_node))
 workflow.add_node("tools", tool_node)
 
 # 3. Định nghĩa các cạnh (giữ nguyên code cũ của bạn)
@@ -74,14 +85,10 @@ workflow.add_conditional_edges(
 )
 
 # 4. ✅ THÊM CHECKPOINT VÀO ĐÂY
-
-checkpointer = InMemorySaver()
+# Checkpointer trong bộ nhớ có giới hạn (giữ K checkpoint/thread, xóa thread hết hạn).
+# Backend SQLite bền vững được gắn khi ứng dụng khởi động, xem graph/checkpointing.py.
+checkpointer = create_checkpointer()
 app = workflow.compile(checkpointer=checkpointer)
 
-
-
-try:
-    app.get_graph().draw_mermaid_png(output_file_path="D:\\Project\\-n-T-t-Nghi-p-\\img\\workflow_graph.png")
-    print("Đã vẽ sơ đồ workflow ra file: workflow_graph.png")
-except Exception as e:
-    print(f"Không thể vẽ đồ thị: {e}")
\ No newline at end of file
+# Sơ đồ workflow không còn được vẽ lúc import; chạy thủ công khi cần:
+#   python -m src.flight_booking_agent.graph.render img/workflow_graph.png
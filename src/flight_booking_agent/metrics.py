@@ -0,0 +1,221 @@
+# src/flight_booking_agent/metrics.py
+import bisect
+import functools
+import inspect
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Sequence, Tuple
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+# Histogram/counter tối giản xuất ra định dạng văn bản Prometheus (exposition format 0.0.4).
+# Mỗi lần ghi chỉ là một bisect và vài phép cộng dưới lock, nên chi phí không đáng kể so với
+# một lượt hội thoại. METRICS_ENABLED=0 để tắt hẳn việc ghi.
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") != "0"
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768)
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{n}="{_escape_label(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, registry, name: str, documentation: str, labelnames: Sequence[str]):
+        self._registry = registry
+        self.name, self.documentation, self.labelnames = name, documentation, tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels: str, amount: float = 1.0):
+        if not self._registry.enabled:
+            return
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0.0)
+
+    def collect(self) -> list:
+        with self._lock:
+            values = sorted(self._values.items())
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        lines += [f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(v)}" for labels, v in values]
+        return lines
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Histogram:
+    def __init__(self, registry, name: str, documentation: str, labelnames: Sequence[str],
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        self._registry = registry
+        self.name, self.documentation, self.labelnames = name, documentation, tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # nhãn -> [số mẫu theo từng bucket (không cộng dồn, phần tử cuối là +Inf), tổng, số mẫu]
+        self._series: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str):
+        if not self._registry.enabled:
+            return
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, *labels: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def count(self, *labels: str) -> int:
+        series = self._series.get(labels)
+        return series[2] if series else 0
+
+    def collect(self) -> list:
+        with self._lock:
+            snapshot = sorted((labels, (list(s[0]), s[1], s[2])) for labels, s in self._series.items())
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total, count) in snapshot:
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += bucket_count
+                le = 'le="%s"' % (bound if bound == "+Inf" else _format_value(bound))
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {count}")
+        return lines
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+
+class MetricsRegistry:
+    def __init__(self, enabled: bool = METRICS_ENABLED):
+        self.enabled = enabled
+        self._metrics = []
+
+    def counter(self, name, documentation, labelnames=()) -> Counter:
+        metric = Counter(self, name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS) -> Histogram:
+        metric = Histogram(self, name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """Toàn bộ metric theo định dạng văn bản Prometheus."""
+        return "\n".join(line for metric in self._metrics for line in metric.collect()) + "\n"
+
+    def reset(self):
+        for metric in self._metrics:
+            metric.reset()
+
+
+metrics = MetricsRegistry()
+
+NODE_DURATION = metrics.histogram("agent_node_duration_seconds", "Thời gian chạy mỗi node của graph", ["node"])
+NODE_ERRORS = metrics.counter("agent_node_errors_total", "Số lần node ném lỗi", ["node"])
+LLM_DURATION = metrics.histogram("llm_call_duration_seconds", "Độ trễ mỗi lời gọi LLM theo vai trò", ["role", "model"])
+LLM_TOKENS = metrics.histogram("llm_call_tokens", "Số token mỗi lời gọi LLM theo vai trò", ["role", "direction"], TOKEN_BUCKETS)
+LLM_CALLS = metrics.counter("llm_calls_total", "Số lời gọi LLM theo vai trò và kết quả", ["role", "status"])
+LLM_RECOVERIES = metrics.counter(
+    "llm_recoveries_total", "Số lần thử lại, chuyển model dự phòng hoặc hết thời hạn lượt khi gọi LLM", ["role", "action"]
+)
+TOOL_DURATION = metrics.histogram("tool_call_duration_seconds", "Độ trễ mỗi lần chạy tool", ["tool"])
+TOOL_CALLS = metrics.counter("tool_calls_total", "Số lần chạy tool theo kết quả", ["tool", "status"])
+CHECKPOINT_DURATION = metrics.histogram(
+    "checkpoint_operation_duration_seconds", "Thời gian đọc/ghi checkpoint", ["backend", "operation"]
+)
+LLM_QUEUE_WAIT = metrics.histogram("llm_queue_wait_seconds", "Thời gian chờ chỗ gọi LLM theo độ ưu tiên", ["priority"])
+ADMISSION_REJECTED = metrics.counter("admission_rejected_total", "Số lượt/lời gọi bị từ chối vì quá tải", ["reason"])
+
+
+def timed_node(name: str, func):
+    """Bọc hàm node (đồng bộ hoặc async) để ghi thời gian chạy và số lần lỗi theo tên node."""
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(state):
+            started = time.perf_counter()
+            try:
+                return await func(state)
+            except BaseException:
+                NODE_ERRORS.inc(name)
+                raise
+            finally:
+                NODE_DURATION.observe(time.perf_counter() - started, name)
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(state):
+        started = time.perf_counter()
+        try:
+            return func(state)
+        except BaseException:
+            NODE_ERRORS.inc(name)
+            raise
+        finally:
+            NODE_DURATION.observe(time.perf_counter() - started, name)
+    return wrapper
+
+
+def _is_error_output(output) -> bool:
+    # Tool của ứng dụng trả lỗi dưới dạng JSON {"error": ...} thay vì ném ngoại lệ
+    content = getattr(output, "content", output)
+    return isinstance(content, str) and content.lstrip().startswith('{"error"')
+
+
+class ToolMetricsHandler(BaseCallbackHandler):
+    """Callback gắn vào các tool: ghi độ trễ và kết quả (ok/error) của mỗi lần chạy."""
+
+    def __init__(self):
+        self._running = {}
+        self._lock = threading.Lock()
+
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        with self._lock:
+            self._running[run_id] = ((serialized or {}).get("name", "unknown"), time.perf_counter())
+
+    def _finish(self, run_id, status):
+        with self._lock:
+            started = self._running.pop(run_id, None)
+        if started is not None:
+            name, started_at = started
+            TOOL_DURATION.observe(time.perf_counter() - started_at, name)
+            TOOL_CALLS.inc(name, status)
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        self._finish(run_id, "error" if _is_error_output(output) else "ok")
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self._finish(run_id, "error")
+
+
+tool_metrics = ToolMetricsHandler()
@@ -1,14 +1,301 @@
 # src/flight_booking_agent/services/amadeus_client.py
 import os
+import asyncio
+import functools
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from cachetools import TTLCache
+import httpx
 from amadeus import Client, ResponseError
 from dotenv import load_dotenv
 
 load_dotenv()
 
-class AmadeusClient:
+from ..deadlines import current_deadline
+from .amadeus_http import AmadeusHttpError, AmadeusHttpTransport
+
+# Cách gọi Amadeus: "http" (mặc định) dùng transport httpx bất đồng bộ có connection pool,
+# cache token và hedging (xem amadeus_http.py); "sdk" dùng SDK `amadeus` đồng bộ như trước.
+AMADEUS_TRANSPORT = os.getenv("AMADEUS_TRANSPORT", "http").strip().lower()
+
+# Cấu hình cache kết quả tìm kiếm (TTL tính bằng giây, 0 = tắt cache)
+SEARCH_CACHE_TTL = float(os.getenv("AMADEUS_CACHE_TTL", "300"))
+SEARCH_CACHE_MAXSIZE = int(os.getenv("AMADEUS_CACHE_MAXSIZE", "1024"))
+
+# Cấu hình tìm kiếm song song (lịch giá rẻ nhất theo ngày):
+# - AMADEUS_FANOUT_CONCURRENCY: số lời gọi Amadeus chạy đồng thời tối đa
+# - AMADEUS_CALL_TIMEOUT: thời gian chờ tối đa (giây) cho mỗi lời gọi
+# - FARE_CALENDAR_MAX_DAYS: độ dài tối đa của khoảng ngày
+FANOUT_CONCURRENCY = int(os.getenv("AMADEUS_FANOUT_CONCURRENCY", "8"))
+CALL_TIMEOUT = float(os.getenv("AMADEUS_CALL_TIMEOUT", "10"))
+FARE_CALENDAR_MAX_DAYS = int(os.getenv("FARE_CALENDAR_MAX_DAYS", "14"))
+# Số kết quả mỗi lời gọi của lịch giá: trùng với `search_flights_tool` để dùng chung cache,
+# khi người dùng chọn ngày thì lượt tìm kiếm chi tiết là cache hit.
+FARE_CALENDAR_RESULTS = 10
+
+# Thread pool riêng cho các lời gọi song song: lời gọi quá hạn vẫn chạy nốt ở đây (SDK
+# Amadeus không hủy được giữa chừng) mà không chặn việc đóng event loop của người gọi.
+_fanout_executor = ThreadPoolExecutor(max_workers=FANOUT_CONCURRENCY, thread_name_prefix="amadeus-fanout")
+
+
+def flight_search_key(origin, destination, departure_date, adults, non_stop=False, max_results=5) -> tuple:
+    """Chuẩn hóa tham số tìm kiếm thành khóa cache: 'sgn ' và 'SGN' là cùng một truy vấn."""
+    return (
+        str(origin).strip().upper(),
+        str(destination).strip().upper(),
+        str(departure_date).strip(),
+        int(adults or 1),
+        bool(non_stop),
+        int(max_results),
+    )
+
+
+class _EvictionCountingTTLCache(TTLCache):
+    """TTLCache báo lại mỗi lần phải đẩy bớt phần tử ít dùng nhất (LRU) khi đầy."""
+
+    def __init__(self, maxsize, ttl, timer, on_evict):
+        super().__init__(maxsize, ttl, timer=timer)
+        self._on_evict = on_evict
+
+    def popitem(self):
+        item = super().popitem()
+        self._on_evict()
+        return item
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class _InFlight:
+    """
+    Một lời gọi upstream đang chạy; các request trùng khóa chờ trên `done` (thread) hoặc
+    đăng ký vào `callbacks` (coroutine, xem `aget_or_load`). `abandoned` đánh dấu leader bị
+    hủy giữa chừng: không có kết quả để chia sẻ, request đang chờ phải tự tải lại.
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.callbacks = []
+        self.value = None
+        self.error = None
+        self.abandoned = False
+
+
+class FlightSearchCache:
+    """
+    Cache kết quả tìm kiếm chuyến bay: hết hạn theo TTL, giới hạn số phần tử với
+    cơ chế loại bỏ LRU, và gộp request (single-flight): nhiều request trùng khóa
+    cùng lúc chỉ tạo ra một lời gọi upstream duy nhất.
+    Kết quả lỗi (dict có khóa "error") không được cache.
+    """
+
+    def __init__(self, maxsize=SEARCH_CACHE_MAXSIZE, ttl=SEARCH_CACHE_TTL, timer=time.monotonic):
+        self.enabled = maxsize > 0 and ttl > 0
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self._counters = {"hits": 0, "misses": 0, "coalesced": 0, "evictions": 0}
+        self._entries = _EvictionCountingTTLCache(max(maxsize, 1), max(ttl, 1e-9), timer, self._count_eviction)
+
+    def _count_eviction(self):
+        self._counters["evictions"] += 1
+
+    def peek(self, key):
+        """Trả về kết quả đã cache (và tính là một lần hit) hoặc None, không gọi upstream."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._counters["hits"] += 1
+            return value
+
+    def get_or_load(self, key, loader):
+        if not self.enabled:
+            return loader()
+
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._counters["hits"] += 1
+                return value
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = _InFlight()
+                self._counters["misses"] += 1
+            else:
+                self._counters["coalesced"] += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.abandoned:
+                return self.get_or_load(key, loader)
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = loader()
+            if not (isinstance(flight.value, dict) and "error" in flight.value):
+                with self._lock:
+                    self._entries[key] = flight.value
+            return flight.value
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            self._finish(key, flight)
+
+    async def aget_or_load(self, key, loader):
+        """Như `get_or_load` nhưng `loader` là coroutine function; request trùng khóa chờ mà không chiếm thread."""
+        if not self.enabled:
+            return await loader()
+
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._counters["hits"] += 1
+                return value
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = _InFlight()
+                self._counters["misses"] += 1
+            else:
+                self._counters["coalesced"] += 1
+                waiter = loop.create_future()
+                flight.callbacks.append(lambda: loop.call_soon_threadsafe(_resolve, waiter))
+
+        if not leader:
+            await waiter
+            if flight.abandoned:
+                # Lượt của leader bị hủy (hết thời hạn, client ngắt stream): việc hủy đó không
+                # thuộc về request này, nên tải lại (một request chờ trở thành leader mới)
+                return await self.aget_or_load(key, loader)
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = await loader()
+            if not (isinstance(flight.value, dict) and "error" in flight.value):
+                with self._lock:
+                    self._entries[key] = flight.value
+            return flight.value
+        except asyncio.CancelledError:
+            flight.abandoned = True
+            raise
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            self._finish(key, flight)
+
+    def _finish(self, key, flight: _InFlight):
+        with self._lock:
+            self._inflight.pop(key, None)
+            callbacks = list(flight.callbacks)
+        flight.done.set()
+        for callback in callbacks:
+            callback()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._counters, "size": len(self._entries)}
+
+
+_UNSET = object()
+
+
+class _BackgroundLoop:
+    """
+    Event loop chạy trên một daemon thread riêng, để code đồng bộ (graph chạy bằng `invoke`)
+    dùng transport bất đồng bộ mà vẫn giữ được connection pool giữa các lần gọi.
+    Coroutine chạy ở đây không thấy config của graph: thời hạn lượt phải được đọc ở thread
+    người gọi và truyền vào tường minh.
+    """
+
     def __init__(self):
+        self._loop = None
+        self._lock = threading.Lock()
+
+    def run(self, coro):
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name="amadeus-http", daemon=True).start()
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+
+_background_loop = _BackgroundLoop()
+
+
+class AmadeusClient:
+    transport = AMADEUS_TRANSPORT
+    _http = _UNSET
+
+    def __init__(self, transport: str = AMADEUS_TRANSPORT):
+        self.cache = FlightSearchCache()
+        self.transport = transport
+        # SDK client / transport HTTP được tạo ở lần dùng đầu tiên (hoặc khi /readyz?warm=true),
+        # không phải lúc import
+        self._client = _UNSET
+        self._http = _UNSET
+        self._client_lock = threading.Lock()
+
+    @property
+    def client(self):
+        if self._client is _UNSET:
+            with self._client_lock:
+                if self._client is _UNSET:
+                    self._client = self._build_client()
+        return self._client
+
+    @client.setter
+    def client(self, value):
+        self._client = value
+
+    @property
+    def http(self):
+        """Transport HTTP bất đồng bộ (None nếu thiếu thông tin xác thực)."""
+        if self._http is _UNSET:
+            with self._client_lock:
+                if self._http is _UNSET:
+                    self._http = AmadeusHttpTransport.from_env()
+        return self._http
+
+    @http.setter
+    def http(self, value):
+        self._http = value
+
+    @property
+    def backend(self):
+        """Đối tượng thực sự gọi Amadeus theo `transport` đang chọn (None nếu không dựng được)."""
+        return self.http if self.transport == "http" else self.client
+
+    @property
+    def initialized(self) -> bool:
+        return (self._http if self.transport == "http" else self._client) is not _UNSET
+
+    async def aclose(self):
+        """Đóng connection pool HTTP của event loop hiện tại (gọi khi tắt server)."""
+        if self._http not in (_UNSET, None):
+            await self._http.aclose()
+
+    @staticmethod
+    def _build_client():
         try:
-            self.client = Client(
+            return Client(
                 client_id=os.getenv("AMADEUS_CLIENT_ID"),
                 client_secret=os.getenv("AMADEUS_CLIENT_SECRET"),
                 hostname=os.getenv("AMADEUS_HOSTNAME", "test") # Mặc định là môi trường test
@@ -16,13 +303,23 @@ class AmadeusClient:
         except Exception as e:
             print(f"Lỗi: Không thể khởi tạo Amadeus Client. Vui lòng kiểm tra biến môi trường.")
             print(f"Chi tiết lỗi: {e}")
-            self.client = None
+            return None
 
     def search_flights(self, origin, destination, departure_date, adults, non_stop=False, max_results=5):
-        if not self.client:
+        if not self.backend:
             return {"error": "Amadeus Client chưa được khởi tạo."}
 
-        params = {
+        key = flight_search_key(origin, destination, departure_date, adults, non_stop, max_results)
+        if self.transport == "http":
+            # Đọc thời hạn lượt ở thread người gọi: coroutine chạy trên loop nền không thấy config của graph
+            turn_deadline = current_deadline()
+            load = lambda: _background_loop.run(self._search_flights_http(*key, turn_deadline=turn_deadline))
+            return self.cache.get_or_load(key, load)
+        return self.cache.get_or_load(key, lambda: self._search_flights_upstream(*key))
+
+    @staticmethod
+    def _search_params(origin, destination, departure_date, adults, non_stop, max_results) -> dict:
+        return {
             'originLocationCode': origin,
             'destinationLocationCode': destination,
             'departureDate': departure_date,
@@ -31,6 +328,9 @@ class AmadeusClient:
             'max': max_results,
             'currencyCode': 'VND'
         }
+
+    def _search_flights_upstream(self, origin, destination, departure_date, adults, non_stop, max_results):
+        params = self._search_params(origin, destination, departure_date, adults, non_stop, max_results)
         
         print(f"--- Đang tìm kiếm chuyến bay với tham số: {params} ---")
         try:
@@ -40,6 +340,109 @@ class AmadeusClient:
             print(f"Lỗi API Amadeus: {error.response.result}")
             return {"error": "Không tìm thấy chuyến bay hoặc có lỗi xảy ra.", "details": error.response.result}
 
+    async def _search_flights_http(self, origin, destination, departure_date, adults, non_stop, max_results,
+                                   turn_deadline=None):
+        params = self._search_params(origin, destination, departure_date, adults, non_stop, max_results)
+
+        print(f"--- Đang tìm kiếm chuyến bay với tham số: {params} ---")
+        try:
+            return self.format_flight_results(await self.http.search_flight_offers(params, turn_deadline))
+        except AmadeusHttpError as error:
+            print(f"Lỗi API Amadeus: {error.body}")
+            return {"error": "Không tìm thấy chuyến bay hoặc có lỗi xảy ra.", "details": error.body}
+        except (httpx.HTTPError, asyncio.TimeoutError) as error:
+            print(f"Lỗi kết nối Amadeus: {error!r}")
+            return {"error": "Không tìm thấy chuyến bay hoặc có lỗi xảy ra.", "details": repr(error)}
+
+    async def asearch_flights(self, origin, destination, departure_date, adults, non_stop=False, max_results=5,
+                              turn_deadline=None):
+        """
+        Phiên bản bất đồng bộ của `search_flights`.
+        Với transport "http", lời gọi chạy thẳng trên event loop (request trùng khóa được gộp),
+        trong `turn_deadline` (mặc định: thời hạn của lượt đang chạy).
+        SDK Amadeus là đồng bộ nên lời gọi được đẩy sang thread pool để không chặn event loop.
+        Cache hit được trả về ngay trên event loop, không tốn một lượt chuyển thread.
+        """
+        if self.transport == "http":
+            if not self.http:
+                return {"error": "Amadeus Client chưa được khởi tạo."}
+            key = flight_search_key(origin, destination, departure_date, adults, non_stop, max_results)
+            return await self.cache.aget_or_load(key, lambda: self._search_flights_http(*key, turn_deadline=turn_deadline))
+        if self.client:
+            cached = self.cache.peek(flight_search_key(origin, destination, departure_date, adults, non_stop, max_results))
+            if cached is not None:
+                return cached
+        return await asyncio.to_thread(
+            self.search_flights, origin, destination, departure_date, adults,
+            non_stop=non_stop, max_results=max_results
+        )
+
+    async def asearch_fare_calendar(self, origins, destinations, start_date, days, adults,
+                                    concurrency=FANOUT_CONCURRENCY, call_timeout=CALL_TIMEOUT, turn_deadline=None):
+        """
+        Tìm song song mọi tổ hợp (điểm đi, điểm đến, ngày) trong khoảng `days` ngày kể từ
+        `start_date` và gộp thành lịch giá thấp nhất theo ngày.
+
+        Trả về {"calendar": [...], "failed": [...]}: mỗi ngày một phần tử (price = None nếu
+        không có chuyến); lời gọi lỗi hoặc quá `call_timeout` giây được ghi vào "failed"
+        thay vì làm hỏng cả kết quả.
+        """
+        if not self.backend:
+            return {"error": "Amadeus Client chưa được khởi tạo."}
+
+        first_day = date.fromisoformat(str(start_date))
+        dates = [(first_day + timedelta(days=i)).isoformat() for i in range(max(1, min(int(days), FARE_CALENDAR_MAX_DAYS)))]
+        combos = list(itertools.product(dates, dict.fromkeys(origins), dict.fromkeys(destinations)))
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+        loop = asyncio.get_running_loop()
+        turn_deadline = turn_deadline or current_deadline()
+
+        async def one(departure_date, origin, destination):
+            key = flight_search_key(origin, destination, departure_date, adults, False, FARE_CALENDAR_RESULTS)
+            cached = self.cache.peek(key)
+            if cached is not None:
+                return cached
+            async with semaphore:
+                if self.transport == "http":
+                    return await asyncio.wait_for(self.asearch_flights(*key, turn_deadline=turn_deadline), call_timeout)
+                call = functools.partial(self.search_flights, *key)
+                return await asyncio.wait_for(loop.run_in_executor(_fanout_executor, call), call_timeout)
+
+        outcomes = await asyncio.gather(*(one(*combo) for combo in combos), return_exceptions=True)
+
+        cheapest, failed = {}, []
+        for (departure_date, origin, destination), outcome in zip(combos, outcomes):
+            if isinstance(outcome, asyncio.TimeoutError):
+                failed.append({"date": departure_date, "origin": origin, "destination": destination, "reason": "timeout"})
+                continue
+            if isinstance(outcome, BaseException) or isinstance(outcome, dict):
+                failed.append({"date": departure_date, "origin": origin, "destination": destination, "reason": "error"})
+                continue
+            for flight in outcome:
+                best = cheapest.get(departure_date)
+                if best is None or flight["price"] < best["price"]:
+                    cheapest[departure_date] = flight
+
+        calendar = []
+        for departure_date in dates:
+            flight = cheapest.get(departure_date)
+            calendar.append({
+                "date": departure_date,
+                "price": flight["price"] if flight else None,
+                "flight_number": flight["flight_number"] if flight else None,
+                "origin": flight["departure_airport"] if flight else None,
+                "destination": flight["arrival_airport"] if flight else None,
+            })
+        return {"calendar": calendar, "failed": failed}
+
+    def search_fare_calendar(self, origins, destinations, start_date, days, adults, **kwargs):
+        """
+        Phiên bản đồng bộ của `asearch_fare_calendar` (dùng khi graph chạy bằng `invoke`).
+        Chạy trên cùng event loop nền với `search_flights` để dùng chung connection pool và token.
+        """
+        kwargs.setdefault("turn_deadline", current_deadline())
+        return _background_loop.run(self.asearch_fare_calendar(origins, destinations, start_date, days, adults, **kwargs))
+
     def format_flight_results(self, flight_data):
         """Định dạng lại kết quả cho dễ đọc và xử lý."""
         formatted = []
@@ -0,0 +1,216 @@
+# src/flight_booking_agent/services/amadeus_http.py
+import asyncio
+import os
+import time
+from typing import Optional
+
+import httpx
+
+from ..deadlines import Deadline, current_deadline
+
+AMADEUS_HOSTS = {"test": "https://test.api.amadeus.com", "production": "https://api.amadeus.com"}
+
+# Cấu hình transport HTTP bất đồng bộ tới Amadeus:
+# - AMADEUS_BASE_URL: ghi đè địa chỉ API (mặc định theo AMADEUS_HOSTNAME; dùng cho mock server)
+# - AMADEUS_POOL_SIZE: số kết nối keep-alive tối đa dùng chung
+# - AMADEUS_REQUEST_DEADLINE: thời hạn (giây) cho cả một lần tìm kiếm, gồm lấy token và thử lại
+# - AMADEUS_HEDGE_AFTER: sau bấy nhiêu giây chưa có phản hồi thì gửi thêm một request song song
+#   và lấy kết quả về trước (0 = tắt)
+# - AMADEUS_RETRIES: số lần thử lại khi lỗi tạm thời (lỗi mạng, 429, 5xx) nếu còn trong thời hạn
+# - AMADEUS_TOKEN_REFRESH_MARGIN: làm mới access token trước khi hết hạn bấy nhiêu giây
+AMADEUS_BASE_URL = os.getenv("AMADEUS_BASE_URL") or AMADEUS_HOSTS.get(
+    os.getenv("AMADEUS_HOSTNAME", "test"), AMADEUS_HOSTS["test"]
+)
+AMADEUS_POOL_SIZE = int(os.getenv("AMADEUS_POOL_SIZE", "20"))
+AMADEUS_REQUEST_DEADLINE = float(os.getenv("AMADEUS_REQUEST_DEADLINE", "10"))
+AMADEUS_HEDGE_AFTER = float(os.getenv("AMADEUS_HEDGE_AFTER", "0"))
+AMADEUS_RETRIES = int(os.getenv("AMADEUS_RETRIES", "1"))
+AMADEUS_TOKEN_REFRESH_MARGIN = float(os.getenv("AMADEUS_TOKEN_REFRESH_MARGIN", "60"))
+
+TOKEN_PATH = "/v1/security/oauth2/token"
+FLIGHT_OFFERS_PATH = "/v2/shopping/flight-offers"
+
+
+class AmadeusHttpError(Exception):
+    """Phản hồi lỗi từ Amadeus; `retryable` cho lỗi tạm thời (429, 5xx)."""
+
+    def __init__(self, status_code: int, body):
+        super().__init__(f"Amadeus HTTP {status_code}")
+        self.status_code = status_code
+        self.body = body
+        self.retryable = status_code == 429 or status_code >= 500
+
+
+def _json_or_text(response: httpx.Response):
+    try:
+        return response.json()
+    except ValueError:
+        return response.text
+
+
+class _LoopState:
+    """Connection pool và lock làm mới token gắn với một event loop."""
+
+    def __init__(self, client: httpx.AsyncClient):
+        self.client = client
+        self.token_lock = asyncio.Lock()
+        self.refresh_task: Optional[asyncio.Task] = None
+
+
+class AmadeusHttpTransport:
+    """
+    Gọi Amadeus Self-Service API trực tiếp bằng `httpx.AsyncClient`, thay cho SDK đồng bộ:
+    - một connection pool keep-alive dùng chung cho mọi request trên cùng event loop;
+    - access token OAuth được cache và làm mới ngầm trước khi hết hạn, và chỉ một request
+      lấy token tại một thời điểm;
+    - mỗi lần gọi có thời hạn tổng (`deadline`). Lỗi tạm thời được thử lại khi còn thời gian;
+    - tùy chọn hedging: request chậm hơn `hedge_after` giây thì gửi thêm một bản song song.
+    Trả về dữ liệu thô của Amadeus (`data`); định dạng do `AmadeusClient` đảm nhiệm.
+    """
+
+    def __init__(self, client_id: str, client_secret: str, base_url: str = AMADEUS_BASE_URL, *,
+                 pool_size: int = AMADEUS_POOL_SIZE, deadline: float = AMADEUS_REQUEST_DEADLINE,
+                 hedge_after: float = AMADEUS_HEDGE_AFTER, retries: int = AMADEUS_RETRIES,
+                 refresh_margin: float = AMADEUS_TOKEN_REFRESH_MARGIN, timer=time.monotonic):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.base_url = base_url.rstrip("/")
+        self.pool_size = max(pool_size, 1)
+        self.deadline = deadline
+        self.hedge_after = hedge_after
+        self.retries = max(retries, 0)
+        self.refresh_margin = refresh_margin
+        self._timer = timer
+        self._token: Optional[str] = None
+        self._token_expires_at = 0.0
+        self._states = {}  # event loop -> _LoopState
+        self.counters = {"requests": 0, "token_requests": 0, "hedged": 0, "retried": 0}
+
+    @classmethod
+    def from_env(cls, **kwargs) -> Optional["AmadeusHttpTransport"]:
+        client_id, client_secret = os.getenv("AMADEUS_CLIENT_ID"), os.getenv("AMADEUS_CLIENT_SECRET")
+        if not client_id or not client_secret:
+            print("Lỗi: Thiếu AMADEUS_CLIENT_ID/AMADEUS_CLIENT_SECRET, không thể khởi tạo transport Amadeus.")
+            return None
+        return cls(client_id, client_secret, **kwargs)
+
+    def _state(self) -> _LoopState:
+        # httpx.AsyncClient gắn với event loop tạo ra nó: mỗi loop (FastAPI, asyncio.run của
+        # đường đồng bộ) có pool riêng
+        loop = asyncio.get_running_loop()
+        state = self._states.get(loop)
+        if state is None:
+            for stale in [l for l in self._states if l.is_closed()]:
+                del self._states[stale]
+            limits = httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size,
+                                  keepalive_expiry=30)
+            state = self._states[loop] = _LoopState(httpx.AsyncClient(
+                base_url=self.base_url, limits=limits, timeout=httpx.Timeout(self.deadline)
+            ))
+        return state
+
+    async def aclose(self):
+        """Đóng connection pool của event loop hiện tại (gọi khi tắt ứng dụng)."""
+        state = self._states.pop(asyncio.get_running_loop(), None)
+        if state is not None:
+            if state.refresh_task is not None:
+                state.refresh_task.cancel()
+            await state.client.aclose()
+
+    def _token_fresh(self) -> bool:
+        return self._token is not None and self._timer() < self._token_expires_at - self.refresh_margin
+
+    async def _refresh_token(self, state: _LoopState) -> str:
+        async with state.token_lock:
+            if self._token_fresh():
+                return self._token
+            self.counters["token_requests"] += 1
+            response = await state.client.post(TOKEN_PATH, data={
+                "grant_type": "client_credentials", "client_id": self.client_id, "client_secret": self.client_secret,
+            })
+            if response.status_code != 200:
+                raise AmadeusHttpError(response.status_code, _json_or_text(response))
+            payload = response.json()
+            self._token = payload["access_token"]
+            self._token_expires_at = self._timer() + float(payload.get("expires_in", 1799))
+            return self._token
+
+    async def _access_token(self, state: _LoopState) -> str:
+        if self._token_fresh():
+            return self._token
+        if self._token is not None and self._timer() < self._token_expires_at:
+            # Sắp hết hạn: vẫn dùng token hiện tại, làm mới ở nền
+            if state.refresh_task is None or state.refresh_task.done():
+                state.refresh_task = asyncio.ensure_future(self._refresh_token(state))
+                state.refresh_task.add_done_callback(lambda task: self._refresh_done(state, task))
+            return self._token
+        return await self._refresh_token(state)
+
+    @staticmethod
+    def _refresh_done(state: _LoopState, task: asyncio.Task):
+        # Không ai await task làm mới ở nền: đọc lỗi ở đây để ghi log và để lần sau thử lại
+        if state.refresh_task is task:
+            state.refresh_task = None
+        if not task.cancelled() and task.exception() is not None:
+            print(f"Lỗi làm mới token Amadeus ở nền: {task.exception()!r}")
+
+    async def _get_once(self, state: _LoopState, path: str, params: dict):
+        self.counters["requests"] += 1
+        token = await self._access_token(state)
+        response = await state.client.get(path, params=params, headers={"Authorization": f"Bearer {token}"})
+        if response.status_code == 401:
+            # Token bị thu hồi trước hạn: lấy token mới rồi gửi lại một lần
+            self._token = None
+            token = await self._refresh_token(state)
+            response = await state.client.get(path, params=params, headers={"Authorization": f"Bearer {token}"})
+        if response.status_code != 200:
+            raise AmadeusHttpError(response.status_code, _json_or_text(response))
+        return response.json()
+
+    async def _get_hedged(self, state: _LoopState, path: str, params: dict):
+        first = asyncio.ensure_future(self._get_once(state, path, params))
+        if not self.hedge_after:
+            return await first
+        pending = {first}
+        try:
+            done, pending = await asyncio.wait(pending, timeout=self.hedge_after)
+            if not done:
+                self.counters["hedged"] += 1
+                pending.add(asyncio.ensure_future(self._get_once(state, path, params)))
+            error = None
+            while done or pending:
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+                if not pending:
+                    break
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def get(self, path: str, params: dict, turn_deadline: Optional[Deadline] = None):
+        """
+        GET có thời hạn tổng (không vượt thời hạn của lượt chat), thử lại lỗi tạm thời và hedging
+        (nếu bật). `turn_deadline` mặc định đọc từ config của graph; người gọi chạy coroutine trên
+        event loop khác (không thấy config đó) phải truyền vào.
+        """
+        state = self._state()
+        turn = turn_deadline or current_deadline()
+        deadline = self._timer() + (self.deadline if turn is None else min(self.deadline, turn.remaining()))
+        attempt = 0
+        while True:
+            remaining = deadline - self._timer()
+            try:
+                return await asyncio.wait_for(self._get_hedged(state, path, params), max(remaining, 0))
+            except (httpx.TransportError, AmadeusHttpError) as e:
+                retryable = not isinstance(e, AmadeusHttpError) or e.retryable
+                if not retryable or attempt >= self.retries or deadline - self._timer() <= 0:
+                    raise
+                attempt += 1
+                self.counters["retried"] += 1
+
+    async def search_flight_offers(self, params: dict, turn_deadline: Optional[Deadline] = None) -> list:
+        return (await self.get(FLIGHT_OFFERS_PATH, params, turn_deadline)).get("data", [])
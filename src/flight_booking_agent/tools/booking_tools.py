@@ -1,11 +1,14 @@
 # src/flight_booking_agent/tools/flight_tools.py
 import json
-from langchain_core.tools import tool
+import re
+from datetime import date, datetime
+from langchain_core.tools import StructuredTool
 from pydantic import BaseModel, Field
-from typing import Optional
+from typing import List, Optional
 
 # Import a-ma-de-us client đã được khởi tạo sẵn
 from ..services.amadeus_client import amadeus_client
+from ..config import FLIGHT_RESULTS_TOP_N
 
 class FlightSearchInput(BaseModel):
     """Cấu trúc dữ liệu đầu vào cho công cụ tìm kiếm chuyến bay."""
@@ -14,8 +17,166 @@ class FlightSearchInput(BaseModel):
     departure_date: str = Field(description="Ngày đi theo định dạng YYYY-MM-DD.")
     adults: Optional[int] = Field(description="Số lượng hành khách người lớn.")
 
-@tool("flight-search-tool", args_schema=FlightSearchInput)
-def search_flights_tool(origin: str, destination: str, departure_date: str, adults: int) -> str:
+class FareCalendarInput(BaseModel):
+    """Đầu vào cho công cụ tìm ngày bay rẻ nhất trong một khoảng ngày."""
+    origins: List[str] = Field(description="Các mã IATA điểm đi (có thể gồm sân bay lân cận). Ví dụ: ['HAN', 'HPH']")
+    destinations: List[str] = Field(description="Các mã IATA điểm đến. Ví dụ: ['SGN']")
+    start_date: str = Field(description="Ngày đầu tiên của khoảng tìm kiếm, định dạng YYYY-MM-DD.")
+    days: int = Field(7, description="Số ngày cần tìm kể từ start_date.")
+    adults: int = Field(1, description="Số lượng hành khách người lớn.")
+
+def select_top_flights(flights: List[dict], top_n: int = FLIGHT_RESULTS_TOP_N) -> List[dict]:
+    """
+    Giữ `top_n` chuyến rẻ nhất theo thứ tự cố định (giá, giờ đi, số hiệu). Vị trí trong
+    danh sách này chính là số thứ tự hiển thị cho người dùng (bắt đầu từ 1).
+    """
+    ordered = sorted(flights, key=lambda f: (f["price"], f["departure_time"], f["flight_number"]))
+    return ordered[:top_n] if top_n > 0 else ordered
+
+def _short_duration(duration: str) -> str:
+    # "PT2H10M" -> "2h10m"
+    return re.sub(r"^PT", "", duration or "").lower()
+
+def format_flights_compact(flights) -> str:
+    """
+    Bảng chuyến bay gọn để đưa vào prompt thay cho JSON `indent=2`: mỗi chuyến một dòng,
+    cột phân cách bằng "|", giờ HH:MM (ngày đi ghi một lần ở đầu nếu tất cả cùng ngày,
+    "+1" khi hạ cánh sang ngày hôm sau).
+    """
+    if not flights:
+        return "(không có chuyến bay)"
+    try:
+        return _flight_table(flights)
+    except (KeyError, TypeError, ValueError, AttributeError):
+        # Dữ liệu không đúng cấu trúc của `format_flight_results`: giữ nguyên dạng JSON gọn
+        return json.dumps(flights, ensure_ascii=False, separators=(",", ":"))
+
+def _flight_table(flights: List[dict]) -> str:
+    dates = {f["departure_time"][:10] for f in flights}
+    single_date = len(dates) == 1
+    currency = flights[0].get("currency", "VND")
+    lines = [f"ngay:{dates.pop()}"] if single_date else []
+    lines.append(f"#|chuyen|tu|den|di|den_luc|bay|dung|gia_{currency}")
+    for index, f in enumerate(flights, start=1):
+        departure = f["departure_time"][11:16] if single_date else f"{f['departure_time'][5:10]} {f['departure_time'][11:16]}"
+        arrival = f["arrival_time"][11:16]
+        if f["arrival_time"][:10] != f["departure_time"][:10]:
+            arrival += "+1"
+        lines.append(
+            f"{index}|{f['flight_number']}|{f['departure_airport']}|{f['arrival_airport']}|{departure}|{arrival}"
+            f"|{_short_duration(f.get('duration'))}|{f.get('stops', 0)}|{f['price']:.0f}"
+        )
+    return "\n".join(lines)
+
+def format_vnd(amount) -> str:
+    """1500000 -> "1.500.000 VND" (dấu chấm phân tách hàng nghìn theo cách viết Việt Nam)."""
+    return f"{float(amount):,.0f}".replace(",", ".") + " VND"
+
+def format_duration_vi(duration: str) -> str:
+    """"PT2H10M" -> "2 giờ 10 phút"."""
+    match = re.fullmatch(r"PT(?:(\d+)H)?(?:(\d+)M)?", duration or "")
+    if not match or not any(match.groups()):
+        return duration or ""
+    hours, minutes = (int(x) if x else 0 for x in match.groups())
+    parts = ([f"{hours} giờ"] if hours else []) + ([f"{minutes} phút"] if minutes else [])
+    return " ".join(parts)
+
+def render_flight_summary(flights: List[dict], header: Optional[str] = None, more: int = 0) -> str:
+    """
+    Tóm tắt kết quả tìm kiếm cho người dùng bằng template (không cần LLM): danh sách
+    đánh số từ 1 theo đúng thứ tự của `search_results`, giờ HH:MM, thời gian bay và giá VND.
+    `header` thay dòng mở đầu (vd. khi đang lọc/sắp xếp), `more` là số chuyến chưa hiển thị.
+    """
+    if not flights:
+        return ("Dạ em xin lỗi, em không tìm thấy chuyến bay nào phù hợp. "
+                "Anh/chị có muốn thử ngày khác hoặc chặng bay khác không ạ?")
+
+    first = flights[0]
+    departure_date = datetime.fromisoformat(first["departure_time"]).strftime("%d/%m/%Y")
+    lines = [header or f"Dạ, em tìm được {len(flights)} chuyến bay từ {first['departure_airport']} đến {first['arrival_airport']} ngày {departure_date}:"]
+    for index, f in enumerate(flights, start=1):
+        departure = datetime.fromisoformat(f["departure_time"])
+        arrival = datetime.fromisoformat(f["arrival_time"])
+        days = (arrival.date() - departure.date()).days
+        arrival_text = arrival.strftime("%H:%M") + (f" (+{days} ngày)" if days > 0 else "")
+        if departure.date() != datetime.fromisoformat(first["departure_time"]).date():
+            departure_text = departure.strftime("%H:%M %d/%m")
+        else:
+            departure_text = departure.strftime("%H:%M")
+        stops = "bay thẳng" if not f.get("stops") else f"{f['stops']} điểm dừng"
+        lines.append(
+            f"{index}. **{f['flight_number']}**: cất cánh {departure_text}, hạ cánh {arrival_text} "
+            f"({format_duration_vi(f.get('duration'))}, {stops}) - **{format_vnd(f['price'])}**"
+        )
+    if more > 0:
+        lines.append(f"(Còn {more} chuyến khác, anh/chị nhắn `xem thêm` để xem tiếp ạ.)")
+    lines.append("Anh/chị muốn chọn chuyến bay số mấy ạ?")
+    return "\n".join(lines)
+
+_WEEKDAYS_VI = ["T2", "T3", "T4", "T5", "T6", "T7", "CN"]
+
+def render_fare_calendar(calendar: dict) -> str:
+    """Lịch giá thấp nhất theo ngày (đầu ra gọn của `fare-calendar-tool`) cho người dùng."""
+    days = calendar.get("lich") if isinstance(calendar, dict) else None
+    priced = [d for d in days or [] if d.get("p") is not None]
+    if not priced:
+        return ("Dạ em xin lỗi, em chưa tìm được giá vé nào trong khoảng ngày này. "
+                "Anh/chị có muốn thử khoảng ngày khác không ạ?")
+
+    cheapest = min(priced, key=lambda d: (d["p"], d["d"]))
+    lines = ["Dạ, giá vé thấp nhất theo từng ngày ạ:"]
+    for day in days:
+        when = date.fromisoformat(day["d"])
+        label = f"{_WEEKDAYS_VI[when.weekday()]} {when.strftime('%d/%m')}"
+        if day.get("p") is not None:
+            marker = " ← rẻ nhất" if day is cheapest else ""
+            lines.append(f"- {label}: **{format_vnd(day['p'])}** ({day['f']}, {day['r']}){marker}")
+        elif day.get("loi"):
+            lines.append(f"- {label}: chưa lấy được giá")
+        else:
+            lines.append(f"- {label}: không có chuyến")
+    lines.append("Anh/chị muốn bay ngày nào để em tìm chi tiết các chuyến bay ạ?")
+    return "\n".join(lines)
+
+def _to_calendar_output(result) -> str:
+    if not result or "error" in result:
+        return json.dumps({"error": "Xin lỗi, tôi không tìm được lịch giá vé hoặc đã có lỗi xảy ra."})
+
+    # Khóa ngắn: d = ngày, p = giá thấp nhất, f = số hiệu, r = chặng, loi = lý do không lấy được giá
+    failed = {f["date"]: f["reason"] for f in result["failed"]}
+    days = []
+    for day in result["calendar"]:
+        if day["price"] is not None:
+            days.append({"d": day["date"], "p": day["price"], "f": day["flight_number"], "r": f"{day['origin']}-{day['destination']}"})
+        elif day["date"] in failed:
+            days.append({"d": day["date"], "loi": failed[day["date"]]})
+        else:
+            days.append({"d": day["date"]})
+    return json.dumps({"lich": days}, ensure_ascii=False, separators=(",", ":"))
+
+def search_fare_calendar(origins: List[str], destinations: List[str], start_date: str, days: int = 7, adults: int = 1) -> str:
+    """
+    Sử dụng công cụ này khi người dùng linh hoạt ngày bay và muốn biết ngày nào rẻ nhất.
+    Các ngày (và các sân bay) được tìm song song, trả về giá thấp nhất của từng ngày.
+    """
+    print(f"--- TOOL: Lịch giá {origins} -> {destinations} từ {start_date} trong {days} ngày ---")
+    return _to_calendar_output(amadeus_client.search_fare_calendar(origins, destinations, start_date, days, adults))
+
+async def asearch_fare_calendar(origins: List[str], destinations: List[str], start_date: str, days: int = 7, adults: int = 1) -> str:
+    """Phiên bản bất đồng bộ của `search_fare_calendar`."""
+    print(f"--- TOOL (async): Lịch giá {origins} -> {destinations} từ {start_date} trong {days} ngày ---")
+    return _to_calendar_output(await amadeus_client.asearch_fare_calendar(origins, destinations, start_date, days, adults))
+
+def _to_tool_output(search_results) -> str:
+    # Tool của LangChain nên trả về một chuỗi (string), vì vậy ta chuyển kết quả thành chuỗi JSON
+    if not search_results or "error" in search_results:
+        return json.dumps({"error": "Xin lỗi, tôi không tìm thấy chuyến bay nào phù hợp hoặc đã có lỗi xảy ra."})
+
+    # JSON gọn (không thụt lề), đủ mọi chuyến theo thứ tự cố định: booking node lưu cả danh sách
+    # (`search_pool`) để lọc/sắp xếp tại chỗ và chỉ hiển thị top-N (`search_results`)
+    return json.dumps(select_top_flights(search_results, top_n=0), ensure_ascii=False, separators=(",", ":"))
+
+def search_flights(origin: str, destination: str, departure_date: str, adults: int) -> str:
     """
     Sử dụng công cụ này để tìm kiếm các chuyến bay.
     Công cụ sẽ gọi đến Amadeus API với các tham số được cung cấp.
@@ -28,13 +189,33 @@ def search_flights_tool(origin: str, destination: str, departure_date: str, adul
         destination=destination,
         departure_date=departure_date,
         adults=adults,
-        max_results=10 # Giới hạn 5 kết quả cho ngắn gọn
+        max_results=10 # Lấy 10 kết quả, hiển thị top-N rẻ nhất, phần còn lại để lọc/xem thêm
     )
-    
-    # Tool của LangChain nên trả về một chuỗi (string), vì vậy ta chuyển kết quả thành chuỗi JSON
-    if not search_results or "error" in search_results:
-        return json.dumps({"error": "Xin lỗi, tôi không tìm thấy chuyến bay nào phù hợp hoặc đã có lỗi xảy ra."})
-        
-    return json.dumps(search_results, ensure_ascii=False, indent=2)
+    return _to_tool_output(search_results)
+
+async def asearch_flights(origin: str, destination: str, departure_date: str, adults: int) -> str:
+    """Phiên bản bất đồng bộ của `search_flights`, được ToolNode dùng khi graph chạy bằng `ainvoke`."""
+    print(f"--- TOOL (async): Bắt đầu tìm kiếm chuyến bay từ {origin} đến {destination} vào ngày {departure_date} cho {adults} người lớn ---")
+
+    search_results = await amadeus_client.asearch_flights(
+        origin=origin,
+        destination=destination,
+        departure_date=departure_date,
+        adults=adults,
+        max_results=10
+    )
+    return _to_tool_output(search_results)
 
+search_flights_tool = StructuredTool.from_function(
+    func=search_flights,
+    coroutine=asearch_flights,
+    name="flight-search-tool",
+    args_schema=FlightSearchInput,
+)
 
+fare_calendar_tool = StructuredTool.from_function(
+    func=search_fare_calendar,
+    coroutine=asearch_fare_calendar,
+    name="fare-calendar-tool",
+    args_schema=FareCalendarInput,
+)
@@ -0,0 +1,113 @@
+# src/flight_booking_agent/tools/flight_query.py
+import math
+import re
+from typing import List, NamedTuple, Optional
+
+import numpy as np
+
+from ..config import FLIGHT_RESULTS_TOP_N
+
+# Khóa sắp xếp của một view; tiền tố "-" là giảm dần ("-departure": bay muộn nhất trước)
+SORT_KEYS = ("price", "departure", "duration")
+DEFAULT_SORT = "price"
+# Thời gian bay không đọc được: xếp cuối và không qua bộ lọc thời gian bay
+_UNKNOWN_DURATION = 10 ** 6
+
+
+def duration_minutes(duration) -> int:
+    """"PT2H10M" -> 130."""
+    match = re.fullmatch(r"PT(?:(\d+)H)?(?:(\d+)M)?", duration or "")
+    if not match or not any(match.groups()):
+        return _UNKNOWN_DURATION
+    hours, minutes = (int(x) if x else 0 for x in match.groups())
+    return hours * 60 + minutes
+
+
+class FlightPage(NamedTuple):
+    """Một trang của view: các chuyến hiển thị (đánh số lại từ 1), số chuyến khớp và vị trí trang."""
+    flights: List[dict]
+    total: int
+    page: int
+    pages: int
+
+
+class FlightTable:
+    """
+    Bản sao dạng cột (mảng numpy) của kết quả `format_flight_results`, để lọc (giá, khung giờ
+    cất cánh, số điểm dừng, hãng, thời gian bay), sắp xếp và phân trang ngay trong state mà
+    không phải tìm lại trên Amadeus hay gửi danh sách cho LLM. Mọi phép lọc là phép toán trên
+    cả cột; sắp xếp ổn định với thứ tự phụ cố định (giá, giờ đi, số hiệu) như `select_top_flights`.
+    """
+
+    def __init__(self, flights: List[dict]):
+        self.flights = list(flights)
+        departure = np.array([f["departure_time"][:16] for f in self.flights], dtype="datetime64[m]")
+        self.departure = departure.astype(np.int64)
+        self.departure_minute = (departure - departure.astype("datetime64[D]")).astype(np.int64)
+        self.price = np.array([float(f["price"]) for f in self.flights], dtype=np.float64)
+        self.duration = np.array([duration_minutes(f.get("duration")) for f in self.flights], dtype=np.int64)
+        self.stops = np.array([int(f.get("stops") or 0) for f in self.flights], dtype=np.int64)
+        self.carrier = np.array([str(f.get("airline", "")).upper() for f in self.flights], dtype=str)
+        self.flight_number = np.array([str(f["flight_number"]).upper() for f in self.flights], dtype=str)
+
+    def __len__(self) -> int:
+        return len(self.flights)
+
+    def mask(self, filters: dict) -> np.ndarray:
+        """
+        Mảng bool các chuyến thỏa mọi bộ lọc. Khóa hỗ trợ: min_price, max_price, time_window
+        ([bắt đầu, kết thúc) tính bằng phút trong ngày; bắt đầu > kết thúc là khung qua nửa đêm),
+        max_stops, carriers, exclude_carriers, max_duration (phút).
+        """
+        keep = np.ones(len(self), dtype=bool)
+        if filters.get("min_price") is not None:
+            keep &= self.price >= filters["min_price"]
+        if filters.get("max_price") is not None:
+            keep &= self.price <= filters["max_price"]
+        if filters.get("time_window"):
+            start, end = filters["time_window"]
+            minute = self.departure_minute
+            keep &= ((minute >= start) & (minute < end)) if start < end else ((minute >= start) | (minute < end))
+        if filters.get("max_stops") is not None:
+            keep &= self.stops <= filters["max_stops"]
+        if filters.get("carriers"):
+            keep &= np.isin(self.carrier, list(filters["carriers"]))
+        if filters.get("exclude_carriers"):
+            keep &= ~np.isin(self.carrier, list(filters["exclude_carriers"]))
+        if filters.get("max_duration") is not None:
+            keep &= self.duration <= filters["max_duration"]
+        return keep
+
+    def order(self, sort: str = DEFAULT_SORT) -> np.ndarray:
+        """Chỉ số các chuyến theo khóa `sort`, hòa thì theo (giá, giờ đi, số hiệu)."""
+        key = sort.lstrip("-")
+        if key not in SORT_KEYS:
+            raise ValueError(f"Khóa sắp xếp không hợp lệ: {sort}")
+        primary = {"price": self.price, "departure": self.departure, "duration": self.duration}[key]
+        if sort.startswith("-"):
+            primary = -primary
+        # np.lexsort sắp theo khóa cuối cùng trước
+        return np.lexsort((self.flight_number, self.departure, self.price, primary))
+
+    def select(self, filters: Optional[dict] = None, sort: str = DEFAULT_SORT) -> np.ndarray:
+        order = self.order(sort)
+        return order[self.mask(filters or {})[order]]
+
+    def page(self, filters: Optional[dict] = None, sort: str = DEFAULT_SORT, page: int = 0,
+             page_size: int = FLIGHT_RESULTS_TOP_N) -> FlightPage:
+        selected = self.select(filters, sort)
+        page_size = max(page_size, 1)
+        pages = max(1, math.ceil(len(selected) / page_size))
+        page = min(max(page, 0), pages - 1)
+        chosen = selected[page * page_size:(page + 1) * page_size]
+        return FlightPage([self.flights[i] for i in chosen], len(selected), page, pages)
+
+    def best(self, filters: Optional[dict] = None, sort: str = DEFAULT_SORT) -> Optional[dict]:
+        """Chuyến đứng đầu view (vd. rẻ nhất trong các chuyến buổi sáng), None nếu không chuyến nào khớp."""
+        selected = self.select(filters, sort)
+        return self.flights[selected[0]] if len(selected) else None
+
+    def find(self, flight_number: str) -> Optional[dict]:
+        """Chuyến có số hiệu `flight_number` ("vn 213" khớp "VN213"), None nếu không có hoặc trùng nhiều chuyến."""
+        matches = np.flatnonzero(self.flight_number == re.sub(r"\s+", "", flight_number).upper())
+        return self.flights[matches[0]] if len(matches) == 1 else None
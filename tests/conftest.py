@@ -0,0 +1,389 @@
+"""
+Các đối tượng giả lập dùng chung cho bộ test: chat model giả (hỗ trợ structured
+output và tool call, có độ trễ cấu hình được) và backend Amadeus giả.
+Toàn bộ test chạy offline, không gọi Vertex AI hay Amadeus thật.
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+from types import SimpleNamespace
+from typing import Any, Callable, List, Optional
+
+import pytest
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.utils.function_calling import convert_to_openai_tool
+from pydantic import Field
+
+# Các so sánh wall-clock (độ trễ, throughput, p50/p99 giữa hai phương án) phụ thuộc tải
+# của máy chạy test nên chỉ được kiểm tra khi bật RUN_TIMING_ASSERTS=1; mặc định các
+# benchmark vẫn chạy và in số liệu nhưng chỉ assert số lời gọi, thứ tự và kích thước.
+TIMING_ASSERTS = os.getenv("RUN_TIMING_ASSERTS", "").lower() in ("1", "true", "yes")
+
+
+def tool_call_message(name: str, args: dict) -> AIMessage:
+    """Tạo AIMessage chứa một tool call (structured output cũng đi qua đường này)."""
+    return AIMessage(content="", tool_calls=[{"name": name, "args": args, "id": f"call_{uuid.uuid4().hex[:8]}"}])
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Chat model giả lập cho test/benchmark.
+
+    `responder(messages, tool_names)` quyết định câu trả lời; `tool_names` là tên các
+    tool/schema đang được bind (ví dụ `["ManagerHandoff"]` khi gọi `with_structured_output`).
+    Khi được stream, `latency` là thời gian tới token đầu tiên và `token_latency`
+    là khoảng cách giữa các token tiếp theo.
+    """
+    responder: Callable[[List[BaseMessage], List[str]], AIMessage]
+    latency: float = 0.0
+    token_latency: float = 0.0
+    calls: list = Field(default_factory=list)
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def bind_tools(self, tools, *, tool_choice: Optional[str] = None, **kwargs: Any):
+        formatted = [convert_to_openai_tool(t) for t in tools]
+        return self.bind(tools=formatted, tool_choice=tool_choice, **kwargs)
+
+    def _reply(self, messages: List[BaseMessage], tools: Optional[list]) -> AIMessage:
+        names = [t["function"]["name"] for t in tools or []]
+        self.calls.append(names)
+        return self.responder(messages, names)
+
+    def _respond(self, messages: List[BaseMessage], tools: Optional[list]) -> ChatResult:
+        return ChatResult(generations=[ChatGeneration(message=self._reply(messages, tools))])
+
+    def _chunks(self, message: AIMessage) -> List[AIMessageChunk]:
+        if message.tool_calls:
+            return [AIMessageChunk(content="", tool_call_chunks=[
+                {"name": c["name"], "args": json.dumps(c["args"]), "id": c["id"], "index": i}
+                for i, c in enumerate(message.tool_calls)
+            ])]
+        words = message.content.split(" ")
+        return [AIMessageChunk(content=w if i == 0 else " " + w) for i, w in enumerate(words)]
+
+    def _generate(self, messages, stop=None, run_manager=None, tools=None, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        return self._respond(messages, tools)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, tools=None, **kwargs):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self._respond(messages, tools)
+
+    async def _astream(self, messages, stop=None, run_manager=None, tools=None, **kwargs):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        for i, chunk in enumerate(self._chunks(self._reply(messages, tools))):
+            if i and self.token_latency:
+                await asyncio.sleep(self.token_latency)
+            yield ChatGenerationChunk(message=chunk)
+
+
+def booking_responder(messages: List[BaseMessage], tool_names: List[str]) -> AIMessage:
+    """Kịch bản mặc định: mọi yêu cầu là tìm chuyến SGN → HAN ngày mai cho 1 người."""
+    if "ManagerHandoff" in tool_names:
+        return tool_call_message("ManagerHandoff", {"target_agent_name": "booking_agent"})
+    if "FlightInfoExtractor" in tool_names:
+        return tool_call_message("FlightInfoExtractor", {
+            "departure_city": "SGN", "destination_city": "HAN",
+            "departure_date": "ngày mai", "passenger_count": 1,
+        })
+    if "FlightChoice" in tool_names:
+        return tool_call_message("FlightChoice", {"choice_index": 1, "is_confirmed": True})
+    if "PassengerInfoExtractor" in tool_names:
+        return tool_call_message("PassengerInfoExtractor", {
+            "passengers": [{"full_name": "Nguyen Van A", "date_of_birth": "25/12/1990", "phone_number": "0987654321"}],
+        })
+    return AIMessage(content="Dạ, em đã ghi nhận. Anh/chị muốn chọn chuyến bay nào ạ?")
+
+
+def make_offers(origin: str, destination: str, departure_date: str, count: int = 10, base_price: int = 1500000) -> list:
+    """Sinh dữ liệu flight-offer giống cấu trúc của Amadeus `flight_offers_search`."""
+    offers = []
+    base = datetime.strptime(departure_date, "%Y-%m-%d").replace(hour=6)
+    for i in range(count):
+        dep = base + timedelta(minutes=75 * i)
+        arr = dep + timedelta(hours=2, minutes=10)
+        segments = [{
+            "carrierCode": "VN" if i % 2 == 0 else "VJ",
+            "number": str(200 + i),
+            "departure": {"iataCode": origin, "at": dep.strftime("%Y-%m-%dT%H:%M:%S")},
+            "arrival": {"iataCode": destination, "at": arr.strftime("%Y-%m-%dT%H:%M:%S")},
+        }]
+        offers.append({
+            "itineraries": [{"duration": "PT2H10M", "segments": segments}],
+            "price": {"total": f"{base_price + 85000 * i:.2f}", "currency": "VND"},
+        })
+    return offers
+
+
+class StubAmadeusBackend:
+    """
+    Thay thế `amadeus.Client`: trả về offer giả sau một độ trễ cố định.
+    `fare(origin, departure_date)` cho giá cơ sở theo chặng/ngày; các ngày trong
+    `fail_dates` ném lỗi, các ngày trong `slow_dates` trễ `slow_latency` giây.
+    """
+
+    def __init__(self, latency: float = 0.0, offers: int = 10, fare: Optional[Callable[[str, str], int]] = None,
+                 fail_dates=(), slow_dates=(), slow_latency: float = 1.0):
+        self.latency = latency
+        self.offers = offers
+        self.fare = fare or (lambda origin, departure_date: 1500000)
+        self.fail_dates = set(fail_dates)
+        self.slow_dates = set(slow_dates)
+        self.slow_latency = slow_latency
+        self.calls = 0
+        self._lock = threading.Lock()
+        self.shopping = SimpleNamespace(flight_offers_search=SimpleNamespace(get=self._get))
+
+    def _get(self, **params):
+        with self._lock:
+            self.calls += 1
+        departure_date = params["departureDate"]
+        latency = self.slow_latency if departure_date in self.slow_dates else self.latency
+        if latency:
+            time.sleep(latency)
+        if departure_date in self.fail_dates:
+            raise ConnectionError(f"upstream error for {departure_date}")
+        return SimpleNamespace(data=make_offers(
+            params["originLocationCode"], params["destinationLocationCode"], departure_date,
+            min(self.offers, int(params.get("max", self.offers))),
+            base_price=self.fare(params["originLocationCode"], departure_date),
+        ))
+
+
+class _LocalHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256  # benchmark mở nhiều kết nối cùng lúc; mặc định 5 sẽ bị reset
+
+
+class MockAmadeusServer:
+    """
+    Server HTTP/1.1 cục bộ giả lập hai endpoint Amadeus mà ứng dụng dùng (cấp token OAuth
+    và flight-offers), để chạy cả SDK lẫn transport httpx qua mạng thật mà không ra internet.
+    Mỗi truy vấn khác nhau thứ `slow_every` (lần gửi đầu tiên) trả chậm `slow_latency` giây,
+    giả lập đuôi độ trễ của upstream; gửi lại cùng truy vấn thì nhanh như thường.
+    `fail_tokens` lần cấp token tiếp theo trả lỗi 500.
+    """
+
+    def __init__(self, latency: float = 0.0, slow_every: int = 0, slow_latency: float = 0.3,
+                 token_ttl: int = 1799, offers: int = 10):
+        self.latency = latency
+        self.slow_every = slow_every
+        self.slow_latency = slow_latency
+        self.token_ttl = token_ttl
+        self.offers = offers
+        self.fail_tokens = 0
+        self.counters = {"connections": 0, "tokens": 0, "searches": 0, "unauthorized": 0}
+        self.tokens = set()
+        self._seen = {}
+        self._lock = threading.Lock()
+        self._httpd = _LocalHTTPServer(("127.0.0.1", 0), self._handler())
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+
+    @property
+    def port(self) -> int:
+        return self._httpd.server_address[1]
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def _search_latency(self, query: str) -> float:
+        with self._lock:
+            self.counters["searches"] += 1
+            first = query not in self._seen
+            if first:
+                self._seen[query] = len(self._seen) + 1
+            slow = first and self.slow_every and self._seen[query] % self.slow_every == 0
+        return self.slow_latency if slow else self.latency
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # giữ kết nối (keep-alive) nếu client muốn
+            disable_nagle_algorithm = True  # header và body gửi riêng: tránh trễ 40ms do Nagle + delayed ACK
+
+            def setup(self):
+                super().setup()
+                with server._lock:
+                    server.counters["connections"] += 1
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status: int, body: dict):
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/vnd.amadeus+json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                with server._lock:
+                    if server.fail_tokens:
+                        server.fail_tokens -= 1
+                        return self._send(500, {"errors": [{"status": 500, "title": "Internal error"}]})
+                    server.counters["tokens"] += 1
+                    token = f"token-{server.counters['tokens']}"
+                    server.tokens.add(token)
+                self._send(200, {"access_token": token, "token_type": "Bearer", "expires_in": server.token_ttl})
+
+            def do_GET(self):
+                url = urlsplit(self.path)
+                token = (self.headers.get("Authorization") or "").removeprefix("Bearer ")
+                if token not in server.tokens:
+                    with server._lock:
+                        server.counters["unauthorized"] += 1
+                    return self._send(401, {"errors": [{"status": 401, "title": "Invalid access token"}]})
+                latency = server._search_latency(url.query)
+                if latency:
+                    time.sleep(latency)
+                params = {k: v[0] for k, v in parse_qs(url.query).items()}
+                self._send(200, {"data": make_offers(
+                    params["originLocationCode"], params["destinationLocationCode"], params["departureDate"],
+                    min(server.offers, int(params.get("max", server.offers))),
+                )})
+
+        return Handler
+
+
+class StubChatBackend:
+    """
+    Backend FastAPI giả cho frontend: `POST /chat/stream` chờ `latency` giây rồi trả về các
+    sự kiện SSE `token`/`done`. Đếm số kết nối mở ra và số lượt chồng nhau trên cùng thread.
+    """
+
+    def __init__(self, latency: float = 0.0, reply: str = "Dạ em đã tìm thấy 10 chuyến bay ạ."):
+        self.latency = latency
+        self.reply = reply
+        self.counters = {"connections": 0, "requests": 0, "overlapping": 0}
+        self._active_threads = set()
+        self._lock = threading.Lock()
+        self._httpd = _LocalHTTPServer(("127.0.0.1", 0), self._handler())
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self._httpd.server_address[1]}"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def _events(self) -> bytes:
+        words = self.reply.split(" ")
+        events = [("token", {"text": w if i == 0 else " " + w}) for i, w in enumerate(words)]
+        events.append(("done", {"response": self.reply}))
+        return "".join(f"event: {e}\ndata: {json.dumps(d, ensure_ascii=False)}\n\n" for e, d in events).encode()
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def setup(self):
+                super().setup()
+                with server._lock:
+                    server.counters["connections"] += 1
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                thread_id = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)))["thread_id"]
+                with server._lock:
+                    server.counters["requests"] += 1
+                    if thread_id in server._active_threads:
+                        server.counters["overlapping"] += 1
+                    server._active_threads.add(thread_id)
+                try:
+                    if server.latency:
+                        time.sleep(server.latency)
+                    payload = server._events()
+                finally:
+                    with server._lock:
+                        server._active_threads.discard(thread_id)
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+        return Handler
+
+
+def install_fake_llm(monkeypatch, model: FakeChatModel) -> FakeChatModel:
+    """Dùng chat model giả cho mọi vai trò (route/extract/respond) của registry model."""
+    install_model_factory(monkeypatch, lambda spec: model)
+    return model
+
+
+def install_model_factory(monkeypatch, factory):
+    """Thay registry model bằng registry mới dùng `factory(spec)`; trả về registry đó."""
+    from src.flight_booking_agent import config
+
+    registry = config.ModelRegistry(factory=factory)
+    monkeypatch.setattr(config, "model_registry", registry)
+    return registry
+
+
+def install_stub_amadeus(monkeypatch, backend: StubAmadeusBackend) -> StubAmadeusBackend:
+    from src.flight_booking_agent.services.amadeus_client import FlightSearchCache, amadeus_client
+
+    monkeypatch.setattr(amadeus_client, "transport", "sdk")
+    monkeypatch.setattr(amadeus_client, "_client", backend)  # không dựng client SDK thật
+    monkeypatch.setattr(amadeus_client, "cache", FlightSearchCache())
+    return backend
+
+
+@pytest.fixture(autouse=True)
+def faq_index_dir(monkeypatch, tmp_path_factory):
+    """Chỉ mục FAQ được lưu trong thư mục tạm của phiên test, không ghi vào thư mục dự án."""
+    from src.flight_booking_agent.agents import faq_index
+    path = tmp_path_factory.getbasetemp() / "faq_index"
+    monkeypatch.setattr(faq_index, "FAQ_INDEX_DIR", str(path))
+    return path
+
+
+@pytest.fixture
+def fake_llm(monkeypatch):
+    return install_fake_llm(monkeypatch, FakeChatModel(responder=booking_responder))
+
+
+@pytest.fixture
+def stub_amadeus(monkeypatch):
+    return install_stub_amadeus(monkeypatch, StubAmadeusBackend())
+
+
+def new_thread_config() -> dict:
+    return {"configurable": {"thread_id": f"test-{uuid.uuid4().hex}"}}
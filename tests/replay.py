@@ -0,0 +1,233 @@
+"""
+Harness replay offline cho kiểm thử hồi quy hiệu năng end-to-end.
+
+Các hội thoại tiếng Việt theo kịch bản (tìm chuyến → chọn chuyến → nhập hành khách →
+xác nhận) được chạy qua graph thật (`graph.workflow.app`) và endpoint `/chat`. LLM giả
+và Amadeus giả có độ trễ cố định. Báo cáo gồm:
+- p50/p95 độ trễ mỗi lượt;
+- throughput ở mức đồng thời cho trước;
+- số lời gọi LLM mỗi hội thoại;
+- bộ nhớ checkpoint mỗi thread.
+
+Kết quả được so với baseline đã lưu (`tests/replay_baseline.json`).
+
+    python -m tests.replay                    # in báo cáo và so với baseline
+    python -m tests.replay --update-baseline  # ghi lại baseline sau một thay đổi có chủ đích
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+import uuid
+from typing import Dict, List, NamedTuple, Optional
+
+import httpx
+import pytest
+from langchain_core.messages import HumanMessage
+
+from tests.conftest import (
+    FakeChatModel, StubAmadeusBackend, booking_responder, install_fake_llm, install_stub_amadeus,
+)
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "replay_baseline.json")
+
+# Ngưỡng hồi quy so với baseline. Số lời gọi LLM và số tin nhắn là tất định nên so chính
+# xác; kích thước checkpoint cho phép lệch nhẹ (ngày tháng, id); độ trễ và throughput phụ
+# thuộc máy chạy nên chỉ bắt các thay đổi lớn (thêm một lời gọi LLM, gọi tool hai lần...).
+CHECKPOINT_BYTES_TOLERANCE = 0.10
+LATENCY_TOLERANCE = 0.5
+LATENCY_SLACK_MS = 15.0
+THROUGHPUT_TOLERANCE = 0.5
+
+CONVERSATIONS: Dict[str, List[str]] = {
+    "sgn-han-1pax": [
+        "Tìm giúp em chuyến bay từ Sài Gòn đi Hà Nội ngày mai cho 1 người",
+        "Em chọn chuyến số 1 nhé",
+        "Nguyen Van A, 25/12/1990, 0987654321",
+        "xác nhận",
+    ],
+    "han-dad-2pax": [
+        "Đặt vé từ Hà Nội đi Đà Nẵng thứ 6 tuần sau cho 2 người",
+        "Chọn chuyến 3",
+        "1. Tran Thi B, 01/02/1985, 0912345678\n2. Le Van C, 03/04/1990, 0398765432",
+        "xác nhận",
+    ],
+    "dad-sgn-labelled": [
+        "Mình muốn bay Đà Nẵng - Sài Gòn ngày 20/11 một mình",
+        "lấy chuyến 2 nha",
+        "Họ tên: Pham Minh D\nNgày sinh: 12/07/1992\nSĐT: +84 903 123 456",
+        "xác nhận",
+    ],
+}
+
+
+class ReplaySettings(NamedTuple):
+    llm_latency: float = 0.02       # giây mỗi lời gọi LLM giả
+    amadeus_latency: float = 0.02   # giây mỗi lần gọi Amadeus giả
+    repeats: int = 2                # số lần chạy lại mỗi hội thoại khi đo độ trễ
+    concurrency: int = 8            # số hội thoại chạy đồng thời khi đo throughput
+
+
+def _percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] if ordered else 0.0
+
+
+def thread_checkpoint_bytes(saver, thread_id: str) -> int:
+    """
+    Tổng số byte checkpoint, blob kênh và pending write mà checkpointer bộ nhớ giữ cho một
+    thread, cộng các khối trong kho khối (CompactSerializer) mà chúng tham chiếu.
+    """
+    from src.flight_booking_agent.graph.checkpoint_serde import referenced_blocks
+
+    records = [checkpoint for checkpoints in saver.storage.get(thread_id, {}).values()
+               for checkpoint, _, _ in checkpoints.values()]
+    total = sum(len(metadata[1]) for checkpoints in saver.storage.get(thread_id, {}).values()
+                for _, metadata, _ in checkpoints.values())
+    records += [value for key, value in saver.blobs.items() if key[0] == thread_id]
+    records += [write[2] for key, writes in saver.writes.items() if key[0] == thread_id for write in writes.values()]
+    total += sum(len(record[1]) for record in records)
+    total += sum(len(saver.serde.store.get(key)) for key in referenced_blocks(saver.serde, records))
+    return total
+
+
+async def _replay_sequential(graph_app, llm: FakeChatModel, settings: ReplaySettings) -> dict:
+    latencies, llm_calls, checkpoint_bytes, messages = [], {}, {}, {}
+    for repeat in range(settings.repeats):
+        for name, script in CONVERSATIONS.items():
+            thread_id = f"replay-{name}-{uuid.uuid4().hex[:8]}"
+            config = {"configurable": {"thread_id": thread_id}}
+            calls_before = len(llm.calls)
+            for text in script:
+                started = time.perf_counter()
+                result = await graph_app.ainvoke({"messages": [HumanMessage(content=text)]}, config=config)
+                latencies.append((time.perf_counter() - started) * 1000)
+            if repeat == 0:
+                llm_calls[name] = len(llm.calls) - calls_before
+                checkpoint_bytes[name] = thread_checkpoint_bytes(graph_app.checkpointer, thread_id)
+                messages[name] = len(result["messages"])
+    return {
+        "turn_latency_ms": {"p50": round(_percentile(latencies, 0.5), 1), "p95": round(_percentile(latencies, 0.95), 1)},
+        "llm_calls_per_conversation": llm_calls,
+        "checkpoint_bytes_per_thread": checkpoint_bytes,
+        "messages_per_thread": messages,
+    }
+
+
+async def _replay_concurrent(concurrency: int) -> float:
+    """Chạy `concurrency` hội thoại đồng thời qua `/chat`; trả về số lượt/giây."""
+    from endpoints import fastapi_app
+
+    scripts = list(CONVERSATIONS.values())
+    transport = httpx.ASGITransport(app=fastapi_app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=60) as client:
+        async def conversation(index: int) -> int:
+            thread_id = f"replay-concurrent-{index}-{uuid.uuid4().hex[:8]}"
+            script = scripts[index % len(scripts)]
+            for text in script:
+                response = await client.post("/chat", json={"message": text, "thread_id": thread_id})
+                response.raise_for_status()
+            return len(script)
+
+        started = time.perf_counter()
+        turns = await asyncio.gather(*(conversation(i) for i in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    return sum(turns) / elapsed
+
+
+def run_replay(settings: ReplaySettings = ReplaySettings()) -> dict:
+    """Chạy toàn bộ kịch bản với LLM/Amadeus giả và trả về báo cáo (dict tuần tự hóa được JSON)."""
+    from src.flight_booking_agent.graph.workflow import app as graph_app
+
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        llm = install_fake_llm(monkeypatch, FakeChatModel(responder=booking_responder, latency=settings.llm_latency))
+        install_stub_amadeus(monkeypatch, StubAmadeusBackend(latency=settings.amadeus_latency))
+        report = asyncio.run(_replay_sequential(graph_app, llm, settings))
+        # Cache tìm kiếm mới để lượt đồng thời cũng phải gọi Amadeus như lượt tuần tự
+        install_stub_amadeus(monkeypatch, StubAmadeusBackend(latency=settings.amadeus_latency))
+        throughput = asyncio.run(_replay_concurrent(settings.concurrency))
+    report["throughput_turns_per_s"] = {str(settings.concurrency): round(throughput, 1)}
+    report["settings"] = settings._asdict()
+    return report
+
+
+def load_baseline(path: str = BASELINE_PATH) -> Optional[dict]:
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_baseline(report: dict, path: str = BASELINE_PATH):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def compare_to_baseline(report: dict, baseline: dict, timing: bool = True) -> List[str]:
+    """
+    Danh sách các hồi quy (rỗng nếu báo cáo không tệ hơn baseline quá ngưỡng cho phép).
+    `timing=False` bỏ qua độ trễ/throughput, chỉ so số lời gọi LLM, tin nhắn và kích thước checkpoint.
+    """
+    regressions = []
+    for name, calls in report["llm_calls_per_conversation"].items():
+        expected = baseline["llm_calls_per_conversation"].get(name)
+        if expected is not None and calls > expected:
+            regressions.append(f"llm_calls_per_conversation[{name}]: {calls} > baseline {expected}")
+    for name, count in report["messages_per_thread"].items():
+        expected = baseline["messages_per_thread"].get(name)
+        if expected is not None and count > expected:
+            regressions.append(f"messages_per_thread[{name}]: {count} > baseline {expected}")
+    for name, size in report["checkpoint_bytes_per_thread"].items():
+        expected = baseline["checkpoint_bytes_per_thread"].get(name)
+        if expected is not None and size > expected * (1 + CHECKPOINT_BYTES_TOLERANCE):
+            regressions.append(f"checkpoint_bytes_per_thread[{name}]: {size} > baseline {expected} (+{CHECKPOINT_BYTES_TOLERANCE:.0%})")
+    if not timing:
+        return regressions
+    for key, value in report["turn_latency_ms"].items():
+        expected = baseline["turn_latency_ms"][key]
+        if value > expected * (1 + LATENCY_TOLERANCE) + LATENCY_SLACK_MS:
+            regressions.append(f"turn_latency_ms[{key}]: {value} > baseline {expected}")
+    for concurrency, value in report["throughput_turns_per_s"].items():
+        expected = baseline["throughput_turns_per_s"].get(concurrency)
+        if expected is not None and value < expected * THROUGHPUT_TOLERANCE:
+            regressions.append(f"throughput_turns_per_s[{concurrency}]: {value} < baseline {expected}")
+    return regressions
+
+
+def format_report(report: dict, baseline: Optional[dict] = None) -> str:
+    baseline = baseline or {}
+
+    def row(label, value, expected):
+        return f"  {label:46} {value!s:>10} {'' if expected is None else expected!s:>10}"
+
+    lines = [f"  {'metric':46} {'current':>10} {'baseline':>10}"]
+    for section in ("turn_latency_ms", "throughput_turns_per_s", "llm_calls_per_conversation",
+                    "checkpoint_bytes_per_thread", "messages_per_thread"):
+        for key, value in report[section].items():
+            lines.append(row(f"{section}[{key}]", value, baseline.get(section, {}).get(key)))
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay hội thoại đặt vé offline và so với baseline hiệu năng")
+    parser.add_argument("--update-baseline", action="store_true", help=f"ghi báo cáo hiện tại vào {BASELINE_PATH}")
+    parser.add_argument("--concurrency", type=int, default=ReplaySettings().concurrency)
+    args = parser.parse_args(argv)
+
+    report = run_replay(ReplaySettings(concurrency=args.concurrency))
+    baseline = load_baseline()
+    print(format_report(report, baseline))
+    if args.update_baseline:
+        save_baseline(report)
+        print(f"Đã ghi baseline: {BASELINE_PATH}")
+        return 0
+    regressions = compare_to_baseline(report, baseline) if baseline else []
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,854 @@
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+from langchain_core.messages import HumanMessage
+
+from src.flight_booking_agent.agents import manager
+from src.flight_booking_agent.agents.intent_rules import classify_intent
+from tests.conftest import (
+    TIMING_ASSERTS, FakeChatModel, booking_responder, install_fake_llm, make_offers, new_thread_config, tool_call_message,
+)
+
+
+# Tập đánh giá có nhãn cho bộ định tuyến (tiếng Việt có dấu, không dấu và tiếng Anh)
+ROUTING_EVAL_SET = [
+    ("hủy vé ABC123", "cancel_booking_agent"),
+    ("Em muốn huỷ vé mã đặt chỗ VN8K2P", "cancel_booking_agent"),
+    ("huy ve giup minh ma QX12RT", "cancel_booking_agent"),
+    ("Cho mình hủy chuyến bay ngày mai", "cancel_booking_agent"),
+    ("Tôi cần hoàn vé đã mua", "cancel_booking_agent"),
+    ("Please cancel my booking 7HJK9L", "cancel_booking_agent"),
+    ("I want to cancel my flight", "cancel_booking_agent"),
+    ("Làm sao để hủy đặt chỗ?", "cancel_booking_agent"),
+    ("đặt vé từ Sài Gòn đi Hà Nội ngày mai", "booking_agent"),
+    ("Tìm chuyến bay SGN HAN 25/12 cho 2 người", "booking_agent"),
+    ("mua ve may bay di Da Nang", "booking_agent"),
+    ("Có chuyến bay nào từ Hải Phòng vào Phú Quốc không?", "booking_agent"),
+    ("Em muốn bay từ Hà Nội đi Bangkok tuần sau", "booking_agent"),
+    ("book a flight from Hanoi to Singapore", "booking_agent"),
+    ("Find me flights to Tokyo next Friday", "booking_agent"),
+    ("Hà Nội đi Đà Nẵng ngày 20/11", "booking_agent"),
+    ("SGN đi HAN 25/12 2 người", "booking_agent"),
+    ("Còn vé đi Nha Trang cuối tuần không em", "booking_agent"),
+    ("đặt chỗ chuyến bay đi Seoul", "booking_agent"),
+    ("tôi muốn mua vé máy bay", "booking_agent"),
+    ("xin chào", "general_agent"),
+    ("Chào em", "general_agent"),
+    ("hello", "general_agent"),
+    ("Hi there", "general_agent"),
+    ("cảm ơn em nhiều", "general_agent"),
+    ("alo", "general_agent"),
+    ("thanks!", "general_agent"),
+    ("Tạm biệt", "general_agent"),
+    # Các câu mơ hồ / kiến thức chung: luật không đủ tin cậy, phải hỏi LLM
+    ("Hành lý xách tay được bao nhiêu kg?", "general_agent"),
+    ("Thủ tục check-in online thế nào?", "general_agent"),
+    ("Trẻ em dưới 2 tuổi có cần giấy tờ gì không?", "general_agent"),
+    ("Đà Nẵng có gì chơi?", "general_agent"),
+    ("Tôi tên Huy, muốn hỏi về quy định đổi tên", "general_agent"),
+    ("Mình muốn đổi vé sang ngày khác", "booking_agent"),
+    ("Giờ bay của chuyến VN213 là mấy giờ?", "booking_agent"),
+    ("Hủy vé cũ rồi đặt vé mới giúp mình", "booking_agent"),
+    ("Có được mang thú cưng lên máy bay không?", "general_agent"),
+    ("Thời tiết Hà Nội hôm nay thế nào?", "general_agent"),
+    ("Em ơi", "general_agent"),
+    ("Chính sách hoàn tiền khi chuyến bay bị hoãn?", "general_agent"),
+    # Câu hỏi chính sách có từ khóa hủy/hoàn: không được tự động chuyển sang agent hủy vé
+    ("Chính sách hủy vé như thế nào?", "general_agent"),
+    ("Hủy vé có mất phí không?", "general_agent"),
+    ("hoàn vé mất bao lâu", "general_agent"),
+    ("Quy định huỷ vé của Vietjet ra sao?", "general_agent"),
+    ("What is the cancellation policy?", "general_agent"),
+]
+
+
+def _oracle_llm(latency: float = 0.0) -> FakeChatModel:
+    """LLM giả luôn định tuyến đúng nhãn (giả định LLM là 'chuẩn vàng' cho phần mơ hồ)."""
+    labels = dict(ROUTING_EVAL_SET)
+
+    def responder(messages, tool_names):
+        text = messages[-1].content.split(": ", 1)[1]
+        return tool_call_message("ManagerHandoff", {"target_agent_name": labels[text]})
+
+    return FakeChatModel(responder=responder, latency=latency)
+
+
+def test_rule_classifier_examples():
+    assert classify_intent("hủy vé ABC123") == ("cancel_booking_agent", 0.95, "cancel keyword + booking code")
+    assert classify_intent("đặt vé từ Sài Gòn đi Hà Nội").target_agent_name == "booking_agent"
+    assert classify_intent("xin chào").target_agent_name == "general_agent"
+    # "Huy" là tên người, không phải ý định hủy vé
+    assert classify_intent("Tôi tên Huy").confidence == 0.0
+    assert classify_intent("Hủy vé cũ rồi đặt vé mới giúp mình").confidence < manager.MANAGER_RULE_THRESHOLD
+    # Hỏi chính sách hủy/hoàn vé: để LLM quyết định, trừ khi có mã đặt chỗ
+    assert classify_intent("Hủy vé có mất phí không?").confidence < manager.MANAGER_RULE_THRESHOLD
+    assert classify_intent("hoàn vé mất bao lâu").confidence < manager.MANAGER_RULE_THRESHOLD
+    assert classify_intent("Hủy vé ABC123 có mất phí không?").target_agent_name == "cancel_booking_agent"
+
+
+def test_manager_skips_llm_for_high_confidence_intents(monkeypatch):
+    model = install_fake_llm(monkeypatch, _oracle_llm())
+
+    result = manager.manager_node({"messages": [HumanMessage(content="hủy vé ABC123")]})
+
+    assert result == {"next_agent": "cancel_booking_agent"}
+    assert model.calls == []
+
+
+def test_manager_falls_back_to_llm_below_threshold(monkeypatch):
+    model = install_fake_llm(monkeypatch, _oracle_llm())
+    monkeypatch.setattr(manager, "MANAGER_RULE_THRESHOLD", 1.01)
+
+    result = manager.manager_node({"messages": [HumanMessage(content="hủy vé ABC123")]})
+
+    assert result == {"next_agent": "cancel_booking_agent"}
+    assert model.calls == [["ManagerHandoff"]]
+
+
+def test_routing_evaluation_report(monkeypatch):
+    """
+    Đánh giá trên tập có nhãn: độ chính xác của định tuyến lai (luật + LLM dự phòng),
+    độ chính xác riêng của nhánh luật, tỉ lệ lời gọi LLM tránh được và thời gian tiết
+    kiệm được với LLM giả có độ trễ 20ms/lời gọi.
+    """
+    def run(threshold: float):
+        monkeypatch.setattr(manager, "MANAGER_RULE_THRESHOLD", threshold)
+        model = install_fake_llm(monkeypatch, _oracle_llm(latency=0.02))
+        correct, rule_correct, rule_total = 0, 0, 0
+        started = time.perf_counter()
+        for text, label in ROUTING_EVAL_SET:
+            calls_before = len(model.calls)
+            predicted = manager.manager_node({"messages": [HumanMessage(content=text)]})["next_agent"]
+            correct += predicted == label
+            if len(model.calls) == calls_before:
+                rule_total += 1
+                rule_correct += predicted == label
+        return correct, rule_correct, rule_total, len(model.calls), time.perf_counter() - started
+
+    default_threshold = manager.MANAGER_RULE_THRESHOLD
+    _, _, _, llm_only_calls, llm_only_time = run(threshold=1.01)
+    correct, rule_correct, rule_total, hybrid_calls, hybrid_time = run(threshold=default_threshold)
+    total = len(ROUTING_EVAL_SET)
+    print(
+        f"\nrouting accuracy {correct}/{total}, rule precision {rule_correct}/{rule_total}, "
+        f"LLM calls avoided {1 - hybrid_calls / llm_only_calls:.0%}, "
+        f"time {llm_only_time * 1000:.0f}ms -> {hybrid_time * 1000:.0f}ms"
+    )
+
+    assert rule_correct == rule_total
+    assert correct == total
+    assert hybrid_calls <= 0.5 * llm_only_calls
+
+
+def test_structured_runnables_are_built_once_and_shared(fake_llm):
+    from src.flight_booking_agent.agents import booking
+    from src.flight_booking_agent.agents.utils import structured_output
+
+    assert structured_output(fake_llm, booking.FlightChoice) is structured_output(fake_llm, booking.FlightChoice)
+    assert manager._manager_chain() is manager._manager_chain()
+
+
+def test_per_turn_framework_overhead_benchmark(monkeypatch, fake_llm, stub_amadeus):
+    """
+    Micro-benchmark: chi phí framework mỗi lượt (LLM giả trả lời tức thì) cho nhánh LLM
+    của Manager và bước trích xuất của Booking, khi dựng lại runnable mỗi lượt (như
+    trước) và khi dùng lại runnable đã dựng sẵn.
+    """
+    from src.flight_booking_agent.agents import booking
+    from src.flight_booking_agent.agents.utils import runnable_cache
+
+    monkeypatch.setattr(manager, "MANAGER_RULE_THRESHOLD", 1.01)
+    manager_state = {"messages": [HumanMessage(content="Hành lý xách tay được bao nhiêu kg?")]}
+    booking_state = {"messages": [HumanMessage(content="Em muốn bay vào thứ 6")]}
+
+    def per_turn_ms(rebuild: bool, turns: int = 200) -> float:
+        started = time.perf_counter()
+        for _ in range(turns):
+            if rebuild:
+                runnable_cache.clear()
+            manager.manager_node(manager_state)
+            booking.booking_node(booking_state)
+        return (time.perf_counter() - started) / turns * 1000
+
+    per_turn_ms(rebuild=False, turns=20)  # làm nóng
+    rebuilt = per_turn_ms(rebuild=True)
+    reused = per_turn_ms(rebuild=False)
+    print(f"\nper-turn framework overhead: rebuild {rebuilt:.2f}ms -> reuse {reused:.2f}ms")
+
+    if TIMING_ASSERTS:
+        assert reused < rebuilt
+
+
+def test_model_registry_builds_one_model_per_role(monkeypatch):
+    from src.flight_booking_agent import config
+
+    built = []
+
+    def factory(spec):
+        built.append(spec)
+        return FakeChatModel(responder=lambda messages, tool_names: None)
+
+    registry = config.ModelRegistry(factory=factory)
+
+    assert registry.get("route") is registry.get("route")
+    assert registry.get("route") is not registry.get("respond")
+    assert built == [config.MODEL_SPECS["route"], config.MODEL_SPECS["respond"]]
+    assert registry.get("route").metadata["llm_role"] == "route"
+    assert registry.usage in registry.get("respond").callbacks
+
+
+def test_vertex_model_applies_role_timeout():
+    from src.flight_booking_agent import config
+
+    model = config.build_vertex_model(config.ModelSpec("gemini-2.5-flash", 0.0, 7))
+
+    assert model.model_name == "gemini-2.5-flash"
+    assert model.temperature == 0.0
+    assert model._with_timeout({}) == {"timeout": 7}
+    assert model._with_timeout({"timeout": 2}) == {"timeout": 2}
+
+
+def test_booking_summary_falls_back_to_llm_when_results_cannot_be_rendered(fake_llm):
+    from langchain_core.messages import ToolMessage
+    from src.flight_booking_agent.agents import booking
+
+    malformed = ToolMessage(content='[{"flight_number": "VN200", "price": 1500000}]', tool_call_id="call_1")
+
+    result = booking.booking_node({"messages": [HumanMessage(content="SGN HAN"), malformed]})
+
+    assert fake_llm.calls == [[]]
+    assert result["search_results"] == [{"flight_number": "VN200", "price": 1500000}]
+
+
+def test_airport_resolver_handles_accents_typos_and_prefixes():
+    from src.flight_booking_agent.agents.utils import get_iata_code
+
+    assert get_iata_code("Ha Noi") == get_iata_code("hà nội") == get_iata_code("Sân bay Nội Bài") == "HAN"
+    assert get_iata_code("TP HCM") == get_iata_code("Sai gon") == "SGN"
+    assert get_iata_code("Da Lat") == "DLI"
+    assert get_iata_code("Quy Nhơn") == "UIH"
+    assert get_iata_code("Hue") == "HUI"  # trước đây trả về mã không tồn tại "HUE"
+    assert get_iata_code("Đà Nẵg") == "DAD"
+    assert get_iata_code("Bangok") == "BKK"
+    assert get_iata_code("singapor") == "SIN"
+    # Thành phố nhiều sân bay: ưu tiên ánh xạ thủ công, nếu không thì sân bay lớn hơn
+    assert get_iata_code("Tokyo") == "NRT"
+    assert get_iata_code("Thâm Quyến") == "SZX"
+    assert get_iata_code("tok") == "NRT"
+    assert get_iata_code("SGN") == "SGN"
+    assert get_iata_code("XYZ") == "XYZ"
+    assert get_iata_code("ha") is None
+    assert get_iata_code("") is None
+
+
+def test_airport_autocomplete_ranks_codes_then_larger_airports():
+    from src.flight_booking_agent.agents.airports import airport_resolver
+
+    resolver = airport_resolver()
+
+    assert [m.iata for m in resolver.autocomplete("han")][:2] == ["HAN", "HND"]
+    assert [m.iata for m in resolver.autocomplete("Lon")][:2] == ["LHR", "LGW"]
+    assert [m.iata for m in resolver.autocomplete("da n")] == ["DAD"]
+    assert resolver.autocomplete("dalat")[0].city == "Đà Lạt"
+    assert resolver.autocomplete("Hanoii")[0].iata == "HAN"
+    assert len(resolver.autocomplete("h", limit=3)) == 3
+    assert resolver.autocomplete("") == []
+
+
+def _noisy_airport_queries(resolver, aliases, seed: int = 13):
+    """
+    Sinh truy vấn nhiễu từ mọi tên gọi trong bộ dữ liệu: bỏ dấu, đổi hoa/thường,
+    thêm "sân bay"/"TP", và một lỗi gõ (xóa, thay, chèn, đảo hai ký tự). Nhãn đúng là
+    mọi sân bay cùng thành phố với tên gọi gốc.
+    """
+    import random
+
+    from src.flight_booking_agent.agents.utils import fold_vietnamese
+
+    rng = random.Random(seed)
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    city_airports = {}
+    for airport in resolver.airports.values():
+        city_airports.setdefault(airport.city, set()).add(airport.iata)
+    labels = {}
+    for airport in resolver.airports.values():
+        for label in {airport.city, airport.name, *aliases.get(airport.iata, [])}:
+            labels.setdefault(label, set()).update(city_airports[airport.city])
+    # Bỏ tên gọi dùng chung cho nhiều thành phố (không có nhãn đúng duy nhất)
+    labels = {label: codes for label, codes in labels.items()
+              if len({resolver.airports[c].city for c in codes}) == 1 and len(label) >= 4}
+
+    def typo(text):
+        i = rng.randrange(1, len(text) - 1)
+        kind = rng.choice(["delete", "substitute", "insert", "transpose"])
+        if kind == "delete":
+            return text[:i] + text[i + 1:]
+        if kind == "substitute":
+            return text[:i] + rng.choice(letters) + text[i + 1:]
+        if kind == "insert":
+            return text[:i] + rng.choice(letters) + text[i:]
+        return text[:i - 1] + text[i] + text[i - 1] + text[i + 1:]
+
+    noises = {
+        "clean": lambda t: t,
+        "no_accents": lambda t: fold_vietnamese(t),
+        "case": lambda t: "".join(c.upper() if rng.random() < 0.5 else c.lower() for c in t),
+        "prefix": lambda t: rng.choice(["sân bay ", "San bay ", "TP ", "thành phố "]) + t,
+        "typo": lambda t: typo(fold_vietnamese(t)) if len(t) >= 5 else fold_vietnamese(t),
+    }
+    queries = []
+    for _ in range(3000 // (len(labels) * len(noises)) + 1):
+        for label, codes in sorted(labels.items()):
+            for noise, apply in noises.items():
+                queries.append((noise, apply(label), codes))
+    return queries
+
+
+def test_airport_resolver_accuracy_and_latency_benchmark():
+    """
+    Benchmark trên ~3000 truy vấn nhiễu: độ chính xác theo loại nhiễu của resolver so
+    với tra cứu dict cũ (AIRPORT_MAP.get(text.lower())), và độ trễ mỗi lần tra cứu khi
+    không có cache (p50/p99, µs).
+    """
+    from src.flight_booking_agent.agents.airports import AirportResolver, load_airports
+    from src.flight_booking_agent.agents.utils import AIRPORT_MAP
+
+    airports, aliases = load_airports()
+    resolver = AirportResolver(airports, aliases, curated=AIRPORT_MAP, cache_size=0)
+    queries = _noisy_airport_queries(resolver, aliases)
+
+    def legacy(text):
+        normalized = text.lower().strip()
+        if len(normalized) == 3 and normalized.isalpha():
+            return normalized.upper()
+        return AIRPORT_MAP.get(normalized)
+
+    totals, new_hits, old_hits, latencies = {}, {}, {}, []
+    for noise, text, codes in queries:
+        started = time.perf_counter()
+        match = resolver.resolve(text)
+        latencies.append(time.perf_counter() - started)
+        totals[noise] = totals.get(noise, 0) + 1
+        new_hits[noise] = new_hits.get(noise, 0) + (match is not None and match.iata in codes)
+        old_hits[noise] = old_hits.get(noise, 0) + (legacy(text) in codes)
+
+    latencies.sort()
+    print(f"\n{len(queries)} queries   noise       legacy  resolver")
+    for noise, total in totals.items():
+        print(f"{'':20}{noise:11} {old_hits[noise] / total:6.1%}  {new_hits[noise] / total:7.1%}")
+    overall = sum(new_hits.values()) / len(queries)
+    print(f"overall {sum(old_hits.values()) / len(queries):.1%} -> {overall:.1%}, "
+          f"lookup p50 {latencies[len(latencies) // 2] * 1e6:.1f}us p99 {latencies[int(len(latencies) * 0.99)] * 1e6:.1f}us")
+
+    assert len(queries) >= 3000
+    for noise in ("clean", "no_accents", "case", "prefix"):
+        assert new_hits[noise] == totals[noise]
+    assert new_hits["typo"] / totals["typo"] >= 0.85
+    assert overall > sum(old_hits.values()) / len(queries)
+    if TIMING_ASSERTS:
+        assert latencies[len(latencies) // 2] < 500e-6
+
+
+# Tập câu có nhãn cho bộ trích xuất slot bằng luật (ngày tính theo thứ 4, 14/10/2026)
+SLOT_TODAY = datetime(2026, 10, 14, 9, 0)
+FLIGHT_SLOT_CORPUS = [
+    ("SGN đi HAN 25/12 2 người", {"departure_from": "SGN", "arrival_to": "HAN", "departure_date": "2026-12-25", "passenger_count": 2}),
+    ("Tìm giúp em chuyến bay từ Sài Gòn đi Hà Nội ngày mai cho 1 người", {"departure_from": "SGN", "arrival_to": "HAN", "departure_date": "2026-10-15", "passenger_count": 1}),
+    ("tu ha noi di da nang ngay 20/11 cho 3 nguoi", {"departure_from": "HAN", "arrival_to": "DAD", "departure_date": "2026-11-20", "passenger_count": 3}),
+    ("Hà Nội - Đà Nẵng thứ 6 tuần sau, 2 vé", {"departure_from": "HAN", "arrival_to": "DAD", "departure_date": "2026-10-23", "passenger_count": 2}),
+    ("Đặt vé từ TP HCM ra Huế cuối tháng cho 2 người lớn", {"departure_from": "SGN", "arrival_to": "HUI", "departure_date": "2026-10-31", "passenger_count": 2}),
+    ("Em muốn bay từ Hải Phòng vào Phú Quốc chủ nhật này, một mình", {"departure_from": "HPH", "arrival_to": "PQC", "departure_date": "2026-10-18", "passenger_count": 1}),
+    ("ba nguoi di Phu Quoc tu Ha Noi ngay 30/4", {"departure_from": "HAN", "arrival_to": "PQC", "departure_date": "2027-04-30", "passenger_count": 3}),
+    ("Cho mình 4 vé Đà Lạt → Hà Nội hôm nay", {"departure_from": "DLI", "arrival_to": "HAN", "departure_date": "2026-10-14", "passenger_count": 4}),
+    ("HAN -> BKK 2026-12-21 2 pax", {"departure_from": "HAN", "arrival_to": "BKK", "departure_date": "2026-12-21", "passenger_count": 2}),
+    ("book a flight from Hanoi to Singapore 15/11 for 2 adults", {"departure_from": "HAN", "arrival_to": "SIN", "departure_date": "2026-11-15", "passenger_count": 2}),
+    ("Sài Gòn đi Quy Nhơn thứ 7, 2 khách", {"departure_from": "SGN", "arrival_to": "UIH", "departure_date": "2026-10-17", "passenger_count": 2}),
+    ("Vé Cần Thơ ra Hà Nội ngày mốt cho 1 người", {"departure_from": "VCA", "arrival_to": "HAN", "departure_date": "2026-10-16", "passenger_count": 1}),
+    ("từ Đà Nẵng đi Seoul 1/1/2027, 2 người", {"departure_from": "DAD", "arrival_to": "ICN", "departure_date": "2027-01-01", "passenger_count": 2}),
+    ("Bay từ Vinh vào Sài Gòn cuối tuần này 1 vé", {"departure_from": "VII", "arrival_to": "SGN", "departure_date": "2026-10-17", "passenger_count": 1}),
+    ("Nha Trang đi Hà Nội đầu tháng sau, hai người", {"departure_from": "CXR", "arrival_to": "HAN", "departure_date": "2026-11-01", "passenger_count": 2}),
+    ("tim ve sgn han thu 2 tuan toi 5 nguoi", {"departure_from": "SGN", "arrival_to": "HAN", "departure_date": "2026-10-19", "passenger_count": 5}),
+    ("Từ Hà Nội sang Tokyo ngày 10/12 cho 2 người", {"departure_from": "HAN", "arrival_to": "NRT", "departure_date": "2026-12-10", "passenger_count": 2}),
+    ("Buôn Ma Thuột đi Hà Nội 05/11 1 người", {"departure_from": "BMV", "arrival_to": "HAN", "departure_date": "2026-11-05", "passenger_count": 1}),
+    ("Sân bay Nội Bài đi Tân Sơn Nhất ngày 22/10, 3 vé", {"departure_from": "HAN", "arrival_to": "SGN", "departure_date": "2026-10-22", "passenger_count": 3}),
+    ("Tôi tên Vinh muốn bay từ Hà Nội đi Huế ngày 20/11 một mình", {"departure_from": "HAN", "arrival_to": "HUI", "departure_date": "2026-11-20", "passenger_count": 1}),
+    # Câu thiếu slot: luật điền phần chắc chắn, LLM lo phần còn lại (hoặc hỏi lại khách)
+    ("Em muốn bay vào thứ 6", {"departure_date": "2026-10-16"}),
+    ("mua ve may bay di Da Nang", {"arrival_to": "DAD"}),
+    ("SGN HAN", {"departure_from": "SGN", "arrival_to": "HAN"}),
+    ("cho 2 người nhé", {"passenger_count": 2}),
+    ("ngày 25/12", {"departure_date": "2026-12-25"}),
+    ("bay đi Bangkok tuần sau", {"arrival_to": "BKK"}),
+    ("Còn vé đi Nha Trang cuối tuần không em", {"arrival_to": "CXR", "departure_date": "2026-10-17"}),
+    ("Mình ở Sài Gòn, muốn ra Hà Nội chơi", {"departure_from": "SGN", "arrival_to": "HAN"}),
+    # Câu cần ngữ cảnh (linh hoạt ngày, sửa thông tin, nhiều lựa chọn): luật nhường cho LLM
+    ("Bay Hà Nội - Sài Gòn tuần sau, ngày nào rẻ nhất?", {"departure_from": "HAN", "arrival_to": "SGN"}),
+    ("không phải Hà Nội, đi Huế cơ", {"arrival_to": "HUI"}),
+    ("đi Đà Nẵng hay Huế hay Nha Trang đều được", {}),
+    ("25/12 hoặc 26/12 đều được, 2 người", {"passenger_count": 2}),
+    # Có trẻ em/em bé: số khách theo nhóm tuổi do LLM tách, luật không được điền 2 rồi bỏ sót bé
+    ("SGN đi HAN 25/12 2 người lớn và 1 trẻ em", {"departure_from": "SGN", "arrival_to": "HAN", "departure_date": "2026-12-25"}),
+    ("Hà Nội đi Đà Nẵng ngày 20/11 cho 2 người lớn, 1 em bé", {"departure_from": "HAN", "arrival_to": "DAD", "departure_date": "2026-11-20"}),
+    ("từ Sài Gòn ra Hà Nội thứ 6, 2 người + 1 em bé sơ sinh", {"departure_from": "SGN", "arrival_to": "HAN", "departure_date": "2026-10-16"}),
+    ("ve HAN SGN 1/12 cho 3 khach, 1 tre em", {"departure_from": "HAN", "arrival_to": "SGN", "departure_date": "2026-12-01"}),
+    ("Tôi muốn mua vé máy bay", {}),
+]
+PASSENGER_CORPUS = [
+    ("Nguyen Van A, 25/12/1990, 0987654321", [("Nguyen Van A", "25/12/1990", "0987654321")]),
+    ("Nguyễn Thị Bình 01/02/1985 0912 345 678", [("Nguyen Thi Binh", "01/02/1985", "0912345678")]),
+    ("Họ tên: Trần Văn Cường\nNgày sinh: 3-7-1992\nSĐT: +84 903 123 456", [("Tran Van Cuong", "03/07/1992", "0903123456")]),
+    ("Tôi là Phạm Minh Đức, sđt 0909123456, sinh ngày 1992-07-03", [("Pham Minh Duc", "03/07/1992", "0909123456")]),
+    ("Le Van C, 04/03/1990, 0356789012; Tran Thi D, 05/06/1995, 0767890123", [
+        ("Le Van C", "04/03/1990", "0356789012"), ("Tran Thi D", "05/06/1995", "0767890123")]),
+    ("1. Hoàng Văn E 12/12/1980 0981111222\n2. Vũ Thị F 13/01/2015 0981111333", [
+        ("Hoang Van E", "12/12/1980", "0981111222"), ("Vu Thi F", "13/01/2015", "0981111333")]),
+    ("Đỗ Quang G - 0388777666 - 21.09.1979", [("Do Quang G", "21/09/1979", "0388777666")]),
+    # Thiếu trường hoặc không đúng khuôn: để LLM xử lý
+    ("Nguyen Van A, 25/12/1990", []),
+    ("Anh ghi giúp em tên Nguyễn Văn A với nhé", []),
+    ("ok em, đợi chút anh gửi", []),
+    ("Nguyen Van A 0987654321, Tran Thi B 01/02/1985 0912345678", []),
+]
+
+
+def test_convert_relative_date_understands_weekdays_and_month_ends():
+    from src.flight_booking_agent.agents.utils import convert_relative_date
+
+    assert convert_relative_date("thứ 6", today=SLOT_TODAY) == "2026-10-16"
+    assert convert_relative_date("thu 6 tuan sau", today=SLOT_TODAY) == "2026-10-23"
+    assert convert_relative_date("chủ nhật tuần tới", today=SLOT_TODAY) == "2026-10-25"
+    assert convert_relative_date("tuần sau", today=SLOT_TODAY) == "2026-10-19"
+    assert convert_relative_date("cuối tuần", today=SLOT_TODAY) == "2026-10-17"
+    assert convert_relative_date("cuối tháng", today=SLOT_TODAY) == "2026-10-31"
+    assert convert_relative_date("cuối tháng sau", today=datetime(2026, 12, 5)) == "2027-01-31"
+    assert convert_relative_date("ngày 14/10", today=SLOT_TODAY) == "2026-10-14"
+    assert convert_relative_date("13/10", today=SLOT_TODAY) == "2027-10-13"
+    assert convert_relative_date("1/1/2027", today=SLOT_TODAY) == "2027-01-01"
+
+
+def test_booking_skips_llm_extraction_for_regular_input(fake_llm, stub_amadeus):
+    from src.flight_booking_agent.agents import booking
+
+    result = booking.booking_node({"messages": [HumanMessage(content="SGN đi HAN 25/12 2 người")]})
+
+    assert fake_llm.calls == []
+    assert result["messages"][0].tool_calls[0]["args"]["origin"] == "SGN"
+    assert result["passenger_count"] == 2
+
+    # Còn thiếu ngày đi: LLM được hỏi, slot luật đọc được vẫn được giữ
+    result = booking.booking_node({"messages": [HumanMessage(content="HAN đi Huế 3 người")]})
+
+    assert fake_llm.calls == [["FlightInfoExtractor"]]
+    assert (result["departure_from"], result["arrival_to"], result["passenger_count"]) == ("HAN", "HUI", 3)
+
+
+def test_slot_extraction_corpus_report():
+    """
+    Đánh giá bộ trích xuất luật trên tập câu có nhãn: precision/recall theo từng slot
+    và tỉ lệ lượt bỏ qua được lời gọi LLM (đủ slot, không mâu thuẫn).
+    """
+    from src.flight_booking_agent.agents.slot_rules import FLIGHT_SLOTS, extract_flight_slots, extract_passengers
+
+    predicted, correct, labeled = Counter(), Counter(), Counter()
+    flight_skipped = 0
+    for text, expected in FLIGHT_SLOT_CORPUS:
+        guess = extract_flight_slots(text, today=SLOT_TODAY)
+        slots = {} if guess.conflict else guess.slots
+        for slot in FLIGHT_SLOTS:
+            predicted[slot] += slot in slots
+            labeled[slot] += slot in expected
+            correct[slot] += slot in slots and slots[slot] == expected.get(slot)
+        flight_skipped += not guess.conflict and all(slot in slots for slot in FLIGHT_SLOTS)
+
+    passenger_skipped = 0
+    for text, expected in PASSENGER_CORPUS:
+        guess = extract_passengers(text, today=SLOT_TODAY)
+        got = [] if guess.conflict else [(p["full_name"], p["date_of_birth"], p["phone_number"]) for p in guess.slots["passengers"]]
+        predicted["passengers"] += len(got)
+        labeled["passengers"] += len(expected)
+        correct["passengers"] += len(set(got) & set(expected))
+        passenger_skipped += bool(got)
+
+    print("\nslot               precision  recall")
+    for slot in (*FLIGHT_SLOTS, "passengers"):
+        precision = correct[slot] / predicted[slot] if predicted[slot] else 1.0
+        print(f"{slot:18} {precision:9.1%}  {correct[slot] / labeled[slot]:6.1%}")
+    print(f"LLM extraction skipped: flight {flight_skipped}/{len(FLIGHT_SLOT_CORPUS)}, "
+          f"passengers {passenger_skipped}/{len(PASSENGER_CORPUS)}")
+
+    for slot in (*FLIGHT_SLOTS, "passengers"):
+        assert correct[slot] == predicted[slot]  # luật không bao giờ điền sai slot
+        assert correct[slot] / labeled[slot] >= 0.75
+    assert flight_skipped / len(FLIGHT_SLOT_CORPUS) >= 0.5
+    assert passenger_skipped == 7
+
+
+REFINEMENT_CORPUS = [
+    # (tin nhắn, bộ lọc, sắp xếp, trang, cách chọn chuyến); None = để LLM xử lý
+    ("chỉ bay buổi sáng thôi", {"time_window": (300, 720)}, None, None, ()),
+    ("bay thẳng thôi em", {"max_stops": 0}, None, None, ()),
+    ("dưới 1tr8 nhé", {"max_price": 1800000}, None, None, ()),
+    ("không bay Vietjet", {"exclude_carriers": ("VJ",)}, None, None, ()),
+    ("chuyến chiều sau 14h", {"time_window": (840, 1440)}, None, None, ()),
+    ("bay dưới 3 tiếng", {"max_duration": 180}, None, None, ()),
+    ("chuyến nào rẻ nhất?", {}, "price", None, ()),
+    ("sắp xếp theo giờ bay", {}, "departure", None, ()),
+    ("xem thêm", {}, None, "next", ()),
+    ("lấy chuyến VN204", {}, None, None, (("flight", "VN204"),)),
+    ("Em chọn chuyến số 1 nhé", {}, None, None, (("ordinal", 1),)),
+    ("chuyến cuối", {}, None, None, (("ordinal", -1),)),
+    ("lấy chuyến sáng rẻ nhất", {"time_window": (300, 720)}, None, None, (("best", "price"),)),
+    ("chuyến 2 mấy giờ bay?", None, None, None, None),
+    ("chuyến rẻ nhất là bao nhiêu tiền?", None, None, None, None),
+    ("cho mình hỏi chuyến sáng sớm nhất mấy giờ", None, None, None, None),
+    ("không chọn chuyến 2", None, None, None, None),
+    ("đừng lấy chuyến VN213", None, None, None, None),
+    ("chưa chọn chuyến 1 đâu", None, None, None, None),
+    ("chuyến 1 không được", None, None, None, None),
+    ("không lấy VN213", None, None, None, None),
+    ("đổi sang ngày 26/12", None, None, None, None),
+    ("xác nhận", None, None, None, None),
+    ("cảm ơn em", None, None, None, None),
+]
+
+
+def test_refinement_parser_corpus():
+    from src.flight_booking_agent.agents.refine_rules import describe_filters, parse_refinement
+
+    for text, filters, sort, page, picks in REFINEMENT_CORPUS:
+        refinement = parse_refinement(text)
+        if filters is None:
+            assert not refinement.actionable, text
+            continue
+        assert refinement.actionable, text
+        assert (refinement.filters, refinement.sort, refinement.page, refinement.picks) == (filters, sort, page, picks), text
+    assert parse_refinement("bỏ lọc").reset
+    assert describe_filters({"time_window": (300, 720), "max_stops": 0, "max_price": 2e6}) == \
+        "buổi sáng, bay thẳng, dưới 2.000.000 VND"
+
+
+def _results_state(text: str, **extra) -> dict:
+    from src.flight_booking_agent.services.amadeus_client import amadeus_client
+
+    pool = amadeus_client.format_flight_results(make_offers("SGN", "HAN", "2026-12-25", 10))
+    return {"messages": [HumanMessage(content=text)], "search_results": pool[:5], "search_pool": pool,
+            "passenger_count": 1, **extra}
+
+
+def test_booking_refines_and_picks_results_without_llm(fake_llm):
+    from src.flight_booking_agent.agents import booking
+
+    # Lọc: trang mới từ toàn bộ kết quả đã lấy về, nhớ view cho lượt sau
+    result = booking.booking_node(_results_state("chỉ bay buổi chiều thôi"))
+    assert [f["flight_number"] for f in result["search_results"]] == ["VJ205", "VN206", "VJ207", "VN208", "VJ209"]
+    assert result["search_view"] == {"filters": {"time_window": [720, 1080]}, "sort": "price", "page": 0}
+    assert result["messages"][0].content.startswith("Dạ, có 5 chuyến buổi chiều, xếp theo giá rẻ nhất:")
+
+    # Xem thêm rồi chọn theo số thứ tự trên trang đang hiển thị
+    result = booking.booking_node(_results_state("xem thêm"))
+    assert result["search_results"][0]["flight_number"] == "VJ205"
+    assert "(trang 2/2)" in result["messages"][0].content
+    picked = booking.booking_node(_results_state("chọn chuyến 2", search_results=result["search_results"]))
+    assert picked["confirmed_flight"]["flight_number"] == "VN206"
+    assert (picked["search_results"], picked["search_pool"], picked["search_view"]) == (None, None, None)
+
+    # Số hiệu chuyến ngoài trang hiển thị và "rẻ nhất" trong bộ lọc đang dùng
+    assert booking.booking_node(_results_state("lấy VN208"))["confirmed_flight"]["flight_number"] == "VN208"
+    state = _results_state("lấy chuyến rẻ nhất", search_view={"filters": {"time_window": (720, 1440)}})
+    assert booking.booking_node(state)["confirmed_flight"]["flight_number"] == "VJ205"
+
+    # Không chuyến nào khớp: giữ nguyên danh sách đang hiển thị
+    result = booking.booking_node(_results_state("chỉ bay Bamboo"))
+    assert "search_results" not in result and "bỏ lọc" in result["messages"][0].content
+    assert fake_llm.calls == []
+
+    # Câu hỏi, từ chối, lựa chọn mơ hồ hoặc số hiệu không có trong kết quả: hỏi LLM như trước
+    for text in ("chuyến 2 mấy giờ bay?", "không chọn chuyến 2", "chọn chuyến 1 hay chuyến 2", "lấy VN999"):
+        booking.booking_node(_results_state(text))
+    assert fake_llm.calls == [["FlightChoice"]] * 4
+
+
+def test_refined_paging_survives_checkpoint_round_trip(fake_llm, stub_amadeus):
+    from src.flight_booking_agent.graph.checkpointing import BoundedInMemorySaver
+    from src.flight_booking_agent.graph.workflow import workflow
+
+    graph = workflow.compile(checkpointer=BoundedInMemorySaver(keep_last=3))
+    config = new_thread_config()
+
+    def turn(text: str) -> dict:
+        graph.invoke({"messages": [HumanMessage(content=text)]}, config=config)
+        return graph.get_state(config).values
+
+    turn("Tìm giúp em chuyến bay từ Sài Gòn đi Hà Nội ngày mai cho 1 người")
+    state = turn("chỉ bay trước 14h thôi")
+    assert state["search_view"] == {"filters": {"time_window": [0, 840]}, "sort": "price", "page": 0}
+
+    # Bộ lọc nạp lại từ checkpoint là list, bộ lọc vừa đọc là tuple: vẫn là cùng bộ lọc
+    state = turn("xem thêm các chuyến trước 14h")
+    assert state["search_view"]["page"] == 1
+    assert "(trang 2/2)" in state["messages"][-1].content
+    assert fake_llm.calls == []
+
+
+def test_result_refinement_latency_benchmark(monkeypatch):
+    """
+    Benchmark lượt hỏi tiếp trên kết quả đã có (lọc, sắp xếp, xem thêm, chọn chuyến) với
+    LLM giả trễ 50ms: bộ lọc tại chỗ so với một lời gọi FlightChoice cho mỗi lượt.
+    """
+    from src.flight_booking_agent.agents import booking
+
+    model = install_fake_llm(monkeypatch, FakeChatModel(responder=booking_responder, latency=0.05))
+    follow_ups = [text for text, filters, *_ in REFINEMENT_CORPUS if filters is not None]
+
+    def run(mode):
+        monkeypatch.setattr(booking, "BOOKING_EXTRACTION_MODE", mode)
+        before, latencies = len(model.calls), []
+        for text in follow_ups * 3:
+            start = time.perf_counter()
+            booking.booking_node(_results_state(text))
+            latencies.append((time.perf_counter() - start) * 1000)
+        latencies.sort()
+        return latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.95)], len(model.calls) - before
+
+    llm_p50, llm_p95, llm_calls = run("llm")
+    rule_p50, rule_p95, rule_calls = run("rules")
+    print(f"\nrefinement turn latency: LLM p50 {llm_p50:.1f}ms p95 {llm_p95:.1f}ms ({llm_calls} calls) -> "
+          f"local p50 {rule_p50:.2f}ms p95 {rule_p95:.2f}ms ({rule_calls} calls)")
+
+    assert llm_calls == len(follow_ups) * 3
+    assert rule_calls == 0
+    if TIMING_ASSERTS:
+        assert rule_p95 < llm_p50 / 5
+
+
+def _long_conversation(turns: int) -> list:
+    """Hội thoại dài có id như sau `add_messages`: mỗi 4 lượt có một lần tìm chuyến (tool call + danh sách)."""
+    from langchain_core.messages import AIMessage, ToolMessage
+    from src.flight_booking_agent.services.amadeus_client import amadeus_client
+    from src.flight_booking_agent.tools.booking_tools import render_flight_summary
+
+    listing = render_flight_summary(amadeus_client.format_flight_results(make_offers("SGN", "HAN", "2026-12-25", 5)))
+    messages = []
+    for t in range(turns):
+        messages.append(HumanMessage(content=f"Cho em hỏi chuyến sáng ngày {t % 28 + 1}/12 còn không, đi {t % 3 + 1} người", id=f"h{t}"))
+        if t % 4 == 0:
+            messages.append(tool_call_message("flight-search-tool", {}))
+            messages[-1].id = f"c{t}"
+            messages.append(ToolMessage(content="[]", tool_call_id=messages[-1].tool_calls[0]["id"], id=f"t{t}"))
+            messages.append(AIMessage(content=listing, id=f"a{t}"))
+        else:
+            messages.append(AIMessage(content="Dạ, em đã ghi nhận. Anh/chị muốn chọn chuyến bay nào ạ?", id=f"a{t}"))
+    return messages
+
+
+def test_context_window_is_incremental_and_budgeted(monkeypatch):
+    from langchain_core.messages import SystemMessage
+    from src.flight_booking_agent.agents import context_window
+
+    monkeypatch.setattr(context_window, "CONTEXT_WINDOW_MAX_MESSAGES", 4)
+    monkeypatch.setattr(context_window, "CONTEXT_SUMMARY_TOKENS", 30)
+    messages = _long_conversation(12)
+
+    context = None
+    for end in range(1, len(messages) + 1):
+        context = context_window.advance(context, messages[:end])
+    assert context == context_window.advance(context, messages)  # không có tin nhắn mới: không đổi
+    assert [messages[i].id for i, _, _ in context["window"]] == ["h10", "a10", "h11", "a11"]
+    assert context["tokens"] <= context_window.CONTEXT_WINDOW_TOKENS
+    # Lời khách đã trôi khỏi cửa sổ còn trong bản tóm tắt (phần cuối, trong ngân sách)
+    assert "ngày 10/12" in context["summary"] and len(context["summary"].split()) <= 31
+
+    state = {"messages": messages, "context": context, "departure_from": "SGN", "arrival_to": "HAN", "passenger_count": 2}
+    prompt = context_window.context_prompt(state, SystemMessage(content="Vivi"))
+    assert prompt[0].content.startswith("Vivi\n\nThông tin đã biết: chặng SGN → HAN, 2 hành khách.")
+    assert prompt[1:] == messages[-4:]
+
+    # Lịch sử bị viết lại (không khớp id): dựng lại cửa sổ từ cuối thay vì dùng chỉ số cũ
+    rewritten = messages[:-2] + [HumanMessage(content="xem thêm", id="new")]
+    assert context_window.advance(context, rewritten)["window"][-1][1] == "new"
+
+
+def test_context_summary_runs_in_background(monkeypatch):
+    from langchain_core.messages import AIMessage
+    from src.flight_booking_agent.agents import context_window
+
+    summaries = []
+    release = threading.Event()
+
+    def responder(messages, tool_names):
+        assert release.wait(timeout=5)  # lời gọi LLM chỉ xong sau khi test cho phép
+        summaries.append(messages[-1].content)
+        return AIMessage(content="Khách hỏi chuyến sáng SGN-HAN nhiều ngày trong tháng 12.")
+
+    install_fake_llm(monkeypatch, FakeChatModel(responder=responder))
+    monkeypatch.setattr(context_window, "CONTEXT_SUMMARY_MODE", "llm")
+    monkeypatch.setattr(context_window, "CONTEXT_WINDOW_MAX_MESSAGES", 4)
+    messages = _long_conversation(6)
+
+    context = context_window.advance(None, messages[:4])
+    context = context_window.advance(context, messages)
+    assert context["pending"] and context["summary"] == ""  # đã gửi việc, lượt này không chờ LLM
+    assert summaries == []
+
+    release.set()
+    context_window.summarizer.wait(timeout=5)
+    context = context_window.advance(context, messages)
+    assert context["summary"] == "Khách hỏi chuyến sáng SGN-HAN nhiều ngày trong tháng 12."
+    assert (context["overflow"], context["pending"]) == ([], None)
+    assert len(summaries) == 1 and "Tin nhắn mới:" in summaries[0]
+
+
+def test_context_window_long_conversation_benchmark():
+    """
+    Benchmark hội thoại 200 lượt: mỗi lượt so sánh `filter_for_human_ai(messages)[-6:]`
+    (duyệt lại toàn bộ lịch sử) với `advance` của cửa sổ ngữ cảnh (chỉ xử lý tin nhắn mới).
+    Báo cáo thời gian CPU mỗi lượt ở đầu/cuối hội thoại và số token của phần lịch sử trong prompt.
+    """
+    from langchain_core.messages import SystemMessage
+    from src.flight_booking_agent.agents import context_window
+    from src.flight_booking_agent.agents.utils import filter_for_human_ai
+
+    messages = _long_conversation(200)
+    boundaries = [i + 1 for i, m in enumerate(messages) if m.id.startswith("a")]
+
+    def best_of(fn, repeat=5):
+        timings = []
+        for _ in range(repeat):
+            start = time.process_time_ns()
+            result = fn()
+            timings.append(time.process_time_ns() - start)
+        return min(timings) / 1000, result
+
+    old_us, new_us, new_tokens = [], [], []
+    context = None
+    for end in boundaries:
+        history = messages[:end]
+        old_us.append(best_of(lambda: filter_for_human_ai(history)[-6:])[0])
+        previous = context
+        elapsed, context = best_of(lambda: context_window.advance(previous, history))
+        new_us.append(elapsed)
+        prompt = context_window.context_prompt({"messages": history, "context": context}, SystemMessage(content=""))
+        new_tokens.append(sum(context_window.estimate_tokens(m.content) for m in prompt))
+    full_tokens = sum(context_window.estimate_tokens(m.content) for m in filter_for_human_ai(messages))
+
+    mean = lambda values: sum(values) / len(values)
+    print(f"\n200-turn conversation ({len(messages)} messages): per-turn CPU "
+          f"filter_for_human_ai {mean(old_us[:20]):.1f}us -> {mean(old_us[-20:]):.1f}us, "
+          f"context window {mean(new_us[:20]):.1f}us -> {mean(new_us[-20:]):.1f}us; "
+          f"prompt history tokens max {max(new_tokens)} (full history {full_tokens})")
+
+    budget = context_window.CONTEXT_WINDOW_TOKENS + 2 * context_window.CONTEXT_SUMMARY_TOKENS
+    assert max(new_tokens) <= budget
+    if TIMING_ASSERTS:
+        assert mean(new_us[-20:]) < 3 * mean(new_us[:20])  # không tăng theo độ dài lịch sử
+        assert mean(new_us[-20:]) < mean(old_us[-20:])
+
+
+def test_general_agent_answers_policy_questions_from_faq(fake_llm):
+    from src.flight_booking_agent.agents.general import general_node
+
+    cases = {
+        "Hành lý xách tay được mang bao nhiêu kg vậy em?": "xách tay",
+        "cho em hỏi check in online trước mấy tiếng": "check-in",
+        "toi muon huy ve thi co duoc hoan tien khong": "hoàn",
+    }
+    for question, expected in cases.items():
+        reply = general_node({"messages": [HumanMessage(content=question)]})["messages"][0].content
+        assert reply.startswith("Dạ, về ") and expected in reply.lower(), (question, reply)
+
+    # Lời xác nhận và câu hỏi ngoài chủ đề không được trả lời bằng một đoạn chính sách
+    for chatter in ("xin chào", "ok", "vâng", "bạn tên gì", "thời tiết hà nội thế nào", "hôm nay ăn gì"):
+        reply = general_node({"messages": [HumanMessage(content=chatter)]})["messages"][0].content
+        assert reply == "Dạ, em có thể giúp gì khác cho anh/chị ạ?", (chatter, reply)
+    assert fake_llm.calls == []
+
+
+def test_faq_index_persists_with_mmap_and_caches_answers(tmp_path):
+    import numpy as np
+    from src.flight_booking_agent.agents import faq_index as faq
+
+    index_dir = str(tmp_path / "index")
+    built = faq.load_or_build(index_dir=index_dir, embedder=faq.HashingEmbedder())
+    loaded = faq.load_or_build(index_dir=index_dir, embedder=faq.HashingEmbedder())
+    assert isinstance(loaded.vectors, np.memmap) and not isinstance(built.vectors, np.memmap)
+    assert loaded.fingerprint == built.fingerprint
+    assert np.allclose(loaded.vectors, built.vectors)
+    # Tài liệu đổi (hoặc đổi embedder) thì chỉ mục cũ không được dùng lại
+    assert faq.FaqIndex.load(index_dir, faq.HashingEmbedder(), fingerprint="khác") is None
+    assert faq.FaqIndex.load(index_dir, faq.HashingEmbedder(dim=64)) is None
+
+    question = "Hành lý ký gửi tối đa bao nhiêu kg?"
+    first = loaded.answer(question)
+    assert first is not None and first.hits[0].score >= faq.FAQ_MIN_SCORE
+    assert loaded.answer("hanh ly ky gui toi da bao nhieu KG ạ") is first
+    assert loaded.counters == {"hits": 1, "misses": 1}
+    # Ngưỡng khác thì không lấy câu trả lời đã cache theo ngưỡng cũ
+    assert loaded.answer(question, min_score=0.99) is None
+    assert loaded.counters == {"hits": 1, "misses": 2}
+    assert [h.chunk for h in loaded.search([question])[0]] == [h.chunk for h in built.search([question])[0]]
+
+
+def _synthetic_faq_chunks(n: int):
+    import random
+    from src.flight_booking_agent.agents.faq_index import Chunk, load_chunks
+
+    base = load_chunks()
+    vocab = sorted({w for c in base for w in c.text.split()})
+    rng = random.Random(3)
+    chunks = []
+    for i in range(n):
+        source = base[i % len(base)]
+        words = source.text.split()
+        rng.shuffle(words)
+        chunks.append(Chunk(f"doc{i // 20}.md", source.title, f"{source.heading} #{i}",
+                            " ".join(words[:60] + rng.sample(vocab, 20))))
+    return chunks
+
+
+def test_faq_index_build_and_query_benchmark(tmp_path):
+    """
+    Benchmark chỉ mục FAQ với 10k và 100k đoạn tổng hợp: thời gian dựng, lưu và mở lại
+    (memory-map), độ trễ một câu hỏi (p50/p95), thông lượng khi tìm theo lô 64 câu, và độ
+    trễ câu trả lời đã có trong cache.
+    """
+    from src.flight_booking_agent.agents.faq_index import FaqIndex, HashingEmbedder
+
+    questions = ["hành lý xách tay bao nhiêu kg", "vé có hoàn tiền được không", "check in online lúc nào",
+                 "trẻ em có cần giấy tờ gì", "đổi ngày bay mất phí bao nhiêu"]
+    print()
+    for n in (10_000, 100_000):
+        chunks = _synthetic_faq_chunks(n)
+        start = time.perf_counter()
+        index = FaqIndex.build(chunks, HashingEmbedder())
+        build = time.perf_counter() - start
+        start = time.perf_counter()
+        index.save(str(tmp_path / f"index-{n}"))
+        save = time.perf_counter() - start
+        start = time.perf_counter()
+        loaded = FaqIndex.load(str(tmp_path / f"index-{n}"), HashingEmbedder())
+        load = time.perf_counter() - start
+
+        latencies = []
+        for question in questions * 8:
+            start = time.perf_counter()
+            hits = loaded.search([question])[0]
+            latencies.append(time.perf_counter() - start)
+        latencies.sort()
+        start = time.perf_counter()
+        loaded.search((questions * 13)[:64])
+        batch = time.perf_counter() - start
+
+        loaded.answer(questions[0])
+        start = time.perf_counter()
+        for _ in range(1000):
+            loaded.answer(questions[0])
+        cached = (time.perf_counter() - start) / 1000
+
+        print(f"{n:>7} chunks: build {build:.2f}s save {save:.2f}s mmap load {load * 1000:.0f}ms | "
+              f"query p50 {latencies[len(latencies) // 2] * 1000:.2f}ms p95 {latencies[int(len(latencies) * 0.95)] * 1000:.2f}ms | "
+              f"batch of 64 {64 / batch:.0f} q/s | cached answer {cached * 1e6:.1f}us")
+        assert len(hits) == 3 and hits[0].score >= hits[-1].score
+        if TIMING_ASSERTS:
+            assert cached < latencies[len(latencies) // 2]
@@ -0,0 +1,596 @@
+import asyncio
+import json
+import random
+import re
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+import pytest
+
+from src.flight_booking_agent.services.amadeus_client import AmadeusClient, FlightSearchCache, flight_search_key
+from src.flight_booking_agent.services.amadeus_http import AmadeusHttpTransport
+from src.flight_booking_agent.tools.flight_query import FlightTable, duration_minutes
+from src.flight_booking_agent.tools.booking_tools import (
+    fare_calendar_tool, format_duration_vi, format_flights_compact, format_vnd, render_fare_calendar,
+    render_flight_summary, search_flights_tool, select_top_flights,
+)
+from tests.conftest import TIMING_ASSERTS, MockAmadeusServer, StubAmadeusBackend, make_offers
+
+
+class FakeTimer:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_client(backend: StubAmadeusBackend, cache: FlightSearchCache) -> AmadeusClient:
+    client = AmadeusClient.__new__(AmadeusClient)
+    client.transport = "sdk"
+    client.client = backend
+    client.cache = cache
+    return client
+
+
+def make_http_client(server: MockAmadeusServer, cache: FlightSearchCache = None, **transport_options) -> AmadeusClient:
+    client = AmadeusClient(transport="http")
+    client.http = AmadeusHttpTransport("test-id", "test-secret", server.base_url, **transport_options)
+    client.cache = cache or FlightSearchCache(maxsize=0)
+    return client
+
+
+def make_sdk_client(server: MockAmadeusServer) -> AmadeusClient:
+    from amadeus import Client
+
+    client = AmadeusClient(transport="sdk")
+    client.client = Client(client_id="test-id", client_secret="test-secret", host="127.0.0.1", port=server.port, ssl=False)
+    client.cache = FlightSearchCache(maxsize=0)
+    return client
+
+
+def test_search_key_is_normalized():
+    assert flight_search_key(" sgn", "han ", "2026-12-25", "2") == flight_search_key("SGN", "HAN", "2026-12-25", 2)
+    assert flight_search_key("SGN", "HAN", "2026-12-25", 2, non_stop=True) != flight_search_key("SGN", "HAN", "2026-12-25", 2)
+
+
+def test_cache_hit_expiry_and_lru_eviction():
+    timer = FakeTimer()
+    backend = StubAmadeusBackend()
+    client = make_client(backend, FlightSearchCache(maxsize=2, ttl=60, timer=timer))
+
+    client.search_flights("SGN", "HAN", "2026-12-25", 1)
+    client.search_flights("sgn", "han", "2026-12-25", 1)
+    assert backend.calls == 1
+
+    client.search_flights("SGN", "DAD", "2026-12-25", 1)
+    client.search_flights("SGN", "PQC", "2026-12-25", 1)  # đẩy SGN-HAN (ít dùng nhất) ra khỏi cache
+    assert client.cache.stats()["evictions"] == 1
+
+    timer.now = 61
+    client.search_flights("SGN", "PQC", "2026-12-25", 1)  # hết TTL → gọi lại upstream
+    assert backend.calls == 4
+    assert client.cache.stats() == {"hits": 1, "misses": 4, "coalesced": 0, "evictions": 1, "size": 1}
+
+
+def test_errors_are_not_cached():
+    client = make_client(StubAmadeusBackend(), FlightSearchCache(maxsize=8, ttl=60))
+    calls = []
+
+    def failing_loader():
+        calls.append(1)
+        return {"error": "Không tìm thấy chuyến bay"}
+
+    key = flight_search_key("SGN", "HAN", "2026-12-25", 1)
+    client.cache.get_or_load(key, failing_loader)
+    client.cache.get_or_load(key, failing_loader)
+    assert len(calls) == 2
+
+
+def test_concurrent_identical_misses_share_one_upstream_call():
+    backend = StubAmadeusBackend(latency=0.1)
+    client = make_client(backend, FlightSearchCache(maxsize=8, ttl=60))
+    barrier = threading.Barrier(8)
+
+    def search():
+        barrier.wait()
+        return client.search_flights("SGN", "HAN", "2026-12-25", 1)
+
+    with ThreadPoolExecutor(8) as pool:
+        results = list(pool.map(lambda _: search(), range(8)))
+
+    assert backend.calls == 1
+    assert all(r == results[0] for r in results)
+    assert client.cache.stats()["coalesced"] == 7
+
+
+def test_cancelled_leader_does_not_cancel_coalesced_waiters():
+    cache = FlightSearchCache(maxsize=8, ttl=60)
+    key = flight_search_key("SGN", "HAN", "2026-12-25", 1)
+    calls = []
+
+    async def loader():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return [{"price": len(calls)}]
+
+    async def scenario():
+        leader = asyncio.create_task(cache.aget_or_load(key, loader))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(cache.aget_or_load(key, loader))
+        await asyncio.sleep(0.01)
+        leader.cancel()  # ví dụ wait_for hết hạn ở lượt của người dùng khác
+        result = await waiter
+        return leader.cancelled(), waiter.cancelled(), result
+
+    assert asyncio.run(scenario()) == (True, False, [{"price": 2}])
+    assert len(calls) == 2
+    assert cache.peek(key) == [{"price": 2}]
+
+
+def test_search_tool_returns_json(stub_amadeus):
+    output = json.loads(search_flights_tool.invoke(
+        {"origin": "SGN", "destination": "HAN", "departure_date": "2026-12-25", "adults": 1}
+    ))
+    assert output[0]["flight_number"] == "VN200"
+    # Trả đủ các chuyến đã lấy về theo thứ tự cố định; booking node chỉ hiển thị top-N
+    assert len(output) == 10
+    assert output == select_top_flights(output, top_n=0)
+
+
+def _sample_results(count: int = 10) -> list:
+    client = make_client(StubAmadeusBackend(), FlightSearchCache())
+    return client.format_flight_results(make_offers("SGN", "HAN", "2026-12-25", count))
+
+
+def test_compact_flight_table_is_deterministic():
+    flights = _sample_results(3)
+    shuffled = [flights[2], flights[0], flights[1]]
+
+    top = select_top_flights(shuffled, top_n=2)
+    table = format_flights_compact(top)
+
+    assert [f["flight_number"] for f in top] == ["VN200", "VJ201"]
+    assert table == (
+        "ngay:2026-12-25\n"
+        "#|chuyen|tu|den|di|den_luc|bay|dung|gia_VND\n"
+        "1|VN200|SGN|HAN|06:00|08:10|2h10m|0|1500000\n"
+        "2|VJ201|SGN|HAN|07:15|09:25|2h10m|0|1585000"
+    )
+
+
+def test_compact_flight_table_marks_overnight_arrival():
+    flight = dict(_sample_results(1)[0], departure_time="2026-12-25T23:30:00", arrival_time="2026-12-26T01:40:00")
+    assert format_flights_compact([flight]).splitlines()[-1] == "1|VN200|SGN|HAN|23:30|01:40+1|2h10m|0|1500000"
+
+
+def test_flight_summary_template_formats_vnd_times_and_duration():
+    flights = _sample_results(2)
+    flights[1] = dict(flights[1], arrival_time="2026-12-26T00:20:00", duration="PT17H5M", stops=1)
+
+    lines = render_flight_summary(flights).splitlines()
+
+    assert lines[0] == "Dạ, em tìm được 2 chuyến bay từ SGN đến HAN ngày 25/12/2026:"
+    assert lines[1] == "1. **VN200**: cất cánh 06:00, hạ cánh 08:10 (2 giờ 10 phút, bay thẳng) - **1.500.000 VND**"
+    assert lines[2] == "2. **VJ201**: cất cánh 07:15, hạ cánh 00:20 (+1 ngày) (17 giờ 5 phút, 1 điểm dừng) - **1.585.000 VND**"
+    assert lines[-1] == "Anh/chị muốn chọn chuyến bay số mấy ạ?"
+    assert format_vnd(12345678.0) == "12.345.678 VND"
+    assert format_duration_vi("PT45M") == "45 phút"
+    assert "không tìm thấy" in render_flight_summary([])
+
+
+def _mixed_results(count: int = 10) -> list:
+    """Kết quả mẫu có thêm chuyến nối chuyến, bay đêm và hãng khác để thử bộ lọc."""
+    flights = _sample_results(count)
+    flights[2] = dict(flights[2], stops=1, duration="PT5H40M")
+    flights[3] = dict(flights[3], departure_time="2026-12-25T22:45:00", arrival_time="2026-12-26T00:55:00")
+    flights[6] = dict(flights[6], airline="QH", flight_number="QH206")
+    return flights
+
+
+def test_flight_table_filters_sorts_and_pages_locally():
+    table = FlightTable(_mixed_results())
+    numbers = lambda flights: [f["flight_number"] for f in flights]
+
+    morning = table.page({"time_window": (300, 720)}, "price", page_size=5)
+    assert numbers(morning.flights) == ["VN200", "VJ201", "VN202", "VN204"]
+    assert (morning.total, morning.pages) == (4, 1)
+    assert numbers(table.page({"time_window": (21 * 60, 5 * 60)}).flights) == ["VJ203"]  # khung qua nửa đêm
+    assert "VN202" not in numbers(table.page({"max_stops": 0}, page_size=10).flights)
+    assert numbers(table.page({"carriers": ("QH",)}).flights) == ["QH206"]
+    assert "QH206" not in numbers(table.page({"exclude_carriers": ("QH",)}, page_size=10).flights)
+    assert numbers(table.page({"max_price": 1670000, "min_price": 1585000}).flights) == ["VJ201", "VN202"]
+    assert numbers(table.page({"max_duration": 180}, page_size=10).flights) == [
+        n for n in numbers(table.flights) if n != "VN202"
+    ]
+
+    # Sắp xếp ổn định, hòa thì theo (giá, giờ đi, số hiệu); trang vượt quá bị kẹp về trang cuối
+    assert numbers(table.page(sort="-departure", page_size=3).flights) == ["VJ203", "VJ209", "VN208"]
+    assert table.page(sort="duration", page_size=10).flights[-1]["flight_number"] == "VN202"
+    last = table.page(page=7, page_size=4)
+    assert (last.page, last.pages, numbers(last.flights)) == (2, 3, ["VN208", "VJ209"])
+
+    assert table.best({"time_window": (720, 1080)}, "departure")["flight_number"] == "VJ205"
+    assert table.best({"carriers": ("BL",)}) is None
+    assert table.find("vj 201")["flight_number"] == "VJ201"
+    assert table.find("VN999") is None
+    assert duration_minutes("PT17H5M") == 1025
+
+
+def test_flight_summary_template_with_header_and_more_hint():
+    lines = render_flight_summary(_sample_results(2), header="Dạ, có 2 chuyến buổi sáng:", more=3).splitlines()
+    assert lines[0] == "Dạ, có 2 chuyến buổi sáng:"
+    assert lines[-2] == "(Còn 3 chuyến khác, anh/chị nhắn `xem thêm` để xem tiếp ạ.)"
+
+
+def test_flight_table_refinement_benchmark():
+    """
+    Benchmark lọc + sắp xếp + cắt trang trên 1000 chuyến: bảng cột numpy so với vòng lặp
+    Python trên list dict. Dựng bảng tốn hơn một lần lọc bằng Python; bảng chỉ nhanh hơn khi
+    được dùng lại cho nhiều view. Với ~10 chuyến mỗi lượt, cái lợi chính là bỏ được lời gọi
+    LLM (xem benchmark trong test_agents.py), không phải tốc độ lọc.
+    """
+    flights = []
+    for i, f in enumerate(_mixed_results(10) * 100):
+        flights.append(dict(f, flight_number=f"{f['airline']}{1000 + i}", price=f["price"] + 1000 * (i % 37)))
+    filters = {"time_window": (300, 720), "max_stops": 0, "max_price": 1800000}
+
+    def python_page():
+        keep = [f for f in flights if 300 <= int(f["departure_time"][11:13]) * 60 + int(f["departure_time"][14:16]) < 720
+                and not f["stops"] and f["price"] <= 1800000]
+        return sorted(keep, key=lambda f: (f["price"], f["departure_time"], f["flight_number"]))[:5]
+
+    def numpy_page():
+        return FlightTable(flights).page(filters).flights
+
+    assert numpy_page() == python_page()
+    timings = {}
+    for name, run in (("python", python_page), ("numpy", numpy_page)):
+        start = time.perf_counter()
+        for _ in range(20):
+            run()
+        timings[name] = (time.perf_counter() - start) / 20 * 1000
+    table = FlightTable(flights)
+    start = time.perf_counter()
+    for _ in range(20):
+        table.page(filters)
+    reuse = (time.perf_counter() - start) / 20 * 1000
+    print(f"\nrefine 1000 flights: python {timings['python']:.2f}ms, numpy (build + page) {timings['numpy']:.2f}ms, "
+          f"numpy page only {reuse:.3f}ms")
+
+    if TIMING_ASSERTS:
+        assert timings["numpy"] < 50
+        assert reuse < timings["python"]
+
+
+def count_tokens(text: str) -> int:
+    """Đếm token bằng tiktoken (cl100k_base) nếu có sẵn; offline thì ước tính theo từ và dấu câu."""
+    try:
+        import tiktoken
+        return len(tiktoken.get_encoding("cl100k_base").encode(text))
+    except Exception:
+        return len(re.findall(r"\w+|[^\w\s]", text))
+
+
+def test_flight_prompt_token_benchmark():
+    """
+    Benchmark số token của phần kết quả chuyến bay trong prompt (tóm tắt ở State 1 và
+    hiểu lựa chọn ở State 2, lặp lại mỗi lượt hỏi thêm) trên payload Amadeus mẫu:
+    JSON `indent=2` của 10 kết quả (cũ) so với bảng gọn, cùng 10 kết quả và top-5.
+    """
+    results = _sample_results(10)
+    old = count_tokens(json.dumps(results, ensure_ascii=False, indent=2))
+    compact_all = count_tokens(format_flights_compact(select_top_flights(results, top_n=10)))
+    compact_top5 = count_tokens(format_flights_compact(select_top_flights(results, top_n=5)))
+    print(f"\nflight results prompt tokens: json indent=2 {old} -> compact {compact_all} -> compact top-5 {compact_top5}")
+
+    assert compact_all < old / 3
+    assert compact_top5 < compact_all
+
+
+def test_cache_benchmark_on_skewed_routes():
+    """
+    Benchmark: 2000 tìm kiếm trên 40 chặng theo phân phối Zipf (vài chặng nóng như
+    SGN→HAN chiếm phần lớn lưu lượng), 16 luồng đồng thời, upstream trễ 10ms.
+    So sánh số lời gọi upstream và p95 khi bật/tắt cache.
+    """
+    airports = ["SGN", "HAN", "DAD", "PQC", "CXR", "HPH", "VCA", "HUI"]
+    routes = [(a, b) for a in airports for b in airports if a != b][:40]
+    weights = [1 / (rank + 1) ** 1.2 for rank in range(len(routes))]
+    rng = random.Random(7)
+    workload = [rng.choices(routes, weights)[0] for _ in range(2000)]
+
+    def run(cache: FlightSearchCache):
+        backend = StubAmadeusBackend(latency=0.01)
+        client = make_client(backend, cache)
+
+        def timed(route):
+            started = time.perf_counter()
+            client.search_flights(route[0], route[1], "2026-12-25", 1)
+            return time.perf_counter() - started
+
+        with ThreadPoolExecutor(16) as pool:
+            latencies = list(pool.map(timed, workload))
+        return backend.calls, statistics.median(latencies), statistics.quantiles(latencies, n=20)[18]
+
+    calls_off, p50_off, p95_off = run(FlightSearchCache(maxsize=0, ttl=0))
+    calls_on, p50_on, p95_on = run(FlightSearchCache(maxsize=64, ttl=300))
+    print(
+        f"\nupstream calls: {calls_off} -> {calls_on}; p50: {p50_off * 1000:.1f}ms -> {p50_on * 1000:.1f}ms; "
+        f"p95: {p95_off * 1000:.1f}ms -> {p95_on * 1000:.1f}ms"
+    )
+
+    assert calls_off == len(workload)
+    assert calls_on <= 40
+    # Lúc khởi động, các request chờ chung một lần tải (coalesced) vẫn mất ~10ms,
+    # nên p95 dao động theo lịch luồng; p50 phản ánh ổn định hơn lợi ích của cache.
+    if TIMING_ASSERTS:
+        assert p50_on < p50_off / 10
+        assert p95_on < 0.75 * p95_off
+
+
+def _fare_by_origin_and_day(origin: str, departure_date: str) -> int:
+    # HPH rẻ hơn HAN 100k vào ngày chẵn, đắt hơn vào ngày lẻ; ngày 23 rẻ nhất
+    day = int(departure_date[-2:])
+    base = 1400000 if day == 23 else 1600000 + 20000 * (day % 5)
+    return base + (-100000 if day % 2 == 0 else 100000) * (origin == "HPH")
+
+
+def test_fare_calendar_keeps_cheapest_fare_per_day_across_airports():
+    backend = StubAmadeusBackend(fare=_fare_by_origin_and_day)
+    client = make_client(backend, FlightSearchCache())
+
+    result = client.search_fare_calendar(["HAN", "HPH"], ["SGN"], "2026-12-21", 4, 1)
+
+    assert backend.calls == 8
+    assert result["failed"] == []
+    assert [(d["date"], d["origin"], d["price"]) for d in result["calendar"]] == [
+        ("2026-12-21", "HAN", 1620000.0),
+        ("2026-12-22", "HPH", 1540000.0),
+        ("2026-12-23", "HAN", 1400000.0),
+        ("2026-12-24", "HPH", 1580000.0),
+    ]
+    # Lịch giá dùng chung khóa cache với `search_flights_tool`: chọn ngày xong là cache hit
+    client.search_flights("HAN", "SGN", "2026-12-23", 1, max_results=10)
+    assert backend.calls == 8
+
+
+def test_fare_calendar_survives_partial_failures_and_timeouts():
+    backend = StubAmadeusBackend(fail_dates={"2026-12-22"}, slow_dates={"2026-12-23"}, slow_latency=2.0)
+    client = make_client(backend, FlightSearchCache())
+
+    started = time.perf_counter()
+    result = client.search_fare_calendar(["HAN"], ["SGN"], "2026-12-21", 4, 1, call_timeout=0.2)
+    elapsed = time.perf_counter() - started
+
+    assert elapsed < 1.0  # không chờ ngày chậm (2s)
+    assert sorted((f["date"], f["reason"]) for f in result["failed"]) == [("2026-12-22", "error"), ("2026-12-23", "timeout")]
+    assert [d["price"] is not None for d in result["calendar"]] == [True, False, False, True]
+
+
+def test_fare_calendar_tool_output_is_compact_and_renders(stub_amadeus):
+    output = fare_calendar_tool.invoke({"origins": ["HAN"], "destinations": ["SGN"], "start_date": "2026-12-21", "days": 2})
+
+    assert output == (
+        '{"lich":[{"d":"2026-12-21","p":1500000.0,"f":"VN200","r":"HAN-SGN"},'
+        '{"d":"2026-12-22","p":1500000.0,"f":"VN200","r":"HAN-SGN"}]}'
+    )
+    rendered = render_fare_calendar({"lich": [
+        {"d": "2026-12-21", "p": 1620000, "f": "VN200", "r": "HAN-SGN"},
+        {"d": "2026-12-22", "loi": "timeout"},
+        {"d": "2026-12-23", "p": 1400000, "f": "VJ201", "r": "HPH-SGN"},
+        {"d": "2026-12-24"},
+    ]}).splitlines()
+    assert rendered[1:5] == [
+        "- T2 21/12: **1.620.000 VND** (VN200, HAN-SGN)",
+        "- T3 22/12: chưa lấy được giá",
+        "- T4 23/12: **1.400.000 VND** (VJ201, HPH-SGN) ← rẻ nhất",
+        "- T5 24/12: không có chuyến",
+    ]
+
+
+def test_fare_calendar_fanout_benchmark():
+    """
+    Benchmark: lịch giá 7 ngày × 2 sân bay đi (14 lời gọi, upstream trễ 50ms),
+    gọi tuần tự từng ngày như trước so với tìm song song.
+    """
+    dates = [f"2026-12-{day}" for day in range(21, 28)]
+    origins = ["HAN", "HPH"]
+
+    sequential_client = make_client(StubAmadeusBackend(latency=0.05), FlightSearchCache())
+    started = time.perf_counter()
+    for departure_date in dates:
+        for origin in origins:
+            sequential_client.search_flights(origin, "SGN", departure_date, 1, max_results=10)
+    sequential = time.perf_counter() - started
+
+    backend = StubAmadeusBackend(latency=0.05)
+    fanout_client = make_client(backend, FlightSearchCache())
+    started = time.perf_counter()
+    result = fanout_client.search_fare_calendar(origins, ["SGN"], dates[0], len(dates), 1)
+    fanout = time.perf_counter() - started
+    print(f"\nfare calendar 7 days x 2 airports: sequential {sequential * 1000:.0f}ms -> fan-out {fanout * 1000:.0f}ms")
+
+    assert backend.calls == 14
+    assert len(result["calendar"]) == 7
+    if TIMING_ASSERTS:
+        assert fanout < sequential / 4
+
+
+def test_http_transport_matches_sdk_output_contract():
+    with MockAmadeusServer() as server:
+        sdk_result = make_sdk_client(server).search_flights("SGN", "HAN", "2026-12-25", 2, max_results=5)
+        http_client = make_http_client(server)
+        sync_result = http_client.search_flights("SGN", "HAN", "2026-12-25", 2, max_results=5)
+
+        async def search():
+            try:
+                return await http_client.asearch_flights("SGN", "HAN", "2026-12-25", 2, max_results=5)
+            finally:
+                await http_client.aclose()
+
+        async_result = asyncio.run(search())
+
+    assert len(sdk_result) == 5
+    assert sync_result == sdk_result
+    assert async_result == sdk_result
+
+
+def test_http_transport_reuses_token_and_connections():
+    timer = FakeTimer()
+    with MockAmadeusServer(token_ttl=120) as server:
+        client = make_http_client(server, refresh_margin=60, timer=timer)
+
+        async def scenario():
+            search = lambda day: client.asearch_flights("SGN", "HAN", f"2026-12-{day:02d}", 1)
+            try:
+                await asyncio.gather(*(search(day) for day in range(1, 9)))
+                assert server.counters["tokens"] == 1  # 8 request đồng thời chỉ lấy token một lần
+                for day in range(9, 17):
+                    await search(day)
+                assert server.counters["connections"] <= 8  # các lượt sau dùng lại kết nối keep-alive
+
+                timer.now = 70  # còn hạn nhưng trong biên làm mới: dùng token cũ, làm mới ở nền
+                assert isinstance(await search(17), list)
+                await asyncio.sleep(0.05)
+                assert server.counters["tokens"] == 2
+
+                server.tokens.clear()  # token bị thu hồi trước hạn: 401 -> lấy token mới và gửi lại
+                assert isinstance(await search(18), list)
+                assert server.counters["unauthorized"] == 1
+                assert server.counters["tokens"] == 3
+            finally:
+                await client.aclose()
+
+        asyncio.run(scenario())
+
+
+def test_http_transport_logs_failed_background_token_refresh(capsys):
+    timer = FakeTimer()
+    with MockAmadeusServer(token_ttl=120) as server:
+        client = make_http_client(server, refresh_margin=60, timer=timer)
+
+        async def scenario():
+            search = lambda day: client.asearch_flights("SGN", "HAN", f"2026-12-{day:02d}", 1)
+            try:
+                await search(1)
+                timer.now = 70  # trong biên làm mới: làm mới ở nền, lần này upstream lỗi
+                server.fail_tokens = 1
+                assert isinstance(await search(2), list)
+                await asyncio.sleep(0.05)
+                state = next(iter(client.http._states.values()))
+                assert state.refresh_task is None
+                assert "Lỗi làm mới token Amadeus ở nền" in capsys.readouterr().out
+
+                assert isinstance(await search(3), list)  # lượt sau làm mới lại được
+                await asyncio.sleep(0.05)
+                assert server.counters["tokens"] == 2
+            finally:
+                await client.aclose()
+
+        asyncio.run(scenario())
+
+
+def test_sync_paths_share_the_background_loop_and_turn_deadline():
+    from langchain_core.runnables import RunnableLambda
+    from src.flight_booking_agent.deadlines import Deadline
+
+    with MockAmadeusServer() as server:
+        client = make_http_client(server)
+        for _ in range(3):
+            result = client.search_fare_calendar(["SGN"], ["HAN"], "2026-12-01", 3, 1)
+            assert len(result["calendar"]) == 3 and result["failed"] == []
+        client.search_flights("SGN", "HAN", "2026-12-25", 1)
+        # Lịch giá (đồng bộ) và tìm kiếm đồng bộ dùng chung một event loop nền: một pool, một token
+        assert len(client.http._states) == 1
+        assert server.counters["tokens"] == 1
+
+    # Graph chạy bằng `invoke`: thời hạn lượt trong config vẫn áp dụng cho lời gọi trên loop nền
+    with MockAmadeusServer(slow_every=1, slow_latency=2.0) as server:
+        client = make_http_client(server)
+        search = RunnableLambda(lambda _: client.search_flights("SGN", "HAN", "2026-12-25", 1))
+        started = time.perf_counter()
+        result = search.invoke(None, config={"configurable": {"turn_deadline": Deadline(0.1)}})
+        elapsed = time.perf_counter() - started
+
+    assert "error" in result
+    assert elapsed < 1.0  # không chờ phản hồi chậm (2s)
+
+
+def test_http_transport_deadline_and_hedging():
+    with MockAmadeusServer(slow_every=1, slow_latency=1.0) as server:
+        hedged = make_http_client(server, hedge_after=0.05)
+        started = time.perf_counter()
+        result = hedged.search_flights("SGN", "HAN", "2026-12-25", 1)
+        hedged_elapsed = time.perf_counter() - started
+
+        strict = make_http_client(server, deadline=0.1, hedge_after=0)
+        started = time.perf_counter()
+        timed_out = strict.search_flights("HAN", "DAD", "2026-12-25", 1)
+        deadline_elapsed = time.perf_counter() - started
+
+    assert isinstance(result, list) and len(result) == 5
+    assert hedged.http.counters["hedged"] == 1
+    assert hedged_elapsed < 0.6  # bản gửi lại trả trước phản hồi chậm (1s)
+    assert "error" in timed_out
+    assert deadline_elapsed < 0.6
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def test_http_transport_tail_latency_benchmark():
+    """
+    Benchmark: 200 lần tìm kiếm khác nhau, 8 luồng đồng thời, trên mock server trễ 5ms
+    và cứ 40 truy vấn có một truy vấn trễ 300ms. So SDK đồng bộ (mỗi request một kết nối
+    mới, đẩy sang thread) với transport httpx (keep-alive, token cache, hedging sau 50ms).
+    """
+    searches = [("SGN", "HAN", (date(2026, 11, 1) + timedelta(days=i)).isoformat()) for i in range(200)]
+
+    with MockAmadeusServer(latency=0.005, slow_every=40) as server:
+        sdk_client = make_sdk_client(server)
+
+        def timed_sdk(search):
+            started = time.perf_counter()
+            sdk_client.search_flights(*search, 1)
+            return time.perf_counter() - started
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            sdk_latencies = list(pool.map(timed_sdk, searches))
+        sdk_connections = server.counters["connections"]
+
+    with MockAmadeusServer(latency=0.005, slow_every=40) as server:
+        http_client = make_http_client(server, hedge_after=0.05)
+
+        async def run_http():
+            semaphore = asyncio.Semaphore(8)
+
+            async def timed(search):
+                async with semaphore:
+                    started = time.perf_counter()
+                    await http_client.asearch_flights(*search, 1)
+                    return time.perf_counter() - started
+
+            try:
+                return await asyncio.gather(*(timed(search) for search in searches))
+            finally:
+                await http_client.aclose()
+
+        http_latencies = asyncio.run(run_http())
+        http_connections = server.counters["connections"]
+
+    sdk_p50, sdk_p99 = _percentile(sdk_latencies, 0.5), _percentile(sdk_latencies, 0.99)
+    http_p50, http_p99 = _percentile(http_latencies, 0.5), _percentile(http_latencies, 0.99)
+    print(f"\namadeus transport (200 searches, concurrency 8): "
+          f"SDK p50 {sdk_p50 * 1000:.1f}ms p99 {sdk_p99 * 1000:.1f}ms ({sdk_connections} connections) -> "
+          f"httpx p50 {http_p50 * 1000:.1f}ms p99 {http_p99 * 1000:.1f}ms ({http_connections} connections, "
+          f"{http_client.http.counters['hedged']} hedged)")
+
+    assert http_connections < sdk_connections / 4  # keep-alive (hedge mở thêm vài kết nối)
+    if TIMING_ASSERTS:
+        assert http_p99 < sdk_p99 / 2
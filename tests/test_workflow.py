@@ -0,0 +1,1391 @@
+import asyncio
+import json
+import time
+from typing import Callable
+
+import httpx
+from langchain_core.messages import AIMessage, HumanMessage
+from pydantic import Field
+
+from src.flight_booking_agent.graph.workflow import app as graph_app
+from tests.conftest import (
+    TIMING_ASSERTS, FakeChatModel, StubAmadeusBackend, StubChatBackend, booking_responder, tool_call_message,
+    install_fake_llm, install_stub_amadeus, new_thread_config,
+)
+
+
+SEARCH_REQUEST = "Tìm giúp em chuyến bay từ Sài Gòn đi Hà Nội ngày mai cho 1 người"
+
+
+def test_ainvoke_runs_search_turn_end_to_end(fake_llm, stub_amadeus):
+    result = asyncio.run(graph_app.ainvoke(
+        {"messages": [HumanMessage(content=SEARCH_REQUEST)]}, config=new_thread_config()
+    ))
+
+    assert stub_amadeus.calls == 1
+    assert len(result["search_results"]) == 5  # top-N rẻ nhất trong 10 kết quả
+    assert result["previous_agent"] == "booking_agent"
+    # manager định tuyến bằng luật, slot trích xuất bằng luật, tool call dựng trực tiếp,
+    # kết quả tóm tắt bằng template: lượt tìm chuyến không cần gọi LLM
+    assert fake_llm.calls == []
+
+
+def test_chat_endpoint_uses_async_graph(fake_llm, stub_amadeus):
+    from endpoints import fastapi_app
+
+    async def call():
+        transport = httpx.ASGITransport(app=fastapi_app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.post("/chat", json={"message": SEARCH_REQUEST, "thread_id": "endpoint-thread"})
+
+    response = asyncio.run(call())
+
+    assert response.status_code == 200
+    assert response.json()["thread_id"] == "endpoint-thread"
+    assert response.json()["response"]
+
+
+def test_async_throughput_scales_with_concurrency(monkeypatch):
+    """
+    Benchmark tải: N cuộc hội thoại giả chạy đồng thời, LLM và Amadeus có độ trễ cố định.
+    Với đường async, thông lượng phải tăng theo số luồng chứ không đứng yên như khi
+    `invoke` đồng bộ chặn event loop.
+    """
+    from src.flight_booking_agent.agents import booking
+
+    # Độ trễ đủ lớn để I/O chiếm phần chính của mỗi lượt; kết quả Amadeus được cache nên
+    # giữ lời gọi LLM trích xuất để mỗi lượt đều có I/O thật sự
+    monkeypatch.setattr(booking, "BOOKING_EXTRACTION_MODE", "llm")
+    install_fake_llm(monkeypatch, FakeChatModel(responder=booking_responder, latency=0.2))
+    install_stub_amadeus(monkeypatch, StubAmadeusBackend(latency=0.1))
+
+    async def one_turn():
+        await graph_app.ainvoke({"messages": [HumanMessage(content=SEARCH_REQUEST)]}, config=new_thread_config())
+
+    async def run(total: int, concurrency: int) -> float:
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def bounded():
+            async with semaphore:
+                await one_turn()
+
+        started = time.perf_counter()
+        await asyncio.gather(*(bounded() for _ in range(total)))
+        return total / (time.perf_counter() - started)
+
+    total = 16
+    throughput = {c: asyncio.run(run(total, c)) for c in (1, 4, 16)}
+    print("\nconcurrency -> turns/s:", {c: round(t, 1) for c, t in throughput.items()})
+
+    if TIMING_ASSERTS:
+        assert throughput[4] > 2.5 * throughput[1]
+        assert throughput[16] > 4 * throughput[1]
+
+
+def _parse_sse(body: str) -> list:
+    events = []
+    for block in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+def test_chat_stream_endpoint_emits_nodes_tokens_and_done(fake_llm, stub_amadeus):
+    from endpoints import fastapi_app
+
+    async def call():
+        transport = httpx.ASGITransport(app=fastapi_app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.post("/chat/stream", json={"message": SEARCH_REQUEST, "thread_id": "stream-thread"})
+
+    response = asyncio.run(call())
+    events = _parse_sse(response.text)
+
+    assert response.headers["content-type"].startswith("text/event-stream")
+    nodes = [data["node"] for event, data in events if event == "node"]
+    assert nodes[:3] == ["router", "manager", "booking_agent"]
+    assert "tools" in nodes
+    tokens = "".join(data["text"] for event, data in events if event == "token")
+    assert events[-1][0] == "done"
+    assert tokens == events[-1][1]["response"]
+
+
+def _undecided_responder(reply: str) -> Callable:
+    """Khách hỏi về danh sách mà chưa chọn chuyến: LLM không gọi FlightChoice mà trả lời bằng văn bản `reply`."""
+    def responder(messages, tool_names):
+        if "FlightChoice" in tool_names or not tool_names:
+            return AIMessage(content=reply)
+        return booking_responder(messages, tool_names)
+    return responder
+
+
+async def _stream_turns(thread_id: str, texts: list) -> list:
+    """Chạy lần lượt các lượt qua `stream_chat_events`, trả về sự kiện SSE của lượt cuối."""
+    from endpoints import ChatRequest, stream_chat_events
+
+    for text in texts:
+        events = [event async for event in stream_chat_events(ChatRequest(message=text, thread_id=thread_id))]
+    return _parse_sse("".join(events))
+
+
+def test_chat_stream_streams_llm_reply_tokens_with_default_settings(monkeypatch, stub_amadeus):
+    # Cấu hình mặc định: câu hỏi về danh sách là một lời gọi "respond" có FlightChoice là tool
+    # tùy chọn; model trả lời bằng văn bản nên câu trả lời được phát ra theo từng token
+    reply = "Dạ chuyến số 2 cất cánh lúc 07:15 và hạ cánh lúc 09:25 ạ."
+    model = install_fake_llm(monkeypatch, FakeChatModel(responder=_undecided_responder(reply)))
+
+    events = asyncio.run(_stream_turns(f"stream-default-{time.time_ns()}", [SEARCH_REQUEST, "chuyến 2 mấy giờ bay?"]))
+
+    tokens = [data["text"] for event, data in events if event == "token" and data["node"] == "booking_agent"]
+    assert len(tokens) == len(reply.split(" "))
+    assert "".join(tokens) == reply == events[-1][1]["response"]
+    assert model.calls == [["FlightChoice"]]
+
+
+def test_stream_time_to_first_token_benchmark(monkeypatch):
+    """
+    Benchmark TTFT với cấu hình mặc định: LLM giả có 50ms tới token đầu tiên và 5ms/token sau đó.
+    Với /chat, người dùng chỉ thấy câu trả lời khi cả lượt kết thúc (TTFT = tổng thời gian);
+    với /chat/stream, token đầu tiên của câu trả lời (State 2, câu hỏi về danh sách) đến sớm hơn nhiều.
+    """
+    from endpoints import ChatRequest, stream_chat_events
+
+    install_fake_llm(monkeypatch, FakeChatModel(
+        responder=_undecided_responder(" ".join(["Chuyến"] * 80)), latency=0.05, token_latency=0.005,
+    ))
+    install_stub_amadeus(monkeypatch, StubAmadeusBackend(latency=0.05))
+    thread_id = f"ttft-{time.time_ns()}"
+
+    async def measure():
+        await _stream_turns(thread_id, [SEARCH_REQUEST])
+        request = ChatRequest(message="chuyến 2 mấy giờ bay?", thread_id=thread_id)
+        started = time.perf_counter()
+        first_token = None
+        async for event in stream_chat_events(request):
+            if first_token is None and event.startswith("event: token"):
+                first_token = time.perf_counter() - started
+        return first_token, time.perf_counter() - started
+
+    ttft, total = asyncio.run(measure())
+    print(f"\nstream: TTFT={ttft * 1000:.0f}ms total={total * 1000:.0f}ms (blocking /chat TTFT = total)")
+
+    assert ttft is not None
+    if TIMING_ASSERTS:
+        assert ttft < total - 0.25
+
+
+def test_messages_reducer_deduplicates_by_id():
+    from src.flight_booking_agent.graph.state import AgentState
+    from typing import get_type_hints
+
+    reducer = get_type_hints(AgentState, include_extras=True)["messages"].__metadata__[0]
+    history = reducer([], [HumanMessage(content="xin chào"), AIMessage(content="Dạ em chào anh/chị")])
+    reply = AIMessage(content="Dạ em đã ghi nhận")
+
+    # Node trả về cả lịch sử cũ lẫn tin nhắn mới: các tin nhắn cũ không bị nhân đôi
+    merged = reducer(history, history + [reply])
+
+    assert [m.content for m in merged] == ["xin chào", "Dạ em chào anh/chị", "Dạ em đã ghi nhận"]
+
+
+def test_history_and_checkpoint_grow_linearly_over_50_turns(fake_llm):
+    """
+    Hồi quy cho lỗi `state["messages"] + [response]` dưới reducer cộng dồn: 50 lượt nhập
+    hành khách liên tiếp (State 4) phải làm lịch sử và checkpoint tăng tuyến tính.
+    """
+    config = new_thread_config()
+    graph_app.update_state(config, {
+        "messages": [AIMessage(content="Anh/chị vui lòng cung cấp thông tin hành khách ạ.")],
+        "previous_agent": "booking_agent",
+        "confirmed_flight": {"flight_number": "VN200", "price": 1500000.0},
+        "passenger_count": 100,
+        "passengers": [],
+    }, as_node="booking_agent")
+
+    def checkpoint_bytes() -> int:
+        # Kích thước snapshot đầy đủ (JsonPlusSerializer): serializer của saver tách list lớn
+        # thành khối nên số byte của riêng bản ghi checkpoint không tăng đều theo lượt
+        from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+        checkpoint = graph_app.checkpointer.get_tuple(config).checkpoint
+        return len(JsonPlusSerializer().dumps_typed(checkpoint)[1])
+
+    message_counts, sizes = [], []
+    for turn in range(1, 51):
+        result = graph_app.invoke(
+            {"messages": [HumanMessage(content=f"Nguyen Van A{turn}, 25/12/1990, 0987654321")]}, config=config
+        )
+        if turn % 10 == 0:
+            message_counts.append(len(result["messages"]))
+            sizes.append(checkpoint_bytes())
+
+    assert message_counts == [1 + 2 * t for t in (10, 20, 30, 40, 50)]
+    assert len(result["passengers"]) == 50
+    growth = [b - a for a, b in zip(sizes, sizes[1:])]
+    print("\ncheckpoint bytes every 10 turns:", sizes)
+    assert max(growth) < 1.2 * min(growth)
+
+
+def _stored_bytes(saver) -> int:
+    blobs = sum(len(value[1]) for value in saver.blobs.values())
+    checkpoints = sum(
+        len(saved[0][1]) + len(saved[1][1])
+        for namespaces in saver.storage.values() for checkpoints in namespaces.values() for saved in checkpoints.values()
+    )
+    store = getattr(saver.serde, "store", None)
+    return blobs + checkpoints + (store.size() if store is not None else 0)
+
+
+def _synthetic_turns(saver, thread_id: str, turns: int):
+    """Ghi `turns` checkpoint cho một thread, mỗi lượt thêm 2 tin nhắn và 10 kết quả tìm kiếm."""
+    from langgraph.checkpoint.base import create_checkpoint, empty_checkpoint
+
+    config = {"configurable": {"thread_id": thread_id, "checkpoint_ns": ""}}
+    checkpoint = empty_checkpoint()
+    messages = []
+    for step in range(turns):
+        messages = messages + [HumanMessage(content=f"lượt {step}"), AIMessage(content="Dạ em đã ghi nhận ạ.")]
+        checkpoint = create_checkpoint(checkpoint, None, step)
+        checkpoint["channel_values"] = {"messages": messages, "search_results": [{"flight_number": f"VN{i}"} for i in range(10)]}
+        new_versions = {
+            channel: saver.get_next_version(checkpoint["channel_versions"].get(channel), None)
+            for channel in checkpoint["channel_values"]
+        }
+        checkpoint["channel_versions"].update(new_versions)
+        config = saver.put(config, checkpoint, {"step": step}, new_versions)
+    return config
+
+
+def test_bounded_saver_keeps_last_k_checkpoints(fake_llm, stub_amadeus):
+    from src.flight_booking_agent.graph.checkpointing import BoundedInMemorySaver
+    from src.flight_booking_agent.graph.workflow import workflow
+
+    saver = BoundedInMemorySaver(keep_last=3)
+    graph = workflow.compile(checkpointer=saver)
+    config = new_thread_config()
+    graph.invoke({"messages": [HumanMessage(content=SEARCH_REQUEST)]}, config=config)
+    graph.invoke({"messages": [HumanMessage(content="Em chọn chuyến số 1")]}, config=config)
+
+    assert len(list(saver.list(config))) == 3
+    state = graph.get_state(config).values
+    assert state["confirmed_flight"]["flight_number"] == "VN200"
+    assert len(state["messages"]) == 6
+
+
+def test_bounded_saver_expires_idle_threads():
+    from src.flight_booking_agent.graph.checkpointing import BoundedInMemorySaver
+
+    clock = {"now": 0.0}
+    saver = BoundedInMemorySaver(keep_last=2, thread_ttl=60, sweep_interval=10, timer=lambda: clock["now"])
+    _synthetic_turns(saver, "old", 3)
+    clock["now"] = 50
+    _synthetic_turns(saver, "recent", 3)
+
+    clock["now"] = 100
+    assert saver.sweep_expired() == 1
+    assert saver.thread_count() == 1
+    assert saver.get_tuple({"configurable": {"thread_id": "old"}}) is None
+    assert all(key[0] == "recent" for key in saver.blobs)
+
+
+def test_sqlite_saver_wal_retention_and_ttl(tmp_path, fake_llm, stub_amadeus):
+    from src.flight_booking_agent.graph.sqlite_checkpointer import open_sqlite_checkpointer
+    from src.flight_booking_agent.graph.workflow import workflow
+
+    async def scenario():
+        async with open_sqlite_checkpointer(str(tmp_path / "checkpoints.sqlite"), keep_last=3, thread_ttl=60) as saver:
+            graph = workflow.compile(checkpointer=saver)
+            config = new_thread_config()
+            await graph.ainvoke({"messages": [HumanMessage(content=SEARCH_REQUEST)]}, config=config)
+            await graph.ainvoke({"messages": [HumanMessage(content="Em chọn chuyến số 1")]}, config=config)
+
+            async with saver.conn.execute("PRAGMA journal_mode") as cursor:
+                journal_mode = (await cursor.fetchone())[0]
+            async with saver.conn.execute("SELECT COUNT(*) FROM checkpoints") as cursor:
+                stored = (await cursor.fetchone())[0]
+            state = (await graph.aget_state(config)).values
+            expired = await saver.asweep_expired(now=time.time() + 3600)
+            remaining = await saver.aget_tuple(config)
+            return journal_mode, stored, state, expired, remaining
+
+    journal_mode, stored, state, expired, remaining = asyncio.run(scenario())
+
+    assert journal_mode == "wal"
+    assert stored == 3
+    assert state["confirmed_flight"]["flight_number"] == "VN200"
+    assert expired == 1
+    assert remaining is None
+
+
+def test_checkpointer_benchmark(tmp_path):
+    """
+    Benchmark: độ trễ ghi/đọc checkpoint mỗi lượt (bộ nhớ và SQLite) và dung lượng
+    lưu trữ sau 10k thread giả lập (5 lượt mỗi thread), có và không có giới hạn K/TTL.
+    """
+    from langgraph.checkpoint.base import create_checkpoint, empty_checkpoint
+    from langgraph.checkpoint.memory import InMemorySaver
+    from src.flight_booking_agent.graph.checkpointing import BoundedInMemorySaver
+    from src.flight_booking_agent.graph.sqlite_checkpointer import open_sqlite_checkpointer
+
+    async def per_turn_latency(saver, turns=200):
+        config = {"configurable": {"thread_id": "bench", "checkpoint_ns": ""}}
+        checkpoint = empty_checkpoint()
+        writes, reads = [], []
+        for step in range(turns):
+            checkpoint = create_checkpoint(checkpoint, None, step)
+            checkpoint["channel_values"] = {"messages": [HumanMessage(content="x" * 200)] * 6}
+            versions = {"messages": saver.get_next_version(checkpoint["channel_versions"].get("messages"), None)}
+            checkpoint["channel_versions"].update(versions)
+            started = time.perf_counter()
+            config = await saver.aput(config, checkpoint, {"step": step}, versions)
+            writes.append(time.perf_counter() - started)
+            started = time.perf_counter()
+            await saver.aget_tuple({"configurable": {"thread_id": "bench"}})
+            reads.append(time.perf_counter() - started)
+        return sum(writes) / turns * 1000, sum(reads) / turns * 1000
+
+    async def sqlite_latency():
+        async with open_sqlite_checkpointer(str(tmp_path / "bench.sqlite"), keep_last=10) as saver:
+            return await per_turn_latency(saver)
+
+    memory_ms = asyncio.run(per_turn_latency(BoundedInMemorySaver(keep_last=10)))
+    sqlite_ms = asyncio.run(sqlite_latency())
+    print(f"\nper turn write/read: memory {memory_ms[0]:.3f}/{memory_ms[1]:.3f}ms, sqlite {sqlite_ms[0]:.3f}/{sqlite_ms[1]:.3f}ms")
+
+    # Mỗi thread mới đến sau thread trước 1 giây; TTL 1 giờ chỉ giữ lại ~3600 thread gần nhất
+    clock = {"now": 0.0}
+    savers = {
+        "unbounded": InMemorySaver(),
+        "keep_last=2": BoundedInMemorySaver(keep_last=2, thread_ttl=float("inf")),
+        "keep_last=2,ttl=1h": BoundedInMemorySaver(keep_last=2, thread_ttl=3600, sweep_interval=60, timer=lambda: clock["now"]),
+    }
+    footprints = {}
+    for name, saver in savers.items():
+        for i in range(10_000):
+            clock["now"] = float(i)
+            _synthetic_turns(saver, f"thread-{i}", 5)
+        footprints[name] = _stored_bytes(saver)
+    print("stored bytes after 10k threads:", footprints)
+
+    assert footprints["keep_last=2"] < footprints["unbounded"]
+    assert footprints["keep_last=2,ttl=1h"] < footprints["unbounded"] / 3
+
+
+def test_compact_serde_round_trips_and_shares_blocks_between_checkpoints():
+    from datetime import datetime
+    from langchain_core.messages import SystemMessage, ToolMessage
+    from src.flight_booking_agent.graph.checkpoint_serde import COMPACT_BLOCKS_TYPE, CompactSerializer
+
+    serde = CompactSerializer(block_items=4)
+    messages = [
+        SystemMessage(content="hệ thống", id="s0"),
+        HumanMessage(content=SEARCH_REQUEST, id="h1"),
+        tool_call_message("search_flights_tool", {"origin": "SGN", "destination": "HAN"}),
+        ToolMessage(content='[{"flight_number": "VN200"}]', tool_call_id="call_1", id="t1"),
+        AIMessage(content="Dạ, em tìm được 5 chuyến ạ", id="a1", response_metadata={"model": "fake"}),
+    ]
+    value = {"messages": messages, "search_pool": [{"flight_number": f"VN{i}", "price": 1e6 + i} for i in range(10)],
+             "searched_at": datetime(2025, 12, 1, 8, 30), "passengers": []}
+    typed = serde.dumps_typed(value)
+    restored = serde.loads_typed(typed)
+    assert typed[0] == COMPACT_BLOCKS_TYPE
+    assert restored == value
+    assert [type(m) for m in restored["messages"]] == [type(m) for m in messages]
+    assert restored["messages"][2].tool_calls == messages[2].tool_calls
+
+    # Lượt sau chỉ nối thêm tin nhắn: các khối đầy cũ được dùng lại, bản ghi không lớn theo lịch sử
+    blocks = len(serde.store)
+    history = messages
+    sizes = []
+    for turn in range(40):
+        history = history + [HumanMessage(content=f"lượt {turn}", id=f"h{turn + 2}")]
+        sizes.append(len(serde.dumps_typed({"messages": history})[1]))
+    assert len(serde.store) - blocks <= 40 // 4 + 1
+    assert serde.loads_typed(serde.dumps_typed({"messages": history}))["messages"] == history
+    assert sizes[-1] < 3 * sizes[0]
+    assert serde.refs(serde.dumps_typed(history)) <= set(serde.store.keys())
+
+
+def test_compact_serde_reads_old_checkpoints_and_collects_unused_blocks(tmp_path, fake_llm, stub_amadeus):
+    from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+    from src.flight_booking_agent.graph.checkpointing import BoundedInMemorySaver
+    from src.flight_booking_agent.graph.checkpoint_serde import CompactSerializer
+    from src.flight_booking_agent.graph.sqlite_checkpointer import open_sqlite_checkpointer
+    from src.flight_booking_agent.graph.workflow import workflow
+
+    path = str(tmp_path / "checkpoints.sqlite")
+
+    async def scenario():
+        config = new_thread_config()
+        # Checkpoint ghi bằng serializer cũ vẫn đọc và chạy tiếp được sau khi đổi serializer
+        async with open_sqlite_checkpointer(path, serde=JsonPlusSerializer()) as saver:
+            graph = workflow.compile(checkpointer=saver)
+            await graph.ainvoke({"messages": [HumanMessage(content=SEARCH_REQUEST)]}, config=config)
+        async with open_sqlite_checkpointer(path, keep_last=3, thread_ttl=60) as saver:
+            assert isinstance(saver.serde, CompactSerializer)
+            graph = workflow.compile(checkpointer=saver)
+            await graph.ainvoke({"messages": [HumanMessage(content="Em chọn chuyến số 1")]}, config=config)
+            async with saver.conn.execute("SELECT type, COUNT(*) FROM checkpoints GROUP BY type") as cursor:
+                types = dict(await cursor.fetchall())
+        # Mở lại (cache khối rỗng): khối được đọc từ bảng checkpoint_blocks
+        async with open_sqlite_checkpointer(path, keep_last=3, thread_ttl=60) as saver:
+            state = (await workflow.compile(checkpointer=saver).aget_state(config)).values
+            async with saver.conn.execute("SELECT COUNT(*) FROM checkpoint_blocks") as cursor:
+                blocks = (await cursor.fetchone())[0]
+            await saver.asweep_expired(now=time.time() + 3600)
+            async with saver.conn.execute("SELECT COUNT(*) FROM checkpoint_blocks") as cursor:
+                remaining = (await cursor.fetchone())[0]
+        return types, state, blocks, remaining
+
+    types, state, blocks, remaining = asyncio.run(scenario())
+    assert set(types) == {"compact-blocks"}  # 3 checkpoint mới nhất đều do serializer mới ghi
+    assert state["confirmed_flight"]["flight_number"] == "VN200"
+    assert len(state["messages"]) == 6
+    assert blocks > 0 and remaining == 0
+
+    clock = {"now": 0.0}
+    saver = BoundedInMemorySaver(keep_last=2, thread_ttl=60, sweep_interval=10, timer=lambda: clock["now"])
+    graph = workflow.compile(checkpointer=saver)
+    config = new_thread_config()
+    graph.invoke({"messages": [HumanMessage(content=SEARCH_REQUEST)]}, config=config)
+    assert len(saver.serde.store) > 0
+    assert saver.collect_blocks() > 0  # khối của các checkpoint đã bị keep_last bỏ
+    assert graph.get_state(config).values["search_pool"]
+    clock["now"] = 100
+    saver.sweep_expired()
+    assert len(saver.serde.store) == 0
+
+
+def test_sqlite_block_cache_stays_bounded_when_reading_old_threads(tmp_path):
+    import sqlite3
+    from src.flight_booking_agent.graph.checkpoint_serde import SqliteContentStore
+
+    path = str(tmp_path / "checkpoints.sqlite")
+    blocks = {i.to_bytes(16, "big"): f"khối {i}".encode() for i in range(20)}
+    with sqlite3.connect(path) as conn:
+        conn.execute("CREATE TABLE checkpoint_blocks (key BLOB PRIMARY KEY, data BLOB)")
+        conn.executemany("INSERT INTO checkpoint_blocks (key, data) VALUES (?, ?)", list(blocks.items()))
+
+    # Sau khi khởi động lại, mọi khối đều đọc từ đĩa: cache vẫn chỉ giữ `cache_size` khối
+    store = SqliteContentStore(path, cache_size=4)
+    keys = list(blocks)
+    try:
+        for key in keys:
+            assert store.get(key) == blocks[key]
+            store.get(keys[0])  # khối dùng thường xuyên không bị loại
+        assert len(store) == 4
+        assert keys[0] in store.keys() and keys[-1] in store.keys()
+    finally:
+        store.close()
+
+
+def _recorded_checkpoints(scripts):
+    """Các checkpoint đầy đủ (kèm channel_values) mà graph ghi ra khi chạy các kịch bản."""
+    from src.flight_booking_agent.graph.checkpointing import BoundedInMemorySaver
+    from src.flight_booking_agent.graph.workflow import workflow
+
+    recorded = []
+
+    class RecordingSaver(BoundedInMemorySaver):
+        def put(self, config, checkpoint, metadata, new_versions):
+            recorded.append({**checkpoint, "channel_values": dict(checkpoint["channel_values"])})
+            return super().put(config, checkpoint, metadata, new_versions)
+
+    graph = workflow.compile(checkpointer=RecordingSaver())
+    for script in scripts:
+        config = new_thread_config()
+        start = len(recorded)
+        for text in script:
+            graph.invoke({"messages": [HumanMessage(content=text)]}, config=config)
+        yield recorded[start:]
+
+
+def test_checkpoint_serializer_benchmark(fake_llm, stub_amadeus):
+    """
+    Benchmark serializer checkpoint trên các hội thoại đặt vé theo kịch bản (kịch bản replay
+    và một hội thoại nhập 30 hành khách): số byte mỗi checkpoint đầy đủ (như backend SQLite
+    lưu, với CompactSerializer gồm cả khối mới phải ghi vào kho khối), thời gian mã hóa và
+    giải mã mỗi checkpoint, JsonPlusSerializer mặc định so với CompactSerializer.
+    """
+    from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+    from src.flight_booking_agent.graph.checkpoint_serde import CompactSerializer
+    from tests.replay import CONVERSATIONS
+
+    long_script = ["Tìm giúp em chuyến bay từ Sài Gòn đi Hà Nội ngày mai cho 30 người", "Em chọn chuyến số 1 nhé"]
+    long_script += [f"Nguyen Van A{i}, 25/12/1990, 0987654321" for i in range(30)]
+    conversations = dict(zip(list(CONVERSATIONS) + ["30-passengers"],
+                             _recorded_checkpoints(list(CONVERSATIONS.values()) + [long_script])))
+
+    print("\nconversation        ckpts  serde      bytes/ckpt  dumps_us  loads_us")
+    results = {}
+    for name, checkpoints in conversations.items():
+        for label, serde in (("jsonplus", JsonPlusSerializer()), ("compact", CompactSerializer())):
+            written, dumps, loads = 0, [], []
+            for checkpoint in checkpoints:
+                blocks = getattr(serde, "store", None)
+                before = blocks.size() if blocks is not None else 0
+                started = time.perf_counter()
+                typed = serde.dumps_typed(checkpoint)
+                dumps.append(time.perf_counter() - started)
+                written += len(typed[1]) + ((blocks.size() - before) if blocks is not None else 0)
+                started = time.perf_counter()
+                restored = serde.loads_typed(typed)
+                loads.append(time.perf_counter() - started)
+                assert restored["channel_values"].keys() == checkpoint["channel_values"].keys()
+            results[name, label] = written / len(checkpoints)
+            print(f"{name:19} {len(checkpoints):5}  {label:9} {written / len(checkpoints):11.0f}  "
+                  f"{sum(dumps) / len(dumps) * 1e6:8.0f}  {sum(loads) / len(loads) * 1e6:8.0f}")
+
+    for name in conversations:
+        assert results[name, "compact"] < 0.6 * results[name, "jsonplus"]
+    assert results["30-passengers", "compact"] < 0.25 * results["30-passengers", "jsonplus"]
+
+
+BOOKING_SCRIPT = [
+    SEARCH_REQUEST,
+    "Em chọn chuyến số 1 nhé",
+    "Nguyen Van A, 25/12/1990, 0987654321",
+]
+# Như trên nhưng khách hỏi thêm về danh sách trước khi chọn (lượt State 2 chưa chọn chuyến)
+BOOKING_SCRIPT_WITH_QUESTION = [BOOKING_SCRIPT[0], "chuyến 2 mấy giờ bay?", *BOOKING_SCRIPT[1:]]
+
+
+def _question_aware_responder(messages, tool_names):
+    """Như `booking_responder`, nhưng tin nhắn là câu hỏi thì model trả lời văn bản thay vì gọi FlightChoice."""
+    asked = [m.content for m in messages if isinstance(m, HumanMessage) and not m.content.startswith("[Instruction]")]
+    if "FlightChoice" in tool_names and asked and asked[-1].endswith("?"):
+        return AIMessage(content="Dạ chuyến số 2 cất cánh lúc 07:15 ạ. Anh/chị muốn chọn chuyến bay số mấy ạ?")
+    return booking_responder(messages, tool_names)
+
+
+def test_llm_calls_per_completed_booking_benchmark(monkeypatch, stub_amadeus):
+    """
+    Benchmark số lời gọi LLM cho một lượt đặt vé hoàn chỉnh theo kịch bản cố định:
+    tìm chuyến → chọn chuyến → nhập hành khách → tổng kết chờ xác nhận.
+    Ban đầu cần 7 lời gọi (3, 2, 2 theo từng lượt); lựa chọn chuyến (tool FlightChoice
+    của lời gọi trả lời) và hành khách (lời gọi có cấu trúc nhỏ) mỗi thứ một lời gọi, còn câu xác nhận và bản tổng kết dùng template,
+    tóm tắt kết quả bằng template bỏ thêm một lời gọi ở lượt tìm chuyến, bộ trích xuất
+    luật bỏ lời gọi trích xuất ở lượt tìm chuyến và lượt nhập hành khách, và bộ lọc kết
+    quả tại chỗ đọc được lựa chọn "chuyến số 1" mà không cần hỏi LLM. Lượt khách hỏi thêm
+    mà chưa chọn chuyến cũng chỉ một lời gọi: câu trả lời và lựa chọn chung một lời gọi.
+    """
+    from src.flight_booking_agent.agents import booking
+
+    fake_llm = install_fake_llm(monkeypatch, FakeChatModel(responder=_question_aware_responder))
+
+    def run(mode, script=BOOKING_SCRIPT):
+        monkeypatch.setattr(booking, "BOOKING_EXTRACTION_MODE", mode)
+        config = new_thread_config()
+        calls_per_turn = []
+        for text in script:
+            before = len(fake_llm.calls)
+            result = graph_app.invoke({"messages": [HumanMessage(content=text)]}, config=config)
+            calls_per_turn.append(len(fake_llm.calls) - before)
+        assert result["final_confirmation_sent"] is True
+        assert result["passengers"][0]["full_name"] == "Nguyen Van A"
+        return calls_per_turn
+
+    llm_calls, rule_calls = run("llm"), run("rules")
+    print(f"\nLLM calls per completed booking: 7 -> {sum(llm_calls)} (per turn {llm_calls}) "
+          f"-> {sum(rule_calls)} with rule extraction (per turn {rule_calls})")
+
+    assert llm_calls == [1, 1, 1]
+    assert rule_calls == [0, 0, 0]
+    assert [names for names in fake_llm.calls if names] == [
+        ["FlightInfoExtractor"], ["FlightChoice"], ["PassengerInfoExtractor"],
+    ]
+
+    fake_llm.calls.clear()
+    llm_calls, rule_calls = run("llm", BOOKING_SCRIPT_WITH_QUESTION), run("rules", BOOKING_SCRIPT_WITH_QUESTION)
+    print(f"with an undecided question turn: per turn {llm_calls} -> {rule_calls} with rule extraction")
+
+    assert llm_calls == [1, 1, 1, 1]
+    assert rule_calls == [0, 1, 0, 0]
+    assert [names for names in fake_llm.calls if names] == [
+        ["FlightInfoExtractor"], ["FlightChoice"], ["FlightChoice"], ["PassengerInfoExtractor"], ["FlightChoice"],
+    ]
+
+
+def test_tiered_models_latency_and_cost_report(monkeypatch, stub_amadeus):
+    """
+    Báo cáo độ trễ và chi phí theo vai trò (route/extract/respond) cho kịch bản đặt vé,
+    so sánh cấu hình phân tầng (Flash cho route/extract, Pro cho respond) với cấu hình
+    chỉ dùng Pro. LLM giả mô phỏng độ trễ theo model: Flash 10ms, Pro 40ms.
+    """
+    from src.flight_booking_agent import config
+    from src.flight_booking_agent.agents import booking, manager
+
+    monkeypatch.setattr(manager, "MANAGER_RULE_THRESHOLD", 1.01)  # để lượt đầu đi qua Manager LLM
+    latency = {"gemini-2.5-flash": 0.01, "gemini-2.5-pro": 0.04}
+    tiered = {
+        "route": config.ModelSpec("gemini-2.5-flash", 0.0, 10),
+        "extract": config.ModelSpec("gemini-2.5-flash", 0.0, 15),
+        "respond": config.ModelSpec("gemini-2.5-pro", 0.7, 60),
+    }
+    pro_only = {role: spec._replace(model_name="gemini-2.5-pro") for role, spec in tiered.items()}
+    # Luôn gọi LLM trích xuất và LLM soạn tóm tắt/tổng kết để so sánh đủ cả ba vai trò
+    monkeypatch.setattr(booking, "BOOKING_EXTRACTION_MODE", "llm")
+    monkeypatch.setattr(booking, "BOOKING_SUMMARY_MODE", "llm")
+
+    def run(specs):
+        registry = config.ModelRegistry(specs, factory=lambda spec: FakeChatModel(
+            responder=booking_responder, latency=latency[spec.model_name]
+        ))
+        monkeypatch.setattr(config, "model_registry", registry)
+        thread = new_thread_config()
+        for text in BOOKING_SCRIPT:
+            graph_app.invoke({"messages": [HumanMessage(content=text)]}, config=thread)
+        return registry.usage.report()
+
+    reports = {"tiered": run(tiered), "pro-only": run(pro_only)}
+    print("\nsetup     role     calls  p50_ms  p95_ms  in_tok  out_tok  cost_usd")
+    for setup, report in reports.items():
+        for role in ("route", "extract", "respond"):
+            r = report[role]
+            print(f"{setup:9} {role:8} {r['calls']:5}  {r['p50_ms']:6}  {r['p95_ms']:6}  "
+                  f"{r['input_tokens']:6}  {r['output_tokens']:7}  {r['cost_usd']:.6f}")
+
+    from endpoints import fastapi_app
+
+    async def usage():
+        transport = httpx.ASGITransport(app=fastapi_app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return (await client.get("/llm/usage")).json()
+
+    assert asyncio.run(usage()) == reports["pro-only"]
+
+    tiered_report, pro_report = reports["tiered"], reports["pro-only"]
+    assert {role: r["calls"] for role, r in tiered_report.items()} == {"route": 1, "extract": 2, "respond": 3}
+    for role in ("route", "extract"):
+        if TIMING_ASSERTS:
+            assert tiered_report[role]["p50_ms"] < pro_report[role]["p50_ms"]
+        assert tiered_report[role]["cost_usd"] < pro_report[role]["cost_usd"]
+    assert tiered_report["respond"]["cost_usd"] == pro_report["respond"]["cost_usd"]
+
+
+def test_search_turn_latency_template_vs_llm_summary_benchmark(monkeypatch):
+    """
+    Benchmark độ trễ lượt tìm chuyến (lượt chậm nhất của luồng đặt vé): tóm tắt kết quả
+    bằng template so với bằng LLM. LLM giả: 50ms mỗi lời gọi cộng 2ms/token cho câu trả lời.
+    """
+    from src.flight_booking_agent.agents import booking
+
+    summary = " ".join(["Chuyến"] * 120)
+
+    def responder(messages, tool_names):
+        reply = booking_responder(messages, tool_names)
+        return reply if reply.tool_calls else AIMessage(content=summary)
+
+    class SlowFakeChatModel(FakeChatModel):
+        async def _agenerate(self, messages, stop=None, run_manager=None, tools=None, **kwargs):
+            result = await super()._agenerate(messages, stop=stop, run_manager=run_manager, tools=tools, **kwargs)
+            await asyncio.sleep(0.002 * len(result.generations[0].message.content.split()))
+            return result
+
+    install_fake_llm(monkeypatch, SlowFakeChatModel(responder=responder, latency=0.05))
+    install_stub_amadeus(monkeypatch, StubAmadeusBackend(latency=0.02))
+
+    def turn_ms(mode: str, turns: int = 5) -> float:
+        monkeypatch.setattr(booking, "BOOKING_SUMMARY_MODE", mode)
+
+        async def run():
+            started = time.perf_counter()
+            for _ in range(turns):
+                await graph_app.ainvoke({"messages": [HumanMessage(content=SEARCH_REQUEST)]}, config=new_thread_config())
+            return (time.perf_counter() - started) / turns * 1000
+
+        return asyncio.run(run())
+
+    template_ms, llm_ms = turn_ms("template"), turn_ms("llm")
+    print(f"\nsearch turn latency: llm summary {llm_ms:.0f}ms -> template {template_ms:.0f}ms")
+
+    if TIMING_ASSERTS:
+        assert template_ms < llm_ms - 200
+
+
+def test_flexible_date_request_returns_fare_calendar(monkeypatch, stub_amadeus):
+    def responder(messages, tool_names):
+        if "FlightInfoExtractor" in tool_names:
+            return tool_call_message("FlightInfoExtractor", {
+                "departure_city": "Hà Nội", "destination_city": "Sài Gòn", "departure_date": "2026-12-21",
+                "flexible_date": True, "date_window_days": 7, "include_nearby_airports": True,
+            })
+        return booking_responder(messages, tool_names)
+
+    install_fake_llm(monkeypatch, FakeChatModel(responder=responder))
+
+    result = graph_app.invoke(
+        {"messages": [HumanMessage(content="Bay Hà Nội - Sài Gòn tuần sau, ngày nào rẻ nhất?")]}, config=new_thread_config()
+    )
+
+    tool_call = result["messages"][-3].tool_calls[0]
+    assert tool_call["name"] == "fare-calendar-tool"
+    assert tool_call["args"] == {
+        "origins": ["HAN", "HPH"], "destinations": ["SGN"], "start_date": "2026-12-21", "days": 7, "adults": 1,
+    }
+    assert stub_amadeus.calls == 14
+    assert result["messages"][-1].content.startswith("Dạ, giá vé thấp nhất theo từng ngày ạ:")
+    # Ngày bay cụ thể do người dùng chọn ở lượt sau
+    assert result.get("departure_date") is None and result.get("search_results") is None
+
+
+def test_airport_autocomplete_endpoint():
+    from endpoints import fastapi_app
+
+    async def call(query):
+        transport = httpx.ASGITransport(app=fastapi_app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.get("/airports/autocomplete", params={"q": query, "limit": 3})
+
+    response = asyncio.run(call("sai gon"))
+
+    assert response.status_code == 200
+    assert response.json()[0]["iata"] == "SGN"
+    assert response.json()[0]["alias"] == "Sài Gòn"
+    assert len(asyncio.run(call("h")).json()) == 3
+
+
+def test_health_and_readiness_endpoints(monkeypatch, fake_llm, stub_amadeus):
+    from endpoints import fastapi_app
+    from tests.conftest import install_model_factory
+
+    async def get(path):
+        transport = httpx.ASGITransport(app=fastapi_app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.get(path)
+
+    assert asyncio.run(get("/healthz")).json() == {"status": "ok"}
+
+    cold = asyncio.run(get("/readyz"))
+    assert cold.status_code == 200
+    assert cold.json()["llm_models"] == []  # chưa dựng model nào cho tới khi cần
+
+    warm = asyncio.run(get("/readyz?warm=true"))
+    assert warm.status_code == 200
+    assert warm.json()["llm_models"] == ["extract", "respond", "route"]
+    assert warm.json()["amadeus_client"] is True
+
+    def broken_factory(spec):
+        raise RuntimeError("missing credentials")
+
+    install_model_factory(monkeypatch, broken_factory)
+    failed = asyncio.run(get("/readyz?warm=true"))
+    assert failed.status_code == 503
+    assert failed.json()["errors"] == {"llm": "missing credentials"}
+
+
+def test_render_cli_writes_mermaid_offline(tmp_path):
+    from src.flight_booking_agent.graph import render
+
+    output = tmp_path / "graph" / "workflow.mmd"
+    render.main(["--mermaid", str(output)])
+
+    assert "booking_agent" in output.read_text(encoding="utf-8")
+
+
+def _import_profile(statement: str) -> tuple:
+    """Chạy `statement` trong tiến trình Python mới với `-X importtime`; trả về (giây, stdout, {module: µs tích lũy})."""
+    import os
+    import subprocess
+    import sys
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    started = time.perf_counter()
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", statement],
+                          cwd=root, capture_output=True, text=True, timeout=120)
+    elapsed = time.perf_counter() - started
+    assert proc.returncode == 0, proc.stderr[-2000:]
+    cumulative = {}
+    for line in proc.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            _, cum, name = line.split("|")
+            if cum.strip().isdigit():
+                cumulative[name.strip()] = int(cum)
+    return elapsed, proc.stdout, cumulative
+
+
+def test_cold_start_import_profile_benchmark():
+    """
+    Benchmark khởi động nguội: thời gian import `endpoints` (như khi một worker uvicorn boot)
+    trong tiến trình mới, so với khi SDK Vertex vẫn được nạp ngay như trước. In ra các module
+    tốn thời gian nhất theo `-X importtime` để theo dõi thời gian boot.
+    """
+    probe = ("import endpoints, sys; "
+             "from src.flight_booking_agent.services.amadeus_client import amadeus_client; "
+             "print('vertex', 'langchain_google_vertexai' in sys.modules, 'amadeus', amadeus_client.initialized)")
+    lazy_runs = [_import_profile(probe) for _ in range(3)]
+    eager, _, _ = _import_profile("import langchain_google_vertexai; " + probe)
+    lazy = sorted(run[0] for run in lazy_runs)[1]
+
+    _, stdout, cumulative = lazy_runs[0]
+    print(f"\ncold start: eager Vertex import {eager * 1000:.0f}ms -> lazy {lazy * 1000:.0f}ms (median of 3)")
+    print("slowest imports (cumulative ms):")
+    top_level = {name: us for name, us in cumulative.items() if "." not in name}
+    for name, us in sorted(top_level.items(), key=lambda item: -item[1])[:8]:
+        print(f"  {name:32} {us / 1000:8.1f}")
+
+    assert "vertex False amadeus False" in stdout
+    assert "Đã vẽ sơ đồ" not in stdout and "Không thể vẽ đồ thị" not in stdout
+    if TIMING_ASSERTS:
+        assert lazy < eager
+
+
+def _metric_value(text: str, sample: str) -> float:
+    """Giá trị của một dòng mẫu Prometheus (vd. 'tool_calls_total{tool="x",status="ok"}')."""
+    for line in text.splitlines():
+        if line.startswith(sample + " "):
+            return float(line.rsplit(" ", 1)[1])
+    return 0.0
+
+
+def test_metrics_endpoint_exposes_node_llm_tool_and_checkpoint_histograms(monkeypatch, fake_llm, stub_amadeus):
+    from endpoints import fastapi_app
+    from src.flight_booking_agent.agents import booking
+    from src.flight_booking_agent.metrics import metrics
+
+    metrics.reset()
+    monkeypatch.setattr(booking, "BOOKING_EXTRACTION_MODE", "llm")  # để có lời gọi LLM vai trò extract
+    graph_app.invoke({"messages": [HumanMessage(content=SEARCH_REQUEST)]}, config=new_thread_config())
+    install_stub_amadeus(monkeypatch, StubAmadeusBackend(offers=0))  # không có chuyến → tool trả lỗi
+    graph_app.invoke({"messages": [HumanMessage(content=SEARCH_REQUEST)]}, config=new_thread_config())
+
+    async def scrape():
+        transport = httpx.ASGITransport(app=fastapi_app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.get("/metrics")
+
+    response = asyncio.run(scrape())
+    text = response.text
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    assert "# TYPE agent_node_duration_seconds histogram" in text
+    for node in ("router", "manager", "booking_agent"):
+        assert _metric_value(text, f'agent_node_duration_seconds_count{{node="{node}"}}') >= 2
+    # tools node không được bọc; độ trễ tool đến từ callback gắn trên từng tool
+    assert _metric_value(text, 'tool_calls_total{tool="flight-search-tool",status="ok"}') == 1
+    assert _metric_value(text, 'tool_calls_total{tool="flight-search-tool",status="error"}') == 1
+    assert _metric_value(text, 'tool_call_duration_seconds_bucket{tool="flight-search-tool",le="+Inf"}') == 2
+    assert _metric_value(text, 'llm_calls_total{role="extract",status="ok"}') == 2
+    assert _metric_value(text, 'llm_call_tokens_count{role="extract",direction="input"}') == 2
+    assert _metric_value(text, 'checkpoint_operation_duration_seconds_count{backend="memory",operation="put"}') > 0
+    assert _metric_value(text, 'checkpoint_operation_duration_seconds_count{backend="memory",operation="get"}') > 0
+    # Bucket cộng dồn: không giảm theo le
+    buckets = [float(line.rsplit(" ", 1)[1]) for line in text.splitlines()
+               if line.startswith('agent_node_duration_seconds_bucket{node="router"')]
+    assert buckets == sorted(buckets) and buckets[-1] == 2
+
+
+def test_metrics_overhead_benchmark(fake_llm, stub_amadeus):
+    """
+    Chi phí của việc đo (node, tool, LLM, checkpoint) trên lượt tìm chuyến: các lượt bật/tắt
+    metrics chạy xen kẽ, so sánh trung vị; kèm ước lượng trực tiếp = số lần ghi mỗi lượt
+    × chi phí một lần observe.
+    """
+    from src.flight_booking_agent.metrics import NODE_DURATION, metrics
+
+    def turn():
+        started = time.perf_counter()
+        graph_app.invoke({"messages": [HumanMessage(content=SEARCH_REQUEST)]}, config=new_thread_config())
+        return (time.perf_counter() - started) * 1000
+
+    samples = {True: [], False: []}
+    try:
+        for _ in range(3):
+            turn()  # làm nóng cache và import
+        for i in range(60):
+            metrics.enabled = i % 2 == 0
+            samples[metrics.enabled].append(turn())
+        metrics.enabled = True
+        metrics.reset()
+        turn()
+        writes_per_turn = sum(
+            float(line.rsplit(" ", 1)[1]) for line in metrics.render().splitlines()
+            if "_count{" in line or (line.startswith(("tool_calls_total", "llm_calls_total")))
+        )
+    finally:
+        metrics.enabled = True
+    on_ms, off_ms = (sorted(samples[flag])[len(samples[flag]) // 2] for flag in (True, False))
+
+    observations = 20000
+    started = time.perf_counter()
+    for _ in range(observations):
+        NODE_DURATION.observe(0.003, "benchmark")
+    observe_us = (time.perf_counter() - started) / observations * 1e6
+    direct_ms = writes_per_turn * observe_us / 1000
+    print(f"\nsearch turn: metrics off {off_ms:.2f}ms, on {on_ms:.2f}ms ({(on_ms - off_ms) / off_ms:+.1%}); "
+          f"{writes_per_turn:.0f} writes x {observe_us:.2f}us = {direct_ms:.3f}ms ({direct_ms / off_ms:.2%})")
+
+    if TIMING_ASSERTS:
+        assert observe_us < 10
+        assert direct_ms < off_ms * 0.02
+        assert on_ms < off_ms * 1.15 + 0.5
+
+
+def test_replay_harness_matches_stored_baseline():
+    """
+    Hồi quy hiệu năng end-to-end: replay các hội thoại kịch bản (graph + /chat, LLM và
+    Amadeus giả) rồi so với tests/replay_baseline.json. Cập nhật baseline sau một thay
+    đổi có chủ đích bằng `python -m tests.replay --update-baseline`. Độ trễ và throughput
+    chỉ được so khi bật RUN_TIMING_ASSERTS (xem tests/conftest.py).
+    """
+    from tests.replay import compare_to_baseline, format_report, load_baseline, run_replay
+
+    baseline = load_baseline()
+    report = run_replay()
+    print("\n" + format_report(report, baseline))
+
+    assert set(report["llm_calls_per_conversation"]) == set(baseline["llm_calls_per_conversation"])
+    assert compare_to_baseline(report, baseline, timing=TIMING_ASSERTS) == []
+
+
+def test_replay_harness_flags_extra_llm_calls_and_checkpoint_growth(monkeypatch):
+    from src.flight_booking_agent.agents import booking
+    from tests.replay import ReplaySettings, compare_to_baseline, load_baseline, run_replay
+
+    baseline = load_baseline()
+    monkeypatch.setattr(booking, "BOOKING_EXTRACTION_MODE", "llm")  # thêm lời gọi trích xuất mỗi hội thoại
+    report = run_replay(ReplaySettings(repeats=1, concurrency=2))
+    report["checkpoint_bytes_per_thread"] = {k: v * 2 for k, v in report["checkpoint_bytes_per_thread"].items()}
+
+    regressions = compare_to_baseline(report, baseline)
+
+    assert sum(r.startswith("llm_calls_per_conversation[") for r in regressions) == len(baseline["llm_calls_per_conversation"])
+    assert sum(r.startswith("checkpoint_bytes_per_thread[") for r in regressions) == len(baseline["checkpoint_bytes_per_thread"])
+
+
+def test_priority_limiter_serves_payment_first_and_sheds_when_queue_full():
+    from src.flight_booking_agent.admission import PRIORITY_NORMAL, PRIORITY_PAYMENT, Overloaded, PriorityLimiter
+
+    limiter = PriorityLimiter(max_concurrency=1, max_queue=3, queue_timeout=5)
+    served = []
+
+    async def call(name, priority, hold=0.01):
+        async with limiter.aslot(priority):
+            served.append(name)
+            await asyncio.sleep(hold)
+
+    async def scenario():
+        first = asyncio.create_task(call("first", PRIORITY_NORMAL, hold=0.05))
+        await asyncio.sleep(0)
+        queued = [asyncio.create_task(call(name, priority)) for name, priority in
+                  [("search-1", PRIORITY_NORMAL), ("search-2", PRIORITY_NORMAL), ("payment", PRIORITY_PAYMENT)]]
+        await asyncio.sleep(0)
+        rejected = asyncio.create_task(call("overflow", PRIORITY_PAYMENT))
+        results = await asyncio.gather(first, *queued, rejected, return_exceptions=True)
+        return results[-1]
+
+    overflow = asyncio.run(scenario())
+
+    assert isinstance(overflow, Overloaded)
+    assert served == ["first", "payment", "search-1", "search-2"]
+    assert (limiter.active, limiter.waiting) == (0, 0)
+
+    # Chờ quá hạn: rời hàng, không giữ chỗ
+    limiter = PriorityLimiter(max_concurrency=1, max_queue=3, queue_timeout=0.02)
+    with limiter.slot():
+        try:
+            with limiter.slot():
+                pass
+        except Overloaded:
+            pass
+        else:
+            raise AssertionError("expected Overloaded after queue timeout")
+    assert (limiter.active, limiter.waiting) == (0, 0)
+
+
+def _passenger_stage_thread() -> dict:
+    """Thread đã chọn chuyến và đang nhập hành khách (lượt gần bước thanh toán)."""
+    config = new_thread_config()
+    graph_app.update_state(config, {
+        "messages": [AIMessage(content="Anh/chị vui lòng cung cấp thông tin hành khách ạ.")],
+        "previous_agent": "booking_agent",
+        "confirmed_flight": {"flight_number": "VN200", "price": 1500000.0},
+        "passenger_count": 100,
+        "passengers": [],
+    }, as_node="booking_agent")
+    return config
+
+
+def test_turns_on_one_thread_are_serialized_in_order(monkeypatch):
+    """Gửi trùng nhiều lượt cùng lúc trên một thread: không lượt nào ghi đè checkpoint của lượt khác."""
+    from fastapi import HTTPException
+
+    from endpoints import ChatRequest, chat_endpoint
+    from src.flight_booking_agent.agents import booking
+
+    monkeypatch.setattr(booking, "BOOKING_EXTRACTION_MODE", "llm")  # mỗi lượt chờ LLM 20ms
+    install_fake_llm(monkeypatch, FakeChatModel(responder=booking_responder, latency=0.02))
+    texts = [f"hành khách số {i} là anh Nguyễn Văn A" for i in range(4)]
+
+    def human_messages(config):
+        values = graph_app.get_state(config).values
+        return [m.content for m in values["messages"] if isinstance(m, HumanMessage)], len(values["passengers"])
+
+    async def raced(config):
+        await asyncio.gather(*(graph_app.ainvoke({"messages": [HumanMessage(content=t)]}, config=config) for t in texts[:3]))
+
+    raced_config = _passenger_stage_thread()
+    asyncio.run(raced(raced_config))
+
+    async def admitted(thread_id):
+        return await asyncio.gather(
+            *(chat_endpoint(ChatRequest(message=t, thread_id=thread_id)) for t in texts), return_exceptions=True
+        )
+
+    config = _passenger_stage_thread()
+    results = asyncio.run(admitted(config["configurable"]["thread_id"]))
+    print(f"\nconcurrent turns on one thread: without admission {human_messages(raced_config)} "
+          f"-> with admission {human_messages(config)}")
+
+    # Quá CHAT_MAX_PENDING_PER_THREAD (3) lượt chờ: lượt thứ tư bị từ chối ngay
+    assert [getattr(r, "status_code", None) for r in results] == [None, None, None, 429]
+    assert isinstance(results[-1], HTTPException) and results[-1].headers["Retry-After"] == "1"
+    assert human_messages(config) == (texts[:3], 3)
+    assert human_messages(raced_config)[1] < 3  # không tuần tự hóa: các lượt ghi đè lẫn nhau
+
+
+def test_admission_contention_benchmark(monkeypatch, stub_amadeus):
+    """
+    Benchmark tranh chấp: 16 lượt tìm chuyến và 4 lượt nhập hành khách (gần thanh toán)
+    gửi cùng lúc, mỗi lượt một lời gọi LLM 50ms, giới hạn 2 lời gọi LLM đồng thời.
+    So sánh độ trễ lượt thanh toán khi hàng chờ FIFO và khi có ưu tiên; sau đó hàng chờ
+    ngắn (4) phải từ chối phần dư bằng 429 thật nhanh thay vì để mọi lượt cùng chậm.
+    """
+    from fastapi import HTTPException
+
+    from endpoints import ChatRequest, chat_endpoint
+    from src.flight_booking_agent import admission
+    from src.flight_booking_agent.agents import booking
+
+    concurrency = {"in_flight": 0, "peak": 0, "started": 0, "order": []}
+
+    class TrackingChatModel(FakeChatModel):
+        async def _agenerate(self, messages, stop=None, run_manager=None, tools=None, **kwargs):
+            concurrency["started"] += 1
+            concurrency["order"].append("payment" if "Nguyễn Văn A" in str(messages) else "search")
+            concurrency["in_flight"] += 1
+            concurrency["peak"] = max(concurrency["peak"], concurrency["in_flight"])
+            try:
+                return await super()._agenerate(messages, stop=stop, run_manager=run_manager, tools=tools, **kwargs)
+            finally:
+                concurrency["in_flight"] -= 1
+
+    monkeypatch.setattr(booking, "BOOKING_EXTRACTION_MODE", "llm")
+    install_fake_llm(monkeypatch, TrackingChatModel(responder=booking_responder, latency=0.05))
+
+    async def timed(request):
+        started = time.perf_counter()
+        try:
+            await chat_endpoint(request)
+            status = 200
+        except HTTPException as e:
+            status = e.status_code
+        return status, (time.perf_counter() - started) * 1000
+
+    def burst(searches: int, payments: int) -> list:
+        requests = [("search", ChatRequest(message=SEARCH_REQUEST, thread_id=f"search-{time.time_ns()}-{i}"))
+                    for i in range(searches)]
+        requests += [("payment", ChatRequest(message="hành khách là anh Nguyễn Văn A",
+                                             thread_id=_passenger_stage_thread()["configurable"]["thread_id"]))
+                     for _ in range(payments)]
+
+        async def searches_queued():
+            # Mọi lượt tìm chuyến đã lấy được chỗ hoặc đang xếp hàng chờ LLM
+            started = concurrency["started"]
+            while concurrency["started"] - started + admission.llm_limiter.waiting < searches:
+                await asyncio.sleep(0.001)
+
+        async def run():
+            # Lượt thanh toán chỉ được gửi khi hàng chờ LLM đã dồn ứ các lượt tìm chuyến
+            queued = asyncio.create_task(searches_queued()) if payments else None
+
+            async def delayed(kind, request):
+                if kind == "payment":
+                    await asyncio.wait_for(asyncio.shield(queued), 10)
+                return await timed(request)
+
+            return await asyncio.gather(*(delayed(kind, request) for kind, request in requests))
+
+        return [(kind, status, ms) for (kind, _), (status, ms) in zip(requests, asyncio.run(run()))]
+
+    def p50(results, kind, status=200):
+        values = sorted(ms for k, s, ms in results if k == kind and s == status)
+        return values[len(values) // 2]
+
+    def dequeue_order() -> list:
+        order, concurrency["order"] = concurrency["order"], []
+        return order
+
+    monkeypatch.setattr(admission, "llm_limiter", admission.PriorityLimiter(max_concurrency=2, max_queue=64))
+    with monkeypatch.context() as fifo:
+        fifo.setattr(booking, "turn_priority", lambda state: admission.PRIORITY_NORMAL)
+        fifo_results = burst(16, 4)
+        fifo_order = dequeue_order()
+    priority_results = burst(16, 4)
+    priority_order = dequeue_order()
+
+    monkeypatch.setattr(admission, "llm_limiter", admission.PriorityLimiter(max_concurrency=2, max_queue=4))
+    shed_results = burst(16, 0)
+    statuses = [status for _, status, _ in shed_results]
+
+    print(f"\npayment turn p50: FIFO {p50(fifo_results, 'payment'):.0f}ms -> priority "
+          f"{p50(priority_results, 'payment'):.0f}ms (search p50 {p50(priority_results, 'search'):.0f}ms); "
+          f"peak concurrent LLM calls {concurrency['peak']}")
+    print(f"queue limit 4: {statuses.count(200)} served (p50 {p50(shed_results, 'search'):.0f}ms), "
+          f"{statuses.count(429)} shed with 429 (p50 {p50(shed_results, 'search', 429):.0f}ms)")
+
+    assert concurrency["peak"] == 2
+    assert all(status == 200 for _, status, _ in fifo_results + priority_results)
+    # Thứ tự lấy chỗ LLM (không phụ thuộc tốc độ máy): FIFO phục vụ lượt thanh toán sau mọi lượt
+    # tìm chuyến đã xếp hàng, còn hàng ưu tiên cho chúng vượt lên ngay khi có chỗ trống
+    assert fifo_order[-4:] == ["payment"] * 4
+    assert priority_order[:6] == ["search"] * 2 + ["payment"] * 4
+    assert statuses.count(200) >= 6 and statuses.count(429) >= 1
+    assert set(statuses) == {200, 429}
+    if TIMING_ASSERTS:
+        assert p50(priority_results, "payment") < p50(fifo_results, "payment")
+        assert p50(shed_results, "search", 429) < p50(shed_results, "search") / 2
+
+
+class StallingChatModel(FakeChatModel):
+    """Chat model giả treo `stall` giây ở các lời gọi được `should_stall()` chọn (tiêm lỗi)."""
+    stall: float = 10.0
+    should_stall: Callable[[], bool] = lambda: True
+    attempts: list = Field(default_factory=list)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, tools=None, **kwargs):
+        stalled = self.should_stall()
+        self.attempts.append(stalled)
+        if stalled:
+            await asyncio.sleep(self.stall)
+        return await super()._agenerate(messages, stop=stop, run_manager=run_manager, tools=tools, **kwargs)
+
+
+def _install_primary_and_fallback(monkeypatch, primary: FakeChatModel, fallback: FakeChatModel):
+    from src.flight_booking_agent import config
+
+    fallback_specs = {role: config.ModelSpec("fake-fallback", 0.0, 4) for role in config.MODEL_SPECS}
+    registry = config.ModelRegistry(
+        factory=lambda spec: fallback if spec.model_name == "fake-fallback" else primary, fallback_specs=fallback_specs,
+    )
+    monkeypatch.setattr(config, "model_registry", registry)
+    return registry
+
+
+def _scale_turn_deadline(monkeypatch, turn: float, reserve: float):
+    from src.flight_booking_agent import deadlines
+
+    monkeypatch.setattr(deadlines, "TURN_DEADLINE", turn)
+    monkeypatch.setattr(deadlines, "LLM_FALLBACK_RESERVE", reserve)
+    monkeypatch.setattr(deadlines, "LLM_MIN_ATTEMPT", 0.05)
+    monkeypatch.setattr(deadlines, "LLM_RETRY_BACKOFF", 0.02)
+    monkeypatch.setattr(deadlines, "LLM_MAX_ATTEMPTS", 2)
+
+
+def test_turn_deadline_retries_then_falls_back_then_replies_canned(monkeypatch, stub_amadeus):
+    from langchain_core.runnables import RunnableLambda
+
+    from endpoints import ChatRequest, chat_endpoint
+    from src.flight_booking_agent.agents import booking, manager
+    from src.flight_booking_agent.deadlines import TURN_DEADLINE_REPLY, turn_config
+
+    _scale_turn_deadline(monkeypatch, turn=0.6, reserve=0.2)
+    monkeypatch.setattr(manager, "MANAGER_RULE_THRESHOLD", 1.01)
+    stalling = {"primary": True}  # registry dùng bản sao của model nên bật/tắt qua dict dùng chung
+    primary = StallingChatModel(responder=booking_responder, should_stall=lambda: stalling["primary"])
+    fallback = FakeChatModel(responder=booking_responder)
+    registry = _install_primary_and_fallback(monkeypatch, primary, fallback)
+    node = RunnableLambda(manager.manager_node, afunc=manager.amanager_node)
+
+    # Model chính treo: hai lần gọi, mỗi lần bị hủy sau phần thời gian chia cho nó, rồi model dự phòng trả lời
+    started = time.perf_counter()
+    result = asyncio.run(node.ainvoke({"messages": [HumanMessage(content="đặt vé")]}, config=turn_config("deadline-manager")))
+    elapsed = time.perf_counter() - started
+
+    assert result == {"next_agent": "booking_agent"}
+    assert primary.attempts == [True, True]
+    assert fallback.calls == [["ManagerHandoff"]]
+    assert 0.35 < elapsed < 2  # hủy theo thời hạn, không chờ model treo (10s)
+    assert registry.usage.report()["route"]["errors"] == 2  # lời gọi bị hủy vẫn được ghi nhận
+
+    # Không có thời hạn (TURN_DEADLINE = 0): một lần gọi như trước, lỗi được ném vào node
+    stalling["primary"] = False
+    result = asyncio.run(node.ainvoke({"messages": [HumanMessage(content="đặt vé")]}, config=turn_config("no-deadline", 0)))
+    assert result == {"next_agent": "booking_agent"}
+    assert primary.attempts == [True, True, False]
+
+    # Cả model dự phòng cũng treo: lượt kết thúc đúng hạn bằng câu trả lời soạn sẵn (200, không phải 500)
+    stalling["primary"] = True
+    slow_fallback = StallingChatModel(responder=booking_responder)
+    _install_primary_and_fallback(monkeypatch, primary, slow_fallback)
+    monkeypatch.setattr(booking, "BOOKING_EXTRACTION_MODE", "llm")
+    started = time.perf_counter()
+    response = asyncio.run(chat_endpoint(ChatRequest(message=SEARCH_REQUEST, thread_id=f"deadline-{time.time_ns()}")))
+    elapsed = time.perf_counter() - started
+
+    assert response.response == TURN_DEADLINE_REPLY
+    assert slow_fallback.attempts == [True]
+    assert elapsed < 2
+    assert stub_amadeus.calls == 0
+
+    # State 4 (nhập hành khách): hết hạn trong lúc trích xuất không bị nuốt thành "chưa nhận được thông tin"
+    config = _passenger_stage_thread()
+    response = asyncio.run(chat_endpoint(ChatRequest(message="hành khách là anh Nguyễn Văn A",
+                                                     thread_id=config["configurable"]["thread_id"])))
+    assert response.response == TURN_DEADLINE_REPLY
+    assert graph_app.get_state(config).values["passengers"] == []
+
+
+def test_turn_deadline_fault_injection_benchmark(monkeypatch, stub_amadeus):
+    """
+    Benchmark tiêm lỗi: 50 lượt tìm chuyến đồng thời, mỗi lượt một lời gọi LLM trích xuất
+    (20ms); 20% lời gọi tới model chính bị treo 2s. Thời hạn lượt thu nhỏ còn 1s (dành 0.25s cho
+    model dự phòng 10ms). So p50/p99 độ trễ lượt khi không có thời hạn (mỗi lời gọi chờ tới
+    khi xong) và khi có thời hạn (hủy lời gọi treo, thử lại rồi chuyển sang model dự phòng).
+    """
+    import random
+
+    from endpoints import ChatRequest, chat_endpoint
+    from src.flight_booking_agent import admission, deadlines
+    from src.flight_booking_agent.agents import booking
+
+    turns, stall = 50, 2.0
+    monkeypatch.setattr(booking, "BOOKING_EXTRACTION_MODE", "llm")
+    monkeypatch.setattr(admission, "llm_limiter", admission.PriorityLimiter(max_concurrency=turns))
+    _scale_turn_deadline(monkeypatch, turn=1.0, reserve=0.25)
+
+    def run(turn_deadline: float) -> list:
+        rng = random.Random(7)
+        primary = StallingChatModel(responder=booking_responder, latency=0.02, stall=stall,
+                                    should_stall=lambda: rng.random() < 0.2)
+        fallback = FakeChatModel(responder=booking_responder, latency=0.01)
+        _install_primary_and_fallback(monkeypatch, primary, fallback)
+        monkeypatch.setattr(deadlines, "TURN_DEADLINE", turn_deadline)
+
+        async def timed(index):
+            started = time.perf_counter()
+            response = await chat_endpoint(ChatRequest(message=SEARCH_REQUEST, thread_id=f"fault-{time.time_ns()}-{index}"))
+            return (time.perf_counter() - started) * 1000, response.response
+
+        async def burst():
+            return await asyncio.gather(*(timed(i) for i in range(turns)))
+
+        results = asyncio.run(burst())
+        return sorted(ms for ms, _ in results), [text for _, text in results], primary, fallback
+
+    def pct(values, q):
+        return values[min(len(values) - 1, int(len(values) * q))]
+
+    reports = {"no deadline": run(0), "deadline 1s": run(1.0)}
+    print("\nsetup         p50_ms  p99_ms  stalled  primary_calls  fallback_calls  canned")
+    for name, (latencies, texts, primary, fallback) in reports.items():
+        print(f"{name:12} {pct(latencies, 0.5):7.0f} {pct(latencies, 0.99):7.0f}  {sum(primary.attempts):7}  "
+              f"{len(primary.attempts):13}  {len(fallback.calls):14}  {texts.count(deadlines.TURN_DEADLINE_REPLY):6}")
+
+    base, bounded = reports["no deadline"][0], reports["deadline 1s"][0]
+    _, texts, primary, fallback = reports["deadline 1s"]
+    assert pct(base, 0.99) >= stall * 1000
+    if TIMING_ASSERTS:
+        assert pct(bounded, 0.99) < 1000
+        assert pct(bounded, 0.99) < pct(base, 0.99) / 2
+    assert deadlines.TURN_DEADLINE_REPLY not in texts  # mọi lượt vẫn có kết quả tìm chuyến
+    # Lời gọi treo bị hủy rồi được thử lại trên model chính hoặc chuyển sang model dự phòng; thử
+    # lại hay không tùy thời gian còn lại của lượt (phụ thuộc tải máy), nên chỉ đếm tổng
+    assert len(primary.attempts) + len(fallback.calls) > turns
+
+
+def test_frontend_client_serializes_messages_per_session():
+    from chat_client import BackendClient, SessionBusy, SessionGate
+
+    with StubChatBackend(latency=0.05) as stub:
+        backend = BackendClient(stub.base_url, sessions=SessionGate(max_pending=2))
+
+        async def send(thread_id):
+            try:
+                return [event async for event, _ in backend.stream_chat(thread_id, "xin chào")][-1]
+            except SessionBusy:
+                return "busy"
+
+        async def scenario():
+            try:
+                return await asyncio.gather(*(send("session-a") for _ in range(3)), send("session-b"))
+            finally:
+                await backend.aclose()
+
+        results = asyncio.run(scenario())
+
+    assert results == ["done", "done", "busy", "done"]
+    assert stub.counters["requests"] == 3
+    assert stub.counters["overlapping"] == 0  # backend không bao giờ nhận hai lượt chồng nhau của một phiên
+
+
+def test_frontend_client_does_not_resend_chat_turn_on_timeout():
+    from chat_client import BackendClient
+
+    with StubChatBackend(latency=0.5) as stub:
+        backend = BackendClient(stub.base_url, turn_timeout=0.2)
+
+        async def scenario():
+            try:
+                [event async for event in backend.stream_chat("session-a", "xin chào")]
+            except httpx.ReadTimeout:
+                return "timeout"
+            finally:
+                await backend.aclose()
+            return "done"
+
+        # Backend có thể đã xử lý lượt chat: hết giờ đọc thì báo lỗi, không gửi lại
+        assert asyncio.run(scenario()) == "timeout"
+        assert stub.counters["requests"] == 1
+
+
+def test_frontend_shared_client_benchmark():
+    """
+    Benchmark: 50 phiên Chainlit đồng thời, mỗi phiên gửi 3 tin nhắn liên tiếp tới backend giả
+    (trễ 20ms). So cách cũ (mỗi tin nhắn một `httpx.AsyncClient` mới) với client dùng chung.
+    """
+    from chat_client import BackendClient, iter_sse
+
+    sessions, messages = 50, 3
+
+    async def per_message_client(base_url):
+        async def session(index):
+            for _ in range(messages):
+                async with httpx.AsyncClient() as client:
+                    payload = {"message": "xin chào", "thread_id": f"old-{index}"}
+                    async with client.stream("POST", f"{base_url}/chat/stream", json=payload, timeout=30.0) as response:
+                        [event async for event in iter_sse(response)]
+
+        await asyncio.gather(*(session(i) for i in range(sessions)))
+
+    async def shared_client(base_url):
+        backend = BackendClient(base_url)
+        backend.open()
+
+        async def session(index):
+            for _ in range(messages):
+                [event async for event in backend.stream_chat(f"new-{index}", "xin chào")]
+
+        try:
+            await asyncio.gather(*(session(i) for i in range(sessions)))
+        finally:
+            await backend.aclose()
+
+    results = {}
+    for name, run in (("per-message client", per_message_client), ("shared client", shared_client)):
+        with StubChatBackend(latency=0.02) as stub:
+            started = time.perf_counter()
+            asyncio.run(run(stub.base_url))
+            results[name] = (time.perf_counter() - started, stub.counters["connections"], stub.counters["requests"])
+
+    total = sessions * messages
+    for name, (elapsed, connections, requests) in results.items():
+        print(f"\n{name:20} {total / elapsed:6.0f} msg/s  {connections:3} connections  {requests} requests")
+
+    old_elapsed, old_connections, _ = results["per-message client"]
+    new_elapsed, new_connections, new_requests = results["shared client"]
+    assert new_requests == total
+    assert old_connections == total
+    assert new_connections <= sessions
+    if TIMING_ASSERTS:
+        assert new_elapsed < old_elapsed / 2